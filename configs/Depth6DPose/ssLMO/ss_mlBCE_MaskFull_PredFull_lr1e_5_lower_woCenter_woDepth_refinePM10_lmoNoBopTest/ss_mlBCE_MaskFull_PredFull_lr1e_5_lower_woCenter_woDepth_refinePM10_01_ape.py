@@ -180,7 +180,6 @@ MODEL = dict(
 
 VAL = dict(
     DATASET_NAME="lmo",
-    SCRIPT_PATH="lib/pysixd/scripts/eval_pose_results_more.py",
     TARGETS_FILENAME="test_targets_bop19.json",
     ERROR_TYPES="vsd,mspd,mssd,ad,reS,teS",
     RENDERER_TYPE="cpp",  # cpp, python, egl
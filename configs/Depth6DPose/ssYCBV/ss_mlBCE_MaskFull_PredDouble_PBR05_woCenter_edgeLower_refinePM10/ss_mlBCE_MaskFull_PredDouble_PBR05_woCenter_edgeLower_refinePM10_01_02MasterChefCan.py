@@ -201,7 +201,6 @@ MODEL = dict(
 VAL = dict(
     DATASET_NAME="ycbvposecnn",
     SPLIT_TYPE="",
-    SCRIPT_PATH="lib/pysixd/scripts/eval_pose_results_more.py",
     TARGETS_FILENAME="ycbv_test_targets_keyframe.json",
     ERROR_TYPES="ad,AUCad,AUCadi,reteS,reS,teS,projS",
     RENDERER_TYPE="cpp",  # cpp, python, egl
@@ -54,6 +54,10 @@ INPUT = dict(
     # truncation fg (randomly replace some side of fg with bg during replace_bg)
     TRUNCATE_FG=False,
     BG_KEEP_ASPECT_RATIO=True,
+    # pool of decoded/resized bg images (memory-mapped cache in .cache/), 0 to decode a bg image per sample
+    BG_POOL_SIZE=0,
+    BG_POOL_REFRESH_PROB=0.1,  # prob to decode a new bg image into the pool per sample
+    BG_POOL_NUM_THREADS=8,  # threads to build the pool
     ## bbox aug
     DZI_TYPE="uniform",  # uniform, truncnorm, none, roi10d
     DZI_PAD_SCALE=1.0,
@@ -95,6 +99,9 @@ DATASETS = dict(
     INIT_POSE_TOPK_PER_OBJ=1,
     INIT_POSE_TOPK_PER_IM=30,  # TODO: implement this
     INIT_POSE_THR=0.0,  # filter detections
+    # pre-cropped roi targets (core/Depth6DPose/tools/build_roi_pack.py) -------
+    ROI_PACK_FILES_TRAIN=(),  # any order, requires INPUT.DZI_TYPE="none"
+    ROI_PACK_FILES_TEST=(),  # consistent with DATASETS.TEST
     # NOTE: override if symmetric objects are different, used for custom evaluator
     # SYM_OBJS=["024_bowl", "036_wood_block", "051_large_clamp", "052_extra_large_clamp", "061_foam_brick"],  # ycbv
     # SYM_OBJS=["002_master_chef_can", "024_bowl", "025_mug", "036_wood_block", "040_large_marker", "051_large_clamp",
@@ -111,7 +118,8 @@ DATALOADER = dict(
     MAX_OBJS_TRAIN=120,  # max number of objs per batch (used when load image-wise data and then flatten then batch)
     ASPECT_RATIO_GROUPING=False,  # default True in detectron2
     # Default sampler for dataloader
-    # Options: TrainingSampler, RepeatFactorTrainingSampler
+    # Options: TrainingSampler, RepeatFactorTrainingSampler,
+    # ImageGroupedTrainingSampler (self-supervised training, the instances of an image share the full-frame data)
     SAMPLER_TRAIN="TrainingSampler",
     # Repeat threshold for RepeatFactorTrainingSampler
     REPEAT_THRESHOLD=0.0,
@@ -122,6 +130,18 @@ DATALOADER = dict(
     FILTER_EMPTY_DETS=True,  # filter images with empty detections
     # filter out instances with visib_fract <= visib_thr at train time
     FILTER_VISIB_THR=0.0,
+    # how the dataset dicts are held for the workers
+    # Options: pickle (one pickle per dict), columnar (numpy columns + string table)
+    SERIALIZE_TYPE="pickle",
+    # train: gather model points/extents/symmetries of the rois from a bank on the device by class,
+    # instead of carrying per-roi copies in the data
+    MODEL_ASSET_BANK=False,
+    # train: carry masks/roi_region as uint8 and xyz as float16 through collation and H2D copy,
+    # expanded to float32/long on the device in batch_data
+    COMPACT_TARGETS=False,
+    # train: the workers only decode/augment the full images and jitter the rois (DZI),
+    # all the roi crops of a batch are done on the device (not used with roi packs)
+    DEVICE_ROI_CROP=False,
 )
 
 # ---------------------------------------------------------------------------- #
@@ -179,13 +199,15 @@ TRAIN = dict(
     VIS=False,
     # vis imgs in tensorboard
     VIS_IMG=False,
+    # self-supervised training: reuse the teacher outputs of an instance until the (ema) teacher is updated
+    # DEVICE: cpu | cuda (where the cache is stored), MAX_MB: memory bound (least recently used evicted), 0: none
+    PSEUDO_LABEL_CACHE=dict(ENABLED=False, DEVICE="cpu", MAX_MB=4096),
 )
 # ---------------------------------------------------------------------------- #
 # Specific val options
 # ---------------------------------------------------------------------------- #
 VAL = dict(
     DATASET_NAME="lm",
-    SCRIPT_PATH="lib/pysixd/scripts/eval_pose_results_more.py",
     RESULTS_PATH="",
     TARGETS_FILENAME="lm_test_targets_bb8.json",  # 'lm_test_targets_bb8.json'
     ERROR_TYPES="ad,rete,re,te,proj",
@@ -199,6 +221,8 @@ VAL = dict(
     EVAL_PRECISION=False,  # use precision or recall
     USE_BOP=False,  # whether to use bop toolkit
     SAVE_BOP_CSV_ONLY=False,  # when USE_BOP, only save the pose csv results, no eval
+    NUM_WORKERS=0,  # processes to calculate the pose errors (sharded by images), 0: in the main process
+    ERRORS_FORMAT="npz",  # npz: one columnar store per error type, json: one file per scene and error signature
 )
 
 # ---------------------------------------------------------------------------- #
@@ -209,9 +233,17 @@ TEST = dict(
     VIS=False,
     TEST_BBOX_TYPE="gt",  # gt | est
     # USE_PNP = False,  # use pnp or direct prediction
-    # PNP_TYPE = "ransac_pnp",
+    # PNP_TYPE = "ransac_pnp",  # ransac_pnp | batch_ransac_pnp | net_iter_pnp | net_ransac_pnp
+    # batch_ransac_pnp: RANSAC EPnP + Gauss-Newton of all rois at once in torch
+    BATCH_PNP_RANSAC_ITER=100,  # hypotheses per roi
+    BATCH_PNP_REPROJ_ERR=3.0,  # inlier threshold in pixels
+    BATCH_PNP_REFINE_ITER=10,  # Gauss-Newton iterations on the inliers
+    BATCH_PNP_DEVICE="cpu",  # cpu | cuda | "": the device of the network outputs
     PRECISE_BN=dict(ENABLED=False, NUM_ITER=200),
     AMP_TEST=False,
+    # post-process the outputs (and accumulate the metrics) in a background thread while the next batches are inferred
+    PIPELINE_EVAL=False,
+    PIPELINE_MAX_PENDING=2,  # max batches being post-processed in the background
 )
 
 DIST_PARAMS = dict(backend="nccl")
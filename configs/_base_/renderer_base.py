@@ -1,6 +1,8 @@
 RENDERER = dict(
     DIFF_RENDERER="DIBR",
     RENDER_TYPE="batch",  # batch | batch_tex | batch_single | batch_single_tex
+    # self-supervised losses: render each roi at RES x RES in its zoomed-in camera instead of the full image
+    ROI_RENDER=dict(ENABLED=False, RES=-1),  # RES: -1 for OUTPUT_RES (INPUT_RES renders the color losses sharper)
     DIBR=dict(
         ZNEAR=0.01,
         ZFAR=100.0,
@@ -2,18 +2,20 @@
 import copy
 import logging
 import os.path as osp
-import pickle
 
 import cv2
-import mmcv
 import numpy as np
 import ref
 import torch
 from core.base_data_loader import Base_DatasetFromList
 from core.utils.data_utils import (
+    compact_mask,
+    compact_region,
     crop_resize_by_warp_affine,
     get_2d_coord_np,
     read_image_mmcv,
+    use_compact_targets,
+    use_device_roi_crop,
     xyz_to_region,
 )
 from core.utils.dataset_utils import (
@@ -29,7 +31,9 @@ from core.utils.my_distributed_sampler import (
     RepeatFactorTrainingSampler,
     TrainingSampler,
 )
+from core.utils.model_asset_bank import use_model_asset_bank
 from core.utils.ssd_color_transform import ColorAugSSDTransform
+from core.utils.xyz_pack import load_xyz_info
 from detectron2.data import MetadataCatalog
 from detectron2.data import detection_utils as utils
 from detectron2.data import get_detection_dataset_dicts
@@ -41,6 +45,7 @@ from lib.utils.mask_utils import cocosegm2mask, get_edge
 
 from .dataset_factory import register_datasets
 from .data_loader_online import Depth6DPose_Online_DatasetFromList
+from .roi_pack import get_roi_pack_key, get_roi_pack_record, load_roi_packs
 
 logger = logging.getLogger(__name__)
 
@@ -140,6 +145,7 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
         copy: bool = True,
         serialize: bool = True,
         flatten=True,
+        roi_pack_files=None,
     ):
         """
         Args:
@@ -150,6 +156,8 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
             serialize (bool): whether to hold memory using serialized objects, when
                 enabled, data loader workers can use shared RAM from master
                 process instead of making a copy.
+            roi_pack_files (list[str]): roi packs built by tools/build_roi_pack.py,
+                if given, the augmentation-independent roi targets are read from them.
         """
         self.augmentation = build_Depth6DPose_augmentation(cfg, is_train=(split == "train"))
         if cfg.INPUT.COLOR_AUG_PROB > 0 and cfg.INPUT.COLOR_AUG_TYPE.lower() == "ssd":
@@ -176,30 +184,25 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
         self.model_points = {}
         self.extents = {}
         self.sym_infos = {}
+        # the model assets are gathered from the ModelAssetBank on the device for train
+        self.use_asset_bank = split == "train" and use_model_asset_bank(cfg)
+        # train: uint8 masks/region and float16 xyz, expanded on the device in batch_data
+        self.compact_targets = split == "train" and use_compact_targets(cfg)
+        # ----------------------------------------------------
+        self.roi_packs = None
+        if roi_pack_files is not None and len(roi_pack_files) > 0:
+            self.roi_packs = load_roi_packs(roi_pack_files)
+            for roi_pack in self.roi_packs:
+                self._check_roi_pack_meta(roi_pack.meta)
+        # train: crop the rois of a batch on the device instead of in the workers (roi packs are already cropped)
+        self.device_roi_crop = split == "train" and self.roi_packs is None and use_device_roi_crop(cfg)
         # ----------------------------------------------------
         self.flatten = flatten
         self._lst = flat_dataset_dicts(lst) if flatten else lst
         # ----------------------------------------------------
         self._copy = copy
         self._serialize = serialize
-
-        def _serialize(data):
-            buffer = pickle.dumps(data, protocol=-1)
-            return np.frombuffer(buffer, dtype=np.uint8)
-
-        if self._serialize:
-            logger.info("Serializing {} elements to byte tensors and concatenating them all ...".format(len(self._lst)))
-            self._lst = [_serialize(x) for x in self._lst]
-            self._addr = np.asarray([len(x) for x in self._lst], dtype=np.int64)
-            self._addr = np.cumsum(self._addr)
-            self._lst = np.concatenate(self._lst)
-            logger.info("Serialized dataset takes {:.2f} MiB".format(len(self._lst) / 1024 ** 2))
-
-    def __len__(self):
-        if self._serialize:
-            return len(self._addr)
-        else:
-            return len(self._lst)
+        self._serialize_lst()
 
     def _get_fps_points(self, dataset_name, with_center=False):
         """convert to label based keys.
@@ -317,6 +320,312 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
         self.sym_infos[dataset_name] = cur_sym_infos
         return self.sym_infos[dataset_name]
 
+    def get_roi_pack_meta(self):
+        """the cfg options the roi pack depends on."""
+        cfg = self.cfg
+        net_cfg = cfg.MODEL.POSE_NET
+        meta = {
+            "split": "train" if self.split == "train" else "test",
+            "input_res": net_cfg.INPUT_RES,
+            "out_res": net_cfg.OUTPUT_RES,
+            # train rois are max(bw, bh) * DZI_PAD_SCALE (DZI_TYPE none), test rois are padded by it as well
+            "dzi_pad_scale": cfg.INPUT.DZI_PAD_SCALE,
+        }
+        if self.split == "train":
+            meta["smooth_xyz"] = cfg.INPUT.SMOOTH_XYZ
+            meta["bbox_crop_syn"] = cfg.MODEL.BBOX_CROP_SYN
+            meta["bbox_crop_real"] = cfg.MODEL.BBOX_CROP_REAL
+        else:
+            meta["img_format"] = self.img_format
+            meta["test_bbox_type"] = cfg.TEST.TEST_BBOX_TYPE
+        return meta
+
+    def _check_roi_pack_meta(self, meta):
+        cfg = self.cfg
+        cur_meta = self.get_roi_pack_meta()
+        for _k, _v in cur_meta.items():
+            assert meta.get(_k) == _v, "roi pack was built with {}={}, but got {}".format(_k, meta.get(_k), _v)
+        if self.split == "train":
+            # the rois are cropped with the fixed bboxes
+            assert cfg.INPUT.DZI_TYPE.lower() == "none", "roi packs do not support DZI, got {}".format(cfg.INPUT.DZI_TYPE)
+            assert not cfg.TRAIN.VIS, "roi packs only hold binary masks (nearest interpolation)"
+
+    def _get_test_roi_box(self, cfg, bbox, im_H, im_W):
+        """center, scale, width and height of the (fixed) test roi."""
+        x1, y1, x2, y2 = bbox
+        bbox_center = np.array([0.5 * (x1 + x2), 0.5 * (y1 + y2)])
+        bw = max(x2 - x1, 1)
+        bh = max(y2 - y1, 1)
+        scale = max(bh, bw) * cfg.INPUT.DZI_PAD_SCALE
+        scale = min(scale, max(im_H, im_W)) * 1.0
+        return bbox_center, scale, bw, bh
+
+    def _load_inst_xyz_and_aug_bbox(self, cfg, inst_infos, transforms, image_shape, img_type="real"):
+        """load the xyz of the instance, transform its annotations and augment
+        the bbox (DZI).
+
+        Returns:
+            anno (dict): the transformed instance annotations
+            xyz_info (dict): xyz_crop (HWC) and its xyxy in the image
+            bbox_center, scale: the augmented roi
+        """
+        im_H, im_W = image_shape
+        # load xyz =======================================================
+        xyz_info = load_xyz_info(inst_infos["xyz_path"])
+        x1, y1, x2, y2 = xyz_info["xyxy"]
+
+        if cfg.MODEL.BBOX_CROP_SYN and "syn" in img_type:
+            inst_infos["bbox"] = inst_infos["bbox_crop"]
+        elif cfg.MODEL.BBOX_CROP_REAL and "real" in img_type:
+            inst_infos["bbox"] = inst_infos["bbox_crop"]
+        else:
+            # override bbox info using xyz_infos
+            inst_infos["bbox"] = [x1, y1, x2, y2]
+            inst_infos["bbox_mode"] = BoxMode.XYXY_ABS
+
+        # USER: Implement additional transformations if you have other types of data
+        # inst_infos.pop("segmentation")  # NOTE: use mask from xyz
+        anno = transform_instance_annotations(inst_infos, transforms, image_shape, keypoint_hflip_indices=None)
+
+        # augment bbox ===================================================
+        bbox_xyxy = anno["bbox"]
+        bbox_center, scale = self.aug_bbox_DZI(cfg, bbox_xyxy, im_H, im_W)
+        return anno, xyz_info, bbox_center, scale
+
+    def _get_device_crop_data(self, cfg, inst_infos, transforms, image_shape, mask_trunc=None, img_type="real"):
+        """the uncropped data of the roi targets, cropped for the whole batch on
+        the device (crop_roi_targets_batch).
+
+        Returns:
+            anno (dict): the transformed instance annotations
+            crop_data (dict): bbox_center, scale, im_mask_bits (HW, uint8, bit 0/1/2/3:
+                obj/visib/trunc/full mask), xyz_crop (HWC, float16) and xyz_crop_xy (its top left corner)
+        """
+        im_H, im_W = image_shape
+        anno, xyz_info, bbox_center, scale = self._load_inst_xyz_and_aug_bbox(
+            cfg, inst_infos, transforms, image_shape, img_type=img_type
+        )
+        x1, y1, x2, y2 = xyz_info["xyxy"]
+        xyz_crop = np.asarray(xyz_info["xyz_crop"], dtype=np.float32)
+        # NOTE: full mask
+        mask_obj = np.zeros((im_H, im_W), dtype=np.uint8)
+        mask_obj[y1 : y2 + 1, x1 : x2 + 1] = np.any(xyz_crop != 0, axis=2)
+        if cfg.INPUT.SMOOTH_XYZ or cfg.TRAIN.VIS:
+            # pad the crop with the zeros around it, so smoothing it equals smoothing the full xyz
+            xyz_crop = np.pad(xyz_crop, ((2, 2), (2, 2), (0, 0)))
+            x1 -= 2
+            y1 -= 2
+            if cfg.INPUT.SMOOTH_XYZ:
+                xyz_crop = self.smooth_xyz(xyz_crop)
+            if cfg.TRAIN.VIS:
+                xyz_crop = self.smooth_xyz(xyz_crop)
+
+        # (mask_trunc < mask_visib < mask_obj)
+        mask_visib = anno["segmentation"].astype(np.bool).astype(np.uint8) * mask_obj
+        if mask_trunc is not None:
+            mask_trunc = mask_visib * mask_trunc.astype(np.bool).astype(np.uint8)
+        else:
+            mask_trunc = mask_visib
+        mask_bits = mask_obj | (mask_visib << 1) | (mask_trunc << 2)
+        if "mask_full" in anno.keys():
+            mask_bits |= anno["mask_full"].astype(np.bool).astype(np.uint8) << 3
+
+        crop_data = {
+            "bbox_center": bbox_center,
+            "scale": scale,
+            "im_mask_bits": mask_bits,
+            "xyz_crop": xyz_crop.astype(np.float16),
+            "xyz_crop_xy": np.array([x1, y1], dtype=np.float32),
+        }
+        return anno, crop_data
+
+    def _crop_roi_targets(self, cfg, inst_infos, transforms, image_shape, coord_2d, mask_trunc=None, img_type="real"):
+        """load the xyz of the instance, augment the bbox and crop the
+        (augmentation independent) roi targets.
+
+        Returns:
+            anno (dict): the transformed instance annotations
+            roi_targets (dict): bbox_center, scale, roi_coord_2d (CHW), roi_xyz (HWC),
+                roi_mask_trunc/visib/obj and roi_mask_full if available (HW)
+        """
+        im_H, im_W = image_shape
+        out_res = cfg.MODEL.POSE_NET.OUTPUT_RES
+        anno, xyz_info, bbox_center, scale = self._load_inst_xyz_and_aug_bbox(
+            cfg, inst_infos, transforms, image_shape, img_type=img_type
+        )
+        x1, y1, x2, y2 = xyz_info["xyxy"]
+        # float16 does not affect performance (classification/regresion)
+        xyz_crop = xyz_info["xyz_crop"]
+        xyz = np.zeros((im_H, im_W, 3), dtype=np.float32)
+        xyz[y1 : y2 + 1, x1 : x2 + 1, :] = xyz_crop
+        # NOTE: full mask
+        mask_obj = ((xyz[:, :, 0] != 0) | (xyz[:, :, 1] != 0) | (xyz[:, :, 2] != 0)).astype(np.bool).astype(np.float32)
+        if cfg.INPUT.SMOOTH_XYZ:
+            xyz = self.smooth_xyz(xyz)
+
+        if cfg.TRAIN.VIS:
+            xyz = self.smooth_xyz(xyz)
+
+        roi_targets = {"bbox_center": bbox_center, "scale": scale}
+
+        # roi_coord_2d ----------------------------------------------------
+        roi_targets["roi_coord_2d"] = crop_resize_by_warp_affine(
+            coord_2d,
+            bbox_center,
+            scale,
+            out_res,
+            interpolation=cv2.INTER_LINEAR,
+        ).transpose(2, 0, 1)
+
+        ## roi_mask ---------------------------------------
+        # (mask_trunc < mask_visib < mask_obj)
+        mask_visib = anno["segmentation"].astype("float32") * mask_obj
+
+        if mask_trunc is None:
+            mask_trunc = mask_visib
+        else:
+            mask_trunc = mask_visib * mask_trunc.astype("float32")
+
+        if cfg.TRAIN.VIS:
+            mask_xyz_interp = cv2.INTER_LINEAR
+        else:
+            mask_xyz_interp = cv2.INTER_NEAREST
+
+        # maybe truncated mask (true mask for rgb)
+        roi_targets["roi_mask_trunc"] = crop_resize_by_warp_affine(
+            mask_trunc[:, :, None],
+            bbox_center,
+            scale,
+            out_res,
+            interpolation=mask_xyz_interp,
+        )
+
+        # use original visible mask to calculate xyz loss (try full obj mask?)
+        roi_targets["roi_mask_visib"] = crop_resize_by_warp_affine(
+            mask_visib[:, :, None],
+            bbox_center,
+            scale,
+            out_res,
+            interpolation=mask_xyz_interp,
+        )
+
+        roi_targets["roi_mask_obj"] = crop_resize_by_warp_affine(
+            mask_obj[:, :, None],
+            bbox_center,
+            scale,
+            out_res,
+            interpolation=mask_xyz_interp,
+        )
+
+        if "mask_full" in anno.keys():
+            # TODO: maybe directly use mask_obj
+            mask_full = anno["mask_full"].astype("float32")
+            roi_targets["roi_mask_full"] = crop_resize_by_warp_affine(
+                mask_full[:, :, None],
+                bbox_center,
+                scale,
+                out_res,
+                interpolation=mask_xyz_interp,
+            )
+
+        ## roi_xyz ----------------------------------------------------
+        roi_targets["roi_xyz"] = crop_resize_by_warp_affine(
+            xyz, bbox_center, scale, out_res, interpolation=mask_xyz_interp
+        )
+        return anno, roi_targets
+
+    def _get_roi_pack_targets(self, roi_pack_rec, image_shape, mask_trunc=None):
+        """the same as _crop_roi_targets (with fixed bboxes), but read from a
+        roi pack record.
+
+        NOTE: the record holds read-only views into the pack, everything which
+        is modified later is converted (copied) here.
+        """
+        assert tuple(roi_pack_rec["im_hw"]) == tuple(image_shape), (roi_pack_rec["im_hw"], image_shape)
+        out_res = self.cfg.MODEL.POSE_NET.OUTPUT_RES
+        bbox_center = roi_pack_rec["bbox_center"].copy()
+        scale = float(roi_pack_rec["scale"])
+        roi_targets = {"bbox_center": bbox_center, "scale": scale}
+        roi_targets["roi_coord_2d"] = roi_pack_rec["roi_coord_2d"]
+        roi_targets["roi_xyz"] = roi_pack_rec["roi_xyz"].astype("float32")
+        roi_targets["roi_mask_visib"] = roi_mask_visib = roi_pack_rec["roi_mask_visib"].astype("float32")
+        roi_targets["roi_mask_obj"] = roi_pack_rec["roi_mask_obj"].astype("float32")
+        if "roi_mask_full" in roi_pack_rec:
+            roi_targets["roi_mask_full"] = roi_pack_rec["roi_mask_full"].astype("float32")
+        if mask_trunc is None:
+            roi_targets["roi_mask_trunc"] = roi_mask_visib
+        else:
+            # nearest interpolation: crop(mask_visib * mask_trunc) == crop(mask_visib) * crop(mask_trunc)
+            roi_targets["roi_mask_trunc"] = roi_mask_visib * crop_resize_by_warp_affine(
+                mask_trunc.astype("float32")[:, :, None],
+                bbox_center,
+                scale,
+                out_res,
+                interpolation=cv2.INTER_NEAREST,
+            )
+        return roi_targets
+
+    def get_roi_pack_records(self, dataset_dict):
+        """crop the augmentation independent roi data of an image (test) or an
+        instance (train) for the roi pack.
+
+        Returns:
+            list[tuple(str, dict)]: (key, record) of each roi
+        """
+        cfg = self.cfg
+        net_cfg = cfg.MODEL.POSE_NET
+        dataset_dict = copy.deepcopy(dataset_dict)
+
+        image = read_image_mmcv(dataset_dict["file_name"], format=self.img_format)
+        utils.check_image_size(dataset_dict, image)
+        im_H, im_W = image_shape = image.shape[:2]
+        aug_image, transforms = T.apply_augmentations(self.augmentation, image.copy())
+        assert aug_image.shape[:2] == image_shape, "roi packs do not support resizing"
+        coord_2d = get_2d_coord_np(im_W, im_H, low=0, high=1).transpose(1, 2, 0)
+        im_hw = np.array(image_shape, dtype=np.int32)
+
+        if self.split == "train":
+            key = get_roi_pack_key(dataset_dict)
+            inst_infos = dataset_dict["inst_infos"]
+            anno, roi_targets = self._crop_roi_targets(
+                cfg, inst_infos, transforms, image_shape, coord_2d, img_type=dataset_dict.get("img_type", "real")
+            )
+            record = {
+                "im_hw": im_hw,
+                "bbox": np.asarray(anno["bbox"], dtype=np.float64),
+                "bbox_center": roi_targets["bbox_center"].astype(np.float64),
+                "scale": np.float64(roi_targets["scale"]),
+                "roi_coord_2d": roi_targets["roi_coord_2d"].astype(np.float32),
+                "roi_xyz": roi_targets["roi_xyz"].astype(np.float32),
+                "roi_mask_visib": roi_targets["roi_mask_visib"].astype(np.uint8),
+                "roi_mask_obj": roi_targets["roi_mask_obj"].astype(np.uint8),
+            }
+            if "roi_mask_full" in roi_targets:
+                record["roi_mask_full"] = roi_targets["roi_mask_full"].astype(np.uint8)
+            return [(key, record)]
+
+        test_bbox_type = cfg.TEST.TEST_BBOX_TYPE
+        bbox_key = "bbox" if test_bbox_type == "gt" else f"bbox_{test_bbox_type}"
+        records = []
+        for inst_i, inst_infos in enumerate(dataset_dict["annotations"]):
+            bbox = BoxMode.convert(inst_infos[bbox_key], inst_infos["bbox_mode"], BoxMode.XYXY_ABS)
+            bbox = np.array(transforms.apply_box([bbox])[0])
+            bbox_center, scale, _, _ = self._get_test_roi_box(cfg, bbox, im_H, im_W)
+            roi_img = crop_resize_by_warp_affine(
+                image, bbox_center, scale, net_cfg.INPUT_RES, interpolation=cv2.INTER_LINEAR
+            )
+            roi_coord_2d = crop_resize_by_warp_affine(
+                coord_2d, bbox_center, scale, net_cfg.OUTPUT_RES, interpolation=cv2.INTER_LINEAR
+            ).transpose(2, 0, 1)
+            record = {
+                "im_hw": im_hw,
+                "bbox": bbox.astype(np.float64),
+                "roi_img": roi_img,  # HWC, uint8
+                "roi_coord_2d": roi_coord_2d.astype(np.float32),
+            }
+            records.append((get_roi_pack_key(dataset_dict, inst_i), record))
+        return records
+
     def read_data(self, dataset_dict):
         """load image and annos random shift & scale bbox; crop, rescale."""
         cfg = self.cfg
@@ -325,14 +634,19 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
         pnp_net_cfg = net_cfg.PNP_NET
         loss_cfg = net_cfg.LOSS_CFG
 
-        dataset_dict = copy.deepcopy(dataset_dict)  # it will be modified by code below
+        dataset_dict = self._own_sample_dict(dataset_dict)  # it will be modified by code below
 
         dataset_name = dataset_dict["dataset_name"]
 
-        image = read_image_mmcv(dataset_dict["file_name"], format=self.img_format)
-        # should be consistent with the size in dataset_dict
-        utils.check_image_size(dataset_dict, image)
-        im_H_ori, im_W_ori = image.shape[:2]
+        if self.split != "train" and self.roi_packs is not None:
+            # NOTE: the rois have been cropped offline, no need to decode the image
+            image = None
+            im_H_ori, im_W_ori = dataset_dict["height"], dataset_dict["width"]
+        else:
+            image = read_image_mmcv(dataset_dict["file_name"], format=self.img_format)
+            # should be consistent with the size in dataset_dict
+            utils.check_image_size(dataset_dict, image)
+            im_H_ori, im_W_ori = image.shape[:2]
 
         # currently only replace bg for train ###############################
         if self.split == "train":
@@ -380,8 +694,12 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
 
         # other transforms (mainly geometric ones);
         # for 6d pose task, flip is not allowed in general except for some 2d keypoints methods
-        image, transforms = T.apply_augmentations(self.augmentation, image)
-        im_H, im_W = image_shape = image.shape[:2]  # h, w
+        if image is not None:
+            image, transforms = T.apply_augmentations(self.augmentation, image)
+            im_H, im_W = image_shape = image.shape[:2]  # h, w
+        else:  # roi packs are built without resizing
+            transforms = None
+            im_H, im_W = image_shape = im_H_ori, im_W_ori
 
         # NOTE: scale camera intrinsic if necessary ================================
         scale_x = im_W / im_W_ori
@@ -396,8 +714,11 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
         input_res = net_cfg.INPUT_RES
         out_res = net_cfg.OUTPUT_RES
 
-        # CHW -> HWC
-        coord_2d = get_2d_coord_np(im_W, im_H, low=0, high=1).transpose(1, 2, 0)
+        if self.roi_packs is None and not self.device_roi_crop:
+            # CHW -> HWC
+            coord_2d = get_2d_coord_np(im_W, im_H, low=0, high=1).transpose(1, 2, 0)
+        else:  # roi_coord_2d is in the roi packs or computed on the device
+            coord_2d = None
 
         #################################################################################
         if self.split != "train":
@@ -445,20 +766,20 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
                 roi_extent = self._get_extents(dataset_name)[roi_cls]
                 roi_infos["roi_extent"].append(roi_extent)
 
-                bbox = BoxMode.convert(
-                    inst_infos[bbox_key],
-                    inst_infos["bbox_mode"],
-                    BoxMode.XYXY_ABS,
-                )
-                bbox = np.array(transforms.apply_box([bbox])[0])
+                if self.roi_packs is not None:
+                    roi_pack_rec = get_roi_pack_record(self.roi_packs, get_roi_pack_key(dataset_dict, inst_i))
+                    bbox = roi_pack_rec["bbox"].copy()
+                else:
+                    roi_pack_rec = None
+                    bbox = BoxMode.convert(
+                        inst_infos[bbox_key],
+                        inst_infos["bbox_mode"],
+                        BoxMode.XYXY_ABS,
+                    )
+                    bbox = np.array(transforms.apply_box([bbox])[0])
                 roi_infos[bbox_key].append(bbox)
                 roi_infos["bbox_mode"].append(BoxMode.XYXY_ABS)
-                x1, y1, x2, y2 = bbox
-                bbox_center = np.array([0.5 * (x1 + x2), 0.5 * (y1 + y2)])
-                bw = max(x2 - x1, 1)
-                bh = max(y2 - y1, 1)
-                scale = max(bh, bw) * cfg.INPUT.DZI_PAD_SCALE
-                scale = min(scale, max(im_H, im_W)) * 1.0
+                bbox_center, scale, bw, bh = self._get_test_roi_box(cfg, bbox, im_H, im_W)
 
                 roi_infos["bbox_center"].append(bbox_center.astype("float32"))
                 roi_infos["scale"].append(scale)
@@ -468,27 +789,33 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
 
                 # CHW, float32 tensor
                 # roi_image
-                roi_img = crop_resize_by_warp_affine(
-                    image,
-                    bbox_center,
-                    scale,
-                    input_res,
-                    interpolation=cv2.INTER_LINEAR,
-                ).transpose(2, 0, 1)
+                if roi_pack_rec is not None:
+                    roi_img = roi_pack_rec["roi_img"].transpose(2, 0, 1)
+                else:
+                    roi_img = crop_resize_by_warp_affine(
+                        image,
+                        bbox_center,
+                        scale,
+                        input_res,
+                        interpolation=cv2.INTER_LINEAR,
+                    ).transpose(2, 0, 1)
 
                 roi_img = self.normalize_image(cfg, roi_img)
                 roi_infos["roi_img"].append(roi_img.astype("float32"))
 
                 # roi_coord_2d
-                roi_coord_2d = crop_resize_by_warp_affine(
-                    coord_2d,
-                    bbox_center,
-                    scale,
-                    out_res,
-                    interpolation=cv2.INTER_LINEAR,
-                ).transpose(
-                    2, 0, 1
-                )  # HWC -> CHW
+                if roi_pack_rec is not None:
+                    roi_coord_2d = roi_pack_rec["roi_coord_2d"]
+                else:
+                    roi_coord_2d = crop_resize_by_warp_affine(
+                        coord_2d,
+                        bbox_center,
+                        scale,
+                        out_res,
+                        interpolation=cv2.INTER_LINEAR,
+                    ).transpose(
+                        2, 0, 1
+                    )  # HWC -> CHW
                 roi_infos["roi_coord_2d"].append(roi_coord_2d.astype("float32"))
 
                 # roi_coord_2d_rel
@@ -510,47 +837,74 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
         #######################################################################################
         # NOTE: currently assume flattened dicts for train
         assert self.flatten, "Only support flattened dicts for train now"
+        if self.roi_packs is not None:
+            roi_pack_rec = get_roi_pack_record(self.roi_packs, get_roi_pack_key(dataset_dict))
+        else:
+            roi_pack_rec = None
         inst_infos = dataset_dict.pop("inst_infos")
         dataset_dict["roi_cls"] = roi_cls = inst_infos["category_id"]
 
         # extent
         roi_extent = self._get_extents(dataset_name)[roi_cls]
-        dataset_dict["roi_extent"] = torch.tensor(roi_extent, dtype=torch.float32)
-
-        # load xyz =======================================================
-        xyz_info = mmcv.load(inst_infos["xyz_path"])
-        x1, y1, x2, y2 = xyz_info["xyxy"]
-        # float16 does not affect performance (classification/regresion)
-        xyz_crop = xyz_info["xyz_crop"]
-        xyz = np.zeros((im_H, im_W, 3), dtype=np.float32)
-        xyz[y1 : y2 + 1, x1 : x2 + 1, :] = xyz_crop
-        # NOTE: full mask
-        mask_obj = ((xyz[:, :, 0] != 0) | (xyz[:, :, 1] != 0) | (xyz[:, :, 2] != 0)).astype(np.bool).astype(np.float32)
-        if cfg.INPUT.SMOOTH_XYZ:
-            xyz = self.smooth_xyz(xyz)
-
-        if cfg.TRAIN.VIS:
-            xyz = self.smooth_xyz(xyz)
+        if not self.use_asset_bank:
+            dataset_dict["roi_extent"] = torch.tensor(roi_extent, dtype=torch.float32)
 
-        if cfg.MODEL.BBOX_CROP_SYN and "syn" in img_type:
-            inst_infos["bbox"] = inst_infos["bbox_crop"]
-        elif cfg.MODEL.BBOX_CROP_REAL and "real" in img_type:
-            inst_infos["bbox"] = inst_infos["bbox_crop"]
+        if roi_pack_rec is None and self.device_roi_crop:
+            anno, roi_targets = self._get_device_crop_data(
+                cfg, inst_infos, transforms, image_shape, mask_trunc=mask_trunc, img_type=img_type
+            )
+        elif roi_pack_rec is None:
+            anno, roi_targets = self._crop_roi_targets(
+                cfg, inst_infos, transforms, image_shape, coord_2d, mask_trunc=mask_trunc, img_type=img_type
+            )
         else:
-            # override bbox info using xyz_infos
-            inst_infos["bbox"] = [x1, y1, x2, y2]
+            # the masks are in the roi pack, do not decode the segmentations again
+            inst_infos.pop("segmentation", None)
+            inst_infos.pop("mask_full", None)
+            inst_infos["bbox"] = roi_pack_rec["bbox"].copy()
             inst_infos["bbox_mode"] = BoxMode.XYXY_ABS
+            anno = transform_instance_annotations(inst_infos, transforms, image_shape, keypoint_hflip_indices=None)
+            roi_targets = self._get_roi_pack_targets(roi_pack_rec, image_shape, mask_trunc=mask_trunc)
 
-        # USER: Implement additional transformations if you have other types of data
-        # inst_infos.pop("segmentation")  # NOTE: use mask from xyz
-        anno = transform_instance_annotations(inst_infos, transforms, image_shape, keypoint_hflip_indices=None)
-
-        # augment bbox ===================================================
+        bbox_center = roi_targets["bbox_center"]
+        scale = roi_targets["scale"]
         bbox_xyxy = anno["bbox"]
-        bbox_center, scale = self.aug_bbox_DZI(cfg, bbox_xyxy, im_H, im_W)
         bw = max(bbox_xyxy[2] - bbox_xyxy[0], 1)
         bh = max(bbox_xyxy[3] - bbox_xyxy[1], 1)
 
+        dataset_dict["bbox_center"] = torch.as_tensor(bbox_center, dtype=torch.float32)
+        dataset_dict["scale"] = scale
+        dataset_dict["bbox"] = anno["bbox"]  # NOTE: original bbox
+        dataset_dict["roi_wh"] = torch.as_tensor(np.array([bw, bh], dtype=np.float32))
+        dataset_dict["resize_ratio"] = resize_ratio = out_res / scale
+        z_ratio = inst_infos["trans"][2] / resize_ratio
+        obj_center = anno["centroid_2d"]
+        delta_c = obj_center - bbox_center
+        dataset_dict["trans_ratio"] = torch.as_tensor([delta_c[0] / bw, delta_c[1] / bh, z_ratio]).to(torch.float32)
+
+        # pose targets ----------------------------------------------------------------------
+        pose = inst_infos["pose"]
+        dataset_dict["ego_rot"] = torch.as_tensor(pose[:3, :3].astype("float32"))
+        dataset_dict["trans"] = torch.as_tensor(inst_infos["trans"].astype("float32"))
+
+        if not self.use_asset_bank:
+            dataset_dict["roi_points"] = torch.as_tensor(
+                self._get_model_points(dataset_name)[roi_cls].astype("float32")
+            )
+            dataset_dict["sym_info"] = self._get_sym_infos(dataset_name)[roi_cls]
+
+        if self.device_roi_crop:
+            # the full image and the uncropped targets, cropped on the device by crop_roi_targets_batch
+            dataset_dict["image"] = torch.as_tensor(np.ascontiguousarray(image.transpose(2, 0, 1)))
+            dataset_dict["im_mask_bits"] = torch.as_tensor(roi_targets["im_mask_bits"])
+            dataset_dict["xyz_crop"] = torch.as_tensor(np.ascontiguousarray(roi_targets["xyz_crop"].transpose(2, 0, 1)))
+            dataset_dict["xyz_crop_xy"] = torch.as_tensor(roi_targets["xyz_crop_xy"])
+            dataset_dict["has_mask_full"] = "mask_full" in anno
+            if g_head_cfg.NUM_REGIONS > 1 and not self.use_asset_bank:
+                fps_points = self._get_fps_points(dataset_name)[roi_cls]
+                dataset_dict["roi_fps_points"] = torch.as_tensor(fps_points.astype(np.float32)).contiguous()
+            return dataset_dict
+
         # CHW, float32 tensor
         ## roi_image ------------------------------------
         roi_img = crop_resize_by_warp_affine(
@@ -564,13 +918,7 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
         roi_img = self.normalize_image(cfg, roi_img)
 
         # roi_coord_2d ----------------------------------------------------
-        roi_coord_2d = crop_resize_by_warp_affine(
-            coord_2d,
-            bbox_center,
-            scale,
-            out_res,
-            interpolation=cv2.INTER_LINEAR,
-        ).transpose(2, 0, 1)
+        roi_coord_2d = roi_targets["roi_coord_2d"]
 
         # roi_coord_2d_rel
         roi_coord_2d_rel = (
@@ -578,64 +926,23 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
         ) / scale
 
         ## roi_mask ---------------------------------------
-        # (mask_trunc < mask_visib < mask_obj)
-        mask_visib = anno["segmentation"].astype("float32") * mask_obj
-
-        if mask_trunc is None:
-            mask_trunc = mask_visib
-        else:
-            mask_trunc = mask_visib * mask_trunc.astype("float32")
-
-        if cfg.TRAIN.VIS:
-            mask_xyz_interp = cv2.INTER_LINEAR
-        else:
-            mask_xyz_interp = cv2.INTER_NEAREST
-
-        # maybe truncated mask (true mask for rgb)
-        roi_mask_trunc = crop_resize_by_warp_affine(
-            mask_trunc[:, :, None],
-            bbox_center,
-            scale,
-            out_res,
-            interpolation=mask_xyz_interp,
-        )
-
-        # use original visible mask to calculate xyz loss (try full obj mask?)
-        roi_mask_visib = crop_resize_by_warp_affine(
-            mask_visib[:, :, None],
-            bbox_center,
-            scale,
-            out_res,
-            interpolation=mask_xyz_interp,
-        )
-
-        roi_mask_obj = crop_resize_by_warp_affine(
-            mask_obj[:, :, None],
-            bbox_center,
-            scale,
-            out_res,
-            interpolation=mask_xyz_interp,
-        )
-
-        if "mask_full" in anno.keys():
-            # TODO: maybe directly use mask_obj
-            mask_full = anno["mask_full"].astype("float32")
-            roi_mask_full = crop_resize_by_warp_affine(
-                mask_full[:, :, None],
-                bbox_center,
-                scale,
-                out_res,
-                interpolation=mask_xyz_interp,
-            )
+        roi_mask_trunc = roi_targets["roi_mask_trunc"]
+        roi_mask_visib = roi_targets["roi_mask_visib"]
+        roi_mask_obj = roi_targets["roi_mask_obj"]
+        roi_mask_full = roi_targets.get("roi_mask_full", None)
 
         ## roi_xyz ----------------------------------------------------
-        roi_xyz = crop_resize_by_warp_affine(xyz, bbox_center, scale, out_res, interpolation=mask_xyz_interp)
+        roi_xyz = roi_targets["roi_xyz"]
 
         # region label
         if g_head_cfg.NUM_REGIONS > 1:
             fps_points = self._get_fps_points(dataset_name)[roi_cls]
             roi_region = xyz_to_region(roi_xyz, fps_points)  # HW
-            dataset_dict["roi_region"] = torch.as_tensor(roi_region.astype(np.int32)).contiguous()
+            if self.compact_targets:
+                roi_region = compact_region(roi_region, g_head_cfg.NUM_REGIONS)
+            else:
+                roi_region = roi_region.astype(np.int32)
+            dataset_dict["roi_region"] = torch.as_tensor(roi_region).contiguous()
 
         roi_xyz = roi_xyz.transpose(2, 0, 1)  # HWC-->CHW
         # normalize xyz to [0, 1] using extent
@@ -643,6 +950,7 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
         roi_xyz[1] = roi_xyz[1] / roi_extent[1] + 0.5
         roi_xyz[2] = roi_xyz[2] / roi_extent[2] + 0.5
 
+        xyz_dtype = "float16" if self.compact_targets else "float32"
         xyz_loss_type = loss_cfg.XYZ_LOSS_TYPE
         if ("CE" in xyz_loss_type) or ("cls" in cfg.MODEL.POSE_NET.NAME):  # convert target to int for cls
             n_xyz_bin = g_head_cfg.XYZ_BIN
@@ -679,37 +987,32 @@ class Depth6DPose_DatasetFromList(Base_DatasetFromList):
             if "CE" in xyz_loss_type:
                 dataset_dict["roi_xyz_bin"] = torch.as_tensor(roi_xyz_bin.astype("uint8")).contiguous()
             if "/" in xyz_loss_type and len(xyz_loss_type.split("/")[1]) > 0:
-                dataset_dict["roi_xyz"] = torch.as_tensor(roi_xyz.astype("float32")).contiguous()
+                dataset_dict["roi_xyz"] = torch.as_tensor(roi_xyz.astype(xyz_dtype)).contiguous()
         else:
-            dataset_dict["roi_xyz"] = torch.as_tensor(roi_xyz.astype("float32")).contiguous()
-
-        # pose targets ----------------------------------------------------------------------
-        pose = inst_infos["pose"]
-        dataset_dict["ego_rot"] = torch.as_tensor(pose[:3, :3].astype("float32"))
-        dataset_dict["trans"] = torch.as_tensor(inst_infos["trans"].astype("float32"))
-
-        dataset_dict["roi_points"] = torch.as_tensor(self._get_model_points(dataset_name)[roi_cls].astype("float32"))
-        dataset_dict["sym_info"] = self._get_sym_infos(dataset_name)[roi_cls]
+            dataset_dict["roi_xyz"] = torch.as_tensor(roi_xyz.astype(xyz_dtype)).contiguous()
 
         dataset_dict["roi_img"] = torch.as_tensor(roi_img.astype("float32")).contiguous()
         dataset_dict["roi_coord_2d"] = torch.as_tensor(roi_coord_2d.astype("float32")).contiguous()
         dataset_dict["roi_coord_2d_rel"] = torch.as_tensor(roi_coord_2d_rel.astype("float32")).contiguous()
 
-        dataset_dict["roi_mask_trunc"] = torch.as_tensor(roi_mask_trunc.astype("float32")).contiguous()
-        dataset_dict["roi_mask_visib"] = torch.as_tensor(roi_mask_visib.astype("float32")).contiguous()
-        dataset_dict["roi_mask_obj"] = torch.as_tensor(roi_mask_obj.astype("float32")).contiguous()
-        if "mask_full" in anno.keys():
-            dataset_dict["roi_mask_full"] = torch.as_tensor(roi_mask_full.astype("float32")).contiguous()
+        if self.compact_targets:
+            roi_mask_trunc = compact_mask(roi_mask_trunc)
+            roi_mask_visib = compact_mask(roi_mask_visib)
+            roi_mask_obj = compact_mask(roi_mask_obj)
+            if roi_mask_full is not None:
+                roi_mask_full = compact_mask(roi_mask_full)
+        else:
+            roi_mask_trunc = roi_mask_trunc.astype("float32")
+            roi_mask_visib = roi_mask_visib.astype("float32")
+            roi_mask_obj = roi_mask_obj.astype("float32")
+            if roi_mask_full is not None:
+                roi_mask_full = roi_mask_full.astype("float32")
+        dataset_dict["roi_mask_trunc"] = torch.as_tensor(roi_mask_trunc).contiguous()
+        dataset_dict["roi_mask_visib"] = torch.as_tensor(roi_mask_visib).contiguous()
+        dataset_dict["roi_mask_obj"] = torch.as_tensor(roi_mask_obj).contiguous()
+        if roi_mask_full is not None:
+            dataset_dict["roi_mask_full"] = torch.as_tensor(roi_mask_full).contiguous()
 
-        dataset_dict["bbox_center"] = torch.as_tensor(bbox_center, dtype=torch.float32)
-        dataset_dict["scale"] = scale
-        dataset_dict["bbox"] = anno["bbox"]  # NOTE: original bbox
-        dataset_dict["roi_wh"] = torch.as_tensor(np.array([bw, bh], dtype=np.float32))
-        dataset_dict["resize_ratio"] = resize_ratio = out_res / scale
-        z_ratio = inst_infos["trans"][2] / resize_ratio
-        obj_center = anno["centroid_2d"]
-        delta_c = obj_center - bbox_center
-        dataset_dict["trans_ratio"] = torch.as_tensor([delta_c[0] / bw, delta_c[1] / bh, z_ratio]).to(torch.float32)
         return dataset_dict
 
     def smooth_xyz(self, xyz):
@@ -763,7 +1066,13 @@ def build_Depth6DPose_train_loader(cfg, dataset_names):
     if cfg.MODEL.POSE_NET.XYZ_ONLINE:
         dataset = Depth6DPose_Online_DatasetFromList(cfg, split="train", lst=dataset_dicts, copy=False)
     else:
-        dataset = Depth6DPose_DatasetFromList(cfg, split="train", lst=dataset_dicts, copy=False)
+        dataset = Depth6DPose_DatasetFromList(
+            cfg,
+            split="train",
+            lst=dataset_dicts,
+            copy=False,
+            roi_pack_files=cfg.DATASETS.get("ROI_PACK_FILES_TRAIN", ()),
+        )
 
     sampler_name = cfg.DATALOADER.SAMPLER_TRAIN
     logger = logging.getLogger(__name__)
@@ -823,7 +1132,13 @@ def build_Depth6DPose_test_loader(cfg, dataset_name, train_objs=None):
         if cfg.DATALOADER.FILTER_EMPTY_DETS:
             dataset_dicts = filter_empty_dets(dataset_dicts)
 
-    dataset = Depth6DPose_DatasetFromList(cfg, split="test", lst=dataset_dicts, flatten=False)
+    roi_pack_files = cfg.DATASETS.get("ROI_PACK_FILES_TEST", ())
+    if len(roi_pack_files) > 0:
+        assert len(cfg.DATASETS.TEST) == len(roi_pack_files)
+        roi_pack_files = [roi_pack_files[cfg.DATASETS.TEST.index(dataset_name)]]
+    dataset = Depth6DPose_DatasetFromList(
+        cfg, split="test", lst=dataset_dicts, flatten=False, roi_pack_files=roi_pack_files
+    )
 
     sampler = InferenceSampler(len(dataset))
     # Always use 1 image per worker during inference since this is the
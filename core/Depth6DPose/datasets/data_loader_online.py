@@ -1,8 +1,6 @@
 # -*- coding: utf-8 -*-
-import copy
 import logging
 import os.path as osp
-import pickle
 
 import cv2
 import mmcv
@@ -11,9 +9,11 @@ import ref
 import torch
 from core.base_data_loader import Base_DatasetFromList
 from core.utils.data_utils import (
+    compact_mask,
     crop_resize_by_warp_affine,
     get_2d_coord_np,
     read_image_mmcv,
+    use_compact_targets,
     xyz_to_region,
 )
 from core.utils.dataset_utils import flat_dataset_dicts
@@ -157,6 +157,8 @@ class Depth6DPose_Online_DatasetFromList(Base_DatasetFromList):
             self.color_augmentor = self._get_color_augmentor(aug_type=self.color_aug_type, aug_code=self.color_aug_code)
         else:
             self.color_augmentor = None
+        # train: uint8 masks, expanded on the device in batch_data_train_online
+        self.compact_targets = split == "train" and use_compact_targets(cfg)
         # ------------------------
         # common model infos
         self.fps_points = {}
@@ -169,24 +171,7 @@ class Depth6DPose_Online_DatasetFromList(Base_DatasetFromList):
         # ----------------------------------------------------
         self._copy = copy
         self._serialize = serialize
-
-        def _serialize(data):
-            buffer = pickle.dumps(data, protocol=-1)
-            return np.frombuffer(buffer, dtype=np.uint8)
-
-        if self._serialize:
-            logger.info("Serializing {} elements to byte tensors and concatenating them all ...".format(len(self._lst)))
-            self._lst = [_serialize(x) for x in self._lst]
-            self._addr = np.asarray([len(x) for x in self._lst], dtype=np.int64)
-            self._addr = np.cumsum(self._addr)
-            self._lst = np.concatenate(self._lst)
-            logger.info("Serialized dataset takes {:.2f} MiB".format(len(self._lst) / 1024 ** 2))
-
-    def __len__(self):
-        if self._serialize:
-            return len(self._addr)
-        else:
-            return len(self._lst)
+        self._serialize_lst()
 
     def _get_fps_points(self, dataset_name, with_center=False):
         """convert to label based keys.
@@ -310,7 +295,7 @@ class Depth6DPose_Online_DatasetFromList(Base_DatasetFromList):
         net_cfg = cfg.MODEL.POSE_NET
         g_head_cfg = net_cfg.GEO_HEAD
 
-        dataset_dict = copy.deepcopy(dataset_dict)  # it will be modified by code below
+        dataset_dict = self._own_sample_dict(dataset_dict)  # it will be modified by code below
 
         dataset_name = dataset_dict["dataset_name"]
 
@@ -602,10 +587,11 @@ class Depth6DPose_Online_DatasetFromList(Base_DatasetFromList):
         dataset_dict["roi_coord_2d"] = torch.as_tensor(roi_coord_2d.astype("float32")).contiguous()
         dataset_dict["roi_coord_2d_rel"] = torch.as_tensor(roi_coord_2d_rel.astype("float32")).contiguous()
 
-        dataset_dict["roi_mask_trunc"] = torch.as_tensor(roi_mask_trunc.astype("float32")).contiguous()
-        dataset_dict["roi_mask_visib"] = torch.as_tensor(roi_mask_visib.astype("float32")).contiguous()
+        mask_to_target = compact_mask if self.compact_targets else (lambda m: m.astype("float32"))
+        dataset_dict["roi_mask_trunc"] = torch.as_tensor(mask_to_target(roi_mask_trunc)).contiguous()
+        dataset_dict["roi_mask_visib"] = torch.as_tensor(mask_to_target(roi_mask_visib)).contiguous()
         if "mask_full" in anno.keys():
-            dataset_dict["roi_mask_full"] = torch.as_tensor(roi_mask_full.astype("float32")).contiguous()
+            dataset_dict["roi_mask_full"] = torch.as_tensor(mask_to_target(roi_mask_full)).contiguous()
 
         dataset_dict["bbox_center"] = torch.as_tensor(bbox_center, dtype=torch.float32)
         dataset_dict["scale"] = scale
@@ -1,8 +1,6 @@
 # -*- coding: utf-8 -*-
-import copy
 import logging
 import os.path as osp
-import pickle
 
 import cv2
 import mmcv
@@ -301,24 +299,7 @@ class DeepIM_DatasetFromList(Base_DatasetFromList):
         # ----------------------------------------------------
         self._copy = copy
         self._serialize = serialize
-
-        def _serialize(data):
-            buffer = pickle.dumps(data, protocol=-1)
-            return np.frombuffer(buffer, dtype=np.uint8)
-
-        if self._serialize:
-            logger.info("Serializing {} elements to byte tensors and concatenating them all ...".format(len(self._lst)))
-            self._lst = [_serialize(x) for x in self._lst]
-            self._addr = np.asarray([len(x) for x in self._lst], dtype=np.int64)
-            self._addr = np.cumsum(self._addr)
-            self._lst = np.concatenate(self._lst)
-            logger.info("Serialized dataset takes {:.2f} MiB".format(len(self._lst) / 1024 ** 2))
-
-    def __len__(self):
-        if self._serialize:
-            return len(self._addr)
-        else:
-            return len(self._lst)
+        self._serialize_lst()
 
     def _get_fps_points(self, dataset_name, with_center=False):
         """convert to label based keys.
@@ -442,7 +423,7 @@ class DeepIM_DatasetFromList(Base_DatasetFromList):
         pose_head_cfg = net_cfg.POSE_HEAD
         mask_head_cfg = net_cfg.MASK_HEAD
 
-        dataset_dict = copy.deepcopy(dataset_dict)  # it will be modified by code below
+        dataset_dict = self._own_sample_dict(dataset_dict)  # it will be modified by code below
 
         dataset_name = dataset_dict["dataset_name"]
 
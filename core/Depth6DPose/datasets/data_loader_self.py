@@ -2,7 +2,6 @@
 import copy
 import logging
 import os.path as osp
-import pickle
 
 import cv2
 import mmcv
@@ -25,7 +24,13 @@ from core.utils.dataset_utils import (
     my_build_batch_data_loader,
     trivial_batch_collator,
 )
-from core.utils.my_distributed_sampler import InferenceSampler, RepeatFactorTrainingSampler, TrainingSampler
+from core.utils.model_asset_bank import use_model_asset_bank
+from core.utils.my_distributed_sampler import (
+    ImageGroupedTrainingSampler,
+    InferenceSampler,
+    RepeatFactorTrainingSampler,
+    TrainingSampler,
+)
 
 from lib.pysixd import inout, misc
 from lib.utils.mask_utils import cocosegm2mask, get_edge
@@ -148,30 +153,20 @@ class Depth6DPose_Self_DatasetFromList(Base_DatasetFromList):
         self.model_points = {}
         self.extents = {}
         self.sym_infos = {}
+        # the model assets are gathered from the ModelAssetBank on the device for train
+        self.use_asset_bank = split == "train" and use_model_asset_bank(cfg)
         # ----------------------------------------------------
         self.flatten = flatten
+        if flatten:
+            # image index of each instance (for ImageGroupedTrainingSampler)
+            self.roi_im_inds = [im_i for im_i, d in enumerate(lst) for _ in d.get("annotations", [None])]
         self._lst = flat_dataset_dicts(lst) if flatten else lst
         # ----------------------------------------------------
         self._copy = copy
         self._serialize = serialize
-
-        def _serialize(data):
-            buffer = pickle.dumps(data, protocol=-1)
-            return np.frombuffer(buffer, dtype=np.uint8)
-
-        if self._serialize:
-            logger.info("Serializing {} elements to byte tensors and concatenating them all ...".format(len(self._lst)))
-            self._lst = [_serialize(x) for x in self._lst]
-            self._addr = np.asarray([len(x) for x in self._lst], dtype=np.int64)
-            self._addr = np.cumsum(self._addr)
-            self._lst = np.concatenate(self._lst)
-            logger.info("Serialized dataset takes {:.2f} MiB".format(len(self._lst) / 1024 ** 2))
-
-    def __len__(self):
-        if self._serialize:
-            return len(self._addr)
-        else:
-            return len(self._lst)
+        self._serialize_lst()
+        # image-level data of the last image (per worker), shared by the instances of this image
+        self._im_cache = {}
 
     def _get_fps_points(self, dataset_name, with_center=False):
         """convert to label based keys.
@@ -293,11 +288,20 @@ class Depth6DPose_Self_DatasetFromList(Base_DatasetFromList):
         net_cfg = cfg.MODEL.POSE_NET
         g_head_cfg = net_cfg.GEO_HEAD
 
-        dataset_dict = copy.deepcopy(dataset_dict)  # it will be modified by code below
+        dataset_dict = self._own_sample_dict(dataset_dict)  # it will be modified by code below
 
         dataset_name = dataset_dict["dataset_name"]
 
-        image = read_image_mmcv(dataset_dict["file_name"], format=self.img_format)
+        # the instances of an image share the decoded image and the full-frame tensors (gt_img, depth),
+        # so a batch carries them once per image
+        im_key = (dataset_name, dataset_dict["scene_im_id"])
+        if self.split != "train" or self._im_cache.get("key") != im_key:
+            self._im_cache = {"key": im_key}
+        im_cache = self._im_cache
+
+        if "image" not in im_cache:
+            im_cache["image"] = read_image_mmcv(dataset_dict["file_name"], format=self.img_format)
+        image = im_cache["image"].copy()
 
         # should be consistent with the size in dataset_dict
         utils.check_image_size(dataset_dict, image)
@@ -440,8 +444,9 @@ class Depth6DPose_Self_DatasetFromList(Base_DatasetFromList):
         dataset_dict["roi_cls"] = roi_cls = inst_infos["category_id"]
 
         # extent
-        roi_extent = self._get_extents(dataset_name)[roi_cls]
-        dataset_dict["roi_extent"] = torch.tensor(roi_extent, dtype=torch.float32)
+        if not self.use_asset_bank:
+            roi_extent = self._get_extents(dataset_name)[roi_cls]
+            dataset_dict["roi_extent"] = torch.tensor(roi_extent, dtype=torch.float32)
 
         img_type = dataset_dict.get("img_type", "real")
         if cfg.MODEL.LOAD_DETS_TRAIN:
@@ -485,7 +490,9 @@ class Depth6DPose_Self_DatasetFromList(Base_DatasetFromList):
         roi_gt_img = self.normalize_image(cfg, roi_gt_img)
 
         ## load depth
-        if self.with_depth:
+        if self.with_depth and "depth" in im_cache:
+            dataset_dict["depth"] = im_cache["depth"]
+        elif self.with_depth:
             assert "depth_file" in dataset_dict, "depth file is not in dataset_dict"
             depth_path = dataset_dict["depth_file"]
             depth = mmcv.imread(depth_path, "unchanged") / dataset_dict["depth_factor"]  # to m
@@ -499,7 +506,7 @@ class Depth6DPose_Self_DatasetFromList(Base_DatasetFromList):
 
                 depth_idx = depth > 0
                 depth[depth_idx] += np.random.normal(0, 0.01, depth[depth_idx].shape)
-            dataset_dict["depth"] = torch.as_tensor(depth.reshape(im_H, im_W).astype("float32"))
+            dataset_dict["depth"] = im_cache["depth"] = torch.as_tensor(depth.reshape(im_H, im_W).astype("float32"))
 
         # roi_coord_2d ----------------------------------------------------
         roi_coord_2d = crop_resize_by_warp_affine(
@@ -507,18 +514,23 @@ class Depth6DPose_Self_DatasetFromList(Base_DatasetFromList):
         ).transpose(2, 0, 1)
 
         # fps points: for region label
-        if g_head_cfg.NUM_REGIONS > 1:
+        if g_head_cfg.NUM_REGIONS > 1 and not self.use_asset_bank:
             fps_points = self._get_fps_points(dataset_name)[roi_cls]
             dataset_dict["roi_fps_points"] = torch.as_tensor(fps_points.astype(np.float32)).contiguous()
 
         dataset_dict["roi_img"] = torch.as_tensor(roi_img.astype("float32")).contiguous()
         dataset_dict["roi_gt_img"] = torch.as_tensor(roi_gt_img.astype("float32")).contiguous()
 
-        gt_img = self.normalize_image(cfg, gt_img.transpose(2, 0, 1))
-        dataset_dict["gt_img"] = torch.as_tensor(gt_img.astype("float32")).contiguous()
+        if "gt_img" not in im_cache:
+            gt_img = self.normalize_image(cfg, gt_img.transpose(2, 0, 1))
+            im_cache["gt_img"] = torch.as_tensor(gt_img.astype("float32")).contiguous()
+        dataset_dict["gt_img"] = im_cache["gt_img"]
 
-        dataset_dict["roi_points"] = torch.as_tensor(self._get_model_points(dataset_name)[roi_cls].astype("float32"))
-        dataset_dict["sym_info"] = self._get_sym_infos(dataset_name)[roi_cls]
+        if not self.use_asset_bank:
+            dataset_dict["roi_points"] = torch.as_tensor(
+                self._get_model_points(dataset_name)[roi_cls].astype("float32")
+            )
+            dataset_dict["sym_info"] = self._get_sym_infos(dataset_name)[roi_cls]
 
         dataset_dict["roi_coord_2d"] = torch.as_tensor(roi_coord_2d.astype("float32")).contiguous()
 
@@ -702,6 +714,8 @@ def build_Depth6DPose_self_train_loader(cfg, dataset_names, train_objs=None):
     # TODO avoid if-else?
     if sampler_name == "TrainingSampler":
         sampler = TrainingSampler(len(dataset))
+    elif sampler_name == "ImageGroupedTrainingSampler":
+        sampler = ImageGroupedTrainingSampler(dataset.roi_im_inds)
     elif sampler_name == "RepeatFactorTrainingSampler":
         repeat_factors = RepeatFactorTrainingSampler.repeat_factors_from_category_frequency(
             final_dataset_dicts, cfg.DATALOADER.REPEAT_THRESHOLD
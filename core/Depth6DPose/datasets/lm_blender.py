@@ -17,6 +17,7 @@ import random
 import ref
 from detectron2.data import DatasetCatalog, MetadataCatalog
 from detectron2.structures import BoxMode
+from core.utils.xyz_pack import load_xyz_info, xyz_exists
 from lib.pysixd import inout, misc
 from lib.utils.mask_utils import (
     binary_mask_to_rle,
@@ -192,7 +193,7 @@ class LM_BLENDER_Dataset(object):
                 mask_rle = binary_mask_to_rle(mask, compressed=True)
 
                 xyz_path = osp.join(scene_root, "{}_xyz_bop.pkl".format(str_im_id))
-                assert osp.exists(xyz_path), xyz_path
+                assert xyz_exists(xyz_path), xyz_path
 
                 visib_fract = anno.get("visib_fract", 1.0)
                 inst = {
@@ -506,7 +507,7 @@ def test_vis():
             bottom_color=(128, 128, 128),
         )
 
-        xyz_info = mmcv.load(anno["xyz_path"])
+        xyz_info = load_xyz_info(anno["xyz_path"])
         xyz = np.zeros((imH, imW, 3), dtype=np.float32)
         xyz_crop = xyz_info["xyz_crop"].astype(np.float32)
         x1, y1, x2, y2 = xyz_info["xyxy"]
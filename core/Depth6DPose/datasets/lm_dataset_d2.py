@@ -7,7 +7,6 @@ import time
 from collections import OrderedDict
 import mmcv
 import numpy as np
-from tqdm import tqdm
 from transforms3d.quaternions import mat2quat, quat2mat
 from detectron2.data import DatasetCatalog, MetadataCatalog
 from detectron2.structures import BoxMode
@@ -18,6 +17,8 @@ sys.path.insert(0, PROJ_ROOT)
 
 import ref
 
+from core.utils.dataset_store import get_num_scene_workers, map_scenes
+from core.utils.xyz_pack import load_xyz_info, xyz_exists
 from lib.pysixd import inout, misc
 from lib.utils.mask_utils import binary_mask_to_rle, cocosegm2mask
 from lib.utils.utils import dprint, iprint, lazy_property
@@ -62,6 +63,7 @@ class LM_Dataset(object):
         self.filter_invalid = data_cfg["filter_invalid"]
         self.filter_scene = data_cfg.get("filter_scene", False)
         self.debug_im_id = data_cfg.get("debug_im_id", None)
+        self.num_workers = get_num_scene_workers(data_cfg)  # processes to load the scenes
         ##################################################
 
         # NOTE: careful! Only the selected objects
@@ -109,120 +111,20 @@ class LM_Dataset(object):
         dataset_dicts = []  # ######################################################
         assert len(self.ann_files) == len(self.image_prefixes), f"{len(self.ann_files)} != {len(self.image_prefixes)}"
         assert len(self.ann_files) == len(self.xyz_prefixes), f"{len(self.ann_files)} != {len(self.xyz_prefixes)}"
+        # load the models before forking the scene workers
+        _ = (self.models, self.models_info)
+        scene_results = map_scenes(
+            self._load_scene_dicts, list(range(len(self.ann_files))), num_workers=self.num_workers, desc=self.name
+        )
+        # merge in the order of the scenes, the image ids are unique over all scenes
         unique_im_id = 0
-        for ann_file, scene_root, xyz_root in zip(tqdm(self.ann_files), self.image_prefixes, self.xyz_prefixes):
-            # linemod each scene is an object
-            with open(ann_file, "r") as f_ann:
-                indices = [line.strip("\r\n") for line in f_ann.readlines()]  # string ids
-            gt_dict = mmcv.load(osp.join(scene_root, "scene_gt.json"))
-            gt_info_dict = mmcv.load(osp.join(scene_root, "scene_gt_info.json"))  # bbox_obj, bbox_visib
-            cam_dict = mmcv.load(osp.join(scene_root, "scene_camera.json"))
-            for im_id in tqdm(indices):
-                int_im_id = int(im_id)
-                str_im_id = str(int_im_id)
-                rgb_path = osp.join(scene_root, "rgb/{:06d}.png").format(int_im_id)
-                assert osp.exists(rgb_path), rgb_path
-
-                depth_path = osp.join(scene_root, "depth/{:06d}.png".format(int_im_id))
-
-                scene_id = int(rgb_path.split("/")[-3])
-                scene_im_id = f"{scene_id}/{int_im_id}"
-
-                if self.debug_im_id is not None:
-                    if self.debug_im_id != scene_im_id:
-                        continue
-
-                K = np.array(cam_dict[str_im_id]["cam_K"], dtype=np.float32).reshape(3, 3)
-                depth_factor = 1000.0 / cam_dict[str_im_id]["depth_scale"]
-                if self.filter_scene:
-                    if scene_id not in self.cat_ids:
-                        continue
-                record = {
-                    "dataset_name": self.name,
-                    "file_name": osp.relpath(rgb_path, PROJ_ROOT),
-                    "depth_file": osp.relpath(depth_path, PROJ_ROOT),
-                    "height": self.height,
-                    "width": self.width,
-                    "image_id": unique_im_id,
-                    "scene_im_id": scene_im_id,  # for evaluation
-                    "cam": K,
-                    "depth_factor": depth_factor,
-                    "img_type": "real",
-                }
-                unique_im_id += 1
-                insts = []
-                for anno_i, anno in enumerate(gt_dict[str_im_id]):
-                    obj_id = anno["obj_id"]
-                    if obj_id not in self.cat_ids:
-                        continue
-                    cur_label = self.cat2label[obj_id]  # 0-based label
-                    R = np.array(anno["cam_R_m2c"], dtype="float32").reshape(3, 3)
-                    t = np.array(anno["cam_t_m2c"], dtype="float32") / 1000.0
-                    pose = np.hstack([R, t.reshape(3, 1)])
-                    quat = mat2quat(R).astype("float32")
-
-                    proj = (record["cam"] @ t.T).T
-                    proj = proj[:2] / proj[2]
-
-                    bbox_visib = gt_info_dict[str_im_id][anno_i]["bbox_visib"]
-                    bbox_obj = gt_info_dict[str_im_id][anno_i]["bbox_obj"]
-                    x1, y1, w, h = bbox_visib
-                    if self.filter_invalid:
-                        if h <= 1 or w <= 1:
-                            self.num_instances_without_valid_box += 1
-                            continue
-
-                    mask_file = osp.join(
-                        scene_root,
-                        "mask/{:06d}_{:06d}.png".format(int_im_id, anno_i),
-                    )
-                    mask_visib_file = osp.join(
-                        scene_root,
-                        "mask_visib/{:06d}_{:06d}.png".format(int_im_id, anno_i),
-                    )
-                    assert osp.exists(mask_file), mask_file
-                    assert osp.exists(mask_visib_file), mask_visib_file
-                    # load mask visib
-                    mask_single = mmcv.imread(mask_visib_file, "unchanged")
-                    mask_single = mask_single.astype("bool")
-                    area = mask_single.sum()
-                    if area < 3:  # filter out too small or nearly invisible instances
-                        self.num_instances_without_valid_segmentation += 1
-                        continue
-                    mask_rle = binary_mask_to_rle(mask_single, compressed=True)
-                    # load mask full
-                    mask_full = mmcv.imread(mask_file, "unchanged")
-                    mask_full = mask_full.astype("bool")
-                    mask_full_rle = binary_mask_to_rle(mask_full, compressed=True)
-
-                    inst = {
-                        "category_id": cur_label,  # 0-based label
-                        "bbox": bbox_visib,  # TODO: load both bbox_obj and bbox_visib
-                        "bbox_mode": BoxMode.XYWH_ABS,
-                        "pose": pose,
-                        "quat": quat,
-                        "trans": t,
-                        "centroid_2d": proj,  # absolute (cx, cy)
-                        "segmentation": mask_rle,
-                        "mask_full": mask_full_rle,
-                    }
-
-                    if "test" not in self.name.lower():
-                        # if True:
-                        xyz_path = osp.join(xyz_root, f"{int_im_id:06d}_{anno_i:06d}.pkl")
-                        assert osp.exists(xyz_path), xyz_path
-                        inst["xyz_path"] = xyz_path
-
-                    model_info = self.models_info[str(obj_id)]
-                    inst["model_info"] = model_info
-                    # TODO: using full mask and full xyz
-                    for key in ["bbox3d_and_center"]:
-                        inst[key] = self.models[cur_label][key]
-                    insts.append(inst)
-                if len(insts) == 0:  # filter im without anno
-                    continue
-                record["annotations"] = insts
-                dataset_dicts.append(record)
+        for scene_dicts, num_im_ids, stats in scene_results:
+            for record in scene_dicts:
+                record["image_id"] += unique_im_id
+            unique_im_id += num_im_ids
+            dataset_dicts.extend(scene_dicts)
+            self.num_instances_without_valid_segmentation += stats["num_instances_without_valid_segmentation"]
+            self.num_instances_without_valid_box += stats["num_instances_without_valid_box"]
 
         if self.num_instances_without_valid_segmentation > 0:
             logger.warning(
@@ -247,6 +149,141 @@ class LM_Dataset(object):
         logger.info("Dumped dataset_dicts to {}".format(cache_path))
         return dataset_dicts
 
+    def _load_scene_dicts(self, scene_i):
+        """Load the dataset dicts of the images of an ann_file (scene).
+
+        Returns:
+            list[dict]: the dataset dicts, the image ids start from 0 in the scene
+            int: the number of image ids used by the scene
+            dict: the numbers of filtered instances
+        """
+        ann_file = self.ann_files[scene_i]
+        scene_root = self.image_prefixes[scene_i]
+        xyz_root = self.xyz_prefixes[scene_i]
+        dataset_dicts = []
+        stats = {"num_instances_without_valid_segmentation": 0, "num_instances_without_valid_box": 0}
+        unique_im_id = 0
+        # linemod each scene is an object
+        with open(ann_file, "r") as f_ann:
+            indices = [line.strip("\r\n") for line in f_ann.readlines()]  # string ids
+        gt_dict = mmcv.load(osp.join(scene_root, "scene_gt.json"))
+        gt_info_dict = mmcv.load(osp.join(scene_root, "scene_gt_info.json"))  # bbox_obj, bbox_visib
+        cam_dict = mmcv.load(osp.join(scene_root, "scene_camera.json"))
+        for im_id in indices:
+            int_im_id = int(im_id)
+            str_im_id = str(int_im_id)
+            rgb_path = osp.join(scene_root, "rgb/{:06d}.png").format(int_im_id)
+            assert osp.exists(rgb_path), rgb_path
+
+            depth_path = osp.join(scene_root, "depth/{:06d}.png".format(int_im_id))
+
+            scene_id = int(rgb_path.split("/")[-3])
+            scene_im_id = f"{scene_id}/{int_im_id}"
+
+            if self.debug_im_id is not None:
+                if self.debug_im_id != scene_im_id:
+                    continue
+
+            K = np.array(cam_dict[str_im_id]["cam_K"], dtype=np.float32).reshape(3, 3)
+            depth_factor = 1000.0 / cam_dict[str_im_id]["depth_scale"]
+            if self.filter_scene:
+                if scene_id not in self.cat_ids:
+                    continue
+            record = {
+                "dataset_name": self.name,
+                "file_name": osp.relpath(rgb_path, PROJ_ROOT),
+                "depth_file": osp.relpath(depth_path, PROJ_ROOT),
+                "height": self.height,
+                "width": self.width,
+                "image_id": unique_im_id,
+                "scene_im_id": scene_im_id,  # for evaluation
+                "cam": K,
+                "depth_factor": depth_factor,
+                "img_type": "real",
+            }
+            unique_im_id += 1
+            # poses and projected centers of all the instances of the image
+            annos = gt_dict[str_im_id]
+            Rs = np.array([anno["cam_R_m2c"] for anno in annos], dtype="float32").reshape(-1, 3, 3)
+            ts = np.array([anno["cam_t_m2c"] for anno in annos], dtype="float32").reshape(-1, 3) / 1000.0
+            poses = np.concatenate([Rs, ts[:, :, None]], axis=2)
+            projs = ts @ K.T
+            projs = projs[:, :2] / projs[:, 2:3]
+
+            insts = []
+            for anno_i, anno in enumerate(annos):
+                obj_id = anno["obj_id"]
+                if obj_id not in self.cat_ids:
+                    continue
+                cur_label = self.cat2label[obj_id]  # 0-based label
+                R = Rs[anno_i]
+                t = ts[anno_i]
+                pose = poses[anno_i]
+                quat = mat2quat(R).astype("float32")
+
+                proj = projs[anno_i]
+
+                bbox_visib = gt_info_dict[str_im_id][anno_i]["bbox_visib"]
+                bbox_obj = gt_info_dict[str_im_id][anno_i]["bbox_obj"]
+                x1, y1, w, h = bbox_visib
+                if self.filter_invalid:
+                    if h <= 1 or w <= 1:
+                        stats["num_instances_without_valid_box"] += 1
+                        continue
+
+                mask_file = osp.join(
+                    scene_root,
+                    "mask/{:06d}_{:06d}.png".format(int_im_id, anno_i),
+                )
+                mask_visib_file = osp.join(
+                    scene_root,
+                    "mask_visib/{:06d}_{:06d}.png".format(int_im_id, anno_i),
+                )
+                assert osp.exists(mask_file), mask_file
+                assert osp.exists(mask_visib_file), mask_visib_file
+                # load mask visib
+                mask_single = mmcv.imread(mask_visib_file, "unchanged")
+                mask_single = mask_single.astype("bool")
+                area = mask_single.sum()
+                if area < 3:  # filter out too small or nearly invisible instances
+                    stats["num_instances_without_valid_segmentation"] += 1
+                    continue
+                mask_rle = binary_mask_to_rle(mask_single, compressed=True)
+                # load mask full
+                mask_full = mmcv.imread(mask_file, "unchanged")
+                mask_full = mask_full.astype("bool")
+                mask_full_rle = binary_mask_to_rle(mask_full, compressed=True)
+
+                inst = {
+                    "category_id": cur_label,  # 0-based label
+                    "bbox": bbox_visib,  # TODO: load both bbox_obj and bbox_visib
+                    "bbox_mode": BoxMode.XYWH_ABS,
+                    "pose": pose,
+                    "quat": quat,
+                    "trans": t,
+                    "centroid_2d": proj,  # absolute (cx, cy)
+                    "segmentation": mask_rle,
+                    "mask_full": mask_full_rle,
+                }
+
+                if "test" not in self.name.lower():
+                    # if True:
+                    xyz_path = osp.join(xyz_root, f"{int_im_id:06d}_{anno_i:06d}.pkl")
+                    assert xyz_exists(xyz_path), xyz_path
+                    inst["xyz_path"] = xyz_path
+
+                model_info = self.models_info[str(obj_id)]
+                inst["model_info"] = model_info
+                # TODO: using full mask and full xyz
+                for key in ["bbox3d_and_center"]:
+                    inst[key] = self.models[cur_label][key]
+                insts.append(inst)
+            if len(insts) == 0:  # filter im without anno
+                continue
+            record["annotations"] = insts
+            dataset_dicts.append(record)
+        return dataset_dicts, unique_im_id, stats
+
     @lazy_property
     def models_info(self):
         models_info_path = osp.join(self.models_root, "models_info.json")
@@ -850,7 +887,7 @@ def test_vis():
             img_vis_kpts2d = misc.draw_projected_box3d(img_vis.copy(), kpts_2d[_i])
             if "test" not in dset_name.lower():
                 xyz_path = annos[_i]["xyz_path"]
-                xyz_info = mmcv.load(xyz_path)
+                xyz_info = load_xyz_info(xyz_path)
                 x1, y1, x2, y2 = xyz_info["xyxy"]
                 xyz_crop = xyz_info["xyz_crop"].astype(np.float32)
                 xyz = np.zeros((imH, imW, 3), dtype=np.float32)
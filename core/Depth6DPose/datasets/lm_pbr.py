@@ -11,11 +11,12 @@ import time
 from collections import OrderedDict
 import mmcv
 import numpy as np
-from tqdm import tqdm
 from transforms3d.quaternions import mat2quat, quat2mat
 import ref
 from detectron2.data import DatasetCatalog, MetadataCatalog
 from detectron2.structures import BoxMode
+from core.utils.dataset_store import build_dataset_store, get_num_scene_workers
+from core.utils.xyz_pack import load_xyz_info, xyz_exists
 from lib.pysixd import inout, misc
 from lib.utils.mask_utils import binary_mask_to_rle, cocosegm2mask
 from lib.utils.utils import dprint, iprint, lazy_property
@@ -56,6 +57,7 @@ class LM_PBR_Dataset:
         self.use_cache = data_cfg.get("use_cache", True)
         self.num_to_load = data_cfg["num_to_load"]  # -1
         self.filter_invalid = data_cfg.get("filter_invalid", True)
+        self.num_workers = get_num_scene_workers(data_cfg)  # processes to load the scenes
         ##################################################
 
         # NOTE: careful! Only the selected objects
@@ -74,6 +76,9 @@ class LM_PBR_Dataset:
 
         Do not load heavy data into memory in this file, since we will
         load the annotations of all images into memory.
+
+        Returns:
+            DatasetStore: a read-only list of the dicts, loaded from per-scene files
         """
         # cache the dataset_dicts to avoid loading masks from files
         hashed_file_name = hashlib.md5(
@@ -88,144 +93,27 @@ class LM_PBR_Dataset:
                 )
             ).encode("utf-8")
         ).hexdigest()
-        cache_path = osp.join(
-            self.cache_dir,
-            "dataset_dicts_{}_{}.pkl".format(self.name, hashed_file_name),
-        )
-
-        if osp.exists(cache_path) and self.use_cache:
-            logger.info("load cached dataset dicts from {}".format(cache_path))
-            return mmcv.load(cache_path)
+        # per-scene store of the dataset dicts, only the scenes whose annotations changed are loaded again
+        store_dir = osp.join(self.cache_dir, "dataset_store_{}_{}".format(self.name, hashed_file_name))
 
         t_start = time.perf_counter()
 
         logger.info("loading dataset dicts: {}".format(self.name))
-        self.num_instances_without_valid_segmentation = 0
-        self.num_instances_without_valid_box = 0
-        dataset_dicts = []  # ######################################################
-        # it is slow because of loading and converting masks to rle
-        for scene in tqdm(self.scenes):
-            scene_id = int(scene)
-            scene_root = osp.join(self.dataset_root, scene)
-
-            gt_dict = mmcv.load(osp.join(scene_root, "scene_gt.json"))
-            gt_info_dict = mmcv.load(osp.join(scene_root, "scene_gt_info.json"))
-            cam_dict = mmcv.load(osp.join(scene_root, "scene_camera.json"))
-
-            for str_im_id in tqdm(gt_dict, postfix=f"{scene_id}"):
-                int_im_id = int(str_im_id)
-                rgb_path = osp.join(scene_root, "rgb/{:06d}.jpg").format(int_im_id)
-                assert osp.exists(rgb_path), rgb_path
-
-                depth_path = osp.join(scene_root, "depth/{:06d}.png".format(int_im_id))
-
-                scene_im_id = f"{scene_id}/{int_im_id}"
-
-                K = np.array(cam_dict[str_im_id]["cam_K"], dtype=np.float32).reshape(3, 3)
-                depth_factor = 1000.0 / cam_dict[str_im_id]["depth_scale"]  # 10000
-
-                record = {
-                    "dataset_name": self.name,
-                    "file_name": osp.relpath(rgb_path, PROJ_ROOT),
-                    "depth_file": osp.relpath(depth_path, PROJ_ROOT),
-                    "height": self.height,
-                    "width": self.width,
-                    "image_id": int_im_id,
-                    "scene_im_id": scene_im_id,  # for evaluation
-                    "cam": K,
-                    "depth_factor": depth_factor,
-                    "img_type": "syn_pbr",  # NOTE: has background
-                }
-                insts = []
-                for anno_i, anno in enumerate(gt_dict[str_im_id]):
-                    obj_id = anno["obj_id"]
-                    if obj_id not in self.cat_ids:
-                        continue
-                    cur_label = self.cat2label[obj_id]  # 0-based label
-                    R = np.array(anno["cam_R_m2c"], dtype="float32").reshape(3, 3)
-                    t = np.array(anno["cam_t_m2c"], dtype="float32") / 1000.0
-                    pose = np.hstack([R, t.reshape(3, 1)])
-                    quat = mat2quat(R).astype("float32")
-
-                    proj = (record["cam"] @ t.T).T
-                    proj = proj[:2] / proj[2]
-
-                    bbox_visib = gt_info_dict[str_im_id][anno_i]["bbox_visib"]
-                    bbox_obj = gt_info_dict[str_im_id][anno_i]["bbox_obj"]
-                    x1, y1, w, h = bbox_visib
-
-                    cx, cy = proj
-                    crop_x1 = round(np.clip(cx - 64, 0, self.width - 1))
-                    crop_x2 = round(np.clip(cx + 64, 0, self.width - 1))
-                    crop_y1 = round(np.clip(cy - 64, 0, self.height - 1))
-                    crop_y2 = round(np.clip(cy + 64, 0, self.height - 1))
-
-                    # convert to xywh
-                    crop_w = crop_x2 - crop_x1
-                    crop_h = crop_y2 - crop_y1
-                    bbox_128 = [crop_x1, crop_y1, crop_w, crop_h]
-
-                    if self.filter_invalid:
-                        if h <= 1 or w <= 1:
-                            self.num_instances_without_valid_box += 1
-                            continue
-
-                    mask_file = osp.join(
-                        scene_root,
-                        "mask/{:06d}_{:06d}.png".format(int_im_id, anno_i),
-                    )
-                    mask_visib_file = osp.join(
-                        scene_root,
-                        "mask_visib/{:06d}_{:06d}.png".format(int_im_id, anno_i),
-                    )
-                    assert osp.exists(mask_file), mask_file
-                    assert osp.exists(mask_visib_file), mask_visib_file
-                    # load mask visib  TODO: load both mask_visib and mask_full
-                    mask_single = mmcv.imread(mask_visib_file, "unchanged")
-                    mask_single = mask_single.astype("bool")
-                    area = mask_single.sum()
-                    if area < 30:  # filter out too small or nearly invisible instances
-                        self.num_instances_without_valid_segmentation += 1
-                        continue
-                    mask_rle = binary_mask_to_rle(mask_single, compressed=True)
-
-                    # load mask full
-                    mask_full = mmcv.imread(mask_file, "unchanged")
-                    mask_full = mask_full.astype("bool")
-                    mask_full_rle = binary_mask_to_rle(mask_full, compressed=True)
-
-                    visib_fract = gt_info_dict[str_im_id][anno_i].get("visib_fract", 1.0)
-
-                    xyz_path = osp.join(
-                        self.xyz_root,
-                        f"{scene_id:06d}/{int_im_id:06d}_{anno_i:06d}-xyz.pkl",
-                    )
-                    assert osp.exists(xyz_path), xyz_path
-                    inst = {
-                        "category_id": cur_label,  # 0-based label
-                        "bbox": bbox_visib,  # TODO: load both bbox_obj and bbox_visib
-                        "bbox_mode": BoxMode.XYWH_ABS,
-                        "bbox_crop": bbox_128,
-                        "pose": pose,
-                        "quat": quat,
-                        "trans": t,
-                        "centroid_2d": proj,  # absolute (cx, cy)
-                        "segmentation": mask_rle,
-                        "mask_full": mask_full_rle,
-                        "visib_fract": visib_fract,
-                        "xyz_path": xyz_path,
-                    }
-
-                    model_info = self.models_info[str(obj_id)]
-                    inst["model_info"] = model_info
-                    # TODO: using full mask and full xyz
-                    for key in ["bbox3d_and_center"]:
-                        inst[key] = self.models[cur_label][key]
-                    insts.append(inst)
-                if len(insts) == 0:  # filter im without anno
-                    continue
-                record["annotations"] = insts
-                dataset_dicts.append(record)
+        # load the models before forking the scene workers
+        _ = (self.models, self.models_info)
+        dataset_dicts = build_dataset_store(
+            store_dir,
+            self.scenes,
+            self._load_scene_dicts,
+            self._get_scene_files,
+            key=hashed_file_name,
+            use_cache=self.use_cache,
+            num_workers=self.num_workers,
+        )
+        self.num_instances_without_valid_segmentation = dataset_dicts.stats.get(
+            "num_instances_without_valid_segmentation", 0
+        )
+        self.num_instances_without_valid_box = dataset_dicts.stats.get("num_instances_without_valid_box", 0)
 
         if self.num_instances_without_valid_segmentation > 0:
             logger.warning(
@@ -244,12 +132,157 @@ class LM_PBR_Dataset:
             self.num_to_load = min(int(self.num_to_load), len(dataset_dicts))
             dataset_dicts = dataset_dicts[: self.num_to_load]
         logger.info("loaded {} dataset dicts, using {}s".format(len(dataset_dicts), time.perf_counter() - t_start))
-
-        mmcv.mkdir_or_exist(osp.dirname(cache_path))
-        mmcv.dump(dataset_dicts, cache_path, protocol=4)
-        logger.info("Dumped dataset_dicts to {}".format(cache_path))
         return dataset_dicts
 
+    def _get_scene_files(self, scene):
+        scene_root = osp.join(self.dataset_root, scene)
+        return [osp.join(scene_root, _name) for _name in ["scene_gt.json", "scene_gt_info.json", "scene_camera.json"]]
+
+    def _load_scene_dicts(self, scene):
+        """Load the dataset dicts of a scene.
+
+        It is slow because of loading and converting masks to rle.
+
+        Returns:
+            list[dict], dict: the dataset dicts and the numbers of filtered instances
+        """
+        self.num_instances_without_valid_segmentation = 0
+        self.num_instances_without_valid_box = 0
+        dataset_dicts = []
+        scene_id = int(scene)
+        scene_root = osp.join(self.dataset_root, scene)
+
+        gt_dict = mmcv.load(osp.join(scene_root, "scene_gt.json"))
+        gt_info_dict = mmcv.load(osp.join(scene_root, "scene_gt_info.json"))
+        cam_dict = mmcv.load(osp.join(scene_root, "scene_camera.json"))
+
+        for str_im_id in gt_dict:
+            int_im_id = int(str_im_id)
+            rgb_path = osp.join(scene_root, "rgb/{:06d}.jpg").format(int_im_id)
+            assert osp.exists(rgb_path), rgb_path
+
+            depth_path = osp.join(scene_root, "depth/{:06d}.png".format(int_im_id))
+
+            scene_im_id = f"{scene_id}/{int_im_id}"
+
+            K = np.array(cam_dict[str_im_id]["cam_K"], dtype=np.float32).reshape(3, 3)
+            depth_factor = 1000.0 / cam_dict[str_im_id]["depth_scale"]  # 10000
+
+            record = {
+                "dataset_name": self.name,
+                "file_name": osp.relpath(rgb_path, PROJ_ROOT),
+                "depth_file": osp.relpath(depth_path, PROJ_ROOT),
+                "height": self.height,
+                "width": self.width,
+                "image_id": int_im_id,
+                "scene_im_id": scene_im_id,  # for evaluation
+                "cam": K,
+                "depth_factor": depth_factor,
+                "img_type": "syn_pbr",  # NOTE: has background
+            }
+            # poses and projected centers of all the instances of the image
+            annos = gt_dict[str_im_id]
+            Rs = np.array([anno["cam_R_m2c"] for anno in annos], dtype="float32").reshape(-1, 3, 3)
+            ts = np.array([anno["cam_t_m2c"] for anno in annos], dtype="float32").reshape(-1, 3) / 1000.0
+            poses = np.concatenate([Rs, ts[:, :, None]], axis=2)
+            projs = ts @ K.T
+            projs = projs[:, :2] / projs[:, 2:3]
+
+            insts = []
+            for anno_i, anno in enumerate(annos):
+                obj_id = anno["obj_id"]
+                if obj_id not in self.cat_ids:
+                    continue
+                cur_label = self.cat2label[obj_id]  # 0-based label
+                R = Rs[anno_i]
+                t = ts[anno_i]
+                pose = poses[anno_i]
+                quat = mat2quat(R).astype("float32")
+
+                proj = projs[anno_i]
+
+                bbox_visib = gt_info_dict[str_im_id][anno_i]["bbox_visib"]
+                bbox_obj = gt_info_dict[str_im_id][anno_i]["bbox_obj"]
+                x1, y1, w, h = bbox_visib
+
+                cx, cy = proj
+                crop_x1 = round(np.clip(cx - 64, 0, self.width - 1))
+                crop_x2 = round(np.clip(cx + 64, 0, self.width - 1))
+                crop_y1 = round(np.clip(cy - 64, 0, self.height - 1))
+                crop_y2 = round(np.clip(cy + 64, 0, self.height - 1))
+
+                # convert to xywh
+                crop_w = crop_x2 - crop_x1
+                crop_h = crop_y2 - crop_y1
+                bbox_128 = [crop_x1, crop_y1, crop_w, crop_h]
+
+                if self.filter_invalid:
+                    if h <= 1 or w <= 1:
+                        self.num_instances_without_valid_box += 1
+                        continue
+
+                mask_file = osp.join(
+                    scene_root,
+                    "mask/{:06d}_{:06d}.png".format(int_im_id, anno_i),
+                )
+                mask_visib_file = osp.join(
+                    scene_root,
+                    "mask_visib/{:06d}_{:06d}.png".format(int_im_id, anno_i),
+                )
+                assert osp.exists(mask_file), mask_file
+                assert osp.exists(mask_visib_file), mask_visib_file
+                # load mask visib  TODO: load both mask_visib and mask_full
+                mask_single = mmcv.imread(mask_visib_file, "unchanged")
+                mask_single = mask_single.astype("bool")
+                area = mask_single.sum()
+                if area < 30:  # filter out too small or nearly invisible instances
+                    self.num_instances_without_valid_segmentation += 1
+                    continue
+                mask_rle = binary_mask_to_rle(mask_single, compressed=True)
+
+                # load mask full
+                mask_full = mmcv.imread(mask_file, "unchanged")
+                mask_full = mask_full.astype("bool")
+                mask_full_rle = binary_mask_to_rle(mask_full, compressed=True)
+
+                visib_fract = gt_info_dict[str_im_id][anno_i].get("visib_fract", 1.0)
+
+                xyz_path = osp.join(
+                    self.xyz_root,
+                    f"{scene_id:06d}/{int_im_id:06d}_{anno_i:06d}-xyz.pkl",
+                )
+                assert xyz_exists(xyz_path), xyz_path
+                inst = {
+                    "category_id": cur_label,  # 0-based label
+                    "bbox": bbox_visib,  # TODO: load both bbox_obj and bbox_visib
+                    "bbox_mode": BoxMode.XYWH_ABS,
+                    "bbox_crop": bbox_128,
+                    "pose": pose,
+                    "quat": quat,
+                    "trans": t,
+                    "centroid_2d": proj,  # absolute (cx, cy)
+                    "segmentation": mask_rle,
+                    "mask_full": mask_full_rle,
+                    "visib_fract": visib_fract,
+                    "xyz_path": xyz_path,
+                }
+
+                model_info = self.models_info[str(obj_id)]
+                inst["model_info"] = model_info
+                # TODO: using full mask and full xyz
+                for key in ["bbox3d_and_center"]:
+                    inst[key] = self.models[cur_label][key]
+                insts.append(inst)
+            if len(insts) == 0:  # filter im without anno
+                continue
+            record["annotations"] = insts
+            dataset_dicts.append(record)
+        stats = {
+            "num_instances_without_valid_segmentation": self.num_instances_without_valid_segmentation,
+            "num_instances_without_valid_box": self.num_instances_without_valid_box,
+        }
+        return dataset_dicts, stats
+
     @lazy_property
     def models_info(self):
         models_info_path = osp.join(self.models_root, "models_info.json")
@@ -511,7 +544,7 @@ def test_vis():
             )
             img_vis_kpts2d = misc.draw_projected_box3d(img_vis.copy(), kpts_2d[_i])
             xyz_path = annos[_i]["xyz_path"]
-            xyz_info = mmcv.load(xyz_path)
+            xyz_info = load_xyz_info(xyz_path)
             x1, y1, x2, y2 = xyz_info["xyxy"]
             xyz_crop = xyz_info["xyz_crop"].astype(np.float32)
             xyz = np.zeros((imH, imW, 3), dtype=np.float32)
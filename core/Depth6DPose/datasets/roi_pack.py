@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""ROI pack: pre-cropped, augmentation-independent roi targets in a single
+memory-mapped file.
+
+File layout:
+    magic (8 bytes) | header length (uint64, little endian) | json header | field blocks
+The json header holds the meta infos, the record keys and, for every field, its
+dtype, per-record shape and byte offset. Each field block stores the stacked
+records ([N, ...]) contiguously and is aligned to ALIGN bytes, so a record is
+just a view into the mapped file (no pickle parsing, no copies).
+"""
+import json
+import logging
+import os.path as osp
+import struct
+
+import mmcv
+import numpy as np
+from lib.utils.utils import lazy_property
+
+logger = logging.getLogger(__name__)
+
+ROI_PACK_MAGIC = b"ROIPACK1"
+ALIGN = 64
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def get_roi_pack_key(dataset_dict, inst_id=None):
+    """key of a roi in the pack.
+
+    train (flattened dicts): the xyz label file identifies the instance
+        (inst_id changes when invalid instances are filtered).
+    test: the inst_id of the loaded annotations/detections of the image.
+    """
+    prefix = "{}/{}".format(dataset_dict["dataset_name"], dataset_dict["scene_im_id"])
+    if inst_id is None:
+        return "{}/{}".format(prefix, osp.basename(dataset_dict["inst_infos"]["xyz_path"]))
+    return "{}/{}".format(prefix, inst_id)
+
+
+def write_roi_pack(pack_path, keys, records, meta=None):
+    """
+    Args:
+        pack_path (str): output file
+        keys (list[str]): one key per record
+        records (iterable): yields len(keys) dicts of np.ndarray, all with the same
+            fields/dtypes/shapes, in the order of keys. Consumed lazily, so the
+            whole pack never needs to be held in memory.
+        meta (dict): json serializable infos, e.g. the cfg used to build the pack
+    """
+    keys = list(keys)
+    num = len(keys)
+    assert num > 0, "empty roi pack"
+    records = iter(records)
+    first = next(records)
+
+    fields = {}
+    offset = 0
+    for name in sorted(first.keys()):
+        arr = np.asarray(first[name])
+        fields[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset = _align(offset + num * arr.nbytes)
+    data_size = offset
+
+    header = json.dumps({"meta": meta or {}, "num": num, "keys": keys, "fields": fields}).encode("utf-8")
+    data_start = _align(len(ROI_PACK_MAGIC) + 8 + len(header))
+
+    mmcv.mkdir_or_exist(osp.dirname(osp.abspath(pack_path)))
+    with open(pack_path, "wb") as f:
+        f.write(ROI_PACK_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.truncate(data_start + data_size)
+
+    buf = np.memmap(pack_path, dtype=np.uint8, mode="r+", offset=data_start, shape=(data_size,))
+    arrays = {name: _field_view(buf, field, num) for name, field in fields.items()}
+    i = -1
+    for i, record in enumerate(_chain(first, records)):
+        assert i < num, "got more records than keys"
+        for name, arr in arrays.items():
+            arr[i] = record[name]
+    assert i == num - 1, "got {} records for {} keys".format(i + 1, num)
+    buf.flush()
+    del arrays, buf
+    logger.info("wrote {} rois to roi pack: {}".format(num, pack_path))
+
+
+def _chain(first, rest):
+    yield first
+    for record in rest:
+        yield record
+
+
+def _field_view(buf, field, num):
+    dtype = np.dtype(field["dtype"])
+    shape = tuple(field["shape"])
+    nbytes = num * int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    start = field["offset"]
+    return buf[start : start + nbytes].view(dtype).reshape((num,) + shape)
+
+
+class ROIPack(object):
+    """Read-only access to a roi pack.
+
+    The file is mapped lazily (i.e. after the data loader workers are forked), the
+    returned arrays are read-only views which share the page cache across workers.
+    """
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        with open(pack_path, "rb") as f:
+            magic = f.read(len(ROI_PACK_MAGIC))
+            assert magic == ROI_PACK_MAGIC, "not a roi pack: {}".format(pack_path)
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        self._data_start = _align(len(ROI_PACK_MAGIC) + 8 + header_len)
+        self.meta = header["meta"]
+        self.keys = header["keys"]
+        self.fields = header["fields"]
+        self._key_to_idx = {key: i for i, key in enumerate(self.keys)}
+        logger.info("roi pack {}: {} rois, fields: {}".format(pack_path, len(self.keys), sorted(self.fields.keys())))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._key_to_idx
+
+    @lazy_property
+    def _arrays(self):
+        buf = np.memmap(self.pack_path, dtype=np.uint8, mode="r", offset=self._data_start)
+        return {name: _field_view(buf, field, len(self.keys)) for name, field in self.fields.items()}
+
+    def __getitem__(self, key):
+        """dict of views (field name -> np.ndarray) of the record with this key."""
+        idx = self._key_to_idx[key]
+        return {name: arr[idx] for name, arr in self._arrays.items()}
+
+
+def load_roi_packs(pack_paths):
+    return [ROIPack(pack_path) for pack_path in pack_paths]
+
+
+def get_roi_pack_record(roi_packs, key):
+    for roi_pack in roi_packs:
+        if key in roi_pack:
+            return roi_pack[key]
+    raise KeyError("roi {} is not in roi packs: {}".format(key, [_pack.pack_path for _pack in roi_packs]))
@@ -1,5 +1,6 @@
 import hashlib
 import copy
+import functools
 import logging
 import os
 import os.path as osp
@@ -12,11 +13,12 @@ import time
 from collections import OrderedDict
 import mmcv
 import numpy as np
-from tqdm import tqdm
 from transforms3d.quaternions import mat2quat, quat2mat
 import ref
 from detectron2.data import DatasetCatalog, MetadataCatalog
 from detectron2.structures import BoxMode
+from core.utils.dataset_store import get_num_scene_workers, map_scenes
+from core.utils.xyz_pack import load_xyz_info, xyz_exists
 from lib.pysixd import inout, misc
 from lib.utils.mask_utils import binary_mask_to_rle, cocosegm2mask
 from lib.utils.utils import dprint, iprint, lazy_property
@@ -61,6 +63,7 @@ class YCBV_Dataset:
         self.use_cache = data_cfg.get("use_cache", True)
         self.num_to_load = data_cfg["num_to_load"]  # -1
         self.filter_invalid = data_cfg["filter_invalid"]
+        self.num_workers = get_num_scene_workers(data_cfg)  # processes to load the scenes
 
         self.align_K_by_change_pose = data_cfg.get("align_K_by_change_pose", False)
         # default: 0000~0059 and synt
@@ -92,39 +95,73 @@ class YCBV_Dataset:
             scene_gt_info.json
             scene_camera.json
         """
-        xyz_root = osp.join(image_root, "xyz_crop")
-        scene_gt_dicts = {}
-        scene_gt_info_dicts = {}
-        scene_cam_dicts = {}
-        scene_im_ids = []  # store tuples of (scene_id, im_id)
+        scene_im_ids = {}  # scene_id => im_ids
         with open(idx_file, "r") as f:
             for line in f:
                 line_split = line.strip("\r\n").split("/")
                 scene_id = int(line_split[0])
                 im_id = int(line_split[1])
-                scene_im_ids.append((scene_id, im_id))
-                if scene_id not in scene_gt_dicts:
-                    scene_gt_file = osp.join(image_root, f"{scene_id:06d}/scene_gt.json")
-                    assert osp.exists(scene_gt_file), scene_gt_file
-                    scene_gt_dicts[scene_id] = mmcv.load(scene_gt_file)
-
-                if scene_id not in scene_gt_info_dicts:
-                    scene_gt_info_file = osp.join(image_root, f"{scene_id:06d}/scene_gt_info.json")
-                    assert osp.exists(scene_gt_info_file), scene_gt_info_file
-                    scene_gt_info_dicts[scene_id] = mmcv.load(scene_gt_info_file)
-
-                if scene_id not in scene_cam_dicts:
-                    scene_cam_file = osp.join(image_root, f"{scene_id:06d}/scene_camera.json")
-                    assert osp.exists(scene_cam_file), scene_cam_file
-                    scene_cam_dicts[scene_id] = mmcv.load(scene_cam_file)
-        ######################################################
-        scene_im_ids = sorted(scene_im_ids)  # sort to make it reproducible
+                scene_im_ids.setdefault(scene_id, []).append(im_id)
+        # sort to make it reproducible
+        scenes = [(scene_id, sorted(scene_im_ids[scene_id])) for scene_id in sorted(scene_im_ids)]
+        # load the models before forking the scene workers
+        _ = (self.models, self.models_info)
+        scene_results = map_scenes(
+            functools.partial(self._load_scene_dicts, image_root),
+            scenes,
+            num_workers=self.num_workers,
+            desc=osp.basename(idx_file),
+        )
+        # merge in the order of the scenes, the image ids are unique over all scenes
         dataset_dicts = []
-
         num_instances_without_valid_segmentation = 0
         num_instances_without_valid_box = 0
+        for scene_dicts, stats in scene_results:
+            for record in scene_dicts:
+                record["image_id"] += self._unique_im_id
+            self._unique_im_id += len(scene_dicts)
+            dataset_dicts.extend(scene_dicts)
+            num_instances_without_valid_segmentation += stats["num_instances_without_valid_segmentation"]
+            num_instances_without_valid_box += stats["num_instances_without_valid_box"]
+
+        if num_instances_without_valid_segmentation > 0:
+            logger.warning(
+                "Filtered out {} instances without valid segmentation. "
+                "There might be issues in your dataset generation process.".format(
+                    num_instances_without_valid_segmentation
+                )
+            )
+        if num_instances_without_valid_box > 0:
+            logger.warning(
+                "Filtered out {} instances without valid box. "
+                "There might be issues in your dataset generation process.".format(num_instances_without_valid_box)
+            )
+        return dataset_dicts
+
+    def _load_scene_dicts(self, image_root, scene):
+        """Load the dataset dicts of the images (scene_id, im_ids) of a scene.
 
-        for (scene_id, im_id) in tqdm(scene_im_ids):
+        Returns:
+            list[dict]: the dataset dicts, the image ids start from 0 in the scene
+            dict: the numbers of filtered instances
+        """
+        scene_id, im_ids = scene
+        xyz_root = osp.join(image_root, "xyz_crop")
+        scene_root = osp.join(image_root, f"{scene_id:06d}")
+        scene_gt_file = osp.join(scene_root, "scene_gt.json")
+        assert osp.exists(scene_gt_file), scene_gt_file
+        gt_dict = mmcv.load(scene_gt_file)
+        scene_gt_info_file = osp.join(scene_root, "scene_gt_info.json")
+        assert osp.exists(scene_gt_info_file), scene_gt_info_file
+        gt_info_dict = mmcv.load(scene_gt_info_file)
+        scene_cam_file = osp.join(scene_root, "scene_camera.json")
+        assert osp.exists(scene_cam_file), scene_cam_file
+        cam_dict = mmcv.load(scene_cam_file)
+
+        dataset_dicts = []
+        stats = {"num_instances_without_valid_segmentation": 0, "num_instances_without_valid_box": 0}
+        unique_im_id = 0
+        for im_id in im_ids:
             rgb_path = osp.join(image_root, f"{scene_id:06d}/rgb/{im_id:06d}.png")
             assert osp.exists(rgb_path), rgb_path
             str_im_id = str(im_id)
@@ -132,7 +169,7 @@ class YCBV_Dataset:
             scene_im_id = f"{scene_id}/{im_id}"
 
             # for ycbv/tless, load cam K from image infos
-            cam_anno = np.array(scene_cam_dicts[scene_id][str_im_id]["cam_K"], dtype=np.float32).reshape(3, 3)
+            cam_anno = np.array(cam_dict[str_im_id]["cam_K"], dtype=np.float32).reshape(3, 3)
             adapth_this_K = False
             if self.align_K_by_change_pose:
                 if (cam_anno != self.cam).any():
@@ -140,7 +177,7 @@ class YCBV_Dataset:
                     cam_anno_ori = cam_anno.copy()
                     cam_anno = self.cam
 
-            depth_factor = 1000.0 / scene_cam_dicts[scene_id][str_im_id]["depth_scale"]
+            depth_factor = 1000.0 / cam_dict[str_im_id]["depth_scale"]
             # dprint(record['cam'])
             if "/train_synt/" in rgb_path:
                 img_type = "syn"
@@ -151,7 +188,7 @@ class YCBV_Dataset:
                 "file_name": osp.relpath(rgb_path, PROJ_ROOT),
                 "height": self.height,
                 "width": self.width,
-                "image_id": self._unique_im_id,
+                "image_id": unique_im_id,  # from 0 in the scene
                 "scene_im_id": scene_im_id,  # for evaluation
                 "cam": cam_anno,  # self.cam,
                 "depth_factor": depth_factor,
@@ -164,8 +201,8 @@ class YCBV_Dataset:
                 record["depth_file"] = osp.relpath(depth_file, PROJ_ROOT)
 
             insts = []
-            anno_dict_list = scene_gt_dicts[scene_id][str(im_id)]
-            info_dict_list = scene_gt_info_dicts[scene_id][str(im_id)]
+            anno_dict_list = gt_dict[str(im_id)]
+            info_dict_list = gt_info_dict[str(im_id)]
             for anno_i, anno in enumerate(anno_dict_list):
                 info = info_dict_list[anno_i]
                 obj_id = anno["obj_id"]
@@ -199,7 +236,7 @@ class YCBV_Dataset:
                     bw = bbox[2] - bbox[0]
                     bh = bbox[3] - bbox[1]
                     if bh <= 1 or bw <= 1:
-                        num_instances_without_valid_box += 1
+                        stats["num_instances_without_valid_box"] += 1
                         continue
 
                 ############## mask #######################
@@ -212,7 +249,7 @@ class YCBV_Dataset:
                     mask = mmcv.imread(mask_visib_file, "unchanged")
                     area = mask.sum()
                     if area < 30 and self.filter_invalid:
-                        num_instances_without_valid_segmentation += 1
+                        stats["num_instances_without_valid_segmentation"] += 1
                         continue
                     mask_rle = binary_mask_to_rle(mask)
 
@@ -247,7 +284,7 @@ class YCBV_Dataset:
                         xyz_root,
                         f"{scene_id:06d}/{im_id:06d}_{anno_i:06d}-xyz.pkl",
                     )
-                    assert osp.exists(xyz_path), xyz_path
+                    assert xyz_exists(xyz_path), xyz_path
                     inst["xyz_path"] = xyz_path
 
                 model_info = self.models_info[str(obj_id)]
@@ -260,21 +297,9 @@ class YCBV_Dataset:
                 continue
             record["annotations"] = insts
             dataset_dicts.append(record)
-            self._unique_im_id += 1
+            unique_im_id += 1
 
-        if num_instances_without_valid_segmentation > 0:
-            logger.warning(
-                "Filtered out {} instances without valid segmentation. "
-                "There might be issues in your dataset generation process.".format(
-                    num_instances_without_valid_segmentation
-                )
-            )
-        if num_instances_without_valid_box > 0:
-            logger.warning(
-                "Filtered out {} instances without valid box. "
-                "There might be issues in your dataset generation process.".format(num_instances_without_valid_box)
-            )
-        return dataset_dicts
+        return dataset_dicts, stats
 
     def __call__(self):  # YCBV_Dataset
         """Load light-weight instance annotations of all images into a list of
@@ -659,7 +684,7 @@ def test_vis():
             img_vis_kpts2d = misc.draw_projected_box3d(img_vis.copy(), kpts_2d[_i])
             if with_xyz:
                 xyz_path = annos[_i]["xyz_path"]
-                xyz_info = mmcv.load(xyz_path)
+                xyz_info = load_xyz_info(xyz_path)
                 x1, y1, x2, y2 = xyz_info["xyxy"]
                 xyz_crop = xyz_info["xyz_crop"].astype(np.float32)
                 xyz = np.zeros((imH, imW, 3), dtype=np.float32)
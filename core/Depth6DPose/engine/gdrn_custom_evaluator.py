@@ -23,6 +23,7 @@ from core.utils.my_comm import all_gather, is_main_process, synchronize
 from core.utils.pose_utils import get_closest_rot
 from core.utils.my_visualizer import MyVisualizer, _RED, _GREEN, _BLUE, _GREY
 from core.utils.data_utils import crop_resize_by_warp_affine
+from core.utils.batch_pnp import batch_pnp_ransac, get_img_model_points_with_coords2d_batch
 from lib.pysixd import inout, misc
 from lib.pysixd.pose_error import add, adi, arp_2d, re, te
 from lib.utils.mask_utils import binary_mask_to_rle
@@ -86,6 +87,8 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
                 use_cache=True,
             )
 
+        self._pending_preds = []
+        self._pred_errors = {}
         self.eval_precision = cfg.VAL.get("EVAL_PRECISION", False)
         self._logger.info(f"eval precision: {self.eval_precision}")
         # eval cached
@@ -100,6 +103,41 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
 
     def reset(self):
         self._predictions = OrderedDict()
+        # (obj_name, file_name) of the predictions whose errors are not calculated yet
+        self._pending_preds = []
+        # (obj_name, file_name) => (prediction, errors)
+        self._pred_errors = {}
+
+    def _add_prediction(self, cls_name, file_name, result):
+        if cls_name not in self._predictions:
+            self._predictions[cls_name] = OrderedDict()
+        self._predictions[cls_name][file_name] = result
+        self._pending_preds.append((cls_name, file_name))
+
+    def accumulate(self):
+        """calculate the errors of the predictions added since the last call
+        (e.g. in the background while the next batch is inferred), so that
+        evaluate() only aggregates them."""
+        if self.eval_precision:
+            return
+        if getattr(self, "gts", None) is None:
+            self.get_gts()
+        pending_preds, self._pending_preds = self._pending_preds, []
+        for obj_name, file_name in pending_preds:
+            gt_anno = self.gts.get(obj_name, {}).get(file_name, None)
+            if gt_anno is not None:
+                self._get_pred_errors(obj_name, file_name, gt_anno)
+
+    def _get_pred_errors(self, obj_name, file_name, gt_anno):
+        """(ad, re, te, proj) errors of the prediction of obj_name in
+        file_name, cached until the prediction is replaced."""
+        pred = self._predictions[obj_name][file_name]
+        cached = self._pred_errors.get((obj_name, file_name), None)
+        if cached is not None and cached[0] is pred:
+            return cached[1]
+        pred_errors = self._calc_pred_errors(obj_name, pred, gt_anno)
+        self._pred_errors[(obj_name, file_name)] = (pred, pred_errors)
+        return pred_errors
 
     def _maybe_adapt_label_cls_name(self, label):
         if self.train_objs is not None:
@@ -181,6 +219,8 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
         if cfg.TEST.USE_PNP:
             if cfg.TEST.PNP_TYPE.lower() == "ransac_pnp":
                 return self.process_pnp_ransac(inputs, outputs, out_dict)
+            elif cfg.TEST.PNP_TYPE.lower() == "batch_ransac_pnp":
+                return self.process_pnp_ransac(inputs, outputs, out_dict, batch_pnp=True)
             elif cfg.TEST.PNP_TYPE.lower() == "net_iter_pnp":
                 return self.process_net_and_pnp(inputs, outputs, out_dict, pnp_type="iter")
             elif cfg.TEST.PNP_TYPE.lower() == "net_ransac_pnp":
@@ -327,16 +367,13 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
 
                 output["time"] += time.perf_counter() - start_process_time
 
-                if cls_name not in self._predictions:
-                    self._predictions[cls_name] = OrderedDict()
-
                 result = {
                     "score": score,
                     "R": rot_est,
                     "t": trans_est,
                     "time": output["time"],
                 }
-                self._predictions[cls_name][file_name] = result
+                self._add_prediction(cls_name, file_name, result)
 
     def process_net_and_pnp(self, inputs, outputs, out_dict, pnp_type="iter"):
         """Initialize with network prediction (learned PnP) + iter PnP
@@ -454,24 +491,68 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
                 # result
                 file_name = _input["file_name"][inst_i]
 
-                if cls_name not in self._predictions:
-                    self._predictions[cls_name] = OrderedDict()
-
                 result = {
                     "score": score,
                     "R": pose_est[:3, :3],
                     "t": pose_est[:3, 3],
                     "time": output["time"],
                 }
-                self._predictions[cls_name][file_name] = result
+                self._add_prediction(cls_name, file_name, result)
+
+    def get_pnp_poses_batch(self, inputs, out_xyz, out_mask):
+        """RANSAC EPnP of all the rois of the batch at once (on
+        cfg.TEST.BATCH_PNP_DEVICE, cpu by default, "" for the device of the
+        outputs).
+
+        Returns:
+            poses (np.ndarray): [n, 3, 4], -100 for rois with less than 4 points
+        """
+        cfg = self.cfg
+        device = cfg.TEST.get("BATCH_PNP_DEVICE", "cpu") or out_xyz.device
+        dtype = torch.float64
+
+        def _cat(key):
+            return torch.cat([_input[key] for _input in inputs]).to(device=device, dtype=dtype)
+
+        def _cat_scalars(key):
+            return torch.tensor([float(_v) for _input in inputs for _v in _input[key]], dtype=dtype, device=device)
+
+        img_points, model_points, valid = get_img_model_points_with_coords2d_batch(
+            out_mask.to(device=device, dtype=dtype),
+            out_xyz.to(device=device, dtype=dtype),
+            _cat("roi_coord_2d"),
+            im_H=_cat_scalars("im_H"),
+            im_W=_cat_scalars("im_W"),
+            extent=_cat("roi_extent"),
+            mask_thr=cfg.MODEL.POSE_NET.GEO_HEAD.MASK_THR_TEST,
+        )
+        num_points = valid.sum(1)
+        # rois with too few points are solved as well (with dummy points) and discarded below
+        valid_rows = num_points >= 4
+        valid = torch.where(valid_rows[:, None], valid, torch.ones_like(valid))
+        R, t, _ = batch_pnp_ransac(
+            model_points,
+            img_points,
+            _cat("cam"),
+            valid,
+            num_hypotheses=cfg.TEST.get("BATCH_PNP_RANSAC_ITER", 100),
+            reproj_err_thr=cfg.TEST.get("BATCH_PNP_REPROJ_ERR", 3.0),
+            num_refine_iters=cfg.TEST.get("BATCH_PNP_REFINE_ITER", 10),
+        )
+        poses = torch.cat([R, t.unsqueeze(-1)], dim=-1).cpu().numpy()
+        for i in torch.nonzero(~valid_rows).view(-1).tolist():
+            self._logger.warning("num points: {}".format(num_points[i].item()))
+            poses[i] = -100
+        return poses
 
-    def process_pnp_ransac(self, inputs, outputs, out_dict):
+    def process_pnp_ransac(self, inputs, outputs, out_dict, batch_pnp=False):
         """
         Args:
             inputs: the inputs to a model.
                 It is a list of dict. Each dict corresponds to an image and
                 contains keys like "height", "width", "file_name", "image_id", "scene_id".
             outputs:
+            batch_pnp: solve the PnPs of all rois at once, the time is shared by the images
         """
         cfg = self.cfg
         net_cfg = cfg.MODEL.POSE_NET
@@ -479,14 +560,21 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
         out_coor_y = out_dict["coor_y"].detach()
         out_coor_z = out_dict["coor_z"].detach()
         out_xyz = get_out_coor(cfg, out_coor_x, out_coor_y, out_coor_z)
-        out_xyz = out_xyz.to(self._cpu_device).numpy()
-
         out_mask = get_out_mask(cfg, out_dict["mask"].detach())
+
+        batch_pnp_time = 0
+        if batch_pnp and "rot" in net_cfg.TASK.lower():
+            start_pnp_time = time.perf_counter()
+            pnp_poses = self.get_pnp_poses_batch(inputs, out_xyz, out_mask)
+            batch_pnp_time = (time.perf_counter() - start_pnp_time) / max(len(inputs), 1)
+
+        out_xyz = out_xyz.to(self._cpu_device).numpy()
         out_mask = out_mask.to(self._cpu_device).numpy()
 
         out_trans = out_dict["trans"].detach().to(self._cpu_device).numpy()
         out_i = -1
         for i, (_input, output) in enumerate(zip(inputs, outputs)):
+            output["time"] += batch_pnp_time
             start_process_time = time.perf_counter()
             for inst_i in range(len(_input["roi_img"])):
                 out_i += 1
@@ -506,7 +594,9 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
                     continue
 
                 # get pose
-                if "rot" in net_cfg.TASK.lower():
+                if "rot" in net_cfg.TASK.lower() and batch_pnp:
+                    pose_est = pnp_poses[out_i].copy()
+                elif "rot" in net_cfg.TASK.lower():
                     xyz_i = out_xyz[out_i].transpose(1, 2, 0)
                     mask_i = np.squeeze(out_mask[out_i])
 
@@ -576,19 +666,16 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
                 # result
                 file_name = _input["file_name"][inst_i]
 
-                if cls_name not in self._predictions:
-                    self._predictions[cls_name] = OrderedDict()
-
                 result = {
                     "score": score,
                     "R": pose_est[:3, :3],
                     "t": pose_est[:3, 3],
                     "time": output["time"],
                 }
-                self._predictions[cls_name][file_name] = result
+                self._add_prediction(cls_name, file_name, result)
 
     def evaluate(self):
-        # bop toolkit eval in subprocess, no return value
+        # bop toolkit eval (in this process), no return value
         if self._distributed:
             synchronize()
             _predictions = all_gather(self._predictions)
@@ -624,6 +711,60 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
                     self.gts[obj_name] = OrderedDict()
                 self.gts[obj_name][file_name] = {"R": R, "t": trans, "K": K}
 
+    def _calc_pred_errors(self, obj_name, pred, gt_anno):
+        """(ad, re, te, proj) errors of a prediction w.r.t. its gt."""
+        cfg = self.cfg
+        cur_label = self.obj_names.index(obj_name)
+        R_pred = pred["R"]
+        t_pred = pred["t"]
+
+        R_gt = gt_anno["R"]
+        t_gt = gt_anno["t"]
+
+        t_error = te(t_pred, t_gt)
+
+        if obj_name in cfg.DATASETS.SYM_OBJS:
+            R_gt_sym = get_closest_rot(R_pred, R_gt, self._metadata.sym_infos[cur_label])
+            r_error = re(R_pred, R_gt_sym)
+
+            proj_2d_error = arp_2d(
+                R_pred,
+                t_pred,
+                R_gt_sym,
+                t_gt,
+                pts=self.models_3d[cur_label]["pts"],
+                K=gt_anno["K"],
+            )
+
+            ad_error = adi(
+                R_pred,
+                t_pred,
+                R_gt,
+                t_gt,
+                pts=self.models_3d[self.obj_names.index(obj_name)]["pts"],
+            )
+        else:
+            r_error = re(R_pred, R_gt)
+
+            proj_2d_error = arp_2d(
+                R_pred,
+                t_pred,
+                R_gt,
+                t_gt,
+                pts=self.models_3d[cur_label]["pts"],
+                K=gt_anno["K"],
+            )
+
+            ad_error = add(
+                R_pred,
+                t_pred,
+                R_gt,
+                t_gt,
+                pts=self.models_3d[self.obj_names.index(obj_name)]["pts"],
+            )
+
+        return ad_error, r_error, t_error, proj_2d_error
+
     def _eval_predictions(self):
         """Evaluate self._predictions on 6d pose.
 
@@ -644,7 +785,8 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
 
         recalls = OrderedDict()
         errors = OrderedDict()
-        self.get_gts()
+        if getattr(self, "gts", None) is None:  # may be loaded by accumulate()
+            self.get_gts()
 
         error_names = ["ad", "re", "te", "proj"]
         # yapf: disable
@@ -679,54 +821,8 @@ class Depth6DPose_EvaluatorCustom(DatasetEvaluator):
                     for metric_name in metric_names:
                         recalls[obj_name][metric_name].append(0.0)
                     continue
-                # compute each metric
-                R_pred = obj_preds[file_name]["R"]
-                t_pred = obj_preds[file_name]["t"]
-
-                R_gt = gt_anno["R"]
-                t_gt = gt_anno["t"]
-
-                t_error = te(t_pred, t_gt)
-
-                if obj_name in cfg.DATASETS.SYM_OBJS:
-                    R_gt_sym = get_closest_rot(R_pred, R_gt, self._metadata.sym_infos[cur_label])
-                    r_error = re(R_pred, R_gt_sym)
-
-                    proj_2d_error = arp_2d(
-                        R_pred,
-                        t_pred,
-                        R_gt_sym,
-                        t_gt,
-                        pts=self.models_3d[cur_label]["pts"],
-                        K=gt_anno["K"],
-                    )
-
-                    ad_error = adi(
-                        R_pred,
-                        t_pred,
-                        R_gt,
-                        t_gt,
-                        pts=self.models_3d[self.obj_names.index(obj_name)]["pts"],
-                    )
-                else:
-                    r_error = re(R_pred, R_gt)
-
-                    proj_2d_error = arp_2d(
-                        R_pred,
-                        t_pred,
-                        R_gt,
-                        t_gt,
-                        pts=self.models_3d[cur_label]["pts"],
-                        K=gt_anno["K"],
-                    )
-
-                    ad_error = add(
-                        R_pred,
-                        t_pred,
-                        R_gt,
-                        t_gt,
-                        pts=self.models_3d[self.obj_names.index(obj_name)]["pts"],
-                    )
+                # compute each metric (if not done by accumulate())
+                ad_error, r_error, t_error, proj_2d_error = self._get_pred_errors(obj_name, file_name, gt_anno)
 
                 #########
                 errors[obj_name]["ad"].append(ad_error)
@@ -36,6 +36,7 @@ from core.utils.my_checkpoint import MyCheckpointer
 from core.utils.my_writer import MyCommonMetricPrinter, MyJSONWriter, MyTensorboardXWriter
 from core.utils.utils import get_emb_show
 from core.utils.data_utils import denormalize_image
+from core.utils.model_asset_bank import build_model_asset_bank, use_model_asset_bank
 from core.Depth6DPose.datasets.data_loader import build_Depth6DPose_train_loader, build_Depth6DPose_test_loader
 
 from .Depth6DPose_engine_utils import batch_data, get_out_coor, get_out_mask
@@ -185,6 +186,14 @@ def do_train(cfg, args, model, optimizer, renderer=None, resume=False):
         data_loader_2 = None
         data_loader_2_iter = None
 
+    # model points/extents/symmetries of the train datasets on the device
+    asset_bank = None
+    if use_model_asset_bank(cfg):
+        loaders = [(data_loader, train_dset_names)]
+        if data_loader_2 is not None:
+            loaders.append((data_loader_2, train_2_dset_names))
+        asset_bank = build_model_asset_bank(cfg, loaders)
+
     images_per_batch = cfg.SOLVER.IMS_PER_BATCH
     if isinstance(data_loader, AspectRatioGroupedDataset):
         dataset_len = len(data_loader.dataset.dataset)
@@ -290,7 +299,7 @@ def do_train(cfg, args, model, optimizer, renderer=None, resume=False):
             #     vis_train_data(data, obj_names, cfg)
 
             # forward ============================================================
-            batch = batch_data(cfg, data, renderer=renderer)
+            batch = batch_data(cfg, data, renderer=renderer, asset_bank=asset_bank)
             with autocast(enabled=AMP_ON):
                 out_dict, loss_dict = model(
                     batch["roi_img"],
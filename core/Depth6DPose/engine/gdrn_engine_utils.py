@@ -6,23 +6,30 @@ import itertools
 from einops import rearrange
 from lib.egl_renderer.egl_renderer_v3 import EGLRenderer
 from core.utils.camera_geometry import get_K_crop_resize
-from core.utils.data_utils import xyz_to_region_batch
+from core.utils.data_utils import expand_target, xyz_to_region_batch
+from core.utils.zoom_utils import batch_crop_resize_by_center_scale, stack_padded
 from lib.vis_utils.image import grid_show
 from core.utils.utils import get_emb_show
 from lib.pysixd import misc
 
 
-def batch_data(cfg, data, renderer=None, device="cuda", phase="train"):
+def batch_data(cfg, data, renderer=None, device="cuda", phase="train", asset_bank=None):
+    """
+    Args:
+        asset_bank (ModelAssetBank): if given, gather the model assets of the rois
+            (roi_points, roi_extent, sym_info) from it instead of the data
+    """
     if phase != "train":
         return batch_data_test(cfg, data, device=device)
 
     if cfg.MODEL.POSE_NET.XYZ_ONLINE:
         assert renderer is not None, "renderer must be provided for online rendering"
-        return batch_data_train_online(cfg, data, renderer=renderer, device=device)
+        return batch_data_train_online(cfg, data, renderer=renderer, device=device, asset_bank=asset_bank)
 
     # batch training data
     batch = {}
-    batch["roi_img"] = torch.stack([d["roi_img"] for d in data], dim=0).to(device, non_blocking=True)
+    if "roi_img" in data[0]:  # else cropped on the device (crop_roi_targets_batch)
+        batch["roi_img"] = torch.stack([d["roi_img"] for d in data], dim=0).to(device, non_blocking=True)
     batch["roi_cls"] = torch.tensor([d["roi_cls"] for d in data], dtype=torch.long).to(device, non_blocking=True)
     if "roi_coord_2d" in data[0]:
         batch["roi_coord_2d"] = torch.stack([d["roi_coord_2d"] for d in data], dim=0).to(
@@ -42,9 +49,15 @@ def batch_data(cfg, data, renderer=None, device="cuda", phase="train"):
     batch["resize_ratio"] = torch.tensor([d["resize_ratio"] for d in data]).to(
         device=device, dtype=torch.float32, non_blocking=True
     )
-    batch["roi_extent"] = torch.stack([d["roi_extent"] for d in data], dim=0).to(
-        device=device, dtype=torch.float32, non_blocking=True
-    )
+    if asset_bank is not None:
+        asset_bank.fill_batch(batch, data)
+    else:
+        batch["roi_extent"] = torch.stack([d["roi_extent"] for d in data], dim=0).to(
+            device=device, dtype=torch.float32, non_blocking=True
+        )
+
+    if "image" in data[0]:
+        crop_roi_targets_batch(cfg, data, batch, device=device)
 
     batch["roi_trans_ratio"] = torch.stack([d["trans_ratio"] for d in data], dim=0).to(device, non_blocking=True)
     # yapf: disable
@@ -56,13 +69,8 @@ def batch_data(cfg, data, renderer=None, device="cuda", phase="train"):
         "roi_points",
     ]:
         if key in data[0]:
-            if key in ["roi_region"]:
-                dtype = torch.long
-            else:
-                dtype = torch.float32
-            batch[key] = torch.stack([d[key] for d in data], dim=0).to(
-                device=device, dtype=dtype, non_blocking=True
-            )
+            # copy the (maybe compact) targets as they are, then expand them on the device
+            batch[key] = expand_target(key, torch.stack([d[key] for d in data], dim=0).to(device, non_blocking=True))
     # yapf: enable
     if "sym_info" in data[0]:
         batch["sym_info"] = [d["sym_info"] for d in data]
@@ -70,7 +78,103 @@ def batch_data(cfg, data, renderer=None, device="cuda", phase="train"):
     return batch
 
 
-def batch_data_train_online(cfg, data, renderer, device="cuda"):
+def crop_roi_targets_batch(cfg, data, batch, device="cuda"):
+    """crop the roi image and targets of the whole batch on the device
+    (DATALOADER.DEVICE_ROI_CROP), as the data loader does for each roi with
+    crop_resize_by_warp_affine.
+
+    Needs roi_center and roi_extent (and roi_fps_points if given by the asset bank) in the batch.
+    """
+    net_cfg = cfg.MODEL.POSE_NET
+    g_head_cfg = net_cfg.GEO_HEAD
+    loss_cfg = net_cfg.LOSS_CFG
+    input_res = net_cfg.INPUT_RES
+    out_res = net_cfg.OUTPUT_RES
+    bs = len(data)
+    roi_centers = batch["roi_center"]
+    roi_scales = torch.tensor([d["scale"] for d in data], dtype=torch.float32).to(device, non_blocking=True)
+    mask_xyz_interp = "bilinear" if cfg.TRAIN.VIS else "nearest"
+
+    # roi_img ------------------------------------------------------------
+    image = stack_padded([d["image"] for d in data]).to(device, non_blocking=True).to(torch.float32)
+    roi_img = batch_crop_resize_by_center_scale(image, roi_centers, roi_scales, input_res, interpolation="bilinear")
+    pixel_mean = torch.tensor(cfg.MODEL.PIXEL_MEAN, dtype=torch.float32, device=device).view(1, -1, 1, 1)
+    pixel_std = torch.tensor(cfg.MODEL.PIXEL_STD, dtype=torch.float32, device=device).view(1, -1, 1, 1)
+    batch["roi_img"] = (roi_img - pixel_mean) / pixel_std
+
+    # roi_coord_2d (the images may be padded) ----------------------------
+    H, W = image.shape[-2:]
+    im_wh = torch.tensor([[d["image"].shape[-1], d["image"].shape[-2]] for d in data], dtype=torch.float32)
+    im_wh = im_wh.to(device, non_blocking=True)
+    xs = torch.arange(W, dtype=torch.float32, device=device).view(1, 1, W) / im_wh[:, 0].view(bs, 1, 1)
+    ys = torch.arange(H, dtype=torch.float32, device=device).view(1, H, 1) / im_wh[:, 1].view(bs, 1, 1)
+    xs, ys = xs.expand(bs, H, W), ys.expand(bs, H, W)
+    coord_2d = torch.stack([xs, ys], dim=1) * ((xs < 1) & (ys < 1)).unsqueeze(1)  # 0 in the padding
+    roi_coord_2d = batch_crop_resize_by_center_scale(
+        coord_2d, roi_centers, roi_scales, out_res, interpolation="bilinear"
+    )
+    batch["roi_coord_2d"] = roi_coord_2d
+    batch["roi_coord_2d_rel"] = (
+        roi_centers.view(bs, 2, 1, 1) - roi_coord_2d * im_wh.view(bs, 2, 1, 1)
+    ) / roi_scales.view(bs, 1, 1, 1)
+
+    # roi masks ----------------------------------------------------------
+    mask_bits = stack_padded([d["im_mask_bits"] for d in data]).to(device, non_blocking=True)
+    bits = torch.tensor([1, 2, 4, 8], dtype=torch.uint8, device=device).view(1, 4, 1, 1)
+    masks = ((mask_bits.unsqueeze(1) & bits) > 0).to(torch.float32)  # obj, visib, trunc, full
+    roi_masks = batch_crop_resize_by_center_scale(
+        masks, roi_centers, roi_scales, out_res, interpolation=mask_xyz_interp
+    )
+    batch["roi_mask_obj"] = roi_masks[:, 0]
+    batch["roi_mask_visib"] = roi_masks[:, 1]
+    batch["roi_mask_trunc"] = roi_masks[:, 2]
+    if data[0]["has_mask_full"]:
+        batch["roi_mask_full"] = roi_masks[:, 3]
+
+    # roi_xyz (cropped from the xyz crops, zeros around them) -------------
+    xyz_crop = stack_padded([d["xyz_crop"] for d in data]).to(device, non_blocking=True).to(torch.float32)
+    xyz_crop_xy = torch.stack([d["xyz_crop_xy"] for d in data], dim=0).to(device, non_blocking=True)
+    roi_xyz = batch_crop_resize_by_center_scale(
+        xyz_crop, roi_centers - xyz_crop_xy, roi_scales, out_res, interpolation=mask_xyz_interp
+    )
+
+    if g_head_cfg.NUM_REGIONS > 1:  # get roi_region ------------------------
+        if "roi_fps_points" not in batch:
+            batch["roi_fps_points"] = torch.stack([d["roi_fps_points"] for d in data], dim=0).to(
+                device=device, dtype=torch.float32, non_blocking=True
+            )
+        roi_xyz_mask = (roi_xyz != 0).any(dim=1).to(torch.float32)
+        batch["roi_region"] = xyz_to_region_batch(
+            rearrange(roi_xyz, "b c h w -> b h w c").contiguous(), batch["roi_fps_points"], mask=roi_xyz_mask
+        )
+
+    # normalize xyz to [0, 1] using extent
+    roi_xyz = roi_xyz / batch["roi_extent"].view(bs, 3, 1, 1) + 0.5
+
+    xyz_loss_type = loss_cfg.XYZ_LOSS_TYPE
+    if ("CE" in xyz_loss_type) or ("cls" in net_cfg.NAME):  # convert target to int for cls
+        n_xyz_bin = g_head_cfg.XYZ_BIN
+        # NOTE: clipped in place by the data loader
+        roi_xyz = roi_xyz.clamp(min=0, max=0.999999)
+        # [0, BIN-1], the last bin is for bg
+        roi_xyz_bin = (roi_xyz * n_xyz_bin).to(torch.long).to(torch.float32)
+        roi_mask_xyz = {
+            "trunc": batch["roi_mask_trunc"],
+            "visib": batch["roi_mask_visib"],
+            "obj": batch["roi_mask_obj"],
+            "full": batch.get("roi_mask_full", None),
+        }[loss_cfg.XYZ_LOSS_MASK_GT]
+        roi_xyz_bin.masked_fill_((roi_mask_xyz == 0).unsqueeze(1), n_xyz_bin)
+        if "CE" in xyz_loss_type:
+            batch["roi_xyz_bin"] = roi_xyz_bin
+        if "/" in xyz_loss_type and len(xyz_loss_type.split("/")[1]) > 0:
+            batch["roi_xyz"] = roi_xyz
+    else:
+        batch["roi_xyz"] = roi_xyz
+    return batch
+
+
+def batch_data_train_online(cfg, data, renderer, device="cuda", asset_bank=None):
     # batch training data, rendering xyz online
     net_cfg = cfg.MODEL.POSE_NET
     g_head_cfg = net_cfg.GEO_HEAD
@@ -103,9 +207,12 @@ def batch_data_train_online(cfg, data, renderer, device="cuda"):
     batch["roi_zoom_K"] = get_K_crop_resize(batch["roi_cam"], roi_crop_xy_batch, roi_resize_ratio_batch)
     # --------------------------------------------------------------
     batch["roi_wh"] = torch.stack([d["roi_wh"] for d in data], dim=0).to(device, non_blocking=True)
-    batch["roi_extent"] = torch.stack([d["roi_extent"] for d in data], dim=0).to(
-        device=device, dtype=torch.float32, non_blocking=True
-    )  # [b,3]
+    if asset_bank is not None:
+        asset_bank.fill_batch(batch, data)
+    else:
+        batch["roi_extent"] = torch.stack([d["roi_extent"] for d in data], dim=0).to(
+            device=device, dtype=torch.float32, non_blocking=True
+        )  # [b,3]
 
     batch["roi_trans_ratio"] = torch.stack([d["trans_ratio"] for d in data], dim=0).to(device, non_blocking=True)
     # yapf: disable
@@ -115,10 +222,7 @@ def batch_data_train_online(cfg, data, renderer, device="cuda"):
         "roi_points",
     ]:
         if key in data[0]:
-            dtype = torch.float32
-            batch[key] = torch.stack([d[key] for d in data], dim=0).to(
-                device=device, dtype=dtype, non_blocking=True
-            )
+            batch[key] = expand_target(key, torch.stack([d[key] for d in data], dim=0).to(device, non_blocking=True))
     # yapf: enable
     if "sym_info" in data[0]:
         batch["sym_info"] = [d["sym_info"] for d in data]
@@ -174,9 +278,10 @@ def batch_data_train_online(cfg, data, renderer, device="cuda"):
     batch["roi_mask_visib"] = batch["roi_mask_visib"] * batch["roi_mask_obj"]
 
     if g_head_cfg.NUM_REGIONS > 1:  # get roi_region ------------------------
-        batch["roi_fps_points"] = torch.stack([d["roi_fps_points"] for d in data], dim=0).to(
-            device=device, dtype=torch.float32, non_blocking=True
-        )
+        if "roi_fps_points" not in batch:
+            batch["roi_fps_points"] = torch.stack([d["roi_fps_points"] for d in data], dim=0).to(
+                device=device, dtype=torch.float32, non_blocking=True
+            )
         batch["roi_region"] = xyz_to_region_batch(roi_xyz_batch, batch["roi_fps_points"], mask=batch["roi_mask_obj"])
     # normalize to [0, 1]
     batch["roi_xyz"] = rearrange(roi_xyz_batch, "b h w c -> b c h w") / batch["roi_extent"].view(bs, 3, 1, 1) + 0.5
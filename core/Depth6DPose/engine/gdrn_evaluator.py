@@ -7,7 +7,8 @@ import logging
 import os.path as osp
 import random
 import time
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import mmcv
@@ -23,6 +24,7 @@ from detectron2.evaluation import DatasetEvaluator, DatasetEvaluators, inference
 from detectron2.utils.logger import log_every_n_seconds
 
 from core.utils.my_comm import all_gather, get_world_size, is_main_process, synchronize
+from core.utils.batch_pnp import batch_pnp_ransac, get_img_model_points_with_coords2d_batch
 from lib.pysixd import inout, misc
 from lib.pysixd.pose_error import te
 from lib.utils.mask_utils import binary_mask_to_rle
@@ -30,7 +32,7 @@ from lib.utils.utils import dprint
 from lib.vis_utils.image import grid_show, vis_image_bboxes_cv2
 
 from .Depth6DPose_engine_utils import batch_data, get_out_coor, get_out_mask
-from .test_utils import eval_cached_results, save_and_eval_results, to_list
+from .test_utils import eval_cached_results, get_eval_models, get_result_name, save_and_eval_results, to_list
 
 
 class Depth6DPose_Evaluator(DatasetEvaluator):
@@ -75,10 +77,35 @@ class Depth6DPose_Evaluator(DatasetEvaluator):
 
         # eval cached
         if cfg.VAL.EVAL_CACHED or cfg.VAL.EVAL_PRINT_ONLY:
-            eval_cached_results(self.cfg, self._output_dir, obj_ids=self.obj_ids)
+            models = get_eval_models(self.obj_ids, self.models_3d, self.data_ref.vertex_scale)
+            eval_cached_results(self.cfg, self._output_dir, obj_ids=self.obj_ids, models=models)
 
     def reset(self):
         self._predictions = []
+        self._close_results_writer()
+        # a single process streams the results of the batches to the csv file during the inference
+        if not self._distributed:
+            mmcv.mkdir_or_exist(self._output_dir)
+            res_path = osp.join(self._output_dir, get_result_name(self.cfg, "iter0"))
+            self._results_writer = inout.BopResultsWriter(res_path)
+
+    def _add_results(self, json_results):
+        self._predictions.extend(json_results)
+        if self._results_writer is not None and len(json_results) > 0:
+            self._results_writer.append(json_results)
+
+    def _close_results_writer(self):
+        """
+        Returns:
+            bool: whether the results have been streamed to the csv file
+        """
+        writer = getattr(self, "_results_writer", None)
+        self._results_writer = None
+        if writer is None:
+            return False
+        writer.close()
+        self._logger.info("wrote {} results to: {}".format(writer.count, writer.path))
+        return True
 
     def _maybe_adapt_label_cls_name(self, label):
         if self.train_objs is not None:
@@ -152,6 +179,8 @@ class Depth6DPose_Evaluator(DatasetEvaluator):
         if cfg.TEST.USE_PNP:
             if cfg.TEST.PNP_TYPE.lower() == "ransac_pnp":
                 return self.process_pnp_ransac(inputs, outputs, out_dict)
+            elif cfg.TEST.PNP_TYPE.lower() == "batch_ransac_pnp":
+                return self.process_pnp_ransac(inputs, outputs, out_dict, batch_pnp=True)
             elif cfg.TEST.PNP_TYPE.lower() == "net_iter_pnp":
                 return self.process_net_and_pnp(inputs, outputs, out_dict, pnp_type="iter")
             elif cfg.TEST.PNP_TYPE.lower() == "net_ransac_pnp":
@@ -218,7 +247,7 @@ class Depth6DPose_Evaluator(DatasetEvaluator):
             # process time for this image
             for item in json_results:
                 item["time"] = output["time"]
-            self._predictions.extend(json_results)
+            self._add_results(json_results)
 
     def process_net_and_pnp(self, inputs, outputs, out_dict, pnp_type="iter"):
         """Initialize with network prediction (learned PnP) + iter PnP
@@ -347,15 +376,62 @@ class Depth6DPose_Evaluator(DatasetEvaluator):
             # process time for this image
             for item in json_results:
                 item["time"] = output["time"]
-            self._predictions.extend(json_results)
+            self._add_results(json_results)
+
+    def get_pnp_poses_batch(self, inputs, out_xyz, out_mask):
+        """RANSAC EPnP of all the rois of the batch at once (on
+        cfg.TEST.BATCH_PNP_DEVICE, cpu by default, "" for the device of the
+        outputs).
+
+        Returns:
+            poses (np.ndarray): [n, 3, 4], -100 for rois with less than 4 points
+        """
+        cfg = self.cfg
+        device = cfg.TEST.get("BATCH_PNP_DEVICE", "cpu") or out_xyz.device
+        dtype = torch.float64
+
+        def _cat(key):
+            return torch.cat([_input[key] for _input in inputs]).to(device=device, dtype=dtype)
+
+        def _cat_scalars(key):
+            return torch.tensor([float(_v) for _input in inputs for _v in _input[key]], dtype=dtype, device=device)
+
+        img_points, model_points, valid = get_img_model_points_with_coords2d_batch(
+            out_mask.to(device=device, dtype=dtype),
+            out_xyz.to(device=device, dtype=dtype),
+            _cat("roi_coord_2d"),
+            im_H=_cat_scalars("im_H"),
+            im_W=_cat_scalars("im_W"),
+            extent=_cat("roi_extent"),
+            mask_thr=cfg.MODEL.POSE_NET.GEO_HEAD.MASK_THR_TEST,
+        )
+        num_points = valid.sum(1)
+        # rois with too few points are solved as well (with dummy points) and discarded below
+        valid_rows = num_points >= 4
+        valid = torch.where(valid_rows[:, None], valid, torch.ones_like(valid))
+        R, t, _ = batch_pnp_ransac(
+            model_points,
+            img_points,
+            _cat("cam"),
+            valid,
+            num_hypotheses=cfg.TEST.get("BATCH_PNP_RANSAC_ITER", 100),
+            reproj_err_thr=cfg.TEST.get("BATCH_PNP_REPROJ_ERR", 3.0),
+            num_refine_iters=cfg.TEST.get("BATCH_PNP_REFINE_ITER", 10),
+        )
+        poses = torch.cat([R, t.unsqueeze(-1)], dim=-1).cpu().numpy()
+        for i in torch.nonzero(~valid_rows).view(-1).tolist():
+            self._logger.warning("num points: {}".format(num_points[i].item()))
+            poses[i] = -100
+        return poses
 
-    def process_pnp_ransac(self, inputs, outputs, out_dict):
+    def process_pnp_ransac(self, inputs, outputs, out_dict, batch_pnp=False):
         """
         Args:
             inputs: the inputs to a model.
                 It is a list of dict. Each dict corresponds to an image and
                 contains keys like "height", "width", "file_name", "image_id", "scene_id".
             outputs:
+            batch_pnp: solve the PnPs of all rois at once, the time is shared by the images
         """
         cfg = self.cfg
         net_cfg = cfg.MODEL.POSE_NET
@@ -363,14 +439,21 @@ class Depth6DPose_Evaluator(DatasetEvaluator):
         out_coor_y = out_dict["coor_y"].detach()
         out_coor_z = out_dict["coor_z"].detach()
         out_xyz = get_out_coor(cfg, out_coor_x, out_coor_y, out_coor_z)
-        out_xyz = out_xyz.to(self._cpu_device).numpy()
-
         out_mask = get_out_mask(cfg, out_dict["mask"].detach())
+
+        batch_pnp_time = 0
+        if batch_pnp and "rot" in net_cfg.TASK.lower():
+            start_pnp_time = time.perf_counter()
+            pnp_poses = self.get_pnp_poses_batch(inputs, out_xyz, out_mask)
+            batch_pnp_time = (time.perf_counter() - start_pnp_time) / max(len(inputs), 1)
+
+        out_xyz = out_xyz.to(self._cpu_device).numpy()
         out_mask = out_mask.to(self._cpu_device).numpy()
 
         out_trans = out_dict["trans"].detach().to(self._cpu_device).numpy()
         out_i = -1
         for i, (_input, output) in enumerate(zip(inputs, outputs)):
+            output["time"] += batch_pnp_time
             start_process_time = time.perf_counter()
             json_results = []
             for inst_i in range(len(_input["roi_img"])):
@@ -397,7 +480,9 @@ class Depth6DPose_Evaluator(DatasetEvaluator):
                 obj_id = self.data_ref.obj2id[cls_name]
 
                 # get pose
-                if "rot" in net_cfg.TASK.lower():
+                if "rot" in net_cfg.TASK.lower() and batch_pnp:
+                    pose_est = pnp_poses[out_i].copy()
+                elif "rot" in net_cfg.TASK.lower():
                     xyz_i = out_xyz[out_i].transpose(1, 2, 0)
                     mask_i = np.squeeze(out_mask[out_i])
 
@@ -468,10 +553,11 @@ class Depth6DPose_Evaluator(DatasetEvaluator):
             # process time for this image
             for item in json_results:
                 item["time"] = output["time"]
-            self._predictions.extend(json_results)
+            self._add_results(json_results)
 
     def evaluate(self):
-        # bop toolkit eval in subprocess, no return value
+        # bop toolkit eval (in this process), no return value
+        results_saved = self._close_results_writer()
         if self._distributed:
             synchronize()
             self._predictions = all_gather(self._predictions)
@@ -479,17 +565,21 @@ class Depth6DPose_Evaluator(DatasetEvaluator):
             if not is_main_process():
                 return
 
-        return self._eval_predictions()
+        return self._eval_predictions(results_saved=results_saved)
         # return copy.deepcopy(self._eval_predictions())
 
-    def _eval_predictions(self):
+    def _eval_predictions(self, results_saved=False):
         """Evaluate self._predictions on 6d pose.
 
         Return results with the metrics of the tasks.
         """
         self._logger.info("Eval results with BOP toolkit ...")
         results_all = {"iter0": self._predictions}
-        save_and_eval_results(self.cfg, results_all, self._output_dir, obj_ids=self.obj_ids)
+        # the eval models are already loaded (from the same eval models dir)
+        models = get_eval_models(self.obj_ids, self.models_3d, self.data_ref.vertex_scale)
+        save_and_eval_results(
+            self.cfg, results_all, self._output_dir, obj_ids=self.obj_ids, models=models, results_saved=results_saved
+        )
         return {}
 
     def pose_from_upnp(self, mean_pts2d, covar, points_3d, K):
@@ -548,6 +638,21 @@ class Depth6DPose_Evaluator(DatasetEvaluator):
         return results
 
 
+def _process_outputs(evaluator, inputs, outputs, out_dict, accumulate=False):
+    """post-process the outputs of a batch (RANSAC/PnP) with the evaluator,
+    and if accumulate, calculate the metrics of the predictions (for the
+    evaluators which support it).
+
+    Returns:
+        the post-process time
+    """
+    start_process_time = time.perf_counter()
+    evaluator.process(inputs, outputs, out_dict)  # RANSAC/PnP
+    if accumulate and hasattr(evaluator, "accumulate"):
+        evaluator.accumulate()
+    return time.perf_counter() - start_process_time
+
+
 def Depth6DPose_inference_on_dataset(cfg, model, data_loader, evaluator, amp_test=False):
     """Run model on the data_loader and evaluate the metrics with evaluator.
     Also benchmark the inference speed of `model.forward` accurately. The model
@@ -564,6 +669,10 @@ def Depth6DPose_inference_on_dataset(cfg, model, data_loader, evaluator, amp_tes
         evaluator (DatasetEvaluator): the evaluator to run. Use `None` if you only want
             to benchmark, but don't want to do any evaluation.
 
+    If cfg.TEST.PIPELINE_EVAL, the outputs are post-processed and their metrics
+    accumulated in a background thread while the next batches are inferred,
+    `evaluator.evaluate()` then only aggregates the metrics.
+
     Returns:
         The return value of `evaluator.evaluate()`
     """
@@ -571,6 +680,12 @@ def Depth6DPose_inference_on_dataset(cfg, model, data_loader, evaluator, amp_tes
     logger = logging.getLogger(__name__)
     logger.info("Start inference on {} images".format(len(data_loader)))
 
+    # NOTE: a single worker, the evaluators process the batches in order
+    pipeline_eval = cfg.TEST.get("PIPELINE_EVAL", False)
+    executor = ThreadPoolExecutor(max_workers=1) if pipeline_eval else None
+    max_pending = cfg.TEST.get("PIPELINE_MAX_PENDING", 2)
+    pending = deque()  # futures of the batches being post-processed
+
     total = len(data_loader)  # inference data loader must have a fixed length
     if evaluator is None:
         # create a no-op evaluator
@@ -581,70 +696,82 @@ def Depth6DPose_inference_on_dataset(cfg, model, data_loader, evaluator, amp_tes
     start_time = time.perf_counter()
     total_compute_time = 0
     total_process_time = 0
-    with inference_context(model), torch.no_grad():
-        for idx, inputs in enumerate(data_loader):
-            if idx == num_warmup:
-                start_time = time.perf_counter()
-                total_compute_time = 0
-                total_process_time = 0
-
-            start_compute_time = time.perf_counter()
-            #############################
-            # process input
-            batch = batch_data(cfg, inputs, phase="test")
-            if evaluator.train_objs is not None:
-                roi_labels = batch["roi_cls"].cpu().numpy().tolist()
-                obj_names = [evaluator.obj_names[_l] for _l in roi_labels]
-                if all(_obj not in evaluator.train_objs for _obj in obj_names):
-                    continue
-
-            # if cfg.DEBUG:
-            #     for i in range(len(batch["roi_cls"])):
-            #         vis_roi_im = batch["roi_img"][i].cpu().numpy().transpose(1,2,0)[:, :, ::-1]
-            #         show_ims = [vis_roi_im]
-            #         show_titles = ["roi_im"]
-            #
-            #         vis_coor2d = batch["roi_coord_2d"][i].cpu().numpy()
-            #         show_ims.extend([vis_coor2d[0], vis_coor2d[1]])
-            #         show_titles.extend(["coord_2d_x", "coord_2d_y"])
-            #         grid_show(show_ims, show_titles, row=1, col=3)
+    try:
+        with inference_context(model), torch.no_grad():
+            for idx, inputs in enumerate(data_loader):
+                if idx == num_warmup:
+                    start_time = time.perf_counter()
+                    total_compute_time = 0
+                    total_process_time = 0
+
+                start_compute_time = time.perf_counter()
+                #############################
+                # process input
+                batch = batch_data(cfg, inputs, phase="test")
+                if evaluator.train_objs is not None:
+                    roi_labels = batch["roi_cls"].cpu().numpy().tolist()
+                    obj_names = [evaluator.obj_names[_l] for _l in roi_labels]
+                    if all(_obj not in evaluator.train_objs for _obj in obj_names):
+                        continue
 
-            with autocast(enabled=amp_test):  # Depth6DPose amp_test seems slower
-                out_dict = model(
-                    batch["roi_img"],
-                    roi_classes=batch["roi_cls"],
-                    roi_cams=batch["roi_cam"],
-                    roi_whs=batch["roi_wh"],
-                    roi_centers=batch["roi_center"],
-                    resize_ratios=batch["resize_ratio"],
-                    roi_coord_2d=batch.get("roi_coord_2d", None),
-                    roi_coord_2d_rel=batch.get("roi_coord_2d_rel", None),
-                    roi_extents=batch.get("roi_extent", None),
-                )
-            if torch.cuda.is_available():
-                torch.cuda.synchronize()
-            cur_compute_time = time.perf_counter() - start_compute_time
-            total_compute_time += cur_compute_time
-            # NOTE: added
-            outputs = [{} for _ in range(len(inputs))]
-            for _i in range(len(outputs)):
-                outputs[_i]["time"] = cur_compute_time + float(inputs[_i].get("time", 0))
+                # if cfg.DEBUG:
+                #     for i in range(len(batch["roi_cls"])):
+                #         vis_roi_im = batch["roi_img"][i].cpu().numpy().transpose(1,2,0)[:, :, ::-1]
+                #         show_ims = [vis_roi_im]
+                #         show_titles = ["roi_im"]
+                #
+                #         vis_coor2d = batch["roi_coord_2d"][i].cpu().numpy()
+                #         show_ims.extend([vis_coor2d[0], vis_coor2d[1]])
+                #         show_titles.extend(["coord_2d_x", "coord_2d_y"])
+                #         grid_show(show_ims, show_titles, row=1, col=3)
+
+                with autocast(enabled=amp_test):  # Depth6DPose amp_test seems slower
+                    out_dict = model(
+                        batch["roi_img"],
+                        roi_classes=batch["roi_cls"],
+                        roi_cams=batch["roi_cam"],
+                        roi_whs=batch["roi_wh"],
+                        roi_centers=batch["roi_center"],
+                        resize_ratios=batch["resize_ratio"],
+                        roi_coord_2d=batch.get("roi_coord_2d", None),
+                        roi_coord_2d_rel=batch.get("roi_coord_2d_rel", None),
+                        roi_extents=batch.get("roi_extent", None),
+                    )
+                if torch.cuda.is_available():
+                    torch.cuda.synchronize()
+                cur_compute_time = time.perf_counter() - start_compute_time
+                total_compute_time += cur_compute_time
+                # NOTE: added
+                outputs = [{} for _ in range(len(inputs))]
+                for _i in range(len(outputs)):
+                    outputs[_i]["time"] = cur_compute_time + float(inputs[_i].get("time", 0))
+
+                if executor is not None:
+                    # bound the batches (and their outputs) in flight
+                    while len(pending) >= max_pending:
+                        total_process_time += pending.popleft().result()
+                    pending.append(executor.submit(_process_outputs, evaluator, inputs, outputs, out_dict, True))
+                else:
+                    total_process_time += _process_outputs(evaluator, inputs, outputs, out_dict)
+
+                iters_after_start = idx + 1 - num_warmup * int(idx >= num_warmup)
+                seconds_per_img = total_compute_time / iters_after_start
+                if idx >= num_warmup * 2 or seconds_per_img > 5:
+                    total_seconds_per_img = (time.perf_counter() - start_time) / iters_after_start
+                    eta = datetime.timedelta(seconds=int(total_seconds_per_img * (total - idx - 1)))
+                    log_every_n_seconds(
+                        logging.INFO,
+                        f"Inference done {idx+1}/{total}. {seconds_per_img:.4f} s / img. ETA={str(eta)}",
+                        n=5,
+                    )
 
-            start_process_time = time.perf_counter()
-            evaluator.process(inputs, outputs, out_dict)  # RANSAC/PnP
-            cur_process_time = time.perf_counter() - start_process_time
-            total_process_time += cur_process_time
-
-            iters_after_start = idx + 1 - num_warmup * int(idx >= num_warmup)
-            seconds_per_img = total_compute_time / iters_after_start
-            if idx >= num_warmup * 2 or seconds_per_img > 5:
-                total_seconds_per_img = (time.perf_counter() - start_time) / iters_after_start
-                eta = datetime.timedelta(seconds=int(total_seconds_per_img * (total - idx - 1)))
-                log_every_n_seconds(
-                    logging.INFO,
-                    f"Inference done {idx+1}/{total}. {seconds_per_img:.4f} s / img. ETA={str(eta)}",
-                    n=5,
-                )
+        if executor is not None:
+            # wait for the post-processing of the last batches before the evaluation
+            while len(pending) > 0:
+                total_process_time += pending.popleft().result()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
 
     # Measure the time only for this worker (before the synchronization barrier)
     total_time = time.perf_counter() - start_time
@@ -174,7 +174,7 @@ class Refiner_Evaluator(DatasetEvaluator):
             self._predictions.extend(json_results)
 
     def evaluate(self):
-        # bop toolkit eval in subprocess, no return value
+        # bop toolkit eval (in this process), no return value
         if self._distributed:
             synchronize()
             self._predictions = all_gather(self._predictions)
@@ -37,6 +37,7 @@ from core.utils.my_checkpoint import MyCheckpointer
 from core.utils.my_writer import MyCommonMetricPrinter, MyJSONWriter, MyTensorboardXWriter
 from core.utils.utils import get_emb_show
 from core.utils.data_utils import denormalize_image
+from core.utils.model_asset_bank import build_model_asset_bank, use_model_asset_bank
 from core.Depth6DPose.datasets.data_loader_self import build_Depth6DPose_self_train_loader
 from core.Depth6DPose.datasets.data_loader import build_Depth6DPose_train_loader, build_Depth6DPose_test_loader
 from core.Depth6DPose.losses.ssim import SSIM, MS_SSIM
@@ -44,6 +45,7 @@ from core.Depth6DPose.losses.perceptual_loss import PerceptualLoss
 
 from .Depth6DPose_engine_utils import batch_data, get_out_coor, get_out_mask
 from .self_engine_utils import batch_data_self, compute_self_loss
+from .self_pseudo_label_cache import PseudoLabelCache
 from .Depth6DPose_evaluator import Depth6DPose_inference_on_dataset, Depth6DPose_Evaluator, Depth6DPose_save_result_of_dataset
 from .Depth6DPose_custom_evaluator import Depth6DPose_EvaluatorCustom
 import ref
@@ -206,6 +208,14 @@ def do_train(
         data_loader_2 = None
         data_loader_2_iter = None
 
+    # model points/extents/symmetries of the train datasets on the device
+    asset_bank = None
+    if use_model_asset_bank(cfg):
+        loaders = [(data_loader, train_dset_names)]
+        if data_loader_2 is not None:
+            loaders.append((data_loader_2, train_2_dset_names))
+        asset_bank = build_model_asset_bank(cfg, loaders)
+
     images_per_batch = cfg.SOLVER.IMS_PER_BATCH
     if isinstance(data_loader, AspectRatioGroupedDataset):
         dataset_len = len(data_loader.dataset.dataset)
@@ -257,6 +267,15 @@ def do_train(
     else:
         ema = None
 
+    # teacher outputs are reused until the teacher is updated
+    pseudo_label_cache_cfg = cfg.TRAIN.get("PSEUDO_LABEL_CACHE", dict(ENABLED=False))
+    if pseudo_label_cache_cfg.get("ENABLED", False):
+        pseudo_label_cache = PseudoLabelCache(
+            device=pseudo_label_cache_cfg.get("DEVICE", "cpu"), max_mb=pseudo_label_cache_cfg.get("MAX_MB", 4096)
+        )
+    else:
+        pseudo_label_cache = None
+
     if comm._USE_HVD:  # hvd may be not available, so do not use the one in args
         import horovod.torch as hvd
 
@@ -354,7 +373,7 @@ def do_train(
             if do_syn_sup:  # (synthetic supervised batch)
                 # NOTE: use offline xyz labels (DIBR rendered xyz is not very accurate)
                 assert net_cfg.XYZ_ONLINE is False, "Use offline xyz labels for self-supervised training!"
-                batch = batch_data(cfg, data, renderer=None)
+                batch = batch_data(cfg, data, renderer=None, asset_bank=asset_bank)
                 with autocast(enabled=AMP_ON):
                     out_dict, loss_dict = model(
                         batch["roi_img"],
@@ -387,7 +406,13 @@ def do_train(
                 if comm.is_main_process():
                     storage.put_scalars(total_loss=losses_reduced, **loss_dict_reduced)
             elif do_self:
-                batch = batch_data_self(cfg, data, model_teacher=model_teacher)
+                batch = batch_data_self(
+                    cfg,
+                    data,
+                    model_teacher=model_teacher,
+                    pseudo_label_cache=pseudo_label_cache,
+                    asset_bank=asset_bank,
+                )
                 with autocast(enabled=AMP_ON):
                     # only outputs, no losses
                     out_dict = model(
@@ -492,6 +517,8 @@ def do_train(
             if ema is not None and (iteration + 1) % (cfg.MODEL.EMA.UPDATE_FREQ * iters_per_epoch) == 0:
                 ema.update(model)
                 ema.update_attr(model)
+                if pseudo_label_cache is not None:
+                    pseudo_label_cache.clear()
 
             # ------------------------------------------------------------------
             # do test periodically or after training
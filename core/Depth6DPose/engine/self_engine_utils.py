@@ -14,13 +14,14 @@ from detectron2.layers import paste_masks_in_image
 from fvcore.nn import smooth_l1_loss
 
 from core.utils.camera_geometry import get_K_crop_resize
-from core.utils.data_utils import xyz_to_region_batch, denormalize_image
+from core.utils.data_utils import expand_target, xyz_to_region_batch, denormalize_image
 from core.utils.utils import get_emb_show
 from core.utils.edge_utils import compute_mask_edge_weights
 from core.Depth6DPose.losses.mask_losses import weighted_ex_loss_probs, soft_dice_loss
 from core.Depth6DPose.losses.depth_bp_chamfer_loss import depth_bp_chamfer_loss
 from core.Depth6DPose.losses.pm_loss import PyPMLoss
-from core.utils.zoom_utils import batch_crop_resize
+from core.utils.zoom_utils import batch_crop_resize, batch_crop_resize_by_center_scale
+from core.Depth6DPose.engine.self_pseudo_label_cache import get_pseudo_label_key
 
 from lib.torch_utils.color.lab import rgb_to_lab, normalize_lab
 from lib.vis_utils.image import heatmap, grid_show
@@ -35,6 +36,16 @@ def fig2img(fig):
     return img
 
 
+def is_roi_render(cfg):
+    """render each roi in its zoomed-in camera instead of the full image."""
+    return cfg.RENDERER.get("ROI_RENDER", dict(ENABLED=False)).get("ENABLED", False)
+
+
+def get_roi_render_res(cfg):
+    res = cfg.RENDERER.get("ROI_RENDER", dict(RES=-1)).get("RES", -1)
+    return res if res > 0 else cfg.MODEL.POSE_NET.OUTPUT_RES
+
+
 def compute_self_loss(
     cfg,
     batch,
@@ -63,7 +74,18 @@ def compute_self_loss(
     loss_dict = {}
     # for rendering data
     im_H, im_W = batch["gt_img"].shape[-2:]
-    batch["K_renderer"] = batch["roi_cam"].clone()
+    # the full images/depths are shared by the rois of the same image
+    roi_im_ind = batch["roi_im_ind"]
+    roi_render = is_roi_render(cfg)
+    if roi_render:
+        # render each roi directly in its zoomed-in camera
+        ren_H = ren_W = get_roi_render_res(cfg)
+        bs = batch["roi_cls"].shape[0]
+        rois_xy0 = batch["inst_rois"][:, 1:3]
+        batch["K_renderer"] = get_K_crop_resize(batch["roi_cam"], rois_xy0, ren_H / batch["roi_scale"].view(bs, -1))
+    else:
+        ren_H, ren_W = im_H, im_W
+        batch["K_renderer"] = batch["roi_cam"].clone()
 
     # get rendered mask/rgb/depth/xyz using DIBR
     cur_models = [ren_models[int(_l)] for _l in batch["roi_cls"]]
@@ -80,8 +102,8 @@ def compute_self_loss(
         pred_trans,
         cur_models,
         Ks=batch["K_renderer"],
-        width=im_W,
-        height=im_H,
+        width=ren_W,
+        height=ren_H,
         mode=["color", "depth", "mask", "xyz", "prob"],
     )
     ren_img = rearrange(ren_ret["color"][..., [2, 1, 0]], "b h w c -> b c h w")  # bgr;[0,1]
@@ -95,11 +117,17 @@ def compute_self_loss(
     ren_xyz = rearrange(ren_ret["xyz"], "b h w c -> b c h w")
 
     pseudo_mask = (batch["pseudo_mask_prob"] > 0.5).to(torch.float32)  # 64x64 roi level
-    pseudo_mask_in_im = (batch["pseudo_mask_prob_in_im"] > 0.5).to(torch.float32)  # BHW
+    if roi_render:  # masks at the rendering resolution of the rois, BHW
+        pseudo_mask_in_im = F.interpolate(pseudo_mask, size=(ren_H, ren_W), mode="nearest")[:, 0]
+    else:
+        pseudo_mask_in_im = (batch["pseudo_mask_prob_in_im"] > 0.5).to(torch.float32)  # BHW
 
     if "pseudo_full_mask_prob" in batch.keys():
         pseudo_full_mask = (batch["pseudo_full_mask_prob"] > 0.5).to(torch.float32)  # 64x64 roi level
-        pseudo_full_mask_in_im = (batch["pseudo_full_mask_prob_in_im"] > 0.5).to(torch.float32)  # BHW
+        if roi_render:
+            pseudo_full_mask_in_im = F.interpolate(pseudo_full_mask, size=(ren_H, ren_W), mode="nearest")[:, 0]
+        else:
+            pseudo_full_mask_in_im = (batch["pseudo_full_mask_prob_in_im"] > 0.5).to(torch.float32)  # BHW
 
     pseudo_mask_cal_ml = (
         pseudo_mask_in_im if cfg.MODEL.POSE_NET.SELF_LOSS_CFG.MASK_TYPE is "vis" else pseudo_full_mask_in_im
@@ -118,7 +146,7 @@ def compute_self_loss(
         mask_weight_in_im = torch.ones_like(pseudo_mask_cal_ml[:, None, :, :])
 
     if tb_writer is not None:
-        gt_img_vis = batch["gt_img"][vis_i].cpu().numpy()
+        gt_img_vis = batch["gt_img"][roi_im_ind[vis_i]].cpu().numpy()
         gt_img_vis = denormalize_image(gt_img_vis, cfg)[::-1].astype("uint8")
         vis_data["gt/image"] = rearrange(gt_img_vis, "c h w -> h w c")
 
@@ -142,9 +170,14 @@ def compute_self_loss(
     # mask loss (init ren) -----------------------
     if self_loss_cfg.MASK_INIT_REN_LW > 0:
         if tb_writer is not None:
-            ren_prob_roi = batch_crop_resize(
-                ren_prob, batch["inst_rois"], out_H=pseudo_mask.shape[-2], out_W=pseudo_mask.shape[-1]
-            )
+            if roi_render:
+                ren_prob_roi = F.interpolate(
+                    ren_prob, size=pseudo_mask.shape[-2:], mode="bilinear", align_corners=False
+                )
+            else:
+                ren_prob_roi = batch_crop_resize(
+                    ren_prob, batch["inst_rois"], out_H=pseudo_mask.shape[-2], out_W=pseudo_mask.shape[-1]
+                )
             ren_prob_roi_vis = ren_prob_roi[vis_i].detach().cpu().numpy()
             vis_data["ren/prob_roi"] = ren_prob_roi_vis[0]
 
@@ -189,7 +222,12 @@ def compute_self_loss(
         or self_loss_cfg.GEOM_LW > 0
     ):
         # crop/resize real and ren
-        ren_img_roi = batch_crop_resize(ren_img, batch["inst_rois"], out_H=in_res, out_W=in_res)
+        if not roi_render:
+            ren_img_roi = batch_crop_resize(ren_img, batch["inst_rois"], out_H=in_res, out_W=in_res)
+        elif ren_H != in_res:
+            ren_img_roi = F.interpolate(ren_img, size=(in_res, in_res), mode="bilinear", align_corners=False)
+        else:
+            ren_img_roi = ren_img
         # ren_mask_roi = batch_crop_resize(ren_mask, batch["inst_rois"], out_H=256, out_W=256)
         gt_img_roi = batch["roi_gt_img"]
         # NOTE: use only visib parts to compute color loss
@@ -251,7 +289,18 @@ def compute_self_loss(
         #     rearrange(batch["depth"], "b h w -> b 1 h w"), batch["inst_rois"], out_H=in_res, out_W=in_res
         # )
         # gt_depth_roi_masked = (gt_depth_roi * pseudo_mask_roi)[:, 0]
-        gt_depth_masked = batch["depth"] * pseudo_mask_in_im
+        if roi_render:
+            # crop the shared depths of the images to the rois, nearest to not mix depths across the object borders
+            gt_depth = batch_crop_resize_by_center_scale(
+                rearrange(batch["depth"][roi_im_ind], "b h w -> b 1 h w"),
+                batch["roi_center"],
+                batch["roi_scale"],
+                ren_H,
+                interpolation="nearest",
+            )[:, 0]
+        else:
+            gt_depth = batch["depth"][roi_im_ind]
+        gt_depth_masked = gt_depth * pseudo_mask_in_im
         if self_loss_cfg.GEOM_LOSS_TYPE == "chamfer":
             # NOTE: real depths should be masked by pseudo mask
             # loss_depth_chamfer, loss_chamfer_center = depth_bp_chamfer_loss(
@@ -264,7 +313,7 @@ def compute_self_loss(
             loss_depth_chamfer, loss_chamfer_center = depth_bp_chamfer_loss(
                 ren_depth,
                 gt_depth_masked,
-                batch["roi_cam"],
+                batch["K_renderer"],
                 distance_threshold=self_loss_cfg.CHAMFER_DIST_THR,
                 center_lw=self_loss_cfg.CHAMFER_CENTER_LW,
             )
@@ -278,7 +327,7 @@ def compute_self_loss(
             pseudo_mask_in_im_vis = pseudo_mask_in_im[vis_i].detach().cpu().numpy()
             vis_data["pseudo/mask_in_im"] = pseudo_mask_in_im_vis
 
-            gt_depth_vis = batch["depth"][vis_i].detach().cpu().numpy()
+            gt_depth_vis = gt_depth[vis_i].detach().cpu().numpy()
             vis_data["gt/depth"] = heatmap(gt_depth_vis, to_rgb=True)
 
             gt_depth_masked_vis = gt_depth_masked[vis_i].detach().cpu().numpy()
@@ -361,7 +410,9 @@ def compute_self_loss(
     return loss_dict
 
 
-def batch_data_self(cfg, data, model_teacher=None, device="cuda", phase="train"):
+def batch_data_self(
+    cfg, data, model_teacher=None, device="cuda", phase="train", pseudo_label_cache=None, asset_bank=None
+):
     if phase != "train":
         return batch_data_test_self(cfg, data, device=device)
 
@@ -378,12 +429,16 @@ def batch_data_self(cfg, data, model_teacher=None, device="cuda", phase="train")
     batch["roi_img"] = torch.stack([d["roi_img"] for d in data], dim=0).to(device, non_blocking=True)
     # original roi_image
     batch["roi_gt_img"] = torch.stack([d["roi_gt_img"] for d in data], dim=0).to(device, non_blocking=True)
-    # original image
-    batch["gt_img"] = torch.stack([d["gt_img"] for d in data], dim=0).to(device, non_blocking=True)
+    # original image (and depth), once per image and shared by its rois via roi_im_ind
+    im_inds = {}
+    roi_im_ind = [im_inds.setdefault((d["dataset_name"], d["scene_im_id"]), len(im_inds)) for d in data]
+    im_first_rois = [roi_im_ind.index(_i) for _i in range(len(im_inds))]
+    batch["roi_im_ind"] = torch.tensor(roi_im_ind, dtype=torch.long, device=device)
+    batch["gt_img"] = torch.stack([data[_i]["gt_img"] for _i in im_first_rois], dim=0).to(device, non_blocking=True)
     im_H, im_W = batch["gt_img"].shape[-2:]
 
     if "depth" in data[0]:
-        batch["depth"] = torch.stack([d["depth"] for d in data], dim=0).to(device, non_blocking=True)
+        batch["depth"] = torch.stack([data[_i]["depth"] for _i in im_first_rois], dim=0).to(device, non_blocking=True)
 
     batch["roi_cls"] = torch.tensor([d["roi_cls"] for d in data], dtype=torch.long).to(device, non_blocking=True)
     bs = batch["roi_cls"].shape[0]
@@ -411,9 +466,13 @@ def batch_data_self(cfg, data, model_teacher=None, device="cuda", phase="train")
     batch["resize_ratio"] = torch.tensor([d["resize_ratio"] for d in data]).to(
         device=device, dtype=torch.float32, non_blocking=True
     )
-    batch["roi_extent"] = torch.stack([d["roi_extent"] for d in data], dim=0).to(
-        device=device, dtype=torch.float32, non_blocking=True
-    )
+    if asset_bank is not None:
+        # roi_points, roi_extent, sym_info, roi_fps_points from the device-side bank
+        asset_bank.fill_batch(batch, data)
+    else:
+        batch["roi_extent"] = torch.stack([d["roi_extent"] for d in data], dim=0).to(
+            device=device, dtype=torch.float32, non_blocking=True
+        )
     if "sym_info" in data[0]:
         batch["sym_info"] = [d["sym_info"] for d in data]
 
@@ -426,20 +485,38 @@ def batch_data_self(cfg, data, model_teacher=None, device="cuda", phase="train")
             device=device, dtype=torch.float32, non_blocking=True
         )
     # get pose related pseudo labels from teacher model --------------------------
-    with torch.no_grad():
-        out_dict = model_teacher(
-            batch["roi_img"],
-            roi_classes=batch["roi_cls"],
-            roi_cams=batch["roi_cam"],
-            roi_whs=batch["roi_wh"],
-            roi_centers=batch["roi_center"],
-            resize_ratios=batch["resize_ratio"],
-            roi_coord_2d=batch.get("roi_coord_2d", None),
-            roi_coord_2d_rel=batch.get("roi_coord_2d_rel", None),
-            roi_extents=batch.get("roi_extent", None),
-            do_self=True,
+    def _teacher_forward(ids=None):
+        def _sel(key):
+            value = batch.get(key, None)
+            if value is None or ids is None:
+                return value
+            return value[ids]
+
+        with torch.no_grad():
+            return model_teacher(
+                _sel("roi_img"),
+                roi_classes=_sel("roi_cls"),
+                roi_cams=_sel("roi_cam"),
+                roi_whs=_sel("roi_wh"),
+                roi_centers=_sel("roi_center"),
+                resize_ratios=_sel("resize_ratio"),
+                roi_coord_2d=_sel("roi_coord_2d"),
+                roi_coord_2d_rel=_sel("roi_coord_2d_rel"),
+                roi_extents=_sel("roi_extent"),
+                do_self=True,
+            )
+            # rot, trans, mask, coor_x, coor_y, coor_z
+
+    if pseudo_label_cache is not None:
+        # reuse the outputs of the current teacher, only forward the new instances
+        out_dict = pseudo_label_cache.get_or_compute(
+            [get_pseudo_label_key(d) for d in data],
+            batch["roi_center"],
+            batch["roi_scale"],
+            _teacher_forward,
         )
-        # rot, trans, mask, coor_x, coor_y, coor_z
+    else:
+        out_dict = _teacher_forward()
     if cfg.MODEL.PSEUDO_POSE_TYPE == "pose_refine" and "pose_refine" in data[0]:
         batch["pseudo_rot"] = torch.stack([d["pose_refine"][:3, :3] for d in data], dim=0).to(
             device=device, dtype=torch.float32, non_blocking=True
@@ -459,18 +536,22 @@ def batch_data_self(cfg, data, model_teacher=None, device="cuda", phase="train")
         batch["pseudo_trans"] = out_dict["trans"]
     # batch["pseudo_mask"] = out_dict["mask"]
     batch["pseudo_mask_prob"] = mask_prob = out_dict["mask_prob"]
-    # set threshold < 0: uint8 [0,255]
-    pseudo_mask_prob_in_im = paste_masks_in_image(
-        mask_prob[:, 0, :, :], batch["inst_rois"][:, 1:5], image_shape=(im_H, im_W), threshold=-1
-    )
-    batch["pseudo_mask_prob_in_im"] = pseudo_mask_prob_in_im.to(torch.float32) / 255
+    # the masks in image are only needed when rendering the full images
+    paste_in_im = not is_roi_render(cfg)
+    if paste_in_im:
+        # set threshold < 0: uint8 [0,255]
+        pseudo_mask_prob_in_im = paste_masks_in_image(
+            mask_prob[:, 0, :, :], batch["inst_rois"][:, 1:5], image_shape=(im_H, im_W), threshold=-1
+        )
+        batch["pseudo_mask_prob_in_im"] = pseudo_mask_prob_in_im.to(torch.float32) / 255
 
-    if "full_mask_prob" in out_dict.keys():
+    if out_dict.get("full_mask_prob", None) is not None:
         batch["pseudo_full_mask_prob"] = full_mask_prob = out_dict["full_mask_prob"]
-        pseudo_full_mask_prob_in_im = paste_masks_in_image(
-            full_mask_prob[:, 0, :, :], batch["inst_rois"][:, 1:5], image_shape=(im_H, im_W), threshold=-1
-        )
-        batch["pseudo_full_mask_prob_in_im"] = pseudo_full_mask_prob_in_im.to(torch.float32) / 255
+        if paste_in_im:
+            pseudo_full_mask_prob_in_im = paste_masks_in_image(
+                full_mask_prob[:, 0, :, :], batch["inst_rois"][:, 1:5], image_shape=(im_H, im_W), threshold=-1
+            )
+            batch["pseudo_full_mask_prob_in_im"] = pseudo_full_mask_prob_in_im.to(torch.float32) / 255
 
     batch["pseudo_coor_x"] = coor_x = out_dict["coor_x"]
     batch["pseudo_coor_y"] = coor_y = out_dict["coor_y"]
@@ -479,12 +560,12 @@ def batch_data_self(cfg, data, model_teacher=None, device="cuda", phase="train")
     # batch["pseudo_region"] = xyz_to_region_batch(
     #     rearrange(pseudo_coor, "b c h w -> b h w c"), batch["roi_fps_points"], (mask_prob > 0.5).to(torch.float32)
     # )
-    batch["pseudo_region"] = out_dict["region"]
+    batch["pseudo_region"] = out_dict.get("region", None)
 
     return batch
 
 
-def batch_data_train_online_self(cfg, data, renderer, device="cuda"):
+def batch_data_train_online_self(cfg, data, renderer, device="cuda", asset_bank=None):
     # batch training data, rendering xyz online
     net_cfg = cfg.MODEL.POSE_NET
     g_head_cfg = net_cfg.GEO_HEAD
@@ -512,9 +593,12 @@ def batch_data_train_online_self(cfg, data, renderer, device="cuda"):
     batch["roi_zoom_K"] = get_K_crop_resize(batch["roi_cam"], roi_crop_xy_batch, roi_resize_ratio_batch)
     # --------------------------------------------------------------
     batch["roi_wh"] = torch.stack([d["roi_wh"] for d in data], dim=0).to(device, non_blocking=True)
-    batch["roi_extent"] = torch.stack([d["roi_extent"] for d in data], dim=0).to(
-        device=device, dtype=torch.float32, non_blocking=True
-    )  # [b,3]
+    if asset_bank is not None:
+        asset_bank.fill_batch(batch, data)
+    else:
+        batch["roi_extent"] = torch.stack([d["roi_extent"] for d in data], dim=0).to(
+            device=device, dtype=torch.float32, non_blocking=True
+        )  # [b,3]
 
     batch["roi_trans_ratio"] = torch.stack([d["trans_ratio"] for d in data], dim=0).to(device, non_blocking=True)
     # yapf: disable
@@ -524,10 +608,7 @@ def batch_data_train_online_self(cfg, data, renderer, device="cuda"):
         "roi_points",
     ]:
         if key in data[0]:
-            dtype = torch.float32
-            batch[key] = torch.stack([d[key] for d in data], dim=0).to(
-                device=device, dtype=dtype, non_blocking=True
-            )
+            batch[key] = expand_target(key, torch.stack([d[key] for d in data], dim=0).to(device, non_blocking=True))
     # yapf: enable
     if "sym_info" in data[0]:
         batch["sym_info"] = [d["sym_info"] for d in data]
@@ -554,9 +635,10 @@ def batch_data_train_online_self(cfg, data, renderer, device="cuda"):
     batch["roi_mask_visib"] = batch["roi_mask_visib"] * batch["roi_mask_obj"]
 
     if g_head_cfg.NUM_REGIONS > 1:  # get roi_region ------------------------
-        batch["roi_fps_points"] = torch.stack([d["roi_fps_points"] for d in data], dim=0).to(
-            device=device, dtype=torch.float32, non_blocking=True
-        )
+        if "roi_fps_points" not in batch:
+            batch["roi_fps_points"] = torch.stack([d["roi_fps_points"] for d in data], dim=0).to(
+                device=device, dtype=torch.float32, non_blocking=True
+            )
         batch["roi_region"] = xyz_to_region_batch(roi_xyz_batch, batch["roi_fps_points"], mask=batch["roi_mask_obj"])
     # normalize to [0, 1]
     batch["roi_xyz"] = rearrange(roi_xyz_batch, "b h w c -> b c h w") / batch["roi_extent"].view(bs, 3, 1, 1) + 0.5
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Cache of the teacher outputs (pseudo labels) for self-supervised training.
+
+The teacher only changes when the EMA update runs, so its roi-level outputs of an
+instance are computed on first use and reused until the next update (clear()).
+The maps are stored compactly (probabilities as uint8, region logits as uint8
+over their value range, xyz as float16) with the roi box they were predicted in.
+Since the rois are augmented (DZI), a cached map is warped from its roi to the
+current roi of the instance (identity, i.e. the cached values, when the roi did
+not change). The cache is bounded in memory, the least recently used instances
+are evicted (and recomputed by the teacher when they come back).
+"""
+import logging
+from collections import OrderedDict
+
+import torch
+import torch.nn.functional as F
+
+logger = logging.getLogger(__name__)
+
+# key => storage dtype
+PSEUDO_LABEL_KEYS = {
+    "rot": torch.float32,
+    "trans": torch.float32,
+    "mask_prob": torch.uint8,
+    "full_mask_prob": torch.uint8,
+    "coor_x": torch.float16,
+    "coor_y": torch.float16,
+    "coor_z": torch.float16,
+    "region": torch.uint8,
+}
+# logits quantized to uint8 over the value range of each map, stored in "<key>_range"
+RANGE_KEYS = ("region",)
+
+
+def get_pseudo_label_key(d):
+    """instance key of a (flattened) self-training sample."""
+    return "{}/{}/{}".format(d["dataset_name"], d["scene_im_id"], d["inst_id"])
+
+
+def _compress(value, dtype, value_range=None):
+    if value_range is not None:  # [B, 2] (min, max) of each map
+        lo = value_range[:, 0].view(-1, *([1] * (value.dim() - 1)))
+        span = (value_range[:, 1] - value_range[:, 0]).clamp(min=1e-6).view_as(lo)
+        value = (value - lo) / span
+    if dtype == torch.uint8:  # values in [0, 1]
+        return (value.clamp(0, 1) * 255).round().to(dtype)
+    return value.to(dtype)
+
+
+def _decompress(value, dtype, value_range=None):
+    if dtype == torch.uint8:
+        value = value.to(torch.float32) / 255
+    else:
+        value = value.to(torch.float32)
+    if value_range is not None:
+        lo = value_range[:, 0].view(-1, *([1] * (value.dim() - 1)))
+        span = (value_range[:, 1] - value_range[:, 0]).clamp(min=1e-6).view_as(lo)
+        value = value * span + lo
+    return value
+
+
+def warp_roi_maps(maps, src_centers, src_scales, dst_centers, dst_scales):
+    """resample roi-level maps predicted in the square rois (src_centers,
+    src_scales) to the rois (dst_centers, dst_scales), outside of the source
+    rois is 0.
+
+    maps: [B, C, h, w], centers: [B, 2], scales: [B]
+    """
+    bs = maps.shape[0]
+    ratio = dst_scales / src_scales
+    theta = maps.new_zeros(bs, 2, 3)
+    theta[:, 0, 0] = ratio
+    theta[:, 1, 1] = ratio
+    theta[:, :, 2] = 2 * (dst_centers - src_centers) / src_scales.view(bs, 1)
+    grid = F.affine_grid(theta, list(maps.shape), align_corners=False)
+    return F.grid_sample(maps, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+
+
+def _entry_nbytes(entry):
+    return sum(_v.numel() * _v.element_size() for _v in entry.values())
+
+
+class PseudoLabelCache(object):
+    def __init__(self, device="cpu", max_mb=4096):
+        """
+        Args:
+            device: where the cache is stored
+            max_mb (float): memory bound of the cached entries (LRU eviction), <= 0 for no bound
+        """
+        self.device = device
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb > 0 else None
+        self.version = 0  # teacher version
+        self._entries = OrderedDict()  # key => dict of compressed tensors + roi, least recently used first
+        self._nbytes = 0
+        self._num_evicted = 0
+        self._num_hits = 0
+        self._num_queries = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """the teacher has been updated."""
+        if self._num_queries > 0:
+            logger.info(
+                "pseudo label cache v{}: {} instances ({:.1f} MB), {} evicted, hit rate {:.3f}".format(
+                    self.version,
+                    len(self._entries),
+                    self._nbytes / 1024**2,
+                    self._num_evicted,
+                    self._num_hits / self._num_queries,
+                )
+            )
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._num_evicted = 0
+        self._num_hits = 0
+        self._num_queries = 0
+        self.version += 1
+
+    def get_or_compute(self, keys, roi_centers, roi_scales, compute_fn):
+        """
+        Args:
+            keys (list[str]): instance keys of the batch
+            roi_centers: [B, 2], roi_scales: [B], the current rois
+            compute_fn (callable): indices (LongTensor) => teacher out_dict of these rois
+        Returns:
+            dict: the teacher outputs (float32) of all the rois of the batch, in the current rois
+        """
+        device = roi_centers.device
+        miss = [i for i, key in enumerate(keys) if key not in self._entries]
+        self._num_queries += len(keys)
+        self._num_hits += len(keys) - len(miss)
+        if len(miss) > 0:
+            miss_ids = torch.tensor(miss, dtype=torch.long, device=device)
+            with torch.no_grad():
+                out_dict = compute_fn(miss_ids)
+            # compress on the device and copy each key of the misses at once, then split into entries
+            stored = {}
+            for _k, dtype in PSEUDO_LABEL_KEYS.items():
+                if out_dict.get(_k, None) is None:
+                    continue
+                value = out_dict[_k].detach()
+                value_range = None
+                if _k in RANGE_KEYS:
+                    flat = value.flatten(1).float()
+                    value_range = torch.stack([flat.amin(1), flat.amax(1)], dim=1)
+                    stored[_k + "_range"] = value_range.to(self.device).unbind(0)
+                stored[_k] = _compress(value, dtype, value_range).to(self.device).unbind(0)
+            stored["roi_center"] = roi_centers[miss_ids].detach().to(self.device).unbind(0)
+            stored["roi_scale"] = roi_scales[miss_ids].detach().to(self.device).unbind(0)
+            for j, i in enumerate(miss):
+                entry = {_k: _v[j] for _k, _v in stored.items()}
+                if keys[i] in self._entries:  # duplicated instance in the batch
+                    self._nbytes -= _entry_nbytes(self._entries.pop(keys[i]))
+                self._entries[keys[i]] = entry
+                self._nbytes += _entry_nbytes(entry)
+
+        entries = []
+        for key in keys:
+            self._entries.move_to_end(key)
+            entries.append(self._entries[key])
+        # evict after gathering the batch so its own entries are not evicted under it
+        if self.max_bytes is not None:
+            while self._nbytes > self.max_bytes and len(self._entries) > 0:
+                _, entry = self._entries.popitem(last=False)
+                self._nbytes -= _entry_nbytes(entry)
+                self._num_evicted += 1
+        src_centers = torch.stack([_e["roi_center"] for _e in entries]).to(device, torch.float32)
+        src_scales = torch.stack([_e["roi_scale"] for _e in entries]).to(device, torch.float32)
+        dst_centers = roi_centers.to(torch.float32)
+        dst_scales = roi_scales.to(torch.float32)
+        same_roi = bool(torch.equal(src_centers, dst_centers) and torch.equal(src_scales, dst_scales))
+
+        res = {}
+        for _k, dtype in PSEUDO_LABEL_KEYS.items():
+            if _k not in entries[0]:
+                continue
+            value_range = None
+            if _k in RANGE_KEYS:
+                value_range = torch.stack([_e[_k + "_range"] for _e in entries]).to(device)
+            value = _decompress(
+                torch.stack([_e[_k] for _e in entries]).to(device, non_blocking=True), dtype, value_range
+            )
+            if value.dim() == 4 and not same_roi:
+                value = warp_roi_maps(value, src_centers, src_scales, dst_centers, dst_scales)
+            res[_k] = value
+        return res
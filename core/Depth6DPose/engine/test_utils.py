@@ -2,7 +2,6 @@ import logging
 import os
 import os.path as osp
 import sys
-import subprocess
 import time
 
 import mmcv
@@ -13,62 +12,47 @@ from tabulate import tabulate
 cur_dir = osp.abspath(osp.dirname(__file__))
 sys.path.insert(0, osp.join(cur_dir, "../../.."))
 import ref
-from lib.pysixd import misc
+from lib.pysixd import eval_bop, inout, misc
 
 
 logger = logging.getLogger(__name__)
 
 
-def _to_str(item):
-    if isinstance(item, (list, tuple)):
-        return " ".join(["{}".format(e) for e in item])
-    else:
-        return "{}".format(item)
-
-
 def to_list(array):
     return array.flatten().tolist()
 
 
-def save_and_eval_results(cfg, results_all, output_dir, obj_ids=None):
-    save_root = output_dir  # eval_path
+def get_result_name(cfg, name):
+    """the name of the bop results csv of the predictions `name` (e.g. iter0)."""
     split_type_str = f"-{cfg.VAL.SPLIT_TYPE}" if cfg.VAL.SPLIT_TYPE != "" else ""
+    method_name = f"{cfg.EXP_ID.replace('_', '-')}-{name}"
+    return f"{method_name}_{cfg.VAL.DATASET_NAME}-{cfg.VAL.SPLIT}{split_type_str}.csv"
+
+
+def save_and_eval_results(cfg, results_all, output_dir, obj_ids=None, models=None, results_saved=False):
+    """
+    Args:
+        results_all (dict): name => list of results in BOP format
+        results_saved (bool): the csv files have already been written (streamed during the inference)
+    """
+    save_root = output_dir  # eval_path
     mmcv.mkdir_or_exist(save_root)
-    header = "scene_id,im_id,obj_id,score,R,t,time"
-    keys = header.split(",")
     result_names = []
     for name, result_list in results_all.items():
-        method_name = f"{cfg.EXP_ID.replace('_', '-')}-{name}"
-        result_name = f"{method_name}_{cfg.VAL.DATASET_NAME}-{cfg.VAL.SPLIT}{split_type_str}.csv"
+        result_name = get_result_name(cfg, name)
         res_path = osp.join(save_root, result_name)
         result_names.append(result_name)
-        with open(res_path, "w") as f:
-            f.write(header + "\n")
-            for line_i, result in enumerate(result_list):
-                items = []
-                for res_k in keys:
-                    items.append(_to_str(result[res_k]))
-                f.write(",".join(items) + "\n")
-        logger.info("wrote results to: {}".format(res_path))
+        if not results_saved:
+            inout.save_bop_results(res_path, result_list)
+            logger.info("wrote results to: {}".format(res_path))
 
     if not cfg.VAL.SAVE_BOP_CSV_ONLY:
-        result_names_str = ",".join(result_names)
-        eval_cmd = [
-            "python",
-            cfg.VAL.SCRIPT_PATH,
-            "--results_path={}".format(save_root),
-            "--result_filenames={}".format(result_names_str),
-            "--renderer_type={}".format(cfg.VAL.RENDERER_TYPE),
-            "--error_types={}".format(cfg.VAL.ERROR_TYPES),
-            "--eval_path={}".format(save_root),
-            "--targets_filename={}".format(cfg.VAL.TARGETS_FILENAME),
-            "--n_top={}".format(cfg.VAL.N_TOP),
-        ]
-        if cfg.VAL.SCORE_ONLY:
-            eval_cmd += ["--score_only"]
         eval_time = time.perf_counter()
-        if subprocess.call(eval_cmd) != 0:
-            logger.warning("evaluation failed.")
+        # evaluate the results in memory, the csv files are not read back
+        results = {
+            result_name: result_list for result_name, result_list in zip(result_names, results_all.values())
+        }
+        scores = eval_bop_results(cfg, save_root, result_names, results=results, models=models)
 
         load_and_print_val_scores_tab(
             cfg,
@@ -76,11 +60,61 @@ def save_and_eval_results(cfg, results_all, output_dir, obj_ids=None):
             result_names=result_names,
             error_types=cfg.VAL.ERROR_TYPES.split(","),
             obj_ids=obj_ids,
+            scores=scores,
         )
         logger.info("eval time: {}s".format(time.perf_counter() - eval_time))
 
 
-def eval_cached_results(cfg, output_dir, obj_ids=None):
+def get_eval_models(obj_ids, models_3d, vertex_scale):
+    """the models of an evaluator (loaded from the eval models dir, scaled by
+    vertex_scale) as the models of the bop toolkit (obj_id => model with pts in
+    mm), the other fields are shared."""
+    return {obj_id: dict(model, pts=model["pts"] / vertex_scale) for obj_id, model in zip(obj_ids, models_3d)}
+
+
+def eval_bop_results(cfg, eval_root, result_names, results=None, models=None):
+    """evaluate the results with the bop toolkit (lib/pysixd/eval_bop.py) in
+    this process, the models and renderers are kept for the next evaluations.
+
+    Args:
+        eval_root: the dir of the result csv files and the eval results
+        result_names (list[str]): the names of the result csv files
+        results (dict): result_name => list of results in BOP format, if None, load the csv files
+        models (dict): obj_id => already loaded model (pts in mm)
+    Returns:
+        dict: path of the scores json => scores
+    """
+    if cfg.VAL.get("SCRIPT_PATH", ""):
+        logger.warning(
+            "VAL.SCRIPT_PATH={} is ignored, the evaluation runs in process with lib/pysixd/eval_bop.py".format(
+                cfg.VAL.SCRIPT_PATH
+            )
+        )
+    p = eval_bop.get_default_params(
+        n_top=cfg.VAL.N_TOP,
+        error_types=cfg.VAL.ERROR_TYPES.split(","),
+        renderer_type=cfg.VAL.RENDERER_TYPE,
+        eval_path=eval_root,
+        targets_filename=cfg.VAL.TARGETS_FILENAME,
+        score_only=cfg.VAL.SCORE_ONLY,
+        num_workers=cfg.VAL.get("NUM_WORKERS", 0),
+        errors_format=cfg.VAL.get("ERRORS_FORMAT", "npz"),
+    )
+    scores = {}
+    for result_name in result_names:
+        try:
+            if results is not None:
+                res = eval_bop.evaluate_results(p, result_name.replace(".csv", ""), results[result_name], models=models)
+            else:
+                res = eval_bop.evaluate_result_file(p, eval_root, result_name, models=models)
+        except Exception:
+            logger.exception("evaluation of {} failed.".format(result_name))
+            continue
+        scores.update(res["scores"])
+    return scores
+
+
+def eval_cached_results(cfg, output_dir, obj_ids=None, models=None):
     logger.info("eval cached results")
     split_type_str = f"-{cfg.VAL.SPLIT_TYPE}" if cfg.VAL.SPLIT_TYPE != "" else ""
     save_root = output_dir  # eval_path
@@ -115,23 +149,8 @@ def eval_cached_results(cfg, output_dir, obj_ids=None):
             obj_ids=obj_ids,
         )
     except:
-        result_names_str = ",".join(result_names)
-        eval_cmd = [
-            "python",
-            cfg.VAL.SCRIPT_PATH,
-            "--results_path={}".format(save_root),
-            "--result_filenames={}".format(result_names_str),
-            "--renderer_type={}".format(cfg.VAL.RENDERER_TYPE),
-            "--error_types={}".format(cfg.VAL.ERROR_TYPES),
-            "--eval_path={}".format(save_root),
-            "--targets_filename={}".format(cfg.VAL.TARGETS_FILENAME),
-            "--n_top={}".format(cfg.VAL.N_TOP),
-        ]
-        if cfg.VAL.SCORE_ONLY:
-            eval_cmd += ["--score_only"]
         eval_time = time.perf_counter()
-        if subprocess.call(eval_cmd) != 0:
-            logger.warning("evaluation failed.")
+        scores = eval_bop_results(cfg, save_root, result_names, models=models)
 
         load_and_print_val_scores_tab(
             cfg,
@@ -139,6 +158,7 @@ def eval_cached_results(cfg, output_dir, obj_ids=None):
             result_names=result_names,
             error_types=cfg.VAL.ERROR_TYPES.split(","),
             obj_ids=obj_ids,
+            scores=scores,
         )
         logger.info("eval time: {}s".format(time.perf_counter() - eval_time))
     exit(0)
@@ -237,7 +257,9 @@ def summary_scores(
 
     tabs_col2 = []
     for score_path in sorted_score_paths:
-        score_dict = mmcv.load(score_path)
+        score_dict = score_paths[score_path]
+        if score_dict is None:
+            score_dict = mmcv.load(score_path)
         if obj_ids is None:
             sel_obj_ids = [int(_id) for _id in score_dict["obj_recalls"].keys()]
         else:
@@ -344,8 +366,13 @@ def load_and_print_val_scores_tab(
     error_types=["projS", "ad", "reteS"],
     obj_ids=None,
     print_all_objs=False,
+    scores=None,
 ):
-
+    """
+    Args:
+        scores (dict): path of the scores json => scores of the evaluation in this process,
+            the scores not in it are loaded from eval_root
+    """
     vsd_deltas = {
         "hb": 15,
         "hbs": 15,
@@ -390,14 +417,21 @@ def load_and_print_val_scores_tab(
             score_roots = [osp.join(eval_root, result_name, error_sign) for error_sign in error_signs]
 
             for score_root in score_roots:
-                if osp.exists(score_root):
+                score_paths = {}
+                if scores is not None:
+                    score_paths = {
+                        _path: _scores
+                        for _path, _scores in scores.items()
+                        if osp.normpath(osp.dirname(_path)) == osp.normpath(score_root)
+                    }
+                if len(score_paths) == 0 and osp.exists(score_root):
                     # get all score json files for this metric under this threshold
                     score_paths = {
                         osp.join(score_root, fn.name): None
                         for fn in os.scandir(score_root)
                         if ".json" in fn.name and "scores" in fn.name
                     }
-
+                if len(score_paths) > 0:
                     tab_obj_col = summary_scores(
                         score_paths,
                         error_type,
@@ -461,11 +495,6 @@ if __name__ == "__main__":
     from lib.utils.setup_logger import setup_my_logger
 
     parser = argparse.ArgumentParser(description="wrapper functions to evaluate with bop toolkit")
-    parser.add_argument(
-        "--script-path",
-        default="lib/pysixd/scripts/eval_pose_results_more.py",
-        help="script path to run bop evaluation",
-    )
 
     parser.add_argument("--result_dir", default="", help="result dir")
     # f"{method_name}_{cfg.VAL.DATASET_NAME}-{cfg.VAL.SPLIT}{split_type_str}.csv"
@@ -516,7 +545,6 @@ if __name__ == "__main__":
     cfg_dict = dict(
         VAL=dict(
             DATASET_NAME=args.dataset,
-            SCRIPT_PATH=args.script_path,
             RESULTS_PATH=result_dir,
             TARGETS_FILENAME=args.targets_name,  # 'lm_test_targets_bb8.json'
             ERROR_TYPES=args.error_types,
@@ -533,22 +561,9 @@ if __name__ == "__main__":
         cfg.merge_from_dict(args.opts)
 
     eval_time = time.perf_counter()
+    scores = None
     if not args.print_only:
-        eval_cmd = [
-            "python",
-            cfg.VAL.SCRIPT_PATH,
-            "--results_path={}".format(result_dir),
-            "--result_filenames={}".format(result_names_str),
-            "--renderer_type={}".format(cfg.VAL.RENDERER_TYPE),
-            "--error_types={}".format(cfg.VAL.ERROR_TYPES),
-            "--eval_path={}".format(result_dir),
-            "--targets_filename={}".format(cfg.VAL.TARGETS_FILENAME),
-            "--n_top={}".format(cfg.VAL.N_TOP),
-        ]
-        if cfg.VAL.SCORE_ONLY:
-            eval_cmd += ["--score_only"]
-        if subprocess.call(eval_cmd) != 0:
-            logger.warning("evaluation failed.")
+        scores = eval_bop_results(cfg, result_dir, result_names)
 
     print("print scores")
     load_and_print_val_scores_tab(
@@ -557,5 +572,6 @@ if __name__ == "__main__":
         result_names=result_names,
         error_types=cfg.VAL.ERROR_TYPES.split(","),
         obj_ids=obj_ids,
+        scores=scores,
     )
     logger.info("eval time: {}s".format(time.perf_counter() - eval_time))
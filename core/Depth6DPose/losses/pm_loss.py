@@ -90,6 +90,7 @@ class PyPMLoss(nn.Module):
         extents: [B, 3]
         sym_infos: list [Kx3x3 or None],
             stores K rotations regarding symmetries, if not symmetric, None
+            or padded (sym_rots [B, K, 3, 3], sym_mask [B, K])
         """
         if gt_rots.shape[-1] == 4:
             gt_rots = quat2mat_torch(gt_rots)
@@ -43,6 +43,13 @@ class Depth6DPose(nn.Module):
 
         self.cfg = cfg
         self.xyz_out_dim, self.mask_out_dim, self.region_out_dim = get_xyz_mask_region_out_dim(cfg)
+        # the geo head only computes the class-aware outputs of the roi classes, instead of all the classes
+        g_head_cfg = cfg.MODEL.POSE_NET.GEO_HEAD
+        self.geo_head_class_gather = (
+            g_head_cfg.get("CLASS_GATHER", True)
+            and getattr(geo_head_net, "class_gather", False)
+            and (g_head_cfg.XYZ_CLASS_AWARE or g_head_cfg.MASK_CLASS_AWARE or g_head_cfg.REGION_CLASS_AWARE)
+        )
 
         # uncertainty multi-task loss weighting
         # https://github.com/Hui-Li/multi-task-learning-example-PyTorch/blob/master/multi-task-learning-example-PyTorch.ipynb
@@ -120,9 +127,13 @@ class Depth6DPose(nn.Module):
         conv_feat = self.backbone(x)  # [bs, c, 8, 8]
         if self.neck is not None:
             conv_feat = self.neck(conv_feat)
-        mask, coor_x, coor_y, coor_z, region = self.geo_head_net(conv_feat)
+        if self.geo_head_class_gather:
+            assert roi_classes is not None
+            mask, coor_x, coor_y, coor_z, region = self.geo_head_net(conv_feat, roi_classes=roi_classes)
+        else:
+            mask, coor_x, coor_y, coor_z, region = self.geo_head_net(conv_feat)
 
-        if g_head_cfg.XYZ_CLASS_AWARE:
+        if g_head_cfg.XYZ_CLASS_AWARE and not self.geo_head_class_gather:
             assert roi_classes is not None
             coor_x = coor_x.view(bs, num_classes, self.xyz_out_dim // 3, out_res, out_res)
             coor_x = coor_x[torch.arange(bs).to(device), roi_classes]
@@ -131,12 +142,12 @@ class Depth6DPose(nn.Module):
             coor_z = coor_z.view(bs, num_classes, self.xyz_out_dim // 3, out_res, out_res)
             coor_z = coor_z[torch.arange(bs).to(device), roi_classes]
 
-        if g_head_cfg.MASK_CLASS_AWARE:
+        if g_head_cfg.MASK_CLASS_AWARE and not self.geo_head_class_gather:
             assert roi_classes is not None
             mask = mask.view(bs, num_classes, self.mask_out_dim, out_res, out_res)
             mask = mask[torch.arange(bs).to(device), roi_classes]
 
-        if g_head_cfg.REGION_CLASS_AWARE:
+        if g_head_cfg.REGION_CLASS_AWARE and not self.geo_head_class_gather:
             assert roi_classes is not None
             region = region.view(bs, num_classes, self.region_out_dim, out_res, out_res)
             region = region[torch.arange(bs).to(device), roi_classes]
@@ -1,11 +1,15 @@
+import torch
 import torch.nn as nn
 from torch.nn.modules.batchnorm import _BatchNorm
 from mmcv.cnn import normal_init, constant_init
-from lib.torch_utils.layers.layer_utils import get_norm, get_nn_act_func
+from lib.torch_utils.layers.layer_utils import get_norm, get_nn_act_func, class_gathered_conv2d
 from lib.torch_utils.layers.conv_module import ConvModule
 
 
 class TopDownDoubleMaskXyzRegionHead(nn.Module):
+    # forward() can compute only the outputs of the roi classes (roi_classes)
+    class_gather = True
+
     def __init__(
         self,
         in_dim,
@@ -163,11 +167,18 @@ class TopDownDoubleMaskXyzRegionHead(nn.Module):
             normal_init(self.xyz_out_layer, std=0.01)
             normal_init(self.region_out_layer, std=0.01)
 
-    def forward(self, x):
+    def forward(self, x, roi_classes=None):
+        """
+        Args:
+            roi_classes: if given, the outputs are only computed for the class of each roi,
+                i.e. the class dim of the class-aware outputs is already gathered
+        """
         if isinstance(x, (tuple, list)) and len(x) == 1:
             x = x[0]
         for i, l in enumerate(self.features):
             x = l(x)
+        if roi_classes is not None:
+            return self._forward_class_gathered(x, roi_classes)
         if self.out_layer_shared:
             out = self.out_layer(x)
             mask_dim = self.mask_out_dim * self.mask_num_classes
@@ -199,6 +210,50 @@ class TopDownDoubleMaskXyzRegionHead(nn.Module):
             region = self.region_out_layer(x)
         return vis_mask, full_mask, coor_x, coor_y, coor_z, region
 
+    def _forward_class_gathered(self, x, roi_classes):
+        """only compute the output channels of the roi classes."""
+        bs = x.shape[0]
+        device = x.device
+        zero_classes = torch.zeros_like(roi_classes)
+        mask_classes = roi_classes if self.mask_num_classes > 1 else zero_classes
+        xyz_classes = roi_classes if self.xyz_num_classes > 1 else zero_classes
+        region_classes = roi_classes if self.region_num_classes > 1 else zero_classes
+
+        # output channels of each roi, following the channel layout of forward()
+        single_mask_dim = self.mask_out_dim // 2
+        mask_inds = mask_classes.view(bs, 1) * single_mask_dim + torch.arange(single_mask_dim, device=device)
+        coor_dim = self.xyz_out_dim // 3
+        xyz_inds = (
+            torch.arange(3, device=device).view(3, 1) * (coor_dim * self.xyz_num_classes)
+            + torch.arange(coor_dim, device=device)
+        ).view(1, -1) + xyz_classes.view(bs, 1) * coor_dim
+        region_inds = region_classes.view(bs, 1) * self.region_out_dim + torch.arange(
+            self.region_out_dim, device=device
+        )
+
+        if self.out_layer_shared:
+            mask_dim = self.mask_out_dim * self.mask_num_classes
+            xyz_dim = self.xyz_out_dim * self.xyz_num_classes
+            out_inds = torch.cat(
+                [mask_inds, mask_dim // 2 + mask_inds, mask_dim + xyz_inds, mask_dim + xyz_dim + region_inds], dim=1
+            )
+            out = class_gathered_conv2d(self.out_layer, x, out_inds)
+            vis_mask, full_mask, xyz, region = out.split(
+                [single_mask_dim, single_mask_dim, self.xyz_out_dim, self.region_out_dim], dim=1
+            )
+        else:
+            vis_mask = class_gathered_conv2d(self.vis_mask_out_layer, x, mask_inds)
+            full_mask = class_gathered_conv2d(self.full_mask_out_layer, x, mask_inds)
+            xyz = class_gathered_conv2d(self.xyz_out_layer, x, xyz_inds)
+            region = class_gathered_conv2d(self.region_out_layer, x, region_inds)
+
+        bs, c, h, w = xyz.shape
+        xyz = xyz.view(bs, 3, coor_dim, h, w)
+        coor_x = xyz[:, 0, :, :, :]
+        coor_y = xyz[:, 1, :, :, :]
+        coor_z = xyz[:, 2, :, :, :]
+        return vis_mask, full_mask, coor_x, coor_y, coor_z, region
+
 
 def _get_deconv_pad_outpad(deconv_kernel):
     """Get padding and out padding for deconv layers."""
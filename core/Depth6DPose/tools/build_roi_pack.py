@@ -0,0 +1,84 @@
+import argparse
+import logging
+import os.path as osp
+import sys
+
+from mmcv import Config
+from tqdm import tqdm
+
+cur_dir = osp.dirname(osp.abspath(__file__))
+sys.path.insert(0, osp.join(cur_dir, "../../../"))
+from core.Depth6DPose.datasets.data_loader import Depth6DPose_DatasetFromList, build_Depth6DPose_test_loader
+from core.Depth6DPose.datasets.dataset_factory import register_datasets_in_cfg
+from core.Depth6DPose.datasets.roi_pack import get_roi_pack_key, write_roi_pack
+from core.utils.dataset_utils import filter_invalid_in_dataset_dicts
+from detectron2.data import get_detection_dataset_dicts
+from lib.utils.setup_logger import setup_my_logger
+
+"""
+Build a roi pack (pre-cropped roi_img/roi_coord_2d for test, roi_xyz/masks/roi_coord_2d
+for train) of a dataset, then set DATASETS.ROI_PACK_FILES_TRAIN/ROI_PACK_FILES_TEST.
+
+python core/Depth6DPose/tools/build_roi_pack.py \
+    --config-file configs/Depth6DPose/ssLM/ss_v1_dibr_mlBCE_FreezeBN_woCenter_refinePM10/ss_v1_dibr_mlBCE_FreezeBN_woCenter_refinePM10_ape.py \
+    --dataset lm_real_ape_test --split test \
+    --out .cache/roi_packs/lm_real_ape_test.roipack
+
+NOTE: train packs hold the rois of the fixed (not DZI augmented) bboxes.
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build a roi pack of a dataset.")
+    parser.add_argument("--config-file", type=str, help="config file")
+    parser.add_argument("--dataset", type=str, help="dataset_name")
+    parser.add_argument("--split", type=str, default="test", help="train | test")
+    parser.add_argument("--out", type=str, help="path to the roi pack.")
+    args = parser.parse_args()
+    return args
+
+
+def get_dataset(cfg, dataset_name, split):
+    if split == "train":
+        dataset_dicts = get_detection_dataset_dicts([dataset_name], filter_empty=cfg.DATALOADER.FILTER_EMPTY_ANNOTATIONS)
+        dataset_dicts = filter_invalid_in_dataset_dicts(dataset_dicts, visib_thr=cfg.DATALOADER.FILTER_VISIB_THR)
+        return Depth6DPose_DatasetFromList(cfg, split="train", lst=dataset_dicts, copy=False)
+    return build_Depth6DPose_test_loader(cfg, dataset_name).dataset
+
+
+def main():
+    args = parse_args()
+    setup_my_logger(name="core")
+    logger = logging.getLogger("core")
+    cfg = Config.fromfile(args.config_file)
+    # do not read from existing packs
+    cfg.DATASETS.ROI_PACK_FILES_TRAIN = ()
+    cfg.DATASETS.ROI_PACK_FILES_TEST = ()
+    if args.split == "train":
+        cfg.INPUT.DZI_TYPE = "none"
+        cfg.TRAIN.VIS = False
+    register_datasets_in_cfg(cfg)
+
+    dataset = get_dataset(cfg, args.dataset, args.split)
+    keys = []
+    for idx in range(len(dataset)):
+        dataset_dict = dataset._get_sample_dict(idx)
+        if args.split == "train":
+            keys.append(get_roi_pack_key(dataset_dict))
+        else:
+            keys.extend(get_roi_pack_key(dataset_dict, inst_i) for inst_i in range(len(dataset_dict["annotations"])))
+    logger.info("{} rois in {} samples of {}".format(len(keys), len(dataset), args.dataset))
+
+    def _records():
+        i = 0
+        for idx in tqdm(range(len(dataset))):
+            for key, record in dataset.get_roi_pack_records(dataset._get_sample_dict(idx)):
+                assert key == keys[i], (key, keys[i])
+                i += 1
+                yield record
+
+    write_roi_pack(args.out, keys, _records(), meta=dataset.get_roi_pack_meta())
+
+
+if __name__ == "__main__":
+    main()
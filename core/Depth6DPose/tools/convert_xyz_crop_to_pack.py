@@ -0,0 +1,93 @@
+import argparse
+import multiprocessing
+import os
+import os.path as osp
+import sys
+
+import mmcv
+import numpy as np
+from tqdm import tqdm
+
+cur_dir = osp.dirname(osp.abspath(__file__))
+sys.path.insert(0, osp.join(cur_dir, "../../../"))
+from core.utils.xyz_pack import XYZ_PACK_DTYPES, XyzPack, get_xyz_pack_path, write_xyz_pack
+
+"""
+Pack the per-instance xyz pickles of every scene dir under xyz_root into
+<scene_dir>.xyzpack (read by core.utils.xyz_pack.load_xyz_info).
+
+python core/Depth6DPose/tools/convert_xyz_crop_to_pack.py \
+    --xyz_root datasets/BOP_DATASETS/lm/train_pbr/xyz_crop --dtype float16 --num_workers 8
+
+NOTE: the pickles are kept, remove them after checking the packs (--verify).
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert xyz_crop pickles to xyz packs.")
+    parser.add_argument("--xyz_root", type=str, help="root of the scene dirs with xyz pickles")
+    parser.add_argument("--dtype", type=str, default="float16", choices=XYZ_PACK_DTYPES, help="storage type of xyz")
+    parser.add_argument("--compress", action="store_true", help="zlib compress the xyz crops")
+    parser.add_argument("--verify", action="store_true", help="compare the packs with the pickles")
+    parser.add_argument("--num_workers", type=int, default=4, help="number of scenes converted in parallel")
+    args = parser.parse_args()
+    return args
+
+
+def get_scene_dirs(xyz_root):
+    scene_dirs = []
+    for root, dirs, files in os.walk(xyz_root):
+        if any(fn.endswith(".pkl") for fn in files):
+            scene_dirs.append(root)
+    return sorted(scene_dirs)
+
+
+def convert_scene(scene_dir, dtype, compress, verify):
+    names = sorted(fn for fn in os.listdir(scene_dir) if fn.endswith(".pkl"))
+    pack_path = get_xyz_pack_path(osp.join(scene_dir, names[0]))
+    num = write_xyz_pack(
+        pack_path,
+        ((name, mmcv.load(osp.join(scene_dir, name))) for name in names),
+        dtype=dtype,
+        compress=compress,
+    )
+    max_err = 0.0
+    if verify:
+        xyz_pack = XyzPack(pack_path)
+        for name in names:
+            xyz_info = mmcv.load(osp.join(scene_dir, name))
+            packed = xyz_pack.load(name)
+            assert list(packed["xyxy"]) == [int(_v) for _v in xyz_info["xyxy"]], name
+            xyz_crop = xyz_info["xyz_crop"].astype(np.float32)
+            fg = (xyz_crop != 0).any(-1)
+            assert np.array_equal(fg, (packed["xyz_crop"] != 0).any(-1)), "mask changed: {}".format(name)
+            if fg.any():
+                max_err = max(max_err, float(np.abs(packed["xyz_crop"] - xyz_crop).max()))
+    return pack_path, num, max_err
+
+
+def _convert_scene(job):
+    return convert_scene(*job)
+
+
+def main():
+    args = parse_args()
+    scene_dirs = get_scene_dirs(args.xyz_root)
+    print("{} scene dirs in {}".format(len(scene_dirs), args.xyz_root))
+    jobs = [(scene_dir, args.dtype, args.compress, args.verify) for scene_dir in scene_dirs]
+    if args.num_workers > 1:
+        pool = multiprocessing.get_context("fork").Pool(min(args.num_workers, len(jobs)))
+        results = list(tqdm(pool.imap_unordered(_convert_scene, jobs), total=len(jobs)))
+        pool.close()
+        pool.join()
+    else:
+        results = [_convert_scene(job) for job in tqdm(jobs)]
+    for pack_path, num, max_err in sorted(results):
+        msg = "{}: {} xyz crops".format(pack_path, num)
+        if args.verify:
+            msg += ", max abs err: {:.6f}".format(max_err)
+        print(msg)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,8 @@ import pickle
 
 from numpy.lib.polynomial import _binary_op_dispatcher
 from core.utils.augment import AugmentRGB
+from core.utils.bg_pool import BgImagePool
+from core.utils.columnar_dicts import ColumnarDicts
 import torch.utils.data as data
 from core.utils.dataset_utils import flat_dataset_dicts
 from lib.utils.utils import lazy_property
@@ -68,25 +70,50 @@ class Base_DatasetFromList(data.Dataset):
         self._lst = flat_dataset_dicts(lst) if flatten else lst
         self._copy = copy
         self._serialize = serialize
+        self._serialize_lst()
 
-        def _serialize(data):
-            buffer = pickle.dumps(data, protocol=-1)
-            return np.frombuffer(buffer, dtype=np.uint8)
+    def _serialize_lst(self):
+        """DATALOADER.SERIALIZE_TYPE:
+        pickle: one pickle per dict, concatenated into a byte tensor
+        columnar: the fields of all dicts as numpy columns (see ColumnarDicts),
+            items are rebuilt by index without unpickling or deepcopy
+        """
+        if not self._serialize:
+            return
+        self._serialize_type = serialize_type = self.cfg.DATALOADER.get("SERIALIZE_TYPE", "pickle")
+        if serialize_type == "columnar":
+            logger.info("Storing {} elements in columns ...".format(len(self._lst)))
+            self._lst = ColumnarDicts(self._lst)
+            logger.info("Columnar dataset: {}".format(self._lst.summary()))
+        elif serialize_type == "pickle":
+
+            def _serialize(data):
+                buffer = pickle.dumps(data, protocol=-1)
+                return np.frombuffer(buffer, dtype=np.uint8)
 
-        if self._serialize:
             logger.info("Serializing {} elements to byte tensors and concatenating them all ...".format(len(self._lst)))
             self._lst = [_serialize(x) for x in self._lst]
             self._addr = np.asarray([len(x) for x in self._lst], dtype=np.int64)
             self._addr = np.cumsum(self._addr)
             self._lst = np.concatenate(self._lst)
             logger.info("Serialized dataset takes {:.2f} MiB".format(len(self._lst) / 1024 ** 2))
+        else:
+            raise ValueError("Unknown DATALOADER.SERIALIZE_TYPE: {}".format(serialize_type))
 
     def __len__(self):
-        if self._serialize:
+        if self._serialize and self._serialize_type == "pickle":
             return len(self._addr)
         else:
             return len(self._lst)
 
+    def _own_sample_dict(self, dataset_dict):
+        """a dict which can be modified in place: the dicts from
+        _get_sample_dict are already new objects unless neither serialize nor
+        copy is set."""
+        if self._serialize or self._copy:
+            return dataset_dict
+        return copy.deepcopy(dataset_dict)
+
     def read_data(self, dataset_dict):
         if self.split == "train":
             return self.read_data_train(dataset_dict)
@@ -108,12 +135,14 @@ class Base_DatasetFromList(data.Dataset):
     def __getitem__(self, idx):
         dataset_dict = self._get_sample_dict(idx)
 
-        dataset_dict = copy.deepcopy(dataset_dict)  # it will be modified by code below
+        dataset_dict = self._own_sample_dict(dataset_dict)  # it will be modified by code below
         # NOTE: subclass need to re-implement this part
         return dataset_dict
 
     def _get_sample_dict(self, idx):
         if self._serialize:
+            if self._serialize_type == "columnar":
+                return self._lst[idx]
             start_addr = 0 if idx == 0 else self._addr[idx - 1].item()
             end_addr = self._addr[idx].item()
             bytes = memoryview(self._lst[start_addr:end_addr])
@@ -394,16 +423,14 @@ class Base_DatasetFromList(data.Dataset):
         assert len(bg_img_paths) > 0
         return bg_img_paths
 
-    def replace_bg(self, im, im_mask, return_mask=False, truncate_fg=False, with_bg_depth=False, depth_bp=False):
+    def load_bg(self, bg_path, H, W, with_bg_depth=False, depth_bp=False):
+        """decode a background (and depth) and fit it to HxW."""
         cfg = self.cfg
-        # add background to the image
-        H, W = im.shape[:2]
-        ind = random.randint(0, len(self._bg_img_paths) - 1)
         if with_bg_depth:
-            filename, depth_path, K_path = self._bg_img_paths[ind]
+            filename, depth_path, K_path = bg_path
             depth_factor = cfg.INPUT.BG_DEPTH_FACTOR
         else:
-            filename = self._bg_img_paths[ind]
+            filename = bg_path
             depth_path = None
             K_path = None
             depth_factor = None
@@ -420,6 +447,59 @@ class Base_DatasetFromList(data.Dataset):
         if len(bg_img.shape) != 3:
             bg_img = np.zeros((H, W, 3), dtype=np.uint8)
             logger.warning("bad background image: {}".format(filename))
+        return bg_img, bg_depth
+
+    @lazy_property
+    def _bg_pools(self):
+        # (H, W, with_bg_depth, depth_bp) => BgImagePool
+        return {}
+
+    def get_bg_pool(self, H, W, with_bg_depth=False, depth_bp=False):
+        """the pool of decoded backgrounds of size HxW, None if
+        INPUT.BG_POOL_SIZE <= 0."""
+        cfg = self.cfg
+        pool_size = cfg.INPUT.get("BG_POOL_SIZE", 0)
+        if pool_size <= 0:
+            return None
+        key = (H, W, with_bg_depth, depth_bp)
+        if key not in self._bg_pools:
+            bg_img_paths = self._bg_img_paths
+            hashed_file_name = hashlib.md5(
+                (
+                    "{}_{}_{}_{}_{}_{}_{}_bg_pool".format(
+                        bg_img_paths,
+                        self.img_format,
+                        cfg.INPUT.get("BG_KEEP_ASPECT_RATIO", True),
+                        with_bg_depth,
+                        depth_bp,
+                        cfg.INPUT.BG_DEPTH_FACTOR,
+                        cfg.INPUT.BG_TYPE,
+                    )
+                ).encode("utf-8")
+            ).hexdigest()
+            self._bg_pools[key] = BgImagePool(
+                cache_prefix=osp.join(".cache/bg_pool_{}_{}".format(cfg.INPUT.BG_TYPE, hashed_file_name)),
+                paths=bg_img_paths,
+                load_fn=lambda bg_path: self.load_bg(bg_path, H, W, with_bg_depth=with_bg_depth, depth_bp=depth_bp),
+                imH=H,
+                imW=W,
+                pool_size=pool_size,
+                with_depth=with_bg_depth,
+                refresh_prob=cfg.INPUT.get("BG_POOL_REFRESH_PROB", 0.0),
+                num_threads=cfg.INPUT.get("BG_POOL_NUM_THREADS", 8),
+            )
+        return self._bg_pools[key]
+
+    def replace_bg(self, im, im_mask, return_mask=False, truncate_fg=False, with_bg_depth=False, depth_bp=False):
+        # add background to the image
+        H, W = im.shape[:2]
+        bg_pool = self.get_bg_pool(H, W, with_bg_depth=with_bg_depth, depth_bp=depth_bp)
+        if bg_pool is not None:
+            bg_img, bg_depth = bg_pool.sample()
+        else:
+            ind = random.randint(0, len(self._bg_img_paths) - 1)
+            bg_path = self._bg_img_paths[ind]
+            bg_img, bg_depth = self.load_bg(bg_path, H, W, with_bg_depth=with_bg_depth, depth_bp=depth_bp)
 
         mask = im_mask.copy().astype(np.bool)
         if truncate_fg:
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""Batched PnP (EPnP + RANSAC + Gauss-Newton refinement) in torch.
+
+All ROIs of a batch are solved at once, the (padded) 2D-3D correspondences
+of ROI b are pts_3d[b], pts_2d[b] with valid[b] marking the real ones.
+
+EPnP (Lepetit et al. 2009) with the single null-space vector solution, weighted
+by per-point weights, so the same solver computes the RANSAC hypotheses (from
+the gathered sampled points) and the final pose from the inliers (the weights
+select them), which is then refined by Gauss-Newton on the reprojection error.
+"""
+import torch
+
+from core.utils.lie_algebra import lie_vec_to_rot
+
+
+def _weighted_mean(x, w):
+    # x: [*, N, C], w: [*, N] => [*, C]
+    return (x * w.unsqueeze(-1)).sum(-2) / w.sum(-1).clamp(min=1e-12).unsqueeze(-1)
+
+
+def _skew(v):
+    # v: [*, 3] => [*, 3, 3]
+    zeros = torch.zeros_like(v[..., 0])
+    return torch.stack(
+        [zeros, -v[..., 2], v[..., 1], v[..., 2], zeros, -v[..., 0], -v[..., 1], v[..., 0], zeros], dim=-1
+    ).view(v.shape[:-1] + (3, 3))
+
+
+def weighted_procrustes(pts_src, pts_dst, w):
+    """R, t minimizing sum_i w_i |R @ src_i + t - dst_i|^2.
+
+    pts_src, pts_dst: [*, N, 3], w: [*, N]
+    """
+    mean_src = _weighted_mean(pts_src, w)
+    mean_dst = _weighted_mean(pts_dst, w)
+    src = pts_src - mean_src.unsqueeze(-2)
+    dst = pts_dst - mean_dst.unsqueeze(-2)
+    H = (src * w.unsqueeze(-1)).transpose(-1, -2) @ dst  # [*, 3, 3]
+    U, _, Vh = torch.linalg.svd(H)
+    V = Vh.transpose(-1, -2)
+    d = torch.det(V @ U.transpose(-1, -2))
+    D = torch.diag_embed(torch.stack([torch.ones_like(d), torch.ones_like(d), d], dim=-1))
+    R = V @ D @ U.transpose(-1, -2)
+    t = mean_dst - (R @ mean_src.unsqueeze(-1)).squeeze(-1)
+    return R, t
+
+
+def epnp_weighted(pts_3d, pts_2d_norm, w):
+    """EPnP from weighted correspondences.
+
+    Args:
+        pts_3d: [*, N, 3] model points
+        pts_2d_norm: [*, N, 2] normalized image points (K^-1 @ [u, v, 1])
+        w: [*, N] weights (0 for unused points), at least 6 points should be used
+    Returns:
+        R [*, 3, 3], t [*, 3]
+    """
+    # control points: centroid + principal directions
+    c0 = _weighted_mean(pts_3d, w)
+    centered = pts_3d - c0.unsqueeze(-2)
+    cov = (centered * w.unsqueeze(-1)).transpose(-1, -2) @ centered / w.sum(-1).clamp(min=1e-12)[..., None, None]
+    eig_vals, eig_vecs = torch.linalg.eigh(cov)
+    axes = eig_vecs * eig_vals.clamp(min=1e-12).sqrt().unsqueeze(-2)  # columns: c_j - c0
+    # barycentric coordinates, [*, N, 4]
+    alphas_123 = centered @ torch.inverse(axes).transpose(-1, -2)
+    alphas = torch.cat([1 - alphas_123.sum(-1, keepdim=True), alphas_123], dim=-1)
+
+    # M @ vec(control points in camera) = 0, two rows per point
+    x = pts_2d_norm[..., 0:1]
+    y = pts_2d_norm[..., 1:2]
+    ones = torch.ones_like(x)
+    zeros = torch.zeros_like(x)
+    row_u = torch.cat([ones, zeros, -x], dim=-1)  # [*, N, 3]
+    row_v = torch.cat([zeros, ones, -y], dim=-1)
+    M_u = (alphas.unsqueeze(-1) * row_u.unsqueeze(-2)).flatten(-2)  # [*, N, 12]
+    M_v = (alphas.unsqueeze(-1) * row_v.unsqueeze(-2)).flatten(-2)
+    w_ = w.unsqueeze(-1)
+    MtM = (M_u * w_).transpose(-1, -2) @ M_u + (M_v * w_).transpose(-1, -2) @ M_v  # [*, 12, 12]
+    _, vecs = torch.linalg.eigh(MtM)
+    ctrl_cam = vecs[..., 0].view(vecs.shape[:-2] + (4, 3))
+
+    # scale from the distances between the control points
+    ctrl_world = torch.cat([c0.unsqueeze(-2), c0.unsqueeze(-2) + axes.transpose(-1, -2)], dim=-2)  # [*, 4, 3]
+    pairs_i, pairs_j = [0, 0, 0, 1, 1, 2], [1, 2, 3, 2, 3, 3]
+    dist_cam = (ctrl_cam[..., pairs_i, :] - ctrl_cam[..., pairs_j, :]).norm(dim=-1)
+    dist_world = (ctrl_world[..., pairs_i, :] - ctrl_world[..., pairs_j, :]).norm(dim=-1)
+    beta = (dist_cam * dist_world).sum(-1) / (dist_cam * dist_cam).sum(-1).clamp(min=1e-12)
+    pts_cam = beta[..., None, None] * (alphas @ ctrl_cam)
+    # points in front of the camera
+    sign = torch.sign(_weighted_mean(pts_cam[..., 2:3], w)[..., 0])
+    sign = torch.where(sign == 0, torch.ones_like(sign), sign)
+    pts_cam = pts_cam * sign[..., None, None]
+    return weighted_procrustes(pts_3d, pts_cam, w)
+
+
+def project(pts_3d, R, t, K):
+    """pts_3d: [*, N, 3], R: [*, 3, 3], t: [*, 3], K: [*, 3, 3] => [*, N, 2]"""
+    pts_cam = pts_3d @ R.transpose(-1, -2) + t.unsqueeze(-2)
+    pts = pts_cam @ K.transpose(-1, -2)
+    return pts[..., :2] / pts[..., 2:3].clamp(min=1e-8)
+
+
+def reproj_errors(pts_3d, pts_2d, R, t, K):
+    err = (project(pts_3d, R, t, K) - pts_2d).norm(dim=-1)
+    return torch.nan_to_num(err, nan=float("inf"))
+
+
+def gauss_newton_refine(pts_3d, pts_2d, K, R, t, w, num_iters=10, damping=1e-6):
+    """refine R, t by minimizing the weighted reprojection error.
+
+    pts_3d: [B, N, 3], pts_2d: [B, N, 2], K: [B, 3, 3], R: [B, 3, 3], t: [B, 3], w: [B, N]
+    """
+    fx = K[:, 0, 0, None]
+    fy = K[:, 1, 1, None]
+    eye3 = torch.eye(3, dtype=R.dtype, device=R.device)
+    eye6 = torch.eye(6, dtype=R.dtype, device=R.device)
+    for _ in range(num_iters):
+        pts_cam = pts_3d @ R.transpose(-1, -2) + t.unsqueeze(-2)  # [B, N, 3]
+        X, Y = pts_cam[..., 0], pts_cam[..., 1]
+        Z = pts_cam[..., 2].clamp(min=1e-8)
+        proj = pts_cam @ K.transpose(-1, -2)
+        res = proj[..., :2] / Z.unsqueeze(-1) - pts_2d  # [B, N, 2]
+        # d(u, v) / d(X, Y, Z)
+        zeros = torch.zeros_like(X)
+        J_proj = torch.stack([fx / Z, zeros, -fx * X / Z ** 2, zeros, fy / Z, -fy * Y / Z ** 2], dim=-1)
+        J_proj = J_proj.view(X.shape + (2, 3))
+        # d(X, Y, Z) / d(omega, tau) for the left update exp(omega) @ (R, t) + tau
+        J_pt = torch.cat([-_skew(pts_cam), eye3.expand(X.shape + (3, 3))], dim=-1)  # [B, N, 3, 6]
+        J = J_proj @ J_pt  # [B, N, 2, 6]
+        Jw = J * w[..., None, None]
+        H = torch.einsum("bnki,bnkj->bij", Jw, J) + damping * eye6
+        g = torch.einsum("bnki,bnk->bi", Jw, res)
+        delta = -torch.linalg.solve(H, g.unsqueeze(-1)).squeeze(-1)
+        delta = torch.nan_to_num(delta)
+        dR = lie_vec_to_rot(delta[:, :3])
+        R = dR @ R
+        t = (dR @ t.unsqueeze(-1)).squeeze(-1) + delta[:, 3:]
+    return R, t
+
+
+def batch_pnp_ransac(
+    pts_3d,
+    pts_2d,
+    K,
+    valid,
+    num_hypotheses=100,
+    reproj_err_thr=3.0,
+    sample_size=6,
+    num_refine_iters=10,
+    score_chunk_size=16,
+):
+    """
+    Args:
+        pts_3d: [B, N, 3] model points
+        pts_2d: [B, N, 2] image points (pixels)
+        K: [B, 3, 3]
+        valid: [B, N] bool, the real correspondences (rows need >= 4 valid points)
+        num_hypotheses: RANSAC hypotheses per ROI
+        reproj_err_thr: inlier threshold (pixels)
+        sample_size: points per hypothesis (>= 6 for EPnP with one null-space vector)
+        score_chunk_size: hypotheses scored at once on all the points
+    Returns:
+        R [B, 3, 3], t [B, 3], inliers [B, N] bool
+    """
+    B, N = valid.shape
+    H = num_hypotheses
+    sample_size = min(sample_size, N)
+    dtype = pts_3d.dtype
+    w_valid = valid.to(dtype)
+    ones = torch.ones_like(pts_2d[..., :1])
+    pts_2d_norm = (torch.cat([pts_2d, ones], dim=-1) @ torch.inverse(K).transpose(-1, -2))[..., :2]
+
+    # hypotheses from random subsets, rows with too few points use all their points (valid first)
+    num_valid = valid.sum(-1)
+    can_sample = num_valid >= sample_size
+    probs = torch.where(can_sample[:, None], w_valid, torch.ones_like(w_valid))
+    sample_ids = torch.multinomial(probs.repeat_interleave(H, 0), sample_size, replacement=False).view(B, H, -1)
+    first_ids = torch.argsort(valid.to(torch.uint8), dim=1, descending=True, stable=True)[:, :sample_size]
+    sample_ids = torch.where(can_sample[:, None, None], sample_ids, first_ids[:, None, :].expand_as(sample_ids))
+
+    def _gather(x):
+        # [B, N, C] => the sampled points [B, H, sample_size, C]
+        C = x.shape[-1]
+        return torch.gather(x.unsqueeze(1).expand(B, H, N, C), 2, sample_ids.unsqueeze(-1).expand(B, H, -1, C))
+
+    w_hyp = _gather(w_valid.unsqueeze(-1))[..., 0]
+    R_hyp, t_hyp = epnp_weighted(_gather(pts_3d), _gather(pts_2d_norm), w_hyp)
+
+    # score the hypotheses on all points, in chunks of hypotheses
+    num_inliers = []
+    for h_start in range(0, H, score_chunk_size):
+        R_chunk = R_hyp[:, h_start : h_start + score_chunk_size]
+        t_chunk = t_hyp[:, h_start : h_start + score_chunk_size]
+        H_chunk = R_chunk.shape[1]
+
+        def _expand(x):
+            return x.unsqueeze(1).expand((B, H_chunk) + x.shape[1:])
+
+        errs = reproj_errors(_expand(pts_3d), _expand(pts_2d), R_chunk, t_chunk, _expand(K))  # [B, H_chunk, N]
+        num_inliers.append(((errs < reproj_err_thr) & valid.unsqueeze(1)).sum(-1))
+    best = torch.cat(num_inliers, dim=1).argmax(-1)  # [B]
+    batch_ids = torch.arange(B, device=valid.device)
+
+    def _get_inliers(R, t):
+        inliers = (reproj_errors(pts_3d, pts_2d, R, t, K) < reproj_err_thr) & valid
+        # too few inliers: use all points
+        return torch.where((inliers.sum(-1) >= sample_size)[:, None], inliers, valid)
+
+    inliers = _get_inliers(R_hyp[batch_ids, best], t_hyp[batch_ids, best])
+    # local optimization: the hypotheses are solved from a few (noisy) points, the pose from all their
+    # inliers gives the inliers of the final pose
+    R, t = epnp_weighted(pts_3d, pts_2d_norm, inliers.to(dtype))
+    inliers = _get_inliers(R, t)
+
+    w_in = inliers.to(dtype)
+    R, t = epnp_weighted(pts_3d, pts_2d_norm, w_in)
+    if num_refine_iters > 0:
+        R, t = gauss_newton_refine(pts_3d, pts_2d, K, R, t, w_in, num_iters=num_refine_iters)
+    return R, t, inliers
+
+
+def get_img_model_points_with_coords2d_batch(mask_pred, xyz_pred, coord2d, im_H, im_W, extent, mask_thr=0.5):
+    """batched get_img_model_points_with_coords2d of the evaluators, the
+    correspondences are padded to the max number of points.
+
+    Args:
+        mask_pred: [B, 1, h, w] predicted mask in roi_size
+        xyz_pred: [B, 3, h, w] predicted xyz in [0, 1]
+        coord2d: [B, 2, h, w] normalized 2D coords of the roi pixels
+        im_H, im_W: [B]
+        extent: [B, 3] size of x, y, z
+    Returns:
+        image points [B, N, 2], model points [B, N, 3], valid [B, N]
+    """
+    B = xyz_pred.shape[0]
+    extent = extent.view(B, 3, 1, 1)
+    xyz = (xyz_pred - 0.5) * extent
+    img_pts = coord2d * torch.stack([im_W, im_H], dim=1).view(B, 2, 1, 1).to(coord2d)
+    sel = (mask_pred[:, 0] > mask_thr) & (xyz.abs() > 0.0001 * extent).all(dim=1)  # [B, h, w]
+    sel = sel.flatten(1)
+    num_max = max(int(sel.sum(1).max().item()), 1) if B > 0 else 1
+    # valid points first, in the pixel order
+    order = torch.argsort(sel.to(torch.uint8), dim=1, descending=True, stable=True)[:, :num_max]
+    valid = torch.gather(sel, 1, order)
+    model_points = torch.gather(xyz.flatten(2).transpose(1, 2), 1, order.unsqueeze(-1).expand(-1, -1, 3))
+    image_points = torch.gather(img_pts.flatten(2).transpose(1, 2), 1, order.unsqueeze(-1).expand(-1, -1, 2))
+    return image_points, model_points, valid
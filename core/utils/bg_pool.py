@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Pool of decoded and resized background images for replace_bg.
+
+The backgrounds (and depths) of a target image size are decoded once into
+memory-mapped .npy cache files, which the data loader workers share through
+the page cache, so replacing the background is just picking a slot.
+
+Refresh policy: with probability refresh_prob a sample decodes a new background
+(from all the bg image paths) and writes it into a random slot, so the pool
+slowly covers all the backgrounds (and new random crops for
+BG_KEEP_ASPECT_RATIO=False). The cache files are mapped copy-on-write, a
+refreshed slot is private to the worker process and never written back to the
+persistent cache.
+"""
+import fcntl
+import logging
+import os
+import os.path as osp
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import mmcv
+import numpy as np
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+
+class BgImagePool(object):
+    def __init__(
+        self, cache_prefix, paths, load_fn, imH, imW, pool_size, with_depth=False, refresh_prob=0.0, num_threads=8
+    ):
+        """
+        Args:
+            cache_prefix (str): prefix of the cache files (should identify the bg paths
+                and the loading settings)
+            paths (list): bg image paths (or tuples of (im_path, depth_path, K_path))
+            load_fn (callable): path -> (bg_img HxWx3 uint8, bg_depth HxWxC or None)
+                of size imH x imW
+            pool_size (int): number of pooled backgrounds
+            refresh_prob (float): prob to decode a new background into the pool on sample
+        """
+        self.paths = paths
+        self.load_fn = load_fn
+        self.imH = imH
+        self.imW = imW
+        self.pool_size = min(pool_size, len(paths))
+        self.with_depth = with_depth
+        self.refresh_prob = refresh_prob
+        self.num_threads = num_threads
+        prefix = "{}_{}x{}_{}".format(cache_prefix, imH, imW, self.pool_size)
+        self.img_cache_path = prefix + ".npy"
+        self.depth_cache_path = prefix + "_depth.npy" if with_depth else None
+        self._imgs = None
+        self._depths = None
+
+    def _cache_ready(self):
+        return osp.exists(self.img_cache_path) and (not self.with_depth or osp.exists(self.depth_cache_path))
+
+    def _build(self):
+        logger.info("building bg pool of {} images: {}".format(self.pool_size, self.img_cache_path))
+        mmcv.mkdir_or_exist(osp.dirname(osp.abspath(self.img_cache_path)))
+        tmp_img_path = self.img_cache_path + ".tmp.npy"
+        imgs = np.lib.format.open_memmap(
+            tmp_img_path, mode="w+", dtype=np.uint8, shape=(self.pool_size, self.imH, self.imW, 3)
+        )
+        depths = None
+        tmp_depth_path = None
+
+        def _load(i):
+            return i, self.load_fn(self.paths[i])
+
+        # cv2/imageio decoding releases the GIL, threads also work inside (daemonic) data loader workers
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            for i, (bg_img, bg_depth) in tqdm(
+                executor.map(_load, range(self.pool_size)), total=self.pool_size, desc="bg pool"
+            ):
+                imgs[i] = bg_img
+                if self.with_depth:
+                    if depths is None:
+                        tmp_depth_path = self.depth_cache_path + ".tmp.npy"
+                        depths = np.lib.format.open_memmap(
+                            tmp_depth_path, mode="w+", dtype=np.float32, shape=(self.pool_size,) + bg_depth.shape
+                        )
+                    depths[i] = bg_depth
+        imgs.flush()
+        del imgs
+        if depths is not None:
+            depths.flush()
+            del depths
+            os.replace(tmp_depth_path, self.depth_cache_path)
+        os.replace(tmp_img_path, self.img_cache_path)
+
+    def _load_cache(self):
+        if not self._cache_ready():
+            # only one process builds the pool, the others wait for it
+            lock_path = self.img_cache_path + ".lock"
+            mmcv.mkdir_or_exist(osp.dirname(osp.abspath(lock_path)))
+            with open(lock_path, "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if not self._cache_ready():
+                        self._build()
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        # copy-on-write: refreshed slots stay in the private pages of this process
+        mode = "c" if self.refresh_prob > 0 else "r"
+        self._imgs = np.load(self.img_cache_path, mmap_mode=mode)
+        if self.with_depth:
+            self._depths = np.load(self.depth_cache_path, mmap_mode=mode)
+        logger.info("bg pool: {}".format(self.img_cache_path))
+
+    def sample(self):
+        """
+        Returns:
+            bg_img (HxWx3 uint8, read-only unless refresh_prob > 0, do not modify),
+            bg_depth (HxWxC float32 copy) or None
+        """
+        if self._imgs is None:
+            self._load_cache()
+        ind = random.randint(0, self.pool_size - 1)
+        if self.refresh_prob > 0 and random.random() < self.refresh_prob:
+            bg_img, bg_depth = self.load_fn(random.choice(self.paths))
+            self._imgs[ind] = bg_img
+            if self.with_depth:
+                self._depths[ind] = bg_depth
+            return bg_img, bg_depth
+        bg_depth = np.array(self._depths[ind]) if self.with_depth else None
+        return self._imgs[ind], bg_depth
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Columnar storage of (flattened) dataset dicts.
+
+Instead of one pickle per dict, every field is a column over all dicts:
+    - np.ndarray/np scalars of a fixed dtype and shape: one stacked [N, ...] array
+    - int/float/bool: one array
+    - flat lists of ints/floats of a fixed length: one [N, L] array
+    - str/bytes (paths, rle counts...): ids into a string table, which holds every
+      distinct string only once (e.g. the file_name of all instances of an image)
+    - nested dicts (inst_infos, model_info...): their fields are columns as well
+    - anything else (None, tuples, mixed types...): pickled per dict in one buffer
+
+The columns are a few large numpy arrays, so fork-ed data loader workers share
+them with the main process (no refcount writes on millions of python objects),
+and an item is rebuilt field by field without unpickling the whole dict. The
+rebuilt dict and its arrays are new objects, so it can be modified in place.
+"""
+import logging
+import pickle
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_NUMBER_TYPES = (int, float, bool)
+
+
+def _concat_buffers(buffers):
+    """concatenate bytes into one uint8 array + end offsets."""
+    addr = np.cumsum(np.asarray([len(_b) for _b in buffers], dtype=np.int64))
+    if len(buffers) == 0:
+        return np.zeros(0, dtype=np.uint8), addr
+    data = np.frombuffer(b"".join(buffers), dtype=np.uint8)
+    return data, addr
+
+
+def _buffer_item(data, addr, idx):
+    start = 0 if idx == 0 else addr[idx - 1].item()
+    return memoryview(data[start : addr[idx].item()])
+
+
+class _StringTable(object):
+    def __init__(self):
+        self._ids = {}
+        self._items = []
+
+    def add(self, s):
+        if s not in self._ids:
+            self._ids[s] = len(self._items)
+            self._items.append(s.encode("utf-8") if isinstance(s, str) else s)
+        return self._ids[s]
+
+    def finalize(self):
+        self.data, self.addr = _concat_buffers(self._items)
+        self.num = len(self._items)
+        del self._ids, self._items
+
+    def get(self, i):
+        return _buffer_item(self.data, self.addr, i).tobytes()
+
+
+def _get_kind(values):
+    """storage kind of a column from its (present) values."""
+    v0 = values[0]
+    t0 = type(v0)
+    if isinstance(v0, (np.ndarray, np.generic)) and v0.dtype != object:
+        if all(type(_v) is t0 and _v.dtype == v0.dtype and _v.shape == v0.shape for _v in values):
+            return "scalar" if isinstance(v0, np.generic) else "array"
+    elif t0 in _NUMBER_TYPES:
+        if all(type(_v) is t0 for _v in values):
+            return "number"
+    elif t0 in (str, bytes):
+        if all(type(_v) is t0 for _v in values):
+            return "str" if t0 is str else "bytes"
+    elif t0 is list and len(v0) > 0 and type(v0[0]) in _NUMBER_TYPES:
+        et, n = type(v0[0]), len(v0)
+        if all(type(_v) is list and len(_v) == n and all(type(_e) is et for _e in _v) for _v in values):
+            return "list"
+    return "pickle"
+
+
+class _Column(object):
+    def __init__(self, path, rows, values, num, str_table):
+        self.path = path
+        if len(rows) == num:
+            self.present = None
+        else:
+            self.present = np.zeros(num, dtype=bool)
+            self.present[rows] = True
+        self.kind = kind = _get_kind(values)
+        if kind in ["array", "scalar", "number", "list"]:
+            v0 = np.asarray(values[0])
+            data = np.zeros((num,) + v0.shape, dtype=v0.dtype)
+            data[rows] = np.asarray(values)
+            self.data = data
+        elif kind in ["str", "bytes"]:
+            ids = np.full(num, -1, dtype=np.int64)
+            ids[rows] = [str_table.add(_v) for _v in values]
+            self.data = ids
+            self._str_table = str_table
+        else:
+            buffers = [b""] * num
+            for row, value in zip(rows, values):
+                buffers[row] = pickle.dumps(value, protocol=-1)
+            self.data, self.addr = _concat_buffers(buffers)
+
+    def __getitem__(self, idx):
+        kind = self.kind
+        if kind == "array":
+            return np.array(self.data[idx])
+        if kind == "scalar":
+            return self.data[idx]
+        if kind == "number":
+            return self.data[idx].item()
+        if kind == "list":
+            return self.data[idx].tolist()
+        if kind == "str":
+            return self._str_table.get(self.data[idx]).decode("utf-8")
+        if kind == "bytes":
+            return self._str_table.get(self.data[idx])
+        return pickle.loads(_buffer_item(self.data, self.addr, idx))
+
+    @property
+    def nbytes(self):
+        nbytes = self.data.nbytes
+        if self.present is not None:
+            nbytes += self.present.nbytes
+        if self.kind == "pickle":
+            nbytes += self.addr.nbytes
+        return nbytes
+
+
+class ColumnarDicts(object):
+    """a read-only list of dicts stored column by column."""
+
+    def __init__(self, dicts):
+        self._num = len(dicts)
+        self._str_table = _StringTable()
+        self._columns = []
+        self._add_columns(list(range(self._num)), dicts, ())
+        self._str_table.finalize()
+
+    def _add_columns(self, rows, dicts, prefix):
+        keys = {}  # ordered
+        for d in dicts:
+            for key in d:
+                keys[key] = None
+        for key in keys:
+            sub_rows = [row for row, d in zip(rows, dicts) if key in d]
+            values = [d[key] for d in dicts if key in d]
+            if all(type(_v) is dict and len(_v) > 0 for _v in values):
+                self._add_columns(sub_rows, values, prefix + (key,))
+            else:
+                self._columns.append(_Column(prefix + (key,), sub_rows, values, self._num, self._str_table))
+
+    def __len__(self):
+        return self._num
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._num
+        if not 0 <= idx < self._num:
+            raise IndexError(idx)
+        item = {}
+        for col in self._columns:
+            if col.present is not None and not col.present[idx]:
+                continue
+            d = item
+            for key in col.path[:-1]:
+                d = d.setdefault(key, {})
+            d[col.path[-1]] = col[idx]
+        return item
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in self._columns) + self._str_table.data.nbytes + self._str_table.addr.nbytes
+
+    def summary(self):
+        pickled = [".".join(str(_k) for _k in col.path) for col in self._columns if col.kind == "pickle"]
+        return "{} items, {} columns, {} strings, {:.2f} MiB, pickled columns: {}".format(
+            self._num, len(self._columns), self._str_table.num, self.nbytes / 1024 ** 2, pickled
+        )
@@ -301,6 +301,38 @@ def xyz_to_region_batch(xyz, fps_points, mask=None):
     return (region * mask).to(torch.long)
 
 
+MASK_TARGET_KEYS = ("roi_mask_trunc", "roi_mask_visib", "roi_mask_obj", "roi_mask_full")
+
+
+def use_compact_targets(cfg):
+    return cfg.DATALOADER.get("COMPACT_TARGETS", False)
+
+
+def use_device_roi_crop(cfg):
+    return cfg.DATALOADER.get("DEVICE_ROI_CROP", False)
+
+
+def compact_mask(mask):
+    """[0, 1] mask (maybe interpolated) => uint8 in [0, 255], exact for binary
+    masks."""
+    return np.round(np.clip(mask, 0, 1) * 255).astype(np.uint8)
+
+
+def compact_region(region, num_regions):
+    """region labels in [0, num_regions] => uint8 if possible."""
+    return region.astype(np.uint8 if num_regions < 256 else np.int32)
+
+
+def expand_target(key, value):
+    """(maybe compact) target on the device => the dtype used by the losses:
+    masks float32 in [0, 1], roi_region long, others float32."""
+    if key == "roi_region":
+        return value.to(torch.long)
+    if key in MASK_TARGET_KEYS and value.dtype == torch.uint8:
+        return value.to(torch.float32) / 255
+    return value.to(torch.float32)
+
+
 def get_2d_coord_np(width, height, low=0, high=1, fmt="CHW", endpoint=False):
     """
     Args:
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""Offline store of the dataset dicts of a dataset: one file per scene and an
+index of the scenes, instead of one pickle of all the dataset dicts.
+
+A scene file holds the image-level fields and the (flattened) annotations of the
+images of a scene as ColumnarDicts. Their numpy buffers are written out-of-band
+after the pickled columns, so loading a scene memory-maps them instead of
+reading and unpickling the whole file.
+
+The index holds a stamp of the source of each scene (the dataset config and
+the mtime/size of the annotation files of the scene) and its number of images:
+only the scenes whose stamp changed are (re)built (in parallel with
+map_scenes), and DatasetStore loads the scenes lazily when an index into them
+is accessed.
+"""
+import bisect
+import hashlib
+import logging
+import multiprocessing as mp
+import os
+import os.path as osp
+import pickle
+
+import mmcv
+import numpy as np
+from tqdm import tqdm
+
+from core.utils.columnar_dicts import ColumnarDicts
+
+logger = logging.getLogger(__name__)
+
+_ALIGN = 64
+_OUT_OF_BAND = pickle.HIGHEST_PROTOCOL >= 5
+
+
+def _atomic_dump_bytes(chunks, path):
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+def save_columnar_dicts(obj, path):
+    """pickle obj (holding ColumnarDicts), with its numpy buffers out-of-band
+    (aligned, memory-mappable) after the pickle."""
+    buffers = []
+    if _OUT_OF_BAND:
+        meta = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        buffers = [_b.raw() for _b in buffers]
+    else:
+        meta = pickle.dumps(obj, protocol=-1)
+    spans = []
+    offset = 0
+    for buf in buffers:
+        offset = (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+        spans.append((offset, buf.nbytes))
+        offset += buf.nbytes
+    header = pickle.dumps((len(meta), spans), protocol=-1)
+    prefix = np.array([len(header)], dtype=np.int64).tobytes() + header + meta
+    data_start = (len(prefix) + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    def _chunks():
+        yield prefix
+        pos = len(prefix)
+        for (start, nbytes), buf in zip(spans, buffers):
+            yield b"\0" * (data_start + start - pos)
+            yield buf
+            pos = data_start + start + nbytes
+
+    mmcv.mkdir_or_exist(osp.dirname(osp.abspath(path)))
+    _atomic_dump_bytes(_chunks(), path)
+
+
+def load_columnar_dicts(path, mmap=True):
+    """load an object saved by save_columnar_dicts, its numpy buffers are
+    (read-only) views into the memory-mapped file if mmap."""
+    with open(path, "rb") as f:
+        header_len = int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+        meta_len, spans = pickle.loads(f.read(header_len))
+        meta = f.read(meta_len)
+        data_start = (8 + header_len + meta_len + _ALIGN - 1) // _ALIGN * _ALIGN
+        if len(spans) == 0:
+            return pickle.loads(meta)
+        if mmap:
+            data = np.memmap(path, dtype=np.uint8, mode="r")
+        else:
+            f.seek(0)
+            data = np.frombuffer(f.read(), dtype=np.uint8)
+    buffers = [data[data_start + start : data_start + start + nbytes] for start, nbytes in spans]
+    return pickle.loads(meta, buffers=buffers)
+
+
+class _SceneDicts(object):
+    """the image-level dataset dicts of a scene, with their annotations stored
+    as flattened instances."""
+
+    def __init__(self, dataset_dicts):
+        images = []
+        insts = []
+        inst_ends = []
+        for dataset_dict in dataset_dicts:
+            images.append({_k: _v for _k, _v in dataset_dict.items() if _k != "annotations"})
+            insts.extend(dataset_dict.get("annotations", []))
+            inst_ends.append(len(insts))
+        self.has_annotations = len(dataset_dicts) > 0 and "annotations" in dataset_dicts[0]
+        self.images = ColumnarDicts(images)
+        self.insts = ColumnarDicts(insts)
+        self.inst_ends = np.asarray(inst_ends, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, idx):
+        record = self.images[idx]
+        if self.has_annotations:
+            start = 0 if idx == 0 else self.inst_ends[idx - 1].item()
+            record["annotations"] = [self.insts[i] for i in range(start, self.inst_ends[idx].item())]
+        return record
+
+
+class DatasetStore(object):
+    """a read-only list of the dataset dicts of all scenes, the scene files
+    are loaded (memory-mapped) on first access."""
+
+    def __init__(self, scene_paths, num_images, stats=None):
+        """
+        Args:
+            stats (dict): counts of the dataset (e.g. filtered instances) when the scenes were loaded
+        """
+        self.scene_paths = list(scene_paths)
+        self.stats = stats if stats is not None else {}
+        self._offsets = np.concatenate([[0], np.cumsum(num_images)]).astype(np.int64)
+        self._scenes = [None] * len(self.scene_paths)
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def _get_scene(self, scene_i):
+        if self._scenes[scene_i] is None:
+            self._scenes[scene_i] = load_columnar_dicts(self.scene_paths[scene_i])
+        return self._scenes[scene_i]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        scene_i = bisect.bisect_right(self._offsets, idx) - 1
+        return self._get_scene(scene_i)[idx - self._offsets[scene_i].item()]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+_SCENE_FN = None
+
+
+def _call_scene_fn(scene):
+    return _SCENE_FN(scene)
+
+
+def get_num_scene_workers(data_cfg):
+    """data_cfg["num_workers"]: processes to load the scenes of a dataset,
+    default: the number of cpus (at most 16)."""
+    num_workers = data_cfg.get("num_workers", -1)
+    if num_workers < 0:
+        num_workers = min(os.cpu_count() or 1, 16)
+    return num_workers
+
+
+def map_scenes(fn, scenes, num_workers=0, desc=None):
+    """fn(scene) of all the scenes, in forked processes if num_workers > 1.
+
+    fn is inherited by the processes (not pickled), so it can be a closure or
+    a bound method of a dataset with loaded models. Only the scenes and the
+    results are sent between processes.
+
+    Returns:
+        list: the results in the order of the scenes
+    """
+    global _SCENE_FN
+    if num_workers <= 1 or len(scenes) <= 1:
+        return [fn(scene) for scene in tqdm(scenes, desc=desc)]
+    _SCENE_FN = fn
+    try:
+        with mp.get_context("fork").Pool(min(num_workers, len(scenes))) as pool:
+            return list(tqdm(pool.imap(_call_scene_fn, scenes), total=len(scenes), desc=desc))
+    finally:
+        _SCENE_FN = None
+
+
+def get_scene_stamp(key, files):
+    """stamp of the source of a scene: the config key and the mtime/size of
+    its annotation files."""
+    items = [key]
+    for path in files:
+        st = os.stat(path)
+        items.append("{}:{}:{}".format(path, st.st_mtime_ns, st.st_size))
+    return hashlib.md5("\n".join(items).encode("utf-8")).hexdigest()
+
+
+def build_dataset_store(store_dir, scenes, load_scene_fn, scene_files_fn, key, use_cache=True, num_workers=0):
+    """build (incrementally) and open the store of a dataset.
+
+    Args:
+        store_dir (str): the directory of the scene files and the index
+        scenes (list[str]):
+        load_scene_fn (callable): scene => (dataset dicts (list[dict]), stats (dict of counts)) of the scene
+        scene_files_fn (callable): scene => the annotation files the dicts of the scene are loaded from
+        key (str): the config of the dicts (selected objects, options...), all scenes are rebuilt if it changes
+        use_cache (bool): if False, rebuild all the scenes
+        num_workers (int): processes to build the scenes
+    Returns:
+        DatasetStore: with the summed stats of all scenes
+    """
+    index_path = osp.join(store_dir, "index.pkl")
+    index = {}
+    if use_cache and osp.exists(index_path):
+        index = mmcv.load(index_path)
+
+    def _get_scene_path(scene):
+        return osp.join(store_dir, "{}.cdicts".format(scene))
+
+    def _build_scene(scene):
+        dataset_dicts, stats = load_scene_fn(scene)
+        save_columnar_dicts(_SceneDicts(dataset_dicts), _get_scene_path(scene))
+        return {"num_images": len(dataset_dicts), "stats": stats}
+
+    stamps = {scene: get_scene_stamp(key, scene_files_fn(scene)) for scene in scenes}
+    rebuilt = [
+        scene
+        for scene in scenes
+        if scene not in index or index[scene]["stamp"] != stamps[scene] or not osp.exists(_get_scene_path(scene))
+    ]
+    if len(rebuilt) > 0:
+        entries = map_scenes(_build_scene, rebuilt, num_workers=num_workers, desc=osp.basename(store_dir))
+        for scene, entry in zip(rebuilt, entries):
+            entry["stamp"] = stamps[scene]
+            index[scene] = entry
+        _atomic_dump_bytes([pickle.dumps(index, protocol=-1)], index_path)
+        logger.info("dataset store {}: (re)built {}/{} scenes".format(store_dir, len(rebuilt), len(scenes)))
+
+    stats = {}
+    for scene in scenes:
+        for _k, _v in index[scene].get("stats", {}).items():
+            stats[_k] = stats.get(_k, 0) + _v
+    scene_paths = [_get_scene_path(scene) for scene in scenes]
+    return DatasetStore(scene_paths, [index[scene]["num_images"] for scene in scenes], stats=stats)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Per-class model assets of the training datasets, resident on the training
+device.
+
+The train data loaders then only carry the class (and dataset name) of each
+roi, and the batches gather the model points, fps points, extents and the
+(padded) symmetries from the bank instead of collating and copying per-roi
+copies every step.
+"""
+import logging
+
+import numpy as np
+import torch
+
+from core.utils.pose_utils import pad_sym_infos
+
+logger = logging.getLogger(__name__)
+
+
+def use_model_asset_bank(cfg):
+    return cfg.DATALOADER.get("MODEL_ASSET_BANK", False)
+
+
+def build_model_asset_bank(cfg, loaders, device="cuda"):
+    """
+    Args:
+        loaders (list[tuple]): (train data loader, dataset_names)
+    """
+    datasets = []
+    for data_loader, dataset_names in loaders:
+        dataset = data_loader.dataset
+        if isinstance(dataset, torch.utils.data.DataLoader):  # AspectRatioGroupedDataset
+            dataset = dataset.dataset
+        datasets.append((dataset, dataset_names))
+    with_fps_points = cfg.MODEL.POSE_NET.GEO_HEAD.NUM_REGIONS > 1
+    return ModelAssetBank(datasets, device=device, with_fps_points=with_fps_points)
+
+
+class ModelAssetBank(object):
+    def __init__(self, datasets, device="cuda", with_fps_points=False):
+        """
+        Args:
+            datasets (list[tuple]): (dataset, dataset_names), the dataset provides
+                _get_model_points/_get_extents/_get_sym_infos(/_get_fps_points) of the dataset names
+            with_fps_points (bool): also hold the fps points (for region targets)
+        """
+        self.device = device
+        self.offsets = {}  # dataset_name => index of its first class
+        points = []
+        extents = []
+        sym_infos = []
+        fps_points = []
+        for dataset, dataset_names in datasets:
+            for dataset_name in dataset_names:
+                if dataset_name in self.offsets:
+                    continue
+                self.offsets[dataset_name] = len(extents)
+                cur_points = dataset._get_model_points(dataset_name)
+                cur_extents = dataset._get_extents(dataset_name)
+                cur_sym_infos = dataset._get_sym_infos(dataset_name)
+                if with_fps_points:
+                    cur_fps_points = dataset._get_fps_points(dataset_name)
+                for i in range(len(cur_extents)):
+                    points.append(cur_points[i])
+                    extents.append(cur_extents[i])
+                    sym_infos.append(cur_sym_infos[i])
+                    if with_fps_points:
+                        fps_points.append(cur_fps_points[i])
+
+        # the datasets may sample different numbers of model points
+        num_points = min(len(_pts) for _pts in points)
+        self.points = torch.as_tensor(np.stack([_pts[:num_points] for _pts in points]).astype("float32")).to(device)
+        self.extents = torch.as_tensor(np.stack(extents).astype("float32")).to(device)
+        self.sym_rots, self.sym_mask = pad_sym_infos(sym_infos, device=device)
+        self.fps_points = None
+        if with_fps_points:
+            self.fps_points = torch.as_tensor(np.stack(fps_points).astype("float32")).to(device)
+        logger.info(
+            "model asset bank: {} classes of {}, {} points, {} symmetries".format(
+                len(extents), list(self.offsets.keys()), num_points, self.sym_rots.shape[1]
+            )
+        )
+
+    def get_inds(self, data):
+        """bank indices of the rois (list of dicts with dataset_name and roi_cls)."""
+        inds = [self.offsets[d["dataset_name"]] + int(d["roi_cls"]) for d in data]
+        return torch.tensor(inds, dtype=torch.long).to(self.device, non_blocking=True)
+
+    def fill_batch(self, batch, data):
+        """add roi_points, roi_extent, sym_info (padded (sym_rots, sym_mask) for
+        get_closest_rot_batch) and roi_fps_points to the batch."""
+        inds = batch["roi_asset_ind"] = self.get_inds(data)
+        batch["roi_points"] = self.points[inds]
+        batch["roi_extent"] = self.extents[inds]
+        batch["sym_info"] = (self.sym_rots[inds], self.sym_mask[inds])
+        if self.fps_points is not None:
+            batch["roi_fps_points"] = self.fps_points[inds]
+        return batch
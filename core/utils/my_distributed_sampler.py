@@ -169,6 +169,56 @@ class RepeatFactorTrainingSampler(Sampler):
                 yield from indices
 
 
+class ImageGroupedTrainingSampler(Sampler):
+    """Similar to TrainingSampler, but for flattened (instance-level) datasets
+    the instances of an image are yielded consecutively (the images and the
+    instances of each image are shuffled), so they tend to be in the same batch
+    and can share the image-level data.
+
+    Each worker (gpu) takes whole images: images `[worker_id::num_workers]`
+    of the shuffled stream.
+    """
+
+    def __init__(self, im_inds, *, shuffle=True, seed=None):
+        """
+        Args:
+            im_inds (list[int]): the image index of each data of the underlying dataset
+            shuffle (bool): whether to shuffle the images/instances or not
+            seed (int): the initial seed of the shuffle. Must be the same
+                across all workers. If None, will use a random seed shared
+                among workers (require synchronization among all workers).
+        """
+        assert len(im_inds) > 0
+        self._shuffle = shuffle
+        if seed is None:
+            seed = comm.shared_random_seed()
+        self._seed = int(seed)
+
+        self._rank = comm.get_rank()
+        self._world_size = comm.get_world_size()
+
+        groups = defaultdict(list)
+        for dataset_index, im_ind in enumerate(im_inds):
+            groups[im_ind].append(dataset_index)
+        self._groups = [torch.tensor(_inds, dtype=torch.int64) for _inds in groups.values()]
+
+    def __iter__(self):
+        start = self._rank
+        for group in itertools.islice(self._infinite_groups(), start, None, self._world_size):
+            yield from group
+
+    def _infinite_groups(self):
+        g = torch.Generator()
+        g.manual_seed(self._seed)
+        while True:
+            if self._shuffle:
+                for im_i in torch.randperm(len(self._groups), generator=g):
+                    group = self._groups[im_i]
+                    yield group[torch.randperm(len(group), generator=g)]
+            else:
+                yield from self._groups
+
+
 class InferenceSampler(Sampler):
     """Produce indices for inference.
 
@@ -496,6 +496,32 @@ def get_closest_rot(rot_est, rot_gt, sym_info):
     return closest_rot_gt
 
 
+def pad_sym_infos(sym_infos, dtype=torch.float32, device="cpu"):
+    """pad a list of sym_infos to a common number of symmetries K.
+
+    sym_infos: list [Kx3x3 or None] (ndarray or tensor)
+    -----
+    sym_rots: [B, K, 3, 3], padded with identity
+    sym_mask: [B, K] bool, True for the valid symmetries
+    """
+    batch_size = len(sym_infos)
+    sym_infos = [
+        None if sym_info is None else np.asarray(torch.as_tensor(sym_info).cpu()).reshape(-1, 3, 3)
+        for sym_info in sym_infos
+    ]
+    num_syms = max([1] + [len(sym_info) for sym_info in sym_infos if sym_info is not None])
+    sym_rots = np.tile(np.eye(3, dtype=np.float32), (batch_size, num_syms, 1, 1))
+    sym_mask = np.zeros((batch_size, num_syms), dtype=bool)
+    for i, sym_info in enumerate(sym_infos):
+        if sym_info is not None:
+            sym_rots[i, : len(sym_info)] = sym_info
+            sym_mask[i, : len(sym_info)] = True
+    # single H2D copy for the whole batch
+    sym_rots = torch.as_tensor(sym_rots).to(device=device, dtype=dtype, non_blocking=True)
+    sym_mask = torch.as_tensor(sym_mask).to(device=device, non_blocking=True)
+    return sym_rots, sym_mask
+
+
 def get_closest_rot_batch(pred_rots, gt_rots, sym_infos):
     """
     get closest gt_rots according to current predicted poses_est and sym_infos
@@ -504,6 +530,7 @@ def get_closest_rot_batch(pred_rots, gt_rots, sym_infos):
     gt_rots: [B, 4] or [B, 3, 3]
     sym_infos: list [Kx3x3 or None],
         stores K rotations regarding symmetries, if not symmetric, None
+        or a tuple (sym_rots [B, K, 3, 3], sym_mask [B, K]) from pad_sym_infos
     -----
     closest_gt_rots: [B, 3, 3]
     """
@@ -513,21 +540,50 @@ def get_closest_rot_batch(pred_rots, gt_rots, sym_infos):
         pred_rots = quat2mat_torch(pred_rots[:, :4])
     if gt_rots.shape[-1] == 4:
         gt_rots = quat2mat_torch(gt_rots[:, :4])
+    pred_rots = pred_rots.detach()
+    gt_rots = gt_rots.detach()
 
-    closest_gt_rots = gt_rots.clone().cpu().numpy()  # B,3,3
-
-    for i in range(batch_size):
-        closest_rot = get_closest_rot(
-            pred_rots[i].detach().cpu().numpy(),
-            gt_rots[i].cpu().numpy(),
-            sym_infos[i],
-        )
-        # TODO: automatically detect rot_gt's format in PM_Loss to avoid converting multiple times
-        closest_gt_rots[i] = closest_rot
-    closest_gt_rots = torch.tensor(closest_gt_rots, device=device, dtype=gt_rots.dtype)
+    if isinstance(sym_infos, (tuple, list)) and len(sym_infos) == 2 and isinstance(sym_infos[1], torch.Tensor):
+        sym_rots, sym_mask = sym_infos
+        sym_rots = sym_rots.to(device=device, dtype=gt_rots.dtype)
+        sym_mask = sym_mask.to(device=device)
+    else:
+        sym_rots, sym_mask = pad_sym_infos(sym_infos, dtype=gt_rots.dtype, device=device)
+
+    # candidates: rot_gt itself and R_gt_m2c x R_sym_m2m ==> R_gt_sym_m2c
+    gt_rots_sym = torch.cat([gt_rots[:, None], torch.matmul(gt_rots[:, None], sym_rots)], dim=1)  # B,1+K,3,3
+    cand_mask = torch.cat([sym_mask.new_ones((batch_size, 1)), sym_mask], dim=1)
+    # the smallest rotation error <==> the largest trace(R_est x R_gt_sym^T)
+    traces = (pred_rots[:, None] * gt_rots_sym).sum(dim=(2, 3))
+    traces = traces.masked_fill(~cand_mask, float("-inf"))
+    closest_inds = traces.argmax(dim=1)  # the first one on ties, like get_closest_rot
+    closest_gt_rots = gt_rots_sym[torch.arange(batch_size, device=device), closest_inds]
     return closest_gt_rots
 
 
+def pad_sym_quats_by_label(sym_infos):
+    """sym_infos: dict {label_idx: Kx3x3 or None} ==> [C, K, 4] quats (identity
+    padded), [C, K] mask.
+
+    Compute it once per sym_infos and pass it to get_closest_pose_batch(_cpu).
+    """
+    num_classes = max(sym_infos.keys()) + 1
+    sym_rots, sym_mask = pad_sym_infos([sym_infos.get(i, None) for i in range(num_classes)])
+    sym_rots = sym_rots.numpy()
+    sym_quats = np.array([[mat2quat(rot) for rot in cls_rots] for cls_rots in sym_rots], dtype=np.float32)
+    return sym_quats, sym_mask.numpy()
+
+
+def _closest_quat_ids(quats_est, quats_gt_sym, cand_mask):
+    """index of the candidate quat with the smallest angle to quats_est
+    (largest |<q_est, q_cand>|); the first one on ties."""
+    if isinstance(quats_est, torch.Tensor):
+        dots = (quats_est[:, None] * quats_gt_sym).sum(-1).abs()
+        return dots.masked_fill(~cand_mask, -1).argmax(dim=1)
+    dots = np.abs((quats_est[:, None] * quats_gt_sym).sum(-1))
+    return np.where(cand_mask, dots, -1).argmax(axis=1)
+
+
 def get_closest_pose_batch(poses_est, poses_gt, sym_infos):
     """
     get closest poses_gt according to current predicted poses_est and sym_infos
@@ -535,27 +591,37 @@ def get_closest_pose_batch(poses_est, poses_gt, sym_infos):
     poses_est: [B, 8]
     poses_gt: [B, 8]
     sym_infos: dict {label_idx: Kx3x3 or None}, stores K rotations regarding symmetries, if not symmetric, None
+        or a tuple (sym_quats [C, K, 4], sym_mask [C, K]) from pad_sym_quats_by_label
     -----
     closest_poses_gt: [B, 8]
     """
     batch_size = poses_est.shape[0]
     device = poses_est.device
-
-    rots_est = quat2mat_torch(poses_est[:, :4])
-    rots_gt = quat2mat_torch(poses_gt[:, :4])
+    dtype = poses_gt.dtype
     labels = poses_est[:, 7].long()
 
-    closest_poses_gt = poses_gt.clone().cpu().numpy()
-
-    for i in range(batch_size):
-        closest_rot = get_closest_rot(
-            rots_est[i].detach().cpu().numpy(),
-            rots_gt[i].cpu().numpy(),
-            sym_infos[int(labels[i])],
-        )
-        # TODO: automatically detect rot_gt's format in PM_Loss to avoid converting multiple times
-        closest_poses_gt[i][:4] = mat2quat(closest_rot)
-    closest_poses_gt = torch.tensor(closest_poses_gt, device=device, dtype=poses_gt.dtype)
+    if isinstance(sym_infos, dict):
+        sym_quats, sym_mask = pad_sym_quats_by_label(sym_infos)
+    else:
+        sym_quats, sym_mask = sym_infos
+    sym_quats = torch.as_tensor(sym_quats).to(device=device, dtype=dtype, non_blocking=True)[labels]  # B,K,4
+    sym_mask = torch.as_tensor(sym_mask).to(device=device, non_blocking=True)[labels]
+
+    quats_est = F.normalize(poses_est[:, :4].detach(), p=2, dim=1)
+    quats_gt = F.normalize(poses_gt[:, :4], p=2, dim=1)
+    # q_gt x q_sym <==> R_gt_m2c x R_sym_m2m
+    num_syms = sym_quats.shape[1]
+    quats_gt_sym = torch.cat(
+        [quats_gt[:, None], qmul_torch(quats_gt[:, None].expand(-1, num_syms, -1).contiguous(), sym_quats)], dim=1
+    )
+    cand_mask = torch.cat([sym_mask.new_ones((batch_size, 1)), sym_mask], dim=1)
+    closest_inds = _closest_quat_ids(quats_est, quats_gt_sym, cand_mask)
+    closest_quats = quats_gt_sym[torch.arange(batch_size, device=device), closest_inds]
+    # the same sign convention as mat2quat (w >= 0)
+    closest_quats = torch.where(closest_quats[:, :1] < 0, -closest_quats, closest_quats)
+
+    closest_poses_gt = poses_gt.clone()
+    closest_poses_gt[:, :4] = closest_quats
     return closest_poses_gt
 
 
@@ -566,20 +632,39 @@ def get_closest_pose_batch_cpu(poses_est, poses_gt, sym_infos):
     poses_est: [B, 8] ndarray
     poses_gt: [B, 8] ndarray
     sym_infos: dict {label_idx: Kx3x3 or None}, stores K rotations regarding symmetries, if not symmetric, None
+        or a tuple (sym_quats [C, K, 4], sym_mask [C, K]) from pad_sym_quats_by_label
     -----
     closest_poses_gt: [B, 8]
     """
     batch_size = poses_est.shape[0]
-
-    rots_est = [quat2mat(poses_est[i, :4]) for i in range(batch_size)]
-    rots_gt = [quat2mat(poses_gt[i, :4]) for i in range(batch_size)]
     labels = poses_est[:, 7].astype(int)
 
-    closest_poses_gt = poses_gt.copy()
+    if isinstance(sym_infos, dict):
+        sym_quats, sym_mask = pad_sym_quats_by_label(sym_infos)
+    else:
+        sym_quats, sym_mask = sym_infos
+    sym_quats, sym_mask = sym_quats[labels], sym_mask[labels]
 
-    for i in range(batch_size):
-        closest_rot = get_closest_rot(rots_est[i], rots_gt[i], sym_infos[int(labels[i])])
-        closest_poses_gt[i][:4] = mat2quat(closest_rot)
+    quats_est = poses_est[:, :4] / LA.norm(poses_est[:, :4], axis=1, keepdims=True)
+    quats_gt = poses_gt[:, :4] / LA.norm(poses_gt[:, :4], axis=1, keepdims=True)
+    num_syms = sym_quats.shape[1]
+    quats_gt_sym = np.concatenate(
+        [
+            quats_gt[:, None],
+            qmul_torch(
+                torch.as_tensor(np.repeat(quats_gt[:, None], num_syms, axis=1)),
+                torch.as_tensor(sym_quats.astype(quats_gt.dtype)),
+            ).numpy(),
+        ],
+        axis=1,
+    )
+    cand_mask = np.concatenate([np.ones((batch_size, 1), dtype=bool), sym_mask], axis=1)
+    closest_inds = _closest_quat_ids(quats_est, quats_gt_sym, cand_mask)
+    closest_quats = quats_gt_sym[np.arange(batch_size), closest_inds]
+    closest_quats = np.where(closest_quats[:, :1] < 0, -closest_quats, closest_quats)
+
+    closest_poses_gt = poses_gt.copy()
+    closest_poses_gt[:, :4] = closest_quats
     return closest_poses_gt
 
 
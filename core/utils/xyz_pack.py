@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Packed xyz_crop labels: one file per scene instead of one pickle per
+instance.
+
+The pack of the scene dir `xyz_crop/000001/` is `xyz_crop/000001.xyzpack`:
+    magic | blob_0 | blob_1 | ... | json index | index length (uint64, little endian) | magic
+The index maps the name of the original pickle (e.g. "000000_000000-xyz.pkl")
+to the offset/size of its blob, its xyxy and the quantization range.
+
+Storage types of xyz_crop:
+    float32, float16: as is
+    uint16: quantized against the [lo, hi] range of each instance (which lies in
+        the object extent), 0 is kept for the background so the object mask
+        (xyz != 0) is unchanged
+Optionally the blobs are zlib compressed.
+"""
+import json
+import os.path as osp
+import struct
+import zlib
+
+import mmcv
+import numpy as np
+
+XYZ_PACK_MAGIC = b"XYZPACK1"
+XYZ_PACK_EXT = ".xyzpack"
+XYZ_PACK_DTYPES = ["float32", "float16", "uint16"]
+_UINT16_MAX_CODE = 65535
+
+
+def get_xyz_pack_path(xyz_path):
+    """the pack which (may) hold the xyz pickle."""
+    return osp.dirname(xyz_path) + XYZ_PACK_EXT
+
+
+def encode_xyz_crop(xyz_crop, dtype="float16"):
+    """
+    Returns:
+        blob (bytes), lo (list), hi (list)
+    """
+    xyz_crop = np.asarray(xyz_crop, dtype=np.float32)
+    if dtype in ["float32", "float16"]:
+        return np.ascontiguousarray(xyz_crop.astype(dtype)).tobytes(), None, None
+    assert dtype == "uint16", dtype
+    fg = (xyz_crop[:, :, 0] != 0) | (xyz_crop[:, :, 1] != 0) | (xyz_crop[:, :, 2] != 0)
+    if fg.any():
+        lo = xyz_crop[fg].min(0)
+        hi = xyz_crop[fg].max(0)
+    else:
+        lo = hi = np.zeros(3, dtype=np.float32)
+    step = np.maximum(hi - lo, 1e-8) / (_UINT16_MAX_CODE - 1)
+    # codes of the object in [1, 65535], 0 for the background
+    codes = np.round((xyz_crop - lo) / step).astype(np.int64) + 1
+    codes = np.clip(codes, 1, _UINT16_MAX_CODE).astype(np.uint16)
+    codes[~fg] = 0
+    return codes.tobytes(), lo.tolist(), hi.tolist()
+
+
+def decode_xyz_crop(blob, entry, dtype="float16"):
+    """float32 HxWx3 xyz_crop."""
+    x1, y1, x2, y2 = entry["xyxy"]
+    shape = (y2 - y1 + 1, x2 - x1 + 1, 3)
+    if dtype in ["float32", "float16"]:
+        return np.frombuffer(blob, dtype=dtype).reshape(shape).astype(np.float32)
+    assert dtype == "uint16", dtype
+    codes = np.frombuffer(blob, dtype=np.uint16).reshape(shape)
+    lo = np.array(entry["lo"], dtype=np.float32)
+    hi = np.array(entry["hi"], dtype=np.float32)
+    step = np.maximum(hi - lo, 1e-8) / (_UINT16_MAX_CODE - 1)
+    xyz_crop = lo + (codes.astype(np.float32) - 1) * step
+    xyz_crop[codes == 0] = 0
+    return xyz_crop
+
+
+def write_xyz_pack(pack_path, xyz_infos, dtype="float16", compress=False):
+    """
+    Args:
+        pack_path (str): output file
+        xyz_infos (iterable): (name, xyz_info) pairs, xyz_info is the content of
+            an xyz pickle ({"xyxy": [x1, y1, x2, y2], "xyz_crop": HxWx3})
+        dtype (str): float32 | float16 | uint16
+        compress (bool): zlib compress the blobs
+    Returns:
+        int: number of packed xyz infos
+    """
+    assert dtype in XYZ_PACK_DTYPES, dtype
+    entries = {}
+    with open(pack_path, "wb") as f:
+        f.write(XYZ_PACK_MAGIC)
+        for name, xyz_info in xyz_infos:
+            x1, y1, x2, y2 = [int(_v) for _v in xyz_info["xyxy"]]
+            xyz_crop = xyz_info["xyz_crop"]
+            assert xyz_crop.shape[:2] == (y2 - y1 + 1, x2 - x1 + 1), (name, xyz_crop.shape, xyz_info["xyxy"])
+            blob, lo, hi = encode_xyz_crop(xyz_crop, dtype=dtype)
+            if compress:
+                blob = zlib.compress(blob)
+            entry = {"offset": f.tell(), "nbytes": len(blob), "xyxy": [x1, y1, x2, y2]}
+            if lo is not None:
+                entry["lo"] = lo
+                entry["hi"] = hi
+            entries[name] = entry
+            f.write(blob)
+        index = json.dumps({"dtype": dtype, "compress": bool(compress), "entries": entries}).encode("utf-8")
+        f.write(index)
+        f.write(struct.pack("<Q", len(index)))
+        f.write(XYZ_PACK_MAGIC)
+    return len(entries)
+
+
+class XyzPack(object):
+    """xyz infos of a scene, the file is mapped lazily (i.e. in the data
+    loader workers)."""
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        tail = len(XYZ_PACK_MAGIC) + 8
+        with open(pack_path, "rb") as f:
+            assert f.read(len(XYZ_PACK_MAGIC)) == XYZ_PACK_MAGIC, "not an xyz pack: {}".format(pack_path)
+            f.seek(-tail, 2)
+            (index_len,) = struct.unpack("<Q", f.read(8))
+            assert f.read(len(XYZ_PACK_MAGIC)) == XYZ_PACK_MAGIC, "truncated xyz pack: {}".format(pack_path)
+            f.seek(-tail - index_len, 2)
+            index = json.loads(f.read(index_len).decode("utf-8"))
+        self.dtype = index["dtype"]
+        self.compress = index["compress"]
+        self.entries = index["entries"]
+        self._buf = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def load(self, name):
+        """the same dict as mmcv.load(xyz_path), xyz_crop is float32."""
+        if self._buf is None:
+            self._buf = np.memmap(self.pack_path, dtype=np.uint8, mode="r")
+        entry = self.entries[name]
+        blob = self._buf[entry["offset"] : entry["offset"] + entry["nbytes"]]
+        if self.compress:
+            blob = zlib.decompress(blob)
+        return {"xyxy": entry["xyxy"], "xyz_crop": decode_xyz_crop(blob, entry, self.dtype)}
+
+
+# pack path => XyzPack or None (no pack), per process
+_XYZ_PACKS = {}
+
+
+def _get_xyz_pack(xyz_path):
+    pack_path = get_xyz_pack_path(xyz_path)
+    if pack_path not in _XYZ_PACKS:
+        _XYZ_PACKS[pack_path] = XyzPack(pack_path) if osp.exists(pack_path) else None
+    return _XYZ_PACKS[pack_path]
+
+
+def load_xyz_info(xyz_path):
+    """load the xyz info of an instance from the pack of its scene, or from
+    the pickle if the scene has not been packed."""
+    xyz_pack = _get_xyz_pack(xyz_path)
+    if xyz_pack is not None:
+        return xyz_pack.load(osp.basename(xyz_path))
+    return mmcv.load(xyz_path)
+
+
+def xyz_exists(xyz_path):
+    xyz_pack = _get_xyz_pack(xyz_path)
+    if xyz_pack is not None:
+        return osp.basename(xyz_path) in xyz_pack
+    return osp.exists(xyz_path)
@@ -1,4 +1,5 @@
 import torch
+import torch.nn.functional as F
 from detectron2.layers.roi_align import ROIAlign
 from torchvision.ops import RoIPool
 
@@ -93,3 +94,44 @@ def batch_crop_resize(x, rois, out_H, out_W, aligned=True, interpolation="biline
     else:
         raise ValueError(f"Wrong interpolation type: {interpolation}")
     return op(x, rois)
+
+
+def stack_padded(tensors, value=0):
+    """stack (C)HW tensors of different sizes, padded at the bottom/right.
+
+    Returns:
+        B(C)HW tensor
+    """
+    H = max(_t.shape[-2] for _t in tensors)
+    W = max(_t.shape[-1] for _t in tensors)
+    if all(_t.shape[-2:] == (H, W) for _t in tensors):
+        return torch.stack(tensors, dim=0)
+    return torch.stack([F.pad(_t, (0, W - _t.shape[-1], 0, H - _t.shape[-2]), value=value) for _t in tensors], dim=0)
+
+
+def batch_crop_resize_by_center_scale(x, centers, scales, out_res, interpolation="bilinear"):
+    """batched version of crop_resize_by_warp_affine (no rotation), one roi per
+    image.
+
+    Args:
+        x: BCHW (float)
+        centers: Bx2, scales: B, the square rois in pixels of x
+        out_res (int):
+        interpolation: bilinear | nearest
+    Returns:
+        B x C x out_res x out_res, 0 outside of x (as cv2.BORDER_CONSTANT)
+    """
+    bs, _, H, W = x.shape
+    # the pixel coordinates sampled by cv2.warpAffine for get_affine_transform(center, scale, 0, out_res)
+    steps = torch.arange(out_res, dtype=torch.float32, device=x.device) - out_res / 2
+    offsets = steps.view(1, -1) * (scales.view(-1, 1).to(torch.float32) / out_res)  # B x out_res
+    xs = centers[:, 0:1].to(torch.float32) + offsets
+    ys = centers[:, 1:2].to(torch.float32) + offsets
+    # pixel coordinates => normalized coordinates of grid_sample (align_corners=False)
+    xs = (2 * xs + 1) / W - 1
+    ys = (2 * ys + 1) / H - 1
+    grid = torch.stack(
+        [xs.view(bs, 1, out_res).expand(bs, out_res, out_res), ys.view(bs, out_res, 1).expand(bs, out_res, out_res)],
+        dim=-1,
+    )
+    return F.grid_sample(x, grid, mode=interpolation, padding_mode="zeros", align_corners=False)
@@ -0,0 +1,1228 @@
+# Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
+# Center for Machine Perception, Czech Technical University in Prague
+# modified from eval_bop19.py, eval_calc_errors.py and eval_calc_scores.py
+
+"""Evaluation of 6D object pose estimates in the BOP format, in the calling
+process: pose errors -> matches -> performance scores.
+
+The scripts eval_calc_errors.py, eval_calc_scores.py and
+eval_pose_results_more.py are command line wrappers of this module.
+
+The models, models info, symmetries, GT annotations and renderers of a
+dataset split are held by EvalAssets, which are cached per split, so repeated
+evaluations (e.g. the periodic validation during training) only calculate the
+errors and scores.
+"""
+import copy
+import multiprocessing
+import os.path as osp
+import time
+
+import numpy as np
+from scipy import spatial
+
+from lib.pysixd import config
+from lib.pysixd import dataset_params
+from lib.pysixd import inout
+from lib.pysixd import misc
+from lib.pysixd import pose_error
+from lib.pysixd import pose_matching
+from lib.pysixd import renderer
+from lib.pysixd import score
+
+# PARAMETERS (can be overwritten by the callers).
+################################################################################
+VSD_DELTAS = {
+    "hb": 15,
+    "icbin": 15,
+    "icmi": 15,
+    "itodd": 5,
+    "lm": 15,
+    "lmo": 15,
+    "ruapc": 15,
+    "tless": 15,
+    "tudl": 15,
+    "tyol": 15,
+    "ycbv": 15,
+}
+
+# Errors to calculate with their thresholds of correctness.
+ERRORS = [
+    {
+        "n_top": -1,
+        "type": "vsd",
+        "vsd_deltas": VSD_DELTAS,
+        "vsd_taus": list(np.arange(0.05, 0.51, 0.05)),
+        "vsd_normalized_by_diameter": True,
+        "correct_th": [[th] for th in np.arange(0.05, 0.51, 0.05)],
+    },
+    {
+        "n_top": -1,
+        "type": "mssd",
+        "correct_th": [[th] for th in np.arange(0.05, 0.51, 0.05)],
+    },
+    {
+        "n_top": -1,
+        "type": "mspd",
+        "correct_th": [[th] for th in np.arange(5, 51, 5)],
+    },
+    {
+        "n_top": -1,
+        "type": "add",
+        "correct_th": [[th] for th in [0.02, 0.05, 0.1]],
+    },
+    {
+        "n_top": -1,
+        "type": "adi",
+        "correct_th": [[th] for th in [0.02, 0.05, 0.1]],
+    },  # diameter
+    {
+        "n_top": -1,
+        "type": "ad",  # adi for symmetric objects, add for normal objects
+        "correct_th": [[th] for th in [0.02, 0.05, 0.1]],  # diameter
+    },
+    ##################
+    # ADD(-S) with absolute threshold 2cm, for YCB-Video
+    {"n_top": -1, "type": "ABSadd", "correct_th": [[th] for th in [2]]},
+    {"n_top": -1, "type": "ABSadi", "correct_th": [[th] for th in [2]]},
+    # ABSadi for symmetric objects, ABSadd for normal objects
+    {"n_top": -1, "type": "ABSad", "correct_th": [[th] for th in [2]]},
+    #################
+    # AUC of ADD(-S) with a maximum distance 10cm, for YCB-Video, it uses the VOC 11 points method
+    {
+        "n_top": -1,
+        "type": "AUCadd",
+        "correct_th": [[th] for th in np.linspace(10 / 10, 10, num=10)],
+    },
+    {
+        "n_top": -1,
+        "type": "AUCadi",
+        "correct_th": [[th] for th in np.linspace(10 / 10, 10, num=10)],
+    },
+    # AUCadi for symmetric objects, AUCadd for normal objects
+    {
+        "n_top": -1,
+        "type": "AUCad",
+        "correct_th": [[th] for th in np.linspace(10 / 10, 10, num=10)],
+    },
+    ##################
+    {
+        "n_top": -1,
+        "type": "re",
+        "correct_th": [[th] for th in [2, 5, 10]],
+    },  # deg
+    {
+        "n_top": -1,
+        "type": "te",
+        "correct_th": [[th] for th in [2, 5, 10]],
+    },  # cm
+    {
+        "n_top": -1,
+        "type": "rete",
+        "correct_th": [[2, 2], [5, 5], [10, 10]],
+    },  # deg, cm
+    {
+        "n_top": -1,
+        "type": "proj",
+        "correct_th": [[th] for th in [2, 5, 10]],
+    },  # pixel
+    ##################
+    # sym aware
+    {
+        "n_top": -1,
+        "type": "reS",
+        "correct_th": [[th] for th in [2, 5, 10]],
+    },  # deg
+    {
+        "n_top": -1,
+        "type": "teS",
+        "correct_th": [[th] for th in [2, 5, 10]],
+    },  # cm
+    {
+        "n_top": -1,
+        "type": "reteS",
+        "correct_th": [[2, 2], [5, 5], [10, 10]],
+    },  # deg, cm
+    {
+        "n_top": -1,
+        "type": "projS",
+        "correct_th": [[th] for th in [2, 5, 10]],
+    },  # pixel
+]
+KNOWN_ERROR_TYPES = [_error["type"] for _error in ERRORS]
+
+# Pose errors that will be normalized by object diameter before thresholding.
+NORMALIZED_BY_DIAMETER = ["ad", "add", "adi", "mssd"]
+# Pose errors that will be normalized the image width before thresholding.
+NORMALIZED_BY_IM_WIDTH = ["mspd"]
+
+# The errors which need the object models / models info / symmetries.
+MODEL_ERROR_TYPES = [
+    "ad",
+    "add",
+    "adi",
+    "mssd",
+    "mspd",
+    "proj",
+    "projS",
+    "ABSadd",
+    "ABSadi",
+    "ABSad",
+    "AUCadd",
+    "AUCadi",
+    "AUCad",
+]
+MODELS_INFO_ERROR_TYPES = ["ad", "add", "adi", "vsd", "mssd", "mspd", "cus", "reteS", "reS", "teS", "projS"]
+SYM_ERROR_TYPES = ["mssd", "mspd", "reteS", "reS", "teS", "projS"]
+
+DEFAULT_PARAMS = {
+    # Top N pose estimates (with the highest score) to be evaluated for each
+    # object class in each image.
+    # Options: 0 = all, -1 = given by the number of GT poses.
+    "n_top": -1,
+    # Names of the errors to calculate (see ERRORS).
+    "error_types": ["mspd", "mssd", "vsd", "reteS", "add", "adi", "teS", "reS", "projS"],
+    # VSD parameters.
+    "vsd_deltas": VSD_DELTAS,
+    "vsd_taus": list(np.arange(0.05, 0.51, 0.05)),
+    "vsd_normalized_by_diameter": True,
+    # MSSD/MSPD parameters (see misc.get_symmetry_transformations).
+    "max_sym_disc_step": 0.01,
+    # Whether to ignore/break if some errors are missing.
+    "skip_missing": True,
+    # Number of worker processes over which the images are sharded (each worker
+    # owns its renderer). Options: 0 or 1 = serial.
+    "num_workers": 0,
+    # Number of consecutive images of a scene per shard (0 = whole scene).
+    "shard_size": 0,
+    # Type of the renderer (used for the VSD pose error function).
+    "renderer_type": "cpp",  # Options: 'cpp', 'python', 'numpy', 'aae', 'egl'.
+    # Minimum visible surface fraction of a valid GT pose.
+    # -1 == k most visible GT poses will be considered, where k is given by
+    # the "inst_count" item loaded from "targets_filename".
+    "visib_gt_min": -1,
+    "normalized_by_diameter": NORMALIZED_BY_DIAMETER,
+    "normalized_by_im_width": NORMALIZED_BY_IM_WIDTH,
+    # Folder for the calculated pose errors and performance scores.
+    "eval_path": config.eval_path,
+    # Folder containing the BOP datasets.
+    "datasets_path": config.datasets_path,
+    # File with a list of estimation targets to consider. The file is assumed to
+    # be stored in the dataset folder.
+    "targets_filename": "test_targets_bop19.json",
+    # Skip calculating the errors, load the saved ones.
+    "score_only": False,
+    # Format of the saved errors. Options: 'npz' (one columnar store with all
+    # the scenes and VSD taus per error type, see inout.save_pose_errors),
+    # 'json' (one file per scene and error signature, as the BOP toolkit).
+    "errors_format": "npz",
+    # Template of path to the npz store with calculated errors.
+    "errors_store_tpath": osp.join("{eval_path}", "{result_name}", "errors_{error_sign}.npz"),
+    # Template of path to the json files with calculated errors.
+    "errors_tpath": osp.join(
+        "{eval_path}",
+        "{result_name}",
+        "{error_sign}",
+        "errors_{scene_id:06d}.json",
+    ),
+    # Whether to save the established matches (besides the scores).
+    "save_matches": True,
+    # Template of path to the output file with established matches and calculated
+    # scores.
+    "out_matches_tpath": osp.join("{eval_path}", "{error_dir_path}", "matches_{score_sign}.json"),
+    "out_scores_tpath": osp.join("{eval_path}", "{error_dir_path}", "scores_{score_sign}.json"),
+}
+################################################################################
+
+
+def get_default_params(**kwargs):
+    """copy of DEFAULT_PARAMS updated with kwargs."""
+    p = copy.deepcopy(DEFAULT_PARAMS)
+    for k, v in kwargs.items():
+        if k not in p:
+            raise ValueError("Unknown parameter: {}".format(k))
+        p[k] = v
+    return p
+
+
+def parse_result_name(result_name):
+    """{method}_{dataset}-{split}[-{split_type}] => (method, dataset, split,
+    split_type)"""
+    result_info = result_name.split("_")
+    method = str(result_info[0])
+    dataset_info = result_info[1].split("-")
+    dataset = str(dataset_info[0])
+    split = str(dataset_info[1])
+    split_type = str(dataset_info[2]) if len(dataset_info) > 2 else None
+    return method, dataset, split, split_type
+
+
+def parse_error_sign(error_sign):
+    """error:{type}_ntop:{n_top}... => (error type, n_top)"""
+    err_type = str(error_sign.split("_")[0].split(":")[1])
+    n_top = int(error_sign.split("_")[1].split(":")[1])
+    return err_type, n_top
+
+
+def get_error_signs(error_type, n_top, dataset, vsd_deltas=VSD_DELTAS, vsd_taus=None):
+    """the error signatures of an error type, one per tau for VSD."""
+    if error_type == "vsd":
+        if vsd_taus is None:
+            vsd_taus = DEFAULT_PARAMS["vsd_taus"]
+        return [
+            misc.get_error_signature(error_type, n_top, vsd_delta=vsd_deltas[dataset], vsd_tau=vsd_tau)
+            for vsd_tau in vsd_taus
+        ]
+    return [misc.get_error_signature(error_type, n_top)]
+
+
+def organize_ests(ests):
+    """Organizes the pose estimates by scene, image and object.
+
+    :param ests: List of pose estimates, as loaded by inout.load_bop_results, or
+      with R, t as (nested) lists (t in mm).
+    """
+    ests_org = {}
+    for est in ests:
+        est = dict(est)
+        est["score"] = float(est["score"])
+        est["R"] = np.asarray(est["R"], dtype=np.float64).reshape((3, 3))
+        est["t"] = np.asarray(est["t"], dtype=np.float64).reshape((3, 1))
+        ests_org.setdefault(est["scene_id"], {}).setdefault(est["im_id"], {}).setdefault(est["obj_id"], []).append(est)
+    return ests_org
+
+
+def get_average_time_per_image(ests):
+    """-1 if the time of some estimates is not available."""
+    times = {}
+    for est in ests:
+        result_key = "{:06d}_{:06d}".format(est["scene_id"], est["im_id"])
+        if est["time"] < 0:
+            # All estimation times must be provided.
+            return -1.0
+        elif result_key in times:
+            if abs(times[result_key] - est["time"]) > 0.001:
+                raise ValueError(
+                    "The running time for scene {} and image {} is not the same for "
+                    "all estimates.".format(est["scene_id"], est["im_id"])
+                )
+        else:
+            times[result_key] = est["time"]
+    if len(times) == 0:
+        return -1.0
+    return float(np.mean(list(times.values())))
+
+
+class EvalAssets(object):
+    """The dataset parameters, targets, GT annotations, object models and
+    renderers of a dataset split, loaded on first use."""
+
+    def __init__(self, datasets_path, dataset, split, split_type=None, max_sym_disc_step=0.01):
+        self.dataset = dataset
+        self.max_sym_disc_step = max_sym_disc_step
+        self.dp_split = dataset_params.get_split_params(datasets_path, dataset, split, split_type)
+        self.dp_model = dataset_params.get_model_params(datasets_path, dataset, "eval")
+        self.models = {}
+        self.models_kdtree = {}
+        self.models_mssd_pts = {}
+        self.models_sym = {}
+        self._models_info = None
+        self._targets_org = {}
+        self._scene_gt = {}
+        self._scene_gt_info = {}
+        self._scene_camera = {}
+        self.renderers = {}
+
+    @property
+    def models_info(self):
+        if self._models_info is None:
+            self._models_info = inout.load_json(self.dp_model["models_info_path"], keys_to_int=True)
+        return self._models_info
+
+    def set_models(self, models):
+        """use already loaded object models (obj_id => model with pts in mm)."""
+        self.models.update(models)
+
+    def get_model(self, obj_id):
+        if obj_id not in self.models:
+            self.models[obj_id] = inout.load_ply(self.dp_model["model_tpath"].format(obj_id=obj_id))
+        return self.models[obj_id]
+
+    def get_model_kdtree(self, obj_id):
+        # KD-tree of the model points (in the model space, reused by ADI)
+        if obj_id not in self.models_kdtree:
+            self.models_kdtree[obj_id] = spatial.cKDTree(self.get_model(obj_id)["pts"])
+        return self.models_kdtree[obj_id]
+
+    def get_model_mssd_pts(self, obj_id):
+        # the model points which determine MSSD (vertices of their convex hull)
+        if obj_id not in self.models_mssd_pts:
+            self.models_mssd_pts[obj_id] = pose_error.get_mssd_support_pts(self.get_model(obj_id)["pts"])
+        return self.models_mssd_pts[obj_id]
+
+    def get_model_sym(self, obj_id):
+        if obj_id not in self.models_sym:
+            self.models_sym[obj_id] = misc.get_symmetry_transformations(
+                self.models_info[obj_id], self.max_sym_disc_step
+            )
+        return self.models_sym[obj_id]
+
+    def get_targets_org(self, targets_filename):
+        """the estimation targets organized by scene, image and object."""
+        if targets_filename not in self._targets_org:
+            targets = inout.load_json(osp.join(self.dp_split["base_path"], targets_filename))
+            targets_org = {}
+            for target in targets:
+                targets_org.setdefault(target["scene_id"], {}).setdefault(target["im_id"], {})[
+                    target["obj_id"]
+                ] = target
+            self._targets_org[targets_filename] = targets_org
+        return self._targets_org[targets_filename]
+
+    def get_scene_gt(self, scene_id):
+        if scene_id not in self._scene_gt:
+            self._scene_gt[scene_id] = inout.load_scene_gt(self.dp_split["scene_gt_tpath"].format(scene_id=scene_id))
+        return self._scene_gt[scene_id]
+
+    def get_scene_gt_info(self, scene_id):
+        if scene_id not in self._scene_gt_info:
+            self._scene_gt_info[scene_id] = inout.load_json(
+                self.dp_split["scene_gt_info_tpath"].format(scene_id=scene_id), keys_to_int=True
+            )
+        return self._scene_gt_info[scene_id]
+
+    def get_scene_camera(self, scene_id):
+        if scene_id not in self._scene_camera:
+            self._scene_camera[scene_id] = inout.load_scene_camera(
+                self.dp_split["scene_camera_tpath"].format(scene_id=scene_id)
+            )
+        return self._scene_camera[scene_id]
+
+    def get_renderer(self, renderer_type):
+        """a depth renderer of all the objects of the dataset."""
+        if renderer_type not in self.renderers:
+            misc.log("Initializing renderer...")
+            self.renderers[renderer_type] = self._create_renderer(renderer_type)
+        return self.renderers[renderer_type]
+
+    def _create_renderer(self, renderer_type):
+        width, height = self.dp_split["im_size"]
+        model_paths = [self.dp_model["model_tpath"].format(obj_id=obj_id) for obj_id in self.dp_model["obj_ids"]]
+        if renderer_type in ["python", "cpp", "numpy"]:
+            ren = renderer.create_renderer(width, height, renderer_type, mode="depth")
+            for obj_id, model_path in zip(self.dp_model["obj_ids"], model_paths):
+                ren.add_object(obj_id, model_path)
+        elif renderer_type == "egl":
+            from lib.egl_renderer.egl_renderer import EGLRenderer
+
+            texture_paths = [
+                model_path.replace(".ply", ".png") if osp.exists(model_path.replace(".ply", ".png")) else ""
+                for model_path in model_paths
+            ]
+            ren = EGLRenderer(
+                model_paths=model_paths,
+                texture_paths=texture_paths,
+                vertex_scale=1,
+                model_loadfn="pyassimp",
+                use_cache=True,
+                width=width,
+                height=height,
+                znear=0.01,
+                zfar=10000,
+            )
+        elif renderer_type == "aae":
+            from lib.meshrenderer.meshrenderer_phong_color import Renderer
+
+            ren = Renderer(
+                model_paths,
+                vertex_scale=1.0,
+                height=height,
+                width=width,
+                near=0.01,
+                far=10000,
+                model_load_fn="pyassimp",
+                recalculate_normals=True,
+                use_cache=False,
+            )
+        else:
+            raise ValueError("Unknown renderer type: {}".format(renderer_type))
+        return ren
+
+    def prepare(self, error_type, renderer_type=None):
+        """load the assets needed by an error type (e.g. before forking the
+        workers), the renderers are created by each process."""
+        for obj_id in self.dp_model["obj_ids"]:
+            if error_type in MODEL_ERROR_TYPES:
+                self.get_model(obj_id)
+            if error_type in ["ad", "adi", "ABSadi", "ABSad", "AUCadi", "AUCad"]:
+                self.get_model_kdtree(obj_id)
+            if error_type == "mssd":
+                self.get_model_mssd_pts(obj_id)
+            if error_type in SYM_ERROR_TYPES:
+                self.get_model_sym(obj_id)
+        if error_type in MODELS_INFO_ERROR_TYPES:
+            _ = self.models_info
+
+
+_EVAL_ASSETS = {}
+
+
+def get_eval_assets(datasets_path, dataset, split, split_type=None, max_sym_disc_step=0.01):
+    """the (process-wide) cached EvalAssets of a dataset split."""
+    key = (osp.abspath(datasets_path), dataset, split, split_type, max_sym_disc_step)
+    if key not in _EVAL_ASSETS:
+        _EVAL_ASSETS[key] = EvalAssets(datasets_path, dataset, split, split_type, max_sym_disc_step)
+    return _EVAL_ASSETS[key]
+
+
+# Error calculation.
+# ------------------------------------------------------------------------------
+def _calc_est_errors(p, assets, error_type, obj_id, est, gt, K, vsd_errs, sym_errs, est_id, gt_id):
+    """errors of a pose estimate w.r.t. a GT pose (of the same object class)."""
+    # Estimated pose.
+    R_e = est["R"]
+    t_e = est["t"]
+    # Ground-truth pose.
+    R_g = gt["cam_R_m2c"]
+    t_g = gt["cam_t_m2c"]
+
+    if error_type == "vsd":
+        # Pairs with non-overlapping sphere projections get 1.0.
+        return vsd_errs[(est_id, gt_id)]
+
+    if error_type in ["ad", "add", "adi", "mssd"]:
+        # Check if the bounding spheres of the object in the two poses
+        # overlap (to speed up calculation of some errors).
+        spheres_overlap = np.linalg.norm(t_e - t_g) < assets.models_info[obj_id]["diameter"]
+        if not spheres_overlap:
+            # Infinite error if the bounding spheres do not overlap. With
+            # typically used values of the correctness threshold for the AD
+            # error (e.g. k*diameter, where k = 0.1), such pose estimates
+            # would be considered incorrect anyway.
+            return [float("inf")]
+
+    if error_type in ["mssd", "mspd"]:
+        return [sym_errs[(est_id, gt_id)]]
+
+    if error_type in ["ad", "add", "adi", "ABSad", "ABSadd", "ABSadi", "AUCad", "AUCadd", "AUCadi"]:
+        pts = assets.get_model(obj_id)["pts"]
+        use_adi = error_type in ["adi", "ABSadi", "AUCadi"] or (
+            error_type in ["ad", "ABSad", "AUCad"] and obj_id in assets.dp_model["symmetric_obj_ids"]
+        )
+        if use_adi:
+            e = pose_error.adi(R_e, t_e, R_g, t_g, pts, model_kdtree=assets.get_model_kdtree(obj_id))
+        else:
+            e = pose_error.add(R_e, t_e, R_g, t_g, pts)
+        if error_type.startswith("ABS") or error_type.startswith("AUC"):
+            e = e / 10  # mm to cm
+        return [e]
+
+    if error_type == "proj":  # arp2d
+        return [pose_error.arp_2d(R_e, t_e, R_g, t_g, pts=assets.get_model(obj_id)["pts"], K=K)]
+
+    if error_type == "projS":  # sym-aware arp2d
+        return [
+            pose_error.arp_2d_sym(
+                R_e, t_e, R_g, t_g, pts=assets.get_model(obj_id)["pts"], K=K, syms=assets.get_model_sym(obj_id)
+            )
+        ]
+
+    if error_type == "cus":
+        # Check if the projections of the bounding spheres of the object in
+        # the two poses overlap (to speed up calculation of some errors).
+        radius = 0.5 * assets.models_info[obj_id]["diameter"]
+        if not misc.overlapping_sphere_projections(radius, t_e.squeeze(), t_g.squeeze()):
+            return [1.0]
+        ren = assets.get_renderer(p["renderer_type"])
+        return [pose_error.cus(R_e, t_e, R_g, t_g, K, ren, obj_id, renderer_type=p["renderer_type"])]
+
+    if error_type == "rete":
+        return [pose_error.re(R_e, R_g), pose_error.te(t_e, t_g) / 10]  # mm to cm
+
+    if error_type == "reteS":
+        syms = assets.get_model_sym(obj_id)
+        return [pose_error.re_sym(R_e, R_g, syms=syms), pose_error.te_sym(t_e, t_g, R_gt=R_g, syms=syms) / 10]
+
+    if error_type == "re":
+        return [pose_error.re(R_e, R_g)]
+
+    if error_type == "reS":
+        return [pose_error.re_sym(R_e, R_g, syms=assets.get_model_sym(obj_id))]
+
+    if error_type == "te":
+        return [pose_error.te(t_e, t_g) / 10]  # mm to cm
+
+    if error_type == "teS":
+        return [pose_error.te_sym(t_e, t_g, R_gt=R_g, syms=assets.get_model_sym(obj_id)) / 10]  # mm to cm
+
+    raise ValueError("Unknown pose error function: {}.".format(error_type))
+
+
+def calc_shard_errors(p, assets, error_type, dataset, targets_org, ests_org, shard):
+    """Calculates errors of the pose estimates in a range of images of a scene.
+
+    :param shard: (scene_id, im_ind_start, im_ind_end), where the indices refer to
+      the order of the images in targets_org[scene_id].
+    :return: (scene_id, im_ind_start, list of calculated errors, number of estimates).
+    """
+    scene_id, im_ind_start, im_ind_end = shard
+    scene_targets = list(targets_org[scene_id].items())[im_ind_start:im_ind_end]
+    ests_counter = 0
+
+    # Camera and GT poses for the current scene.
+    scene_camera = assets.get_scene_camera(scene_id)
+    scene_gt = assets.get_scene_gt(scene_id)
+    models_info = assets.models_info if error_type in MODELS_INFO_ERROR_TYPES else None
+
+    scene_errs = []
+
+    for im_ind, (im_id, im_targets) in enumerate(scene_targets, im_ind_start):
+
+        if im_ind % 10 == 0:
+            misc.log(
+                "Calculating error {} - dataset: {}, scene: {}, im: {}".format(error_type, dataset, scene_id, im_ind)
+            )
+
+        # Intrinsic camera matrix.
+        K = scene_camera[im_id]["cam_K"]
+
+        # Load the depth image if VSD is selected as the pose error function.
+        depth_im = None
+        if error_type == "vsd":
+            depth_path = assets.dp_split["depth_tpath"].format(scene_id=scene_id, im_id=im_id)
+            depth_im = inout.load_depth(depth_path)
+            depth_im *= scene_camera[im_id]["depth_scale"]  # Convert to [mm].
+
+        for obj_id, target in im_targets.items():
+
+            # The required number of top estimated poses.
+            if p["n_top"] == 0:  # All estimates are considered.
+                n_top_curr = None
+            elif p["n_top"] == -1:  # Given by the number of GT poses.
+                n_top_curr = target["inst_count"]
+            else:
+                n_top_curr = p["n_top"]
+
+            # Get the estimates.
+            try:
+                obj_ests = ests_org[scene_id][im_id][obj_id]
+                obj_count = len(obj_ests)
+            except KeyError:
+                obj_ests = []
+                obj_count = 0
+
+            # Check the number of estimates.
+            if not p["skip_missing"] and obj_count < n_top_curr:
+                raise ValueError(
+                    "Not enough estimates for scene: {}, im: {}, obj: {} "
+                    "(provided: {}, expected: {})".format(scene_id, im_id, obj_id, obj_count, n_top_curr)
+                )
+
+            # Sort the estimates by score (in descending order).
+            obj_ests_sorted = sorted(
+                enumerate(obj_ests),
+                key=lambda x: x[1]["score"],
+                reverse=True,
+            )
+
+            # Select the required number of top estimated poses.
+            obj_ests_sorted = obj_ests_sorted[slice(0, n_top_curr)]
+            ests_counter += len(obj_ests_sorted)
+
+            obj_gt_ids = [gt_id for gt_id, gt in enumerate(scene_gt[im_id]) if gt["obj_id"] == obj_id]
+
+            # For VSD, calculate errors of all estimates w.r.t. all GT poses of the
+            # same object class at once (each pose is rendered only once).
+            vsd_errs = None
+            if error_type == "vsd":
+                radius = 0.5 * models_info[obj_id]["diameter"]
+                vsd_pair_mask = np.array(
+                    [
+                        [
+                            misc.overlapping_sphere_projections(
+                                radius, est["t"].squeeze(), scene_gt[im_id][gt_id]["cam_t_m2c"].squeeze()
+                            )
+                            for gt_id in obj_gt_ids
+                        ]
+                        for _, est in obj_ests_sorted
+                    ],
+                    dtype=bool,
+                ).reshape(len(obj_ests_sorted), len(obj_gt_ids))
+                vsd_errs_arr = pose_error.vsd_batch(
+                    [est["R"] for _, est in obj_ests_sorted],
+                    [est["t"] for _, est in obj_ests_sorted],
+                    [scene_gt[im_id][gt_id]["cam_R_m2c"] for gt_id in obj_gt_ids],
+                    [scene_gt[im_id][gt_id]["cam_t_m2c"] for gt_id in obj_gt_ids],
+                    depth_im,
+                    K,
+                    p["vsd_deltas"][dataset],
+                    p["vsd_taus"],
+                    p["vsd_normalized_by_diameter"],
+                    models_info[obj_id]["diameter"],
+                    assets.get_renderer(p["renderer_type"]),
+                    obj_id,
+                    "step",
+                    renderer_type=p["renderer_type"],
+                    pair_mask=vsd_pair_mask,
+                )
+                vsd_errs = {
+                    (est_id, gt_id): vsd_errs_arr[est_ind, gt_ind].tolist()
+                    for est_ind, (est_id, _) in enumerate(obj_ests_sorted)
+                    for gt_ind, gt_id in enumerate(obj_gt_ids)
+                }
+
+            # For MSSD/MSPD, calculate errors of all estimates w.r.t. each GT pose of
+            # the same object class at once (all symmetries x estimates in one go).
+            sym_errs = None
+            if error_type in ["mssd", "mspd"]:
+                sym_errs = {}
+                for gt_id in obj_gt_ids:
+                    R_g = scene_gt[im_id][gt_id]["cam_R_m2c"]
+                    t_g = scene_gt[im_id][gt_id]["cam_t_m2c"]
+                    if error_type == "mssd":
+                        # Errors of estimates with non-overlapping spheres are not needed.
+                        gt_ests = [
+                            (est_id, est)
+                            for est_id, est in obj_ests_sorted
+                            if np.linalg.norm(est["t"] - t_g) < models_info[obj_id]["diameter"]
+                        ]
+                        gt_errs = pose_error.mssd_batch(
+                            [est["R"] for _, est in gt_ests],
+                            [est["t"] for _, est in gt_ests],
+                            R_g,
+                            t_g,
+                            assets.get_model_mssd_pts(obj_id),
+                            assets.get_model_sym(obj_id),
+                        )
+                    else:
+                        gt_ests = obj_ests_sorted
+                        gt_errs = pose_error.mspd_batch(
+                            [est["R"] for _, est in gt_ests],
+                            [est["t"] for _, est in gt_ests],
+                            R_g,
+                            t_g,
+                            K,
+                            assets.get_model(obj_id)["pts"],
+                            assets.get_model_sym(obj_id),
+                        )
+                    for (est_id, _), gt_err in zip(gt_ests, gt_errs):
+                        sym_errs[(est_id, gt_id)] = float(gt_err)
+
+            # Calculate error of each pose estimate w.r.t. all GT poses of the same
+            # object class.
+            for est_id, est in obj_ests_sorted:
+                errs = {}  # Errors w.r.t. GT poses of the same object class.
+                for gt_id in obj_gt_ids:
+                    errs[gt_id] = _calc_est_errors(
+                        p, assets, error_type, obj_id, est, scene_gt[im_id][gt_id], K, vsd_errs, sym_errs, est_id, gt_id
+                    )
+
+                # Save the calculated errors.
+                scene_errs.append(
+                    {
+                        "im_id": im_id,
+                        "obj_id": obj_id,
+                        "est_id": est_id,
+                        "score": est["score"],
+                        "errors": errs,
+                    }
+                )
+
+    return scene_id, im_ind_start, scene_errs, ests_counter
+
+
+_SHARD_ARGS = None
+
+
+def _init_shard_worker():
+    # each worker owns its renderers
+    _SHARD_ARGS[1].renderers = {}
+
+
+def _calc_shard_errors(shard):
+    return calc_shard_errors(*_SHARD_ARGS, shard=shard)
+
+
+def split_errors(p, error_type, dataset, errors):
+    """error_sign => scene_id => errors, for VSD the errors of each tau are
+    split into their own error signature."""
+    if error_type != "vsd":
+        return {misc.get_error_signature(error_type, p["n_top"]): errors}
+    res = {}
+    error_signs = get_error_signs(error_type, p["n_top"], dataset, p["vsd_deltas"], p["vsd_taus"])
+    for vsd_tau_id, error_sign in enumerate(error_signs):
+        # Keep only errors for the current tau.
+        res[error_sign] = {}
+        for scene_id, scene_errs in errors.items():
+            scene_errs_curr = []
+            for err in scene_errs:
+                err_curr = dict(err)
+                err_curr["errors"] = {gt_id: [_errs[vsd_tau_id]] for gt_id, _errs in err["errors"].items()}
+                scene_errs_curr.append(err_curr)
+            res[error_sign][scene_id] = scene_errs_curr
+    return res
+
+
+def calc_errors(p, assets, error_type, dataset, ests_org):
+    """Calculates the errors of the pose estimates of all the targets.
+
+    :return: scene_id => list of the errors of the estimates of the scene (see
+      calc_shard_errors, for VSD one error element per tau); number of the
+      evaluated estimates.
+    """
+    global _SHARD_ARGS
+    targets_org = assets.get_targets_org(p["targets_filename"])
+    assets.prepare(error_type)
+
+    # Split the scenes into shards of consecutive images.
+    shards = []
+    for scene_id, scene_targets in targets_org.items():
+        shard_size = p["shard_size"] if p["shard_size"] > 0 else len(scene_targets)
+        for im_ind_start in range(0, len(scene_targets), shard_size):
+            shards.append((scene_id, im_ind_start, im_ind_start + shard_size))
+
+    args = (p, assets, error_type, dataset, targets_org, ests_org)
+    if p["num_workers"] > 1 and len(shards) > 1:
+        # The workers are forked after the assets are loaded, and initialize
+        # their own renderers.
+        misc.log("Calculating errors with {} workers ({} shards)...".format(p["num_workers"], len(shards)))
+        _SHARD_ARGS = args
+        try:
+            with multiprocessing.get_context("fork").Pool(
+                min(p["num_workers"], len(shards)), initializer=_init_shard_worker
+            ) as pool:
+                shard_results = pool.map(_calc_shard_errors, shards)
+        finally:
+            _SHARD_ARGS = None
+    else:
+        shard_results = [calc_shard_errors(*args, shard=shard) for shard in shards]
+
+    # errors of a scene in the order of its images
+    ests_counter = 0
+    errors = {}
+    for scene_id, _, shard_errs, shard_ests_counter in shard_results:
+        errors.setdefault(scene_id, []).extend(shard_errs)
+        ests_counter += shard_ests_counter
+    return errors, ests_counter
+
+
+def get_errors_store_path(p, result_name, error_type):
+    """path of the npz store with the errors (of all the scenes and VSD taus)
+    of an error type."""
+    _, dataset, _, _ = parse_result_name(result_name)
+    error_sign = misc.get_error_signature(error_type, p["n_top"])
+    if error_type == "vsd":
+        error_sign += "_delta:{:.3f}".format(p["vsd_deltas"][dataset])
+    return p["errors_store_tpath"].format(eval_path=p["eval_path"], result_name=result_name, error_sign=error_sign)
+
+
+def save_errors(p, result_name, error_type, errors):
+    """saves the errors (scene_id => errors, see calc_errors) of an error type,
+    to one npz store or (p["errors_format"] == "json") to one json file per
+    scene and error signature."""
+    _, dataset, _, _ = parse_result_name(result_name)
+    if p["errors_format"] == "npz":
+        errors_path = get_errors_store_path(p, result_name, error_type)
+        misc.ensure_dir(osp.dirname(errors_path))
+        misc.log("Saving errors to: {}".format(errors_path))
+        vsd_taus = p["vsd_taus"] if error_type == "vsd" else []
+        inout.save_pose_errors(errors_path, errors, vsd_taus=np.array(vsd_taus, dtype=np.float64))
+        return
+
+    for error_sign, sign_errors in split_errors(p, error_type, dataset, errors).items():
+        for scene_id, scene_errs in sign_errors.items():
+            errors_path = p["errors_tpath"].format(
+                eval_path=p["eval_path"], result_name=result_name, error_sign=error_sign, scene_id=scene_id
+            )
+            misc.ensure_dir(osp.dirname(errors_path))
+            misc.log("Saving errors to: {}".format(errors_path))
+            inout.save_json(errors_path, scene_errs)
+
+
+def load_errors(p, result_name, error_signs, scene_ids):
+    """loads the saved errors of some error signatures (of the same error type)
+    of the scenes.
+
+    :return: error_sign => scene_id => errors.
+    """
+    if p["errors_format"] == "npz":
+        _, dataset, _, _ = parse_result_name(result_name)
+        error_type, _ = parse_error_sign(error_signs[0])
+        errors, meta = inout.load_pose_errors(get_errors_store_path(p, result_name, error_type), scene_ids)
+        # The errors are split by the VSD taus they were saved with.
+        errors = split_errors(dict(p, vsd_taus=meta["vsd_taus"].tolist()), error_type, dataset, errors)
+        return {error_sign: errors[error_sign] for error_sign in error_signs}
+
+    errors = {}
+    for error_sign in error_signs:
+        errors[error_sign] = {}
+        for scene_id in scene_ids:
+            errors_path = p["errors_tpath"].format(
+                eval_path=p["eval_path"], result_name=result_name, error_sign=error_sign, scene_id=scene_id
+            )
+            errors[error_sign][scene_id] = inout.load_json(errors_path, keys_to_int=True)
+    return errors
+
+
+# Calculation of the performance scores.
+# ------------------------------------------------------------------------------
+def get_scene_gt_valid(scene_targets, scene_gt, scene_gt_info, visib_gt_min):
+    """Determines which GT poses are valid (im_id => list of bool)."""
+    scene_gt_valid = {}
+    for im_id, im_targets in scene_targets.items():
+        im_gt = scene_gt[im_id]
+        im_gt_info = scene_gt_info[im_id]
+        scene_gt_valid[im_id] = [True] * len(im_gt)
+        if visib_gt_min >= 0:
+            # All GT poses visible from at least 100 * visib_gt_min percent
+            # are considered valid.
+            for gt_id, gt in enumerate(im_gt):
+                is_target = gt["obj_id"] in im_targets.keys()
+                is_visib = im_gt_info[gt_id]["visib_fract"] >= visib_gt_min
+                scene_gt_valid[im_id][gt_id] = is_target and is_visib
+        else:
+            # k most visible GT poses are considered valid, where k is given by
+            # the "inst_count" item loaded from "targets_filename".
+            gt_ids_sorted = sorted(
+                range(len(im_gt)),
+                key=lambda gt_id: im_gt_info[gt_id]["visib_fract"],
+                reverse=True,
+            )
+            to_add = {obj_id: trg["inst_count"] for obj_id, trg in im_targets.items()}
+            for gt_id in gt_ids_sorted:
+                obj_id = im_gt[gt_id]["obj_id"]
+                if obj_id in to_add.keys() and to_add[obj_id] > 0:
+                    scene_gt_valid[im_id][gt_id] = True
+                    to_add[obj_id] -= 1
+                else:
+                    scene_gt_valid[im_id][gt_id] = False
+    return scene_gt_valid
+
+
+def get_scene_groups(scene_targets, scene_gt, scene_gt_valid, scene_errs, n_top, n_elems):
+    """Arranges the GT poses of the targeted images of a scene and the errors
+    of the top pose estimates per group (an object class in an image), for
+    pose_matching.match_poses_groups.
+
+    :return: Dictionary with:
+      - 'gts': list of (im_id, gt_id, obj_id, valid), the GT poses in the order
+          of the matches of pose_matching.match_poses_scene
+      - 'gt_group_inds', 'gt_inds': (n_rows,) ndarrays, group of each GT pose
+          and its index in the group
+      - 'obj_ids': (n_groups,) ndarray, object ID of each group
+      - 'ests': list with the errors of the pose estimates of each group, sorted
+          by decreasing score
+      - 'errors': (n_groups, n_ests, n_gts, n_elems) ndarray, nan for padding
+      - 'gt_valid': (n_groups, n_gts) bool ndarray
+    """
+    # Organize the errors by image ID and object ID (for faster query).
+    scene_errs_org = {}
+    for e in scene_errs:
+        scene_errs_org.setdefault(e["im_id"], {}).setdefault(e["obj_id"], []).append(e)
+
+    gts = []
+    gt_group_inds = []
+    gt_inds = []
+    groups = []  # (obj_id, gt_ids, ests) of each group
+    for im_id in scene_targets.keys():
+        im_group_inds = {}
+        for gt_id, gt in enumerate(scene_gt[im_id]):
+            obj_id = gt["obj_id"]
+            if obj_id not in im_group_inds:
+                # Sort the estimated poses by decreasing confidence score and keep the top n_top.
+                ests = sorted(scene_errs_org.get(im_id, {}).get(obj_id, []), key=lambda e: e["score"], reverse=True)
+                if n_top > 0:
+                    ests = ests[:n_top]
+                im_group_inds[obj_id] = len(groups)
+                groups.append((obj_id, [], ests))
+            group_gt_ids = groups[im_group_inds[obj_id]][1]
+            gts.append((im_id, gt_id, obj_id, scene_gt_valid[im_id][gt_id]))
+            gt_group_inds.append(im_group_inds[obj_id])
+            gt_inds.append(len(group_gt_ids))
+            group_gt_ids.append(gt_id)
+
+    n_ests = max([len(ests) for _, _, ests in groups] + [0])
+    n_gts = max([len(gt_ids) for _, gt_ids, _ in groups] + [0])
+    errors = np.full((len(groups), n_ests, n_gts, n_elems), np.nan, dtype=np.float64)
+    for group_ind, (_, gt_ids, ests) in enumerate(groups):
+        for est_ind, e in enumerate(ests):
+            for gt_ind, gt_id in enumerate(gt_ids):
+                if gt_id in e["errors"]:
+                    errors[group_ind, est_ind, gt_ind] = e["errors"][gt_id][:n_elems]
+
+    gt_group_inds = np.array(gt_group_inds, dtype=np.int64)
+    gt_inds = np.array(gt_inds, dtype=np.int64)
+    gt_valid = np.zeros((len(groups), n_gts), dtype=bool)
+    gt_valid[gt_group_inds, gt_inds] = [valid for _, _, _, valid in gts]
+    return {
+        "gts": gts,
+        "gt_group_inds": gt_group_inds,
+        "gt_inds": gt_inds,
+        "obj_ids": np.array([obj_id for obj_id, _, _ in groups], dtype=np.int64),
+        "ests": [ests for _, _, ests in groups],
+        "errors": errors,
+        "gt_valid": gt_valid,
+    }
+
+
+def normalize_group_errors(p, assets, err_type, obj_ids, errors):
+    """normalizes the errors of the groups (see get_scene_groups) by the object
+    diameter or the image width, in place."""
+    if err_type in p["normalized_by_diameter"]:
+        models_info = assets.models_info
+        diameters = np.array([float(models_info[obj_id]["diameter"]) for obj_id in obj_ids], dtype=np.float64)
+        errors /= diameters.reshape(-1, 1, 1, 1)
+    elif err_type in p["normalized_by_im_width"]:
+        errors *= 640.0 / float(assets.dp_split["im_size"][0])
+    return errors
+
+
+def calc_scores_ths(p, assets, err_type, n_top, errors, correct_ths):
+    """Matches the estimated poses to the GT poses and calculates the
+    performance scores for several thresholds of correctness at once.
+
+    The errors are arranged once in dense (group, estimate, GT pose, element)
+    arrays, the matching is the same as with pose_matching.match_poses_scene.
+
+    :param errors: scene_id => errors of the pose estimates of the scene.
+    :param correct_ths: List of thresholds of correctness of err_type.
+    :return: List with (scores, matches) of each threshold, matches is None if
+      not p["save_matches"].
+    """
+    targets_org = assets.get_targets_org(p["targets_filename"])
+    correct_ths = np.array(correct_ths, dtype=np.float64).reshape(len(correct_ths), -1)
+    n_ths, n_elems = correct_ths.shape
+
+    # Go through the test scenes and match estimated poses to GT poses.
+    scenes_groups = []
+    gt_scene_ids = []
+    gt_obj_ids = []
+    gt_group_ids = []
+    gt_valid = []
+    gt_est_inds = []  # (n_ths, n_rows) index of the matched estimate in the group of each GT pose
+    group_id_offset = 0
+    for scene_id, scene_targets in targets_org.items():
+        scene_gt = assets.get_scene_gt(scene_id)
+        scene_gt_info = assets.get_scene_gt_info(scene_id)
+        scene_gt_valid = get_scene_gt_valid(scene_targets, scene_gt, scene_gt_info, p["visib_gt_min"])
+
+        groups = get_scene_groups(scene_targets, scene_gt, scene_gt_valid, errors.get(scene_id, []), n_top, n_elems)
+        normalize_group_errors(p, assets, err_type, groups["obj_ids"], groups["errors"])
+
+        # Greedily match the estimated poses to the ground truth poses.
+        group_gt_est_inds = pose_matching.match_poses_groups(groups["errors"], correct_ths, groups["gt_valid"])
+        gt_est_inds.append(group_gt_est_inds[:, groups["gt_group_inds"], groups["gt_inds"]])
+
+        scenes_groups.append((scene_id, groups))
+        gt_scene_ids.append(np.full(len(groups["gts"]), scene_id, dtype=np.int64))
+        gt_obj_ids.append(np.array([obj_id for _, _, obj_id, _ in groups["gts"]], dtype=np.int64))
+        gt_group_ids.append(groups["gt_group_inds"] + group_id_offset)
+        gt_valid.append(np.array([valid for _, _, _, valid in groups["gts"]], dtype=bool))
+        group_id_offset += len(groups["obj_ids"])
+
+    def _concat(arrays, dtype, axis=0, shape=(0,)):
+        return np.concatenate(arrays, axis=axis) if len(arrays) > 0 else np.zeros(shape, dtype=dtype)
+
+    gt_est_inds = _concat(gt_est_inds, np.int64, axis=1, shape=(n_ths, 0))
+
+    # 6D object localization scores (SiSo if n_top = 1).
+    all_scores = score.calc_localization_scores_batch(
+        assets.dp_split["scene_ids"],
+        assets.dp_model["obj_ids"],
+        _concat(gt_scene_ids, np.int64),
+        _concat(gt_obj_ids, np.int64),
+        _concat(gt_group_ids, np.int64),
+        _concat(gt_valid, bool),
+        gt_est_inds >= 0,
+        n_top,
+    )
+
+    res = []
+    for th_ind, scores in enumerate(all_scores):
+        if not p["save_matches"]:
+            res.append((scores, None))
+            continue
+        # Info about the matching pose estimate for each GT pose.
+        correct_th = correct_ths[th_ind]
+        matches = []
+        row_offset = 0
+        for scene_id, groups in scenes_groups:
+            for row_ind, (im_id, gt_id, obj_id, valid) in enumerate(groups["gts"]):
+                m = {
+                    "scene_id": scene_id,
+                    "im_id": im_id,
+                    "obj_id": obj_id,
+                    "gt_id": gt_id,
+                    "est_id": -1,
+                    "score": -1,
+                    "error": -1,
+                    "error_norm": -1,
+                    "valid": valid,
+                }
+                est_ind = int(gt_est_inds[th_ind, row_offset + row_ind])
+                if est_ind >= 0:
+                    group_ind = groups["gt_group_inds"][row_ind]
+                    e = groups["ests"][group_ind][est_ind]
+                    error = groups["errors"][group_ind, est_ind, groups["gt_inds"][row_ind]].tolist()
+                    m["est_id"] = e["est_id"]
+                    m["score"] = e["score"]
+                    m["error"] = error
+                    m["error_norm"] = [error[i] / float(correct_th[i]) for i in range(n_elems)]
+                matches.append(m)
+            row_offset += len(groups["gts"])
+        res.append((scores, matches))
+    return res
+
+
+def calc_scores(p, assets, err_type, n_top, errors, correct_th):
+    """Matches the estimated poses to the GT poses and calculates the
+    performance scores.
+
+    :param errors: scene_id => errors of the pose estimates of the scene.
+    :param correct_th: Thresholds of correctness of err_type.
+    :return: (scores, matches).
+    """
+    return calc_scores_ths(p, assets, err_type, n_top, errors, [correct_th])[0]
+
+
+def save_scores(p, error_dir_path, score_sign, scores, matches=None):
+    """saves the scores (and matches) of an error directory
+    ({result_name}/{error_sign}), returns the path of the scores."""
+    scores_path = p["out_scores_tpath"].format(
+        eval_path=p["eval_path"], error_dir_path=error_dir_path, score_sign=score_sign
+    )
+    misc.ensure_dir(osp.dirname(scores_path))
+    inout.save_json(scores_path, scores)
+    if matches is not None:
+        matches_path = p["out_matches_tpath"].format(
+            eval_path=p["eval_path"], error_dir_path=error_dir_path, score_sign=score_sign
+        )
+        inout.save_json(matches_path, matches)
+    return scores_path
+
+
+# Evaluation.
+# ------------------------------------------------------------------------------
+def evaluate_results(p, result_name, ests, models=None):
+    """Evaluates the pose estimates of a method on a dataset split, the
+    errors, matches and scores are saved to p["eval_path"]/result_name.
+
+    :param p: Parameters, see get_default_params().
+    :param result_name: {method}_{dataset}-{split}[-{split_type}].
+    :param ests: List of pose estimates (see organize_ests) or structured array (see inout.BOP_RESULTS_DTYPE).
+    :param models: Already loaded object models (obj_id => model with pts in mm), optional.
+    :return: Dictionary with:
+      - 'scores': path of the scores json => scores, for all the error types and thresholds
+      - 'final_scores': average recalls (saved to scores_bop19.json)
+    """
+    for e_type in p["error_types"]:
+        assert e_type in KNOWN_ERROR_TYPES, f"Unknown error type: {e_type}"
+
+    misc.log("===========")
+    misc.log("EVALUATING: {}".format(result_name))
+    misc.log("===========")
+
+    time_start = time.time()
+    _, dataset, split, split_type = parse_result_name(result_name)
+    assets = get_eval_assets(p["datasets_path"], dataset, split, split_type, p["max_sym_disc_step"])
+    if models is not None:
+        assets.set_models(models)
+    # The estimates get the types of the loaded csv files (e.g. the scene ids of
+    # the evaluators are strings).
+    ests = inout.bop_results_from_array(inout.bop_results_to_array(ests))
+    ests_org = organize_ests(ests)
+
+    # Calculate the average estimation time per image.
+    average_time_per_image = get_average_time_per_image(ests)
+
+    # Volume under recall surface (VSD) / area under recall curve (MSSD, MSPD; AUCadd, AUCadi, AUCad).
+    average_recalls = {}
+    all_scores = {}
+
+    # Evaluate the pose estimates.
+    for error in sorted(ERRORS, key=lambda _e: _e["type"]):
+        error_type = error["type"]
+        if error_type not in p["error_types"]:
+            continue
+        # NOTE: SISO setting: n_top=1
+        n_top = p["n_top"]
+        misc.log("n_top: {}".format(n_top))
+        error_signs = get_error_signs(error_type, n_top, dataset, p["vsd_deltas"], p["vsd_taus"])
+
+        # Calculate error of the pose estimates.
+        if not p["score_only"]:
+            time_errors = time.perf_counter()
+            errors, ests_counter = calc_errors(p, assets, error_type, dataset, ests_org)
+            save_errors(p, result_name, error_type, errors)
+            errors = split_errors(p, error_type, dataset, errors)
+            misc.log(
+                "Calculation of errors for {} estimates took {}s.".format(
+                    ests_counter, time.perf_counter() - time_errors
+                )
+            )
+        else:
+            scene_ids = list(assets.get_targets_org(p["targets_filename"]).keys())
+            errors = load_errors(p, result_name, error_signs, scene_ids)
+
+        # Recall scores for all settings of the threshold of correctness (and also
+        # of the misalignment tolerance tau in the case of VSD).
+        recalls = []
+
+        # Calculate performance scores.
+        for error_sign in error_signs:
+            error_dir_path = osp.join(result_name, error_sign)
+            misc.log("Calculating scores - error: {}, thresholds: {}.".format(error_sign, error["correct_th"]))
+            ths_scores = calc_scores_ths(p, assets, error_type, n_top, errors.get(error_sign, {}), error["correct_th"])
+            for correct_th, (scores, matches) in zip(error["correct_th"], ths_scores):
+                score_sign = misc.get_score_signature(correct_th, p["visib_gt_min"])
+                scores_path = save_scores(p, error_dir_path, score_sign, scores, matches)
+                all_scores[scores_path] = scores
+                recalls.append(scores["recall"])
+
+        average_recalls[error_type] = np.mean(recalls)
+
+        misc.log("error_type: {} thresholds: {}".format(error_type, " ".join(map(str, error["correct_th"]))))
+        misc.log("Recall scores: {}".format(" ".join(map(str, recalls))))
+        misc.log("Average recall: {}".format(average_recalls[error_type]))
+
+    time_total = time.time() - time_start
+    misc.log("Evaluation of {} took {}s.".format(result_name, time_total))
+
+    # Calculate the final scores.
+    final_scores = {}
+    for error in ERRORS:
+        if error["type"] not in p["error_types"]:
+            continue
+        final_scores["bop19_average_recall_{}".format(error["type"])] = average_recalls[error["type"]]
+
+    # Final score for the given dataset.
+    if all(_e_type in p["error_types"] for _e_type in ["mspd", "mssd", "vsd"]):
+        final_scores["bop19_average_recall"] = np.mean(
+            [
+                average_recalls["mspd"],
+                average_recalls["mssd"],
+                average_recalls["vsd"],
+            ]
+        )
+
+    # Average estimation time per image.
+    final_scores["bop19_average_time_per_image"] = average_time_per_image
+
+    # Save the final scores.
+    final_scores_path = osp.join(p["eval_path"], result_name, "scores_bop19.json")
+    inout.save_json(final_scores_path, final_scores, sort=True)
+
+    # Print the final scores.
+    misc.log("FINAL SCORES:")
+    for score_name, score_value in sorted(final_scores.items()):
+        misc.log("- {}: {}".format(score_name, score_value))
+    misc.log("final score path {}".format(final_scores_path))
+    return {"scores": all_scores, "final_scores": final_scores}
+
+
+def evaluate_result_file(p, results_path, result_filename, models=None):
+    """evaluates the pose estimates saved in results_path/result_filename
+    (BOP19 csv)."""
+    result_name = osp.splitext(osp.basename(result_filename))[0]
+    ests = inout.load_bop_results_array(osp.join(results_path, result_filename), version="bop19")
+    return evaluate_results(p, result_name, ests, models=models)
@@ -3,10 +3,10 @@
 # Center for Machine Perception, Czech Technical University in Prague
 # modified
 """I/O functions."""
+import hashlib
 import json
 import os
 import os.path as osp
-import struct
 import sys
 
 import imageio
@@ -19,7 +19,6 @@ import yaml
 cur_dir = osp.dirname(osp.abspath(__file__))
 sys.path.append(osp.join(cur_dir, "../.."))
 from lib.utils import logger
-from lib.utils.is_binary_file import is_binary as _is_binary
 
 
 def load_im(path):
@@ -297,79 +296,181 @@ def save_scene_gt(path, scene_gt):
     save_json(path, scene_gt)
 
 
-def load_bop_results(path, version="bop19"):
-    """Loads 6D object pose estimates from a file.
+BOP_RESULTS_HEADER = "scene_id,im_id,obj_id,score,R,t,time"
+# Columnar (structured array) representation of BOP results.
+BOP_RESULTS_DTYPE = np.dtype(
+    [
+        ("scene_id", np.int64),
+        ("im_id", np.int64),
+        ("obj_id", np.int64),
+        ("score", np.float64),
+        ("R", np.float64, (3, 3)),
+        ("t", np.float64, (3, 1)),
+        ("time", np.float64),
+    ]
+)
+# Numbers in a line: scene_id, im_id, obj_id, score, R (9), t (3), time.
+_BOP_RESULTS_LINE_LEN = 17
+_BOP_RESULTS_LINE_FMT = "%d,%d,%d,%r,{},{},%r\n".format(" ".join(["%r"] * 9), " ".join(["%r"] * 3))
+
+
+def bop_results_to_array(results):
+    """Converts BOP results (list of dictionaries, see load_bop_results) to a
+    structured array of dtype BOP_RESULTS_DTYPE (returned as is if it is
+    already one)."""
+    if isinstance(results, np.ndarray):
+        assert results.dtype == BOP_RESULTS_DTYPE, results.dtype
+        return results
+    array = np.zeros(len(results), dtype=BOP_RESULTS_DTYPE)
+    if len(results) == 0:
+        return array
+    array["scene_id"] = [int(res["scene_id"]) for res in results]
+    array["im_id"] = [int(res["im_id"]) for res in results]
+    array["obj_id"] = [int(res["obj_id"]) for res in results]
+    array["score"] = [float(res["score"]) for res in results]
+    array["R"] = np.array([np.asarray(res["R"], dtype=np.float64).reshape(3, 3) for res in results])
+    array["t"] = np.array([np.asarray(res["t"], dtype=np.float64).reshape(3, 1) for res in results])
+    array["time"] = [float(res.get("time", -1)) for res in results]
+    return array
+
+
+def bop_results_from_array(array):
+    """Converts a structured array of BOP results to a list of dictionaries
+    (see load_bop_results)."""
+    columns = {name: array[name].tolist() for name in ["scene_id", "im_id", "obj_id", "score", "time"]}
+    Rs = array["R"].copy()
+    ts = array["t"].copy()
+    return [
+        {
+            "scene_id": columns["scene_id"][i],
+            "im_id": columns["im_id"][i],
+            "obj_id": columns["obj_id"][i],
+            "score": columns["score"][i],
+            "R": Rs[i],
+            "t": ts[i],
+            "time": columns["time"][i],
+        }
+        for i in range(len(array))
+    ]
+
+
+def load_bop_results_array(path, version="bop19"):
+    """Loads 6D object pose estimates from a file to a structured array.
+
+    All the numbers of the file are parsed at once.
 
     :param path: Path to a file with pose estimates.
     :param version: Version of the results.
-    :return: List of loaded poses.
+    :return: ndarray of dtype BOP_RESULTS_DTYPE.
     """
-    results = []
-
     # See docs/bop_challenge_2019.md for details.
-    if version == "bop19":
-        header = "scene_id,im_id,obj_id,score,R,t,time"
-        with open(path, "r") as f:
-            line_id = 0
-            for line in f:
-                line_id += 1
-                if line_id == 1 and header in line:
-                    continue
-                else:
-                    elems = line.split(",")
-                    if len(elems) != 7:
-                        raise ValueError("A line does not have 7 comma-sep. elements: {}".format(line))
-                    # import pdb; pdb.set_trace();
-                    result = {
-                        "scene_id": int(elems[0]),
-                        "im_id": int(elems[1]),
-                        "obj_id": int(elems[2]),
-                        "score": float(elems[3]),
-                        "R": np.array(list(map(float, elems[4].split())), np.float).reshape((3, 3)),
-                        "t": np.array(list(map(float, elems[5].split())), np.float).reshape((3, 1)),
-                        "time": float(elems[6]),
-                    }
-
-                    results.append(result)
-    else:
+    if version != "bop19":
         raise ValueError("Unknown version of BOP results.")
 
+    with open(path, "r") as f:
+        lines = [line for line in f.read().splitlines() if line.strip() != ""]
+    if len(lines) > 0 and BOP_RESULTS_HEADER in lines[0]:
+        lines = lines[1:]
+
+    try:
+        values = np.array("\n".join(lines).replace(",", " ").split(), dtype=np.float64)
+        parsed = values.size == len(lines) * _BOP_RESULTS_LINE_LEN and all(line.count(",") == 6 for line in lines)
+    except ValueError:
+        parsed = False
+    if not parsed:
+        # Find the line with the wrong format.
+        for line in lines:
+            elems = line.split(",")
+            if len(elems) != 7:
+                raise ValueError("A line does not have 7 comma-sep. elements: {}".format(line))
+            if len(line.replace(",", " ").split()) != _BOP_RESULTS_LINE_LEN:
+                raise ValueError("A line does not have 9 values of R and 3 values of t: {}".format(line))
+            list(map(float, line.replace(",", " ").split()))
+        raise ValueError("Failed to parse the BOP results: {}".format(path))
+
+    values = values.reshape(-1, _BOP_RESULTS_LINE_LEN)
+    results = np.zeros(len(values), dtype=BOP_RESULTS_DTYPE)
+    results["scene_id"] = values[:, 0]
+    results["im_id"] = values[:, 1]
+    results["obj_id"] = values[:, 2]
+    results["score"] = values[:, 3]
+    results["R"] = values[:, 4:13].reshape(-1, 3, 3)
+    results["t"] = values[:, 13:16].reshape(-1, 3, 1)
+    results["time"] = values[:, 16]
     return results
 
 
+def load_bop_results(path, version="bop19"):
+    """Loads 6D object pose estimates from a file.
+
+    :param path: Path to a file with pose estimates.
+    :param version: Version of the results.
+    :return: List of loaded poses.
+    """
+    return bop_results_from_array(load_bop_results_array(path, version))
+
+
+def format_bop_results(results):
+    """Formats BOP results (list of dictionaries or structured array) as csv
+    lines (without the header)."""
+    results = bop_results_to_array(results)
+    ids = np.stack([results["scene_id"], results["im_id"], results["obj_id"]], axis=1).tolist()
+    values = np.concatenate(
+        [
+            results["score"].reshape(-1, 1),
+            results["R"].reshape(-1, 9),
+            results["t"].reshape(-1, 3),
+            results["time"].reshape(-1, 1),
+        ],
+        axis=1,
+    ).tolist()
+    return "".join([_BOP_RESULTS_LINE_FMT % tuple(_ids + _values) for _ids, _values in zip(ids, values)])
+
+
 def save_bop_results(path, results, version="bop19"):
     """Saves 6D object pose estimates to a file.
 
     :param path: Path to the output file.
-    :param results: Dictionary with pose estimates.
+    :param results: List of dictionaries with pose estimates or structured
+      array of dtype BOP_RESULTS_DTYPE.
     :param version: Version of the results.
     """
-    # See docs/bop_challenge_2019.md for details.
-    if version == "bop19":
-        lines = ["scene_id,im_id,obj_id,score,R,t,time"]
-        for res in results:
-            if "time" in res:
-                run_time = res["time"]
-            else:
-                run_time = -1
-
-            lines.append(
-                "{scene_id},{im_id},{obj_id},{score},{R},{t},{time}".format(
-                    scene_id=res["scene_id"],
-                    im_id=res["im_id"],
-                    obj_id=res["obj_id"],
-                    score=res["score"],
-                    R=" ".join(map(str, res["R"].flatten().tolist())),
-                    t=" ".join(map(str, res["t"].flatten().tolist())),
-                    time=run_time,
-                )
-            )
+    with BopResultsWriter(path, version) as writer:
+        writer.append(results)
 
-        with open(path, "w") as f:
-            f.write("\n".join(lines))
 
-    else:
-        raise ValueError("Unknown version of BOP results.")
+class BopResultsWriter(object):
+    """Writes 6D object pose estimates to a file, the results can be appended
+    in chunks (e.g. during the inference).
+
+    with BopResultsWriter(path) as writer:
+        writer.append(results)
+    """
+
+    def __init__(self, path, version="bop19"):
+        # See docs/bop_challenge_2019.md for details.
+        if version != "bop19":
+            raise ValueError("Unknown version of BOP results.")
+        self.path = path
+        self.count = 0
+        self._f = open(path, "w")
+        self._f.write(BOP_RESULTS_HEADER + "\n")
+
+    def append(self, results):
+        """Appends results (list of dictionaries or structured array)."""
+        self._f.write(format_bop_results(results))
+        self._f.flush()
+        self.count += len(results)
+
+    def close(self):
+        if not self._f.closed:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 def check_bop_results(path, version="bop19"):
@@ -409,6 +510,103 @@ def check_bop_results(path, version="bop19"):
     return check_passed, check_msg
 
 
+def save_pose_errors(path, scenes_errs, **meta):
+    """Saves errors of pose estimates to a columnar npz store.
+
+    Each pose estimate is a row of the columns im_id, obj_id, est_id, score and
+    err_offsets; its errors w.r.t. the GT poses are the rows
+    err_offsets[i]:err_offsets[i + 1] of the columns gt_id and errors (all the
+    error elements, e.g. one per VSD tau). The index scene_ids, scene_offsets
+    gives the rows scene_offsets[j]:scene_offsets[j + 1] of the estimates of
+    the scene scene_ids[j].
+
+    :param path: Path to the output npz file.
+    :param scenes_errs: Dictionary mapping scene ID's to lists of dictionaries with:
+      - 'im_id', 'obj_id', 'est_id', 'score'
+      - 'errors': Dictionary mapping GT ID's to lists of errors.
+    :param meta: Extra arrays to save (e.g. the VSD taus).
+    """
+    scene_offsets = [0]
+    im_ids, obj_ids, est_ids, scores = [], [], [], []
+    err_offsets = [0]
+    gt_ids, errors = [], []
+    for scene_errs in scenes_errs.values():
+        for e in scene_errs:
+            im_ids.append(e["im_id"])
+            obj_ids.append(e["obj_id"])
+            est_ids.append(e["est_id"])
+            scores.append(e["score"])
+            for gt_id, errs in e["errors"].items():
+                gt_ids.append(gt_id)
+                errors.append(errs)
+            err_offsets.append(len(gt_ids))
+        scene_offsets.append(len(im_ids))
+    num_elems = len(errors[0]) if len(errors) > 0 else 0
+
+    tmp_path = "{}.tmp{}.npz".format(path[: -len(".npz")] if path.endswith(".npz") else path, os.getpid())
+    np.savez(
+        tmp_path,
+        scene_ids=np.array(list(scenes_errs.keys()), dtype=np.int64),
+        scene_offsets=np.array(scene_offsets, dtype=np.int64),
+        im_id=np.array(im_ids, dtype=np.int64),
+        obj_id=np.array(obj_ids, dtype=np.int64),
+        est_id=np.array(est_ids, dtype=np.int64),
+        score=np.array(scores, dtype=np.float64),
+        err_offsets=np.array(err_offsets, dtype=np.int64),
+        gt_id=np.array(gt_ids, dtype=np.int64),
+        errors=np.array(errors, dtype=np.float64).reshape(len(errors), num_elems),
+        **meta,
+    )
+    os.replace(tmp_path, path)
+
+
+def load_pose_errors(path, scene_ids=None):
+    """Loads errors of pose estimates saved by save_pose_errors.
+
+    :param path: Path to the npz file.
+    :param scene_ids: ID's of the scenes to load (None = all), scenes without
+      errors get an empty list.
+    :return: Dictionary mapping scene ID's to lists of errors (as in
+      save_pose_errors), dictionary with the extra arrays.
+    """
+    with np.load(path) as data:
+        store = {_k: data[_k] for _k in data.files}
+    scene_inds = {int(scene_id): i for i, scene_id in enumerate(store["scene_ids"])}
+    if scene_ids is None:
+        scene_ids = list(scene_inds.keys())
+
+    scenes_errs = {}
+    for scene_id in scene_ids:
+        scenes_errs[scene_id] = []
+        if scene_id not in scene_inds:
+            continue
+        # Only the rows of the scene are converted.
+        i = scene_inds[scene_id]
+        start, end = store["scene_offsets"][i : i + 2]
+        err_offsets = store["err_offsets"][start : end + 1]
+        gt_ids = store["gt_id"][err_offsets[0] : err_offsets[-1]].tolist()
+        errors = store["errors"][err_offsets[0] : err_offsets[-1]].tolist()
+        err_offsets = (err_offsets - err_offsets[0]).tolist()
+        im_ids = store["im_id"][start:end].tolist()
+        obj_ids = store["obj_id"][start:end].tolist()
+        est_ids = store["est_id"][start:end].tolist()
+        scores = store["score"][start:end].tolist()
+        for k in range(end - start):
+            scenes_errs[scene_id].append(
+                {
+                    "im_id": im_ids[k],
+                    "obj_id": obj_ids[k],
+                    "est_id": est_ids[k],
+                    "score": scores[k],
+                    "errors": {gt_ids[j]: errors[j] for j in range(err_offsets[k], err_offsets[k + 1])},
+                }
+            )
+
+    store_keys = ["scene_ids", "scene_offsets", "im_id", "obj_id", "est_id", "score", "err_offsets", "gt_id", "errors"]
+    meta = {_k: _v for _k, _v in store.items() if _k not in store_keys}
+    return scenes_errs, meta
+
+
 def ply_vtx(path, vertex_scale=1.0):
     """
     discription: read all vertices from a ply file
@@ -486,12 +684,43 @@ def load_ply_model(model_path, vertex_scale=1.0):
     return model["pts"] * vertex_scale
 
 
-def load_ply(path, vertex_scale=1.0):
+# process-wide cache of the loaded (unscaled) ply models: (path, mtime, size) => model
+_PLY_CACHE = {}
+# directory of the on-disk (.npz) cache of the parsed ply models, shared by all processes, None to disable
+PLY_CACHE_DIR = osp.normpath(osp.join(cur_dir, "../../.cache/ply_models"))
+
+_PLY_TYPES = {
+    "char": "i1",
+    "int8": "i1",
+    "uchar": "u1",
+    "uint8": "u1",
+    "short": "i2",
+    "int16": "i2",
+    "ushort": "u2",
+    "uint16": "u2",
+    "int": "i4",
+    "int32": "i4",
+    "uint": "u4",
+    "uint32": "u4",
+    "float": "f4",
+    "float32": "f4",
+    "double": "f8",
+    "float64": "f8",
+}
+
+# Only triangular faces are supported: number of items of the face list properties
+_PLY_FACE_LIST_LENS = {"vertex_indices": 3, "vertex_index": 3, "texcoord": 6}
+
+
+def load_ply(path, vertex_scale=1.0, use_cache=True):
     # https://github.com/thodan/sixd_toolkit/blob/master/pysixd/inout.py
     # bop_toolkit
     """Loads a 3D mesh model from a PLY file.
 
     :param path: Path to a PLY file.
+    :param vertex_scale: Scale of the vertices (pts).
+    :param use_cache: Load the model once per process (and from the on-disk
+      cache in PLY_CACHE_DIR), the cache is invalidated when the file changes.
     :return: The loaded model given by a dictionary with items:
     -' pts' (nx3 ndarray),
     - 'normals' (nx3 ndarray), optional
@@ -501,203 +730,171 @@ def load_ply(path, vertex_scale=1.0):
     - 'texture_uv_face' (mx6 ndarray), optional
     - 'texture_file' (string), optional
     """
-    if _is_binary(path):
-        f = open(path, "rb")
+    if use_cache:
+        model = _load_ply_cached(path)
+        # the callers may modify the model inplace
+        model = {_k: _v.copy() if isinstance(_v, np.ndarray) else _v for _k, _v in model.items()}
     else:
-        f = open(path, "r")
+        model = _read_ply(path)
+    model["pts"] *= vertex_scale
+    return model
 
-    # Only triangular faces are supported.
-    face_n_corners = 3
 
-    n_pts = 0
-    n_faces = 0
-    pt_props = []
-    face_props = []
-    is_binary = False
-    header_vertex_section = False
-    header_face_section = False
-    texture_file = None
+def _load_ply_cached(path):
+    path = osp.abspath(path)
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    if key in _PLY_CACHE:
+        return _PLY_CACHE[key]
+
+    cache_path = None
+    if PLY_CACHE_DIR is not None:
+        cache_path = osp.join(PLY_CACHE_DIR, hashlib.md5(repr(key).encode("utf-8")).hexdigest() + ".npz")
+    if cache_path is not None and osp.exists(cache_path):
+        with np.load(cache_path) as data:
+            model = {_k: data[_k] for _k in data.files}
+        if "texture_file" in model:
+            model["texture_file"] = str(model["texture_file"])
+    else:
+        model = _read_ply(path)
+        if cache_path is not None:
+            try:
+                mmcv.mkdir_or_exist(PLY_CACHE_DIR)
+                tmp_path = "{}.tmp{}.npz".format(cache_path[: -len(".npz")], os.getpid())
+                np.savez(tmp_path, **model)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logger.warning("Failed to cache {} to {}: {}".format(path, cache_path, e))
+    _PLY_CACHE[key] = model
+    return model
 
-    # Read the header.
-    while True:
 
-        # Strip the newline character(s)
+def _read_ply_header(f):
+    """
+    :return: format ("ascii", "binary_little_endian" or "binary_big_endian"),
+      texture file, list of elements (name, count, list of properties (name, type, list count type or None))
+    """
+    ply_format = "ascii"
+    texture_file = None
+    elements = []
+    while True:
         line = f.readline()
-        if isinstance(line, str):
-            line = line.rstrip("\n").rstrip("\r")
-        else:
-            line = str(line, "utf-8").rstrip("\n").rstrip("\r")
-
+        if len(line) == 0:
+            raise ValueError("Unexpected end of the PLY header.")
+        line = str(line, "utf-8").rstrip("\n").rstrip("\r")
+        elems = line.split()
         if line.startswith("comment TextureFile"):
-            texture_file = line.split()[-1]
-        elif line.startswith("element vertex"):
-            n_pts = int(line.split()[-1])
-            header_vertex_section = True
-            header_face_section = False
-        elif line.startswith("element face"):
-            n_faces = int(line.split()[-1])
-            header_vertex_section = False
-            header_face_section = True
-        elif line.startswith("element"):  # Some other element.
-            header_vertex_section = False
-            header_face_section = False
-        elif line.startswith("property") and header_vertex_section:
-            # (name of the property, data type)
-            prop_name = line.split()[-1]
-            if prop_name == "s":
-                prop_name = "texture_u"
-            if prop_name == "t":
-                prop_name = "texture_v"
-            prop_type = line.split()[-2]
-            pt_props.append((prop_name, prop_type))
-        elif line.startswith("property list") and header_face_section:
-            elems = line.split()
-            if elems[-1] == "vertex_indices" or elems[-1] == "vertex_index":
-                # (name of the property, data type)
-                face_props.append(("n_corners", elems[2]))
-                for i in range(face_n_corners):
-                    face_props.append(("ind_" + str(i), elems[3]))
-            elif elems[-1] == "texcoord":
-                # (name of the property, data type)
-                face_props.append(("texcoord", elems[2]))
-                for i in range(face_n_corners * 2):
-                    face_props.append(("texcoord_ind_" + str(i), elems[3]))
-            else:
-                logger.warning("Warning: Not supported face property: " + elems[-1])
+            texture_file = elems[-1]
         elif line.startswith("format"):
-            if "binary" in line:
-                is_binary = True
+            ply_format = elems[1]
+        elif line.startswith("element"):
+            elements.append((elems[1], int(elems[2]), []))
+        elif line.startswith("property list"):
+            elements[-1][2].append((elems[-1], elems[3], elems[2]))
+        elif line.startswith("property"):
+            elements[-1][2].append((elems[-1], elems[-2], None))
         elif line.startswith("end_header"):
             break
+    return ply_format, texture_file, elements
 
-    # Prepare data structures.
-    model = {}
-    if texture_file is not None:
-        model["texture_file"] = texture_file
-    model["pts"] = np.zeros((n_pts, 3), np.float)
-    if n_faces > 0:
-        model["faces"] = np.zeros((n_faces, face_n_corners), np.float)
-
-    # print(pt_props)
-    pt_props_names = [p[0] for p in pt_props]
-    face_props_names = [p[0] for p in face_props]
-    # print(pt_props_names)
-
-    is_normal = False
-    if {"nx", "ny", "nz"}.issubset(set(pt_props_names)):
-        is_normal = True
-        model["normals"] = np.zeros((n_pts, 3), np.float)
-
-    is_color = False
-    if {"red", "green", "blue"}.issubset(set(pt_props_names)):
-        is_color = True
-        model["colors"] = np.zeros((n_pts, 3), np.float)
-
-    is_texture_pt = False
-    if {"texture_u", "texture_v"}.issubset(set(pt_props_names)):
-        is_texture_pt = True
-        model["texture_uv"] = np.zeros((n_pts, 2), np.float)
-
-    is_texture_face = False
-    if {"texcoord"}.issubset(set(face_props_names)):
-        is_texture_face = True
-        model["texture_uv_face"] = np.zeros((n_faces, 6), np.float)
-
-    # Formats for the binary case.
-    formats = {
-        "float": ("f", 4),
-        "double": ("d", 8),
-        "int": ("i", 4),
-        "uchar": ("B", 1),
-    }
 
-    # Load vertices.
-    for pt_id in range(n_pts):
-        prop_vals = {}
-        load_props = [
-            "x",
-            "y",
-            "z",
-            "nx",
-            "ny",
-            "nz",
-            "red",
-            "green",
-            "blue",
-            "texture_u",
-            "texture_v",
-        ]
-        if is_binary:
-            for prop in pt_props:
-                format = formats[prop[1]]
-                read_data = f.read(format[1])
-                val = struct.unpack(format[0], read_data)[0]
-                if prop[0] in load_props:
-                    prop_vals[prop[0]] = val
-        else:
-            elems = f.readline().rstrip("\n").rstrip("\r").split()
-            for prop_id, prop in enumerate(pt_props):
-                if prop[0] in load_props:
-                    prop_vals[prop[0]] = elems[prop_id]
-
-        model["pts"][pt_id, 0] = float(prop_vals["x"])
-        model["pts"][pt_id, 1] = float(prop_vals["y"])
-        model["pts"][pt_id, 2] = float(prop_vals["z"])
-
-        if is_normal:
-            model["normals"][pt_id, 0] = float(prop_vals["nx"])
-            model["normals"][pt_id, 1] = float(prop_vals["ny"])
-            model["normals"][pt_id, 2] = float(prop_vals["nz"])
-
-        if is_color:
-            model["colors"][pt_id, 0] = float(prop_vals["red"])
-            model["colors"][pt_id, 1] = float(prop_vals["green"])
-            model["colors"][pt_id, 2] = float(prop_vals["blue"])
-
-        if is_texture_pt:
-            model["texture_uv"][pt_id, 0] = float(prop_vals["texture_u"])
-            model["texture_uv"][pt_id, 1] = float(prop_vals["texture_v"])
-
-    # Load faces.
-    for face_id in range(n_faces):
-        prop_vals = {}
-        if is_binary:
-            for prop in face_props:
-                format = formats[prop[1]]
-                val = struct.unpack(format[0], f.read(format[1]))[0]
-                if prop[0] == "n_corners":
-                    if val != face_n_corners:
-                        raise ValueError("Only triangular faces are supported.")
-                        # print("Number of face corners: " + str(val))
-                        # exit(-1)
-                elif prop[0] == "texcoord":
-                    if val != face_n_corners * 2:
-                        raise ValueError("Wrong number of UV face coordinates.")
-                else:
-                    prop_vals[prop[0]] = val
+def _read_ply_element(f, ply_format, count, props, list_lens):
+    """read all the records of an element at once, the list properties are
+    assumed to have the number of items given in list_lens.
+
+    :return: dict of the properties, name => (count,) or (count, list len) ndarray;
+      the list counts are named `name + "_n"`.
+    """
+    fields = []
+    for name, prop_type, list_type in props:
+        if list_type is None:
+            fields.append((name, _PLY_TYPES[prop_type], ()))
         else:
-            elems = f.readline().rstrip("\n").rstrip("\r").split()
-            for prop_id, prop in enumerate(face_props):
-                if prop[0] == "n_corners":
-                    if int(elems[prop_id]) != face_n_corners:
-                        raise ValueError("Only triangular faces are supported.")
-                elif prop[0] == "texcoord":
-                    if int(elems[prop_id]) != face_n_corners * 2:
-                        raise ValueError("Wrong number of UV face coordinates.")
-                else:
-                    prop_vals[prop[0]] = elems[prop_id]
+            if name not in list_lens:
+                raise ValueError("Not supported list property: " + name)
+            fields.append((name + "_n", _PLY_TYPES[list_type], ()))
+            fields.append((name, _PLY_TYPES[prop_type], (list_lens[name],)))
+
+    if ply_format == "ascii":
+        num_cols = sum(int(np.prod(_shape)) for _, _, _shape in fields)
+        lines = [f.readline() for _ in range(count)]
+        values = np.array(b" ".join(lines).split(), dtype=np.float64)
+        if values.size != count * num_cols:
+            raise ValueError("Only triangular faces with 3 or 6 uv coordinates are supported.")
+        values = values.reshape(count, num_cols)
+        data = {}
+        col = 0
+        for name, _, shape in fields:
+            if len(shape) == 0:
+                data[name] = values[:, col]
+                col += 1
+            else:
+                data[name] = values[:, col : col + shape[0]]
+                col += shape[0]
+        return data
 
-        model["faces"][face_id, 0] = int(prop_vals["ind_0"])
-        model["faces"][face_id, 1] = int(prop_vals["ind_1"])
-        model["faces"][face_id, 2] = int(prop_vals["ind_2"])
+    byte_order = ">" if ply_format == "binary_big_endian" else "<"
+    dtype = np.dtype([(name, byte_order + _type, shape) for name, _type, shape in fields])
+    records = np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype, count=count)
+    return {name: records[name] for name, _, _ in fields}
 
-        if is_texture_face:
-            for i in range(6):
-                model["texture_uv_face"][face_id, i] = float(prop_vals["texcoord_ind_{}".format(i)])
 
-    f.close()
-    model["pts"] *= vertex_scale
+def _get_face_ind_name(face_data):
+    return "vertex_indices" if "vertex_indices" in face_data else "vertex_index"
+
+
+def _read_ply(path):
+    """parse a PLY file with the records of the vertices and faces read as
+    arrays (structured dtype for the binary format)."""
+    # Only triangular faces are supported.
+    face_n_corners = 3
+
+    with open(path, "rb") as f:
+        ply_format, texture_file, elements = _read_ply_header(f)
+        vertex_data = None
+        face_data = None
+        for name, count, props in elements:
+            if name == "vertex":
+                # (name of the property, data type)
+                props = [({"s": "texture_u", "t": "texture_v"}.get(_p[0], _p[0]),) + _p[1:] for _p in props]
+                vertex_data = _read_ply_element(f, ply_format, count, props, {})
+            elif name == "face":
+                unsupported = [_p[0] for _p in props if _p[2] is not None and _p[0] not in _PLY_FACE_LIST_LENS]
+                for prop_name in unsupported:
+                    logger.warning("Warning: Not supported face property: " + prop_name)
+                face_data = _read_ply_element(f, ply_format, count, props, _PLY_FACE_LIST_LENS)
+            elif vertex_data is None or face_data is None:
+                # Some other element before the vertices and faces
+                _read_ply_element(f, ply_format, count, props, {})
+            if vertex_data is not None and face_data is not None:
+                break
+
+    model = {}
+    if texture_file is not None:
+        model["texture_file"] = texture_file
 
+    def _stack(data, names):
+        return np.stack([data[_name] for _name in names], axis=1).astype(np.float64)
+
+    pt_props_names = set(vertex_data.keys()) if vertex_data is not None else set()
+    n_pts = len(vertex_data["x"]) if vertex_data is not None else 0
+    model["pts"] = _stack(vertex_data, ["x", "y", "z"]) if n_pts > 0 else np.zeros((0, 3), np.float64)
+    if {"nx", "ny", "nz"}.issubset(pt_props_names):
+        model["normals"] = _stack(vertex_data, ["nx", "ny", "nz"])
+    if {"red", "green", "blue"}.issubset(pt_props_names):
+        model["colors"] = _stack(vertex_data, ["red", "green", "blue"])
+    if {"texture_u", "texture_v"}.issubset(pt_props_names):
+        model["texture_uv"] = _stack(vertex_data, ["texture_u", "texture_v"])
+
+    if face_data is not None and len(face_data[_get_face_ind_name(face_data) + "_n"]) > 0:
+        ind_name = _get_face_ind_name(face_data)
+        if np.any(face_data[ind_name + "_n"] != face_n_corners):
+            raise ValueError("Only triangular faces are supported.")
+        model["faces"] = face_data[ind_name].astype(np.float64)
+        if "texcoord" in face_data:
+            if np.any(face_data["texcoord_n"] != face_n_corners * 2):
+                raise ValueError("Wrong number of UV face coordinates.")
+            model["texture_uv_face"] = face_data["texcoord"].astype(np.float64)
     return model
 
 
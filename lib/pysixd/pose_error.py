@@ -58,7 +58,7 @@ def vsd(
     """
     # Render depth images of the model in the estimated and the ground-truth pose.
     fx, fy, cx, cy = K[0, 0], K[1, 1], K[0, 2], K[1, 2]
-    if renderer_type in ["cpp", "python"]:
+    if renderer_type in ["cpp", "python", "numpy"]:
         # import pdb; pdb.set_trace()
         depth_est = renderer.render_object(obj_id, R_est, t_est, fx, fy, cx, cy)["depth"]
         depth_gt = renderer.render_object(obj_id, R_gt, t_gt, fx, fy, cx, cy)["depth"]
@@ -128,6 +128,159 @@ def vsd(
     return errors
 
 
+def _render_depths(renderer, obj_id, Rs, ts, K, renderer_type="python"):
+    """Renders depth images of an object model in several poses.
+
+    :param renderer: Instance of the Renderer class (see renderer.py).
+    :param obj_id: Object identifier.
+    :param Rs: List of 3x3 ndarrays with rotation matrices.
+    :param ts: List of 3x1 ndarrays with translation vectors.
+    :param K: 3x3 ndarray with an intrinsic camera matrix.
+    :param renderer_type: Type of the renderer.
+    :return: List of hxw ndarrays with the rendered depth images.
+    """
+    if len(Rs) == 0:
+        return []
+    fx, fy, cx, cy = K[0, 0], K[1, 1], K[0, 2], K[1, 2]
+    if renderer_type == "numpy":
+        return list(renderer.render_batch([obj_id] * len(Rs), Rs, ts, K))
+    elif renderer_type in ["cpp", "python"]:
+        return [renderer.render_object(obj_id, R, t, fx, fy, cx, cy)["depth"] for R, t in zip(Rs, ts)]
+    elif renderer_type == "egl":
+        import torch
+
+        pc_cam_tensor = torch.cuda.FloatTensor(renderer.height, renderer.width, 4).detach()
+        depths = []
+        for R, t in zip(Rs, ts):
+            renderer.render([obj_id - 1], poses=[np.hstack([R, t.reshape((3, 1))])], K=K, pc_cam_tensor=pc_cam_tensor)
+            depths.append(pc_cam_tensor[:, :, 2].cpu().numpy())
+        return depths
+    elif renderer_type == "aae":
+        return [renderer.render(obj_id - 1, R, t, K=K)[1] for R, t in zip(Rs, ts)]
+    else:
+        raise ValueError("renderer type: {} is not supported".format(renderer_type))
+
+
+def vsd_batch(
+    R_ests,
+    t_ests,
+    R_gts,
+    t_gts,
+    depth_test,
+    K,
+    delta,
+    taus,
+    normalized_by_diameter,
+    diameter,
+    renderer,
+    obj_id,
+    cost_type="step",
+    renderer_type="python",
+    pair_mask=None,
+    max_chunk_size=2 ** 24,
+):
+    """VSD of all pose estimates w.r.t. all GT poses of one object in one image.
+
+    Gives the same errors as calling vsd() for every (estimate, GT) pair, but
+    each pose is rendered only once, the test depth image is converted to a
+    distance image only once, and all taus are evaluated in one pass over the
+    stacked visibility masks (cropped to the region covered by the renderings).
+
+    :param R_ests: List of N 3x3 ndarrays with the estimated rotation matrices.
+    :param t_ests: List of N 3x1 ndarrays with the estimated translation vectors.
+    :param R_gts: List of M 3x3 ndarrays with the ground-truth rotation matrices.
+    :param t_gts: List of M 3x1 ndarrays with the ground-truth translation vectors.
+    :param pair_mask: NxM bool ndarray with the (estimate, GT) pairs for which the
+      error is calculated (None = all). The error of the other pairs is 1.0.
+    :param max_chunk_size: Max. number of elements of the estimate x pixel x tau
+      cost tensor (the estimates are evaluated in chunks).
+    :return: NxMxT ndarray with the calculated errors (T = len(taus)).
+    See vsd() for the other parameters.
+    """
+    n_est, n_gt = len(R_ests), len(R_gts)
+    taus = np.asarray(taus, dtype=np.float64)
+    errors = np.ones((n_est, n_gt, len(taus)), dtype=np.float64)
+    if pair_mask is None:
+        pair_mask = np.ones((n_est, n_gt), dtype=bool)
+    if not np.any(pair_mask):
+        return errors
+    if cost_type not in ["step", "tlinear"]:
+        raise ValueError("Unknown pixel matching cost.")
+
+    # Render only the poses that take part in some pair.
+    est_ids = np.flatnonzero(pair_mask.any(axis=1))
+    gt_ids = np.flatnonzero(pair_mask.any(axis=0))
+    depth_ests = _render_depths(
+        renderer, obj_id, [R_ests[i] for i in est_ids], [t_ests[i] for i in est_ids], K, renderer_type
+    )
+    depth_gts = _render_depths(renderer, obj_id, [R_gts[i] for i in gt_ids], [t_gts[i] for i in gt_ids], K, renderer_type)
+    depth_ests = np.stack(depth_ests)
+    depth_gts = np.stack(depth_gts)
+
+    # Only pixels covered by some rendering can contribute to the errors.
+    ys, xs = np.nonzero(np.logical_or((depth_ests > 0).any(axis=0), (depth_gts > 0).any(axis=0)))
+    if len(ys) == 0:
+        return errors
+    roi = np.s_[ys.min() : ys.max() + 1, xs.min() : xs.max() + 1]
+
+    # Convert depth images to distance images (inside the ROI only).
+    pre_Xs, pre_Ys = misc.Precomputer.precompute_lazy(depth_test, K)
+    pre_Xs, pre_Ys = pre_Xs[roi], pre_Ys[roi]
+
+    def _to_dist(depth):
+        # The same as misc.depth_im_to_dist_im_fast (broadcasted over images).
+        depth = depth.astype(np.float64)
+        return np.sqrt((pre_Xs * depth) ** 2 + (pre_Ys * depth) ** 2 + depth ** 2)
+
+    dist_test = _to_dist(depth_test[roi])
+    dist_gts = _to_dist(depth_gts[(slice(None),) + roi])  # MxHxW
+
+    # Number of estimates per chunk (the cost tensor is chunk x pixels x taus).
+    chunk = max(1, max_chunk_size // max(1, dist_test.size * len(taus)))
+    for gt_ind, gt_id in enumerate(gt_ids):
+        gt_est_inds = np.flatnonzero(pair_mask[est_ids, gt_id])
+        if len(gt_est_inds) == 0:
+            continue
+        dist_gt = dist_gts[gt_ind]
+
+        # Visibility mask of the model in the GT pose.
+        visib_gt = visibility.estimate_visib_mask_gt(dist_test, dist_gt, delta, visib_mode="bop19")
+
+        for start in range(0, len(gt_est_inds), chunk):
+            est_inds = gt_est_inds[start : start + chunk]
+            dist_est = _to_dist(depth_ests[est_inds][(slice(None),) + roi])  # nxHxW
+
+            # Visibility masks of the model in the estimated poses.
+            visib_est = visibility.estimate_visib_mask_est(
+                np.broadcast_to(dist_test, dist_est.shape), dist_est, visib_gt, delta, visib_mode="bop19"
+            )
+
+            # Intersection and union of the visibility masks.
+            visib_inter = np.logical_and(visib_gt, visib_est).reshape(len(est_inds), -1)
+            visib_union_count = np.logical_or(visib_gt, visib_est).reshape(len(est_inds), -1).sum(axis=1)
+            visib_comp_count = visib_union_count - visib_inter.sum(axis=1)
+
+            # Pixel-wise distances (only meaningful inside the intersection).
+            dists = np.abs(dist_gt - dist_est).reshape(len(est_inds), -1)
+            if normalized_by_diameter:
+                dists /= diameter
+
+            # Pixel-wise matching costs for all taus at once (nxPxT).
+            if cost_type == "step":
+                costs = np.logical_and(dists[:, :, None] >= taus, visib_inter[:, :, None]).sum(axis=1)
+            else:  # 'tlinear'
+                costs = np.where(visib_inter[:, :, None], np.minimum(dists[:, :, None] / taus, 1.0), 0.0).sum(axis=1)
+
+            valid = visib_union_count > 0
+            e = np.ones((len(est_inds), len(taus)), dtype=np.float64)
+            e[valid] = (costs[valid] + visib_comp_count[valid, None]) / visib_union_count[valid, None].astype(
+                np.float64
+            )
+            errors[est_ids[est_inds], gt_id] = e
+
+    return errors
+
+
 def mssd(R_est, t_est, R_gt, t_gt, pts, syms):
     """Maximum Symmetry-Aware Surface Distance (MSSD).
 
@@ -271,7 +424,7 @@ def add(R_est, t_est, R_gt, t_gt, pts):
     return e
 
 
-def adi(R_est, t_est, R_gt, t_gt, pts):
+def adi(R_est, t_est, R_gt, t_gt, pts, model_kdtree=None):
     """Average Distance of Model Points for objects with indistinguishable
     views.
 
@@ -282,8 +435,13 @@ def adi(R_est, t_est, R_gt, t_gt, pts):
     :param R_gt: 3x3 ndarray with the ground-truth rotation matrix.
     :param t_gt: 3x1 ndarray with the ground-truth translation vector.
     :param pts: nx3 ndarray with 3D model points.
+    :param model_kdtree: Optional scipy.spatial.cKDTree built on pts (in the
+      model space). If given, it is reused instead of building a new tree.
     :return: The calculated error.
     """
+    if model_kdtree is not None:
+        return adi_batch([R_est], [t_est], R_gt, t_gt, pts, model_kdtree)[0]
+
     pts_est = transform_pts_Rt(pts, R_est, t_est)
     pts_gt = transform_pts_Rt(pts, R_gt, t_gt)
 
@@ -296,6 +454,177 @@ def adi(R_est, t_est, R_gt, t_gt, pts):
     return e
 
 
+def adi_batch(R_ests, t_ests, R_gt, t_gt, pts, model_kdtree=None):
+    """ADI of N pose estimates w.r.t. one GT pose.
+
+    The nearest neighbors are searched in the model space (the GT points are
+    mapped by the inverse of each estimated pose), so a KD-tree built once on
+    the model points can be reused for all estimates and GT poses.
+
+    :param R_ests: List of N 3x3 ndarrays with the estimated rotation matrices.
+    :param t_ests: List of N 3x1 ndarrays with the estimated translation vectors.
+    :param R_gt: 3x3 ndarray with the ground-truth rotation matrix.
+    :param t_gt: 3x1 ndarray with the ground-truth translation vector.
+    :param pts: nx3 ndarray with 3D model points.
+    :param model_kdtree: scipy.spatial.cKDTree built on pts (None = build it).
+    :return: N ndarray with the calculated errors.
+    """
+    if model_kdtree is None:
+        model_kdtree = spatial.cKDTree(pts)
+    n_est = len(R_ests)
+    if n_est == 0:
+        return np.zeros(0)
+    R_ests = np.stack([np.asarray(R, dtype=np.float64).reshape(3, 3) for R in R_ests])  # Nx3x3
+    t_ests = np.stack([np.asarray(t, dtype=np.float64).reshape(3) for t in t_ests])  # Nx3
+    pts_gt = transform_pts_Rt(pts, R_gt, t_gt)  # nx3
+
+    # R_est^T * (pts_gt - t_est) for each estimate (row vectors).
+    pts_gt_in_est = np.einsum("mnj,mjk->mnk", pts_gt[None] - t_ests[:, None], R_ests)  # Nxnx3
+    nn_dists, _ = model_kdtree.query(pts_gt_in_est.reshape(-1, 3), k=1)
+    return nn_dists.reshape(n_est, -1).mean(axis=1)
+
+
+def _syms_to_th(R_gt, t_gt, syms, dtype, device):
+    """Stacks GT poses composed with symmetry transformations into tensors.
+
+    :return: Kx3x3 and Kx3 tensors with R_gt * R_sym and R_gt * t_sym + t_gt.
+    """
+    import torch
+
+    R_syms = np.stack([sym["R"] for sym in syms])  # Kx3x3
+    t_syms = np.stack([np.asarray(sym["t"]).reshape(3) for sym in syms])  # Kx3
+    R_gt = np.asarray(R_gt, dtype=np.float64).reshape(3, 3)
+    t_gt = np.asarray(t_gt, dtype=np.float64).reshape(3)
+    R_gt_syms = np.matmul(R_gt[None], R_syms)
+    t_gt_syms = t_syms.dot(R_gt.T) + t_gt[None]
+    return (
+        torch.as_tensor(R_gt_syms, dtype=dtype, device=device),
+        torch.as_tensor(t_gt_syms, dtype=dtype, device=device),
+    )
+
+
+def _ests_to_th(R_ests, t_ests, dtype, device):
+    """Stacks estimated poses into Nx3x3 and Nx3 tensors."""
+    import torch
+
+    R_ests = np.stack([np.asarray(R, dtype=np.float64).reshape(3, 3) for R in R_ests])
+    t_ests = np.stack([np.asarray(t, dtype=np.float64).reshape(3) for t in t_ests])
+    return torch.as_tensor(R_ests, dtype=dtype, device=device), torch.as_tensor(t_ests, dtype=dtype, device=device)
+
+
+def get_mssd_support_pts(pts):
+    """Returns the model points that determine MSSD.
+
+    The squared distance ||A * p + b||^2 is convex in p, so its maximum over the
+    model points is attained at a vertex of their convex hull. MSSD calculated
+    with the returned points is therefore the same as with all points.
+
+    :param pts: nx3 ndarray with 3D model points.
+    :return: mx3 ndarray with the vertices of the convex hull of pts (m <= n).
+    """
+    try:
+        return pts[spatial.ConvexHull(pts).vertices]
+    except spatial.QhullError:  # E.g. planar models.
+        return pts
+
+
+def mssd_batch(R_ests, t_ests, R_gt, t_gt, pts, syms, device="cpu", max_chunk_size=2 ** 24):
+    """MSSD of N pose estimates w.r.t. one GT pose (see mssd()).
+
+    All K symmetries x N estimates are evaluated with one matrix product per
+    chunk of symmetries: the squared distance ||A * p + b||^2 of a model point p
+    (with A = R_est - R_gt_sym, b = t_est - t_gt_sym) is a quadratic form in p,
+    i.e. a dot product of the 10 monomials of p with coefficients given by A, b.
+
+    :param R_ests: List of N 3x3 ndarrays with the estimated rotation matrices.
+    :param t_ests: List of N 3x1 ndarrays with the estimated translation vectors.
+    :param pts: nx3 ndarray with 3D model points (can be reduced by
+      get_mssd_support_pts, which gives the same errors much faster).
+    :param device: Torch device on which the errors are calculated.
+    :param max_chunk_size: Max. number of elements of the point x pair distance
+      matrix evaluated at once.
+    :return: N ndarray with the calculated errors.
+    """
+    import torch
+
+    n_est = len(R_ests)
+    if n_est == 0:
+        return np.zeros(0)
+    dtype = torch.float64
+    pts_th = torch.as_tensor(np.asarray(pts), dtype=dtype, device=device)
+    x, y, z = pts_th[:, 0], pts_th[:, 1], pts_th[:, 2]
+    ones = torch.ones_like(x)
+    monomials = torch.stack([x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z, 2 * x, 2 * y, 2 * z, ones], dim=1)
+
+    R_ests_th, t_ests_th = _ests_to_th(R_ests, t_ests, dtype, device)
+    R_gt_syms, t_gt_syms = _syms_to_th(R_gt, t_gt, syms, dtype, device)
+    chunk = max(1, max_chunk_size // max(1, n_est * pts_th.shape[0]))
+    sq_errors = []
+    for start in range(0, R_gt_syms.shape[0], chunk):
+        A = R_ests_th[:, None] - R_gt_syms[None, start : start + chunk]  # Nxkx3x3
+        b = t_ests_th[:, None] - t_gt_syms[None, start : start + chunk]  # Nxkx3
+        M = torch.matmul(A.transpose(2, 3), A)  # A^T * A
+        g = torch.matmul(A.transpose(2, 3), b[..., None])[..., 0]  # A^T * b
+        coeffs = torch.stack(
+            [
+                M[..., 0, 0],
+                M[..., 1, 1],
+                M[..., 2, 2],
+                M[..., 0, 1],
+                M[..., 0, 2],
+                M[..., 1, 2],
+                g[..., 0],
+                g[..., 1],
+                g[..., 2],
+                (b * b).sum(-1),
+            ],
+            dim=-1,
+        )  # Nxkx10
+        sq_dists = torch.matmul(monomials, coeffs.reshape(-1, 10).t())  # nx(N*k)
+        sq_errors.append(sq_dists.max(dim=0)[0].reshape(n_est, -1))
+    sq_errors = torch.cat(sq_errors, dim=1).min(dim=1)[0]
+    return sq_errors.clamp(min=0).sqrt().cpu().numpy()
+
+
+def mspd_batch(R_ests, t_ests, R_gt, t_gt, K, pts, syms, device="cpu", max_chunk_size=2 ** 23):
+    """MSPD of N pose estimates w.r.t. one GT pose (see mspd()).
+
+    All K symmetries x N estimates are evaluated as batched tensor ops (chunked
+    over the symmetries to bound the memory).
+
+    :param R_ests: List of N 3x3 ndarrays with the estimated rotation matrices.
+    :param t_ests: List of N 3x1 ndarrays with the estimated translation vectors.
+    :param device: Torch device on which the errors are calculated.
+    :param max_chunk_size: Max. number of elements of the projection
+      differences evaluated at once.
+    :return: N ndarray with the calculated errors.
+    """
+    import torch
+
+    n_est = len(R_ests)
+    if n_est == 0:
+        return np.zeros(0)
+    dtype = torch.float64
+    pts_th = torch.as_tensor(np.asarray(pts), dtype=dtype, device=device)
+    K_th = torch.as_tensor(np.asarray(K), dtype=dtype, device=device)
+
+    def _project(Rs, ts):
+        # Bx3x3, Bx3 -> Bxnx2.
+        pts_im = torch.matmul(torch.matmul(pts_th[None], Rs.transpose(1, 2)) + ts[:, None], K_th.t())
+        return pts_im[:, :, :2] / pts_im[:, :, 2:3]
+
+    R_ests_th, t_ests_th = _ests_to_th(R_ests, t_ests, dtype, device)
+    R_gt_syms, t_gt_syms = _syms_to_th(R_gt, t_gt, syms, dtype, device)
+    proj_est = _project(R_ests_th, t_ests_th)  # Nxnx2
+    chunk = max(1, max_chunk_size // max(1, n_est * pts_th.shape[0] * 2))
+    errors = []
+    for start in range(0, R_gt_syms.shape[0], chunk):
+        proj_gt_sym = _project(R_gt_syms[start : start + chunk], t_gt_syms[start : start + chunk])  # kxnx2
+        dists = torch.norm(proj_est[:, None] - proj_gt_sym[None], dim=3)  # Nxkxn
+        errors.append(dists.max(dim=2)[0])
+    return torch.cat(errors, dim=1).min(dim=1)[0].cpu().numpy()
+
+
 def calc_rt_dist_q(Rq_src, Rq_tgt, T_src, T_tgt):
 
     rd_rad = np.arccos(np.inner(Rq_src, Rq_tgt) ** 2 * 2 - 1)
@@ -499,7 +828,7 @@ def cus(R_est, t_est, R_gt, t_gt, K, renderer, obj_id, renderer_type="python"):
     """
     # Render depth images of the model at the estimated and the ground-truth pose.
     fx, fy, cx, cy = K[0, 0], K[1, 1], K[0, 2], K[1, 2]
-    if renderer_type in ["cpp", "python"]:
+    if renderer_type in ["cpp", "python", "numpy"]:
         depth_est = renderer.render_object(obj_id, R_est, t_est, fx, fy, cx, cy)["depth"]
         depth_gt = renderer.render_object(obj_id, R_gt, t_gt, fx, fy, cx, cy)["depth"]
     elif renderer_type == "egl":
@@ -557,7 +886,7 @@ def cou_bb_proj(R_est, t_est, R_gt, t_gt, K, renderer, obj_id, renderer_type="py
     """
     # Render depth images of the model at the estimated and the ground-truth pose.
     fx, fy, cx, cy = K[0, 0], K[1, 1], K[0, 2], K[1, 2]
-    if renderer_type in ["cpp", "python"]:
+    if renderer_type in ["cpp", "python", "numpy"]:
         depth_est = renderer.render_object(obj_id, R_est, t_est, fx, fy, cx, cy)["depth"]
         depth_gt = renderer.render_object(obj_id, R_gt, t_gt, fx, fy, cx, cy)["depth"]
     elif renderer_type == "egl":
@@ -157,3 +157,48 @@ def match_poses_scene(scene_id, scene_gt, scene_gt_valid, scene_errs, correct_th
         scene_matches += im_matches
 
     return scene_matches
+
+
+def match_poses_groups(errors, error_ths, gt_valid_mask):
+    """Matches the estimated poses to the ground-truth poses of many groups
+    (an object class in an image) for several thresholds of correctness at once.
+
+    Gives the same greedy matching as match_poses: in each group, the estimated
+    poses are matched in the order of decreasing score, each to the valid and not
+    yet matched ground-truth pose whose error elements are all lower than the
+    threshold and than the errors of the ground-truth poses before it (the
+    ground-truth poses are visited in the order of their ID's).
+
+    :param errors: (n_groups, n_ests, n_gts, n_elems) ndarray with the errors of
+      the pose estimates of each group (sorted by decreasing score, the top ones)
+      w.r.t. the ground-truth poses of the group; nan where there is no error
+      (e.g. padding).
+    :param error_ths: (n_ths, n_elems) ndarray with the thresholds of correctness.
+    :param gt_valid_mask: (n_groups, n_gts) bool ndarray, mask of ground-truth poses
+      which can be considered.
+    :return: (n_ths, n_groups, n_gts) ndarray with the index (in the group) of the
+      pose estimate matched to each ground-truth pose, -1 if there is none.
+    """
+    n_groups, n_ests, n_gts, n_elems = errors.shape
+    error_ths = np.asarray(error_ths, dtype=np.float64).reshape(-1, n_elems)
+    n_ths = error_ths.shape[0]
+
+    gt_est_inds = np.full((n_ths, n_groups, n_gts), -1, dtype=np.int64)
+    gt_free = np.broadcast_to(np.asarray(gt_valid_mask, dtype=bool), (n_ths, n_groups, n_gts)).copy()
+    for est_ind in range(n_ests):
+        best_error = np.broadcast_to(error_ths[:, None, :], (n_ths, n_groups, n_elems))
+        best_gt_ind = np.full((n_ths, n_groups), -1, dtype=np.int64)
+        for gt_ind in range(n_gts):
+            error = errors[None, :, est_ind, gt_ind, :]
+            # The comparisons with nan are False.
+            is_best = gt_free[:, :, gt_ind] & np.all(error < best_error, axis=2)
+            best_error = np.where(is_best[:, :, None], error, best_error)
+            best_gt_ind[is_best] = gt_ind
+
+        # Mark the GT poses as matched.
+        th_inds, group_inds = np.nonzero(best_gt_ind >= 0)
+        gt_inds = best_gt_ind[th_inds, group_inds]
+        gt_est_inds[th_inds, group_inds, gt_inds] = est_ind
+        gt_free[th_inds, group_inds, gt_inds] = False
+
+    return gt_est_inds
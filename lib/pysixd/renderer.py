@@ -85,11 +85,13 @@ def create_renderer(
     """A factory to create a renderer.
 
     Note: Parameters mode, shading and bg_color are currently supported only by
-    the Python renderer (renderer_type='python').
+    the Python renderer (renderer_type='python'). The NumPy renderer
+    (renderer_type='numpy') renders only depth images ('rgb+depth' is rendered as
+    'depth') and needs no OpenGL.
 
     :param width: Width of the rendered image.
     :param height: Height of the rendered image.
-    :param renderer_type: Type of renderer (options: 'cpp', 'python').
+    :param renderer_type: Type of renderer (options: 'cpp', 'python', 'numpy').
     :param mode: Rendering mode ('rgb+depth', 'rgb', 'depth').
     :param shading: Type of shading ('flat', 'phong').
     :param bg_color: Color of the background (R, G, B, A).
@@ -105,5 +107,15 @@ def create_renderer(
 
         return renderer_cpp.RendererCpp(width, height)
 
+    elif renderer_type == "numpy":
+        from . import renderer_numpy
+
+        # the default mode of the factory: render only the depth
+        if mode == "rgb+depth":
+            mode = "depth"
+        if mode != "depth":
+            raise ValueError("The NumPy renderer renders only depth images, got mode '{}'.".format(mode))
+        return renderer_numpy.RendererNumpy(width, height, mode)
+
     else:
         raise ValueError("Unknown renderer type.")
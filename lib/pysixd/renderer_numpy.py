@@ -0,0 +1,174 @@
+"""A headless depth renderer based on a vectorized NumPy z-buffer.
+
+Does not need OpenGL/EGL or a display server, so it can be used for
+calculating VSD, CUS and other render-based errors on CPU-only machines.
+Only depth images are produced.
+"""
+
+import numpy as np
+
+from lib.pysixd import inout, renderer
+
+
+class RendererNumpy(renderer.Renderer):
+    """A depth-only renderer implemented as a vectorized z-buffer in NumPy."""
+
+    def __init__(self, width, height, mode="depth", max_chunk_pixels=2 ** 22):
+        """Constructor.
+
+        :param width: Width of the rendered image.
+        :param height: Height of the rendered image.
+        :param mode: Rendering mode (only 'depth' is supported).
+        :param max_chunk_pixels: Maximum number of candidate (triangle, pixel)
+          pairs rasterized at once (bounds the memory footprint).
+        """
+        super(RendererNumpy, self).__init__(width, height)
+        if mode != "depth":
+            raise ValueError("RendererNumpy supports only the 'depth' mode.")
+        self.mode = mode
+        self.max_chunk_pixels = int(max_chunk_pixels)
+
+        # Per-object triangle data: vertices (nx3 float64) and faces (mx3 int64).
+        self.models = {}
+
+    def add_object(self, obj_id, model_path, **kwargs):
+        """See base class."""
+        model = inout.load_ply(model_path)
+        if "faces" not in model:
+            raise ValueError("Model {} has no faces to render.".format(model_path))
+        self.models[obj_id] = {
+            "pts": np.ascontiguousarray(model["pts"], dtype=np.float64),
+            "faces": np.ascontiguousarray(model["faces"], dtype=np.int64),
+        }
+
+    def remove_object(self, obj_id):
+        """See base class."""
+        del self.models[obj_id]
+
+    def render_object(self, obj_id, R, t, fx, fy, cx, cy):
+        """See base class."""
+        K = np.array([[fx, 0.0, cx], [0.0, fy, cy], [0.0, 0.0, 1.0]])
+        depth = self.render_batch([obj_id], [R], [t], [K])[0]
+        return {"depth": depth}
+
+    def render_batch(self, obj_ids, Rs, ts, Ks):
+        """Renders depth images of a batch of object models in one call.
+
+        :param obj_ids: List of N object identifiers.
+        :param Rs: N 3x3 ndarrays with rotation matrices.
+        :param ts: N 3x1 ndarrays with translation vectors.
+        :param Ks: N 3x3 ndarrays with intrinsic camera matrices (or a single
+          3x3 ndarray shared by all renderings).
+        :return: NxHxW float32 ndarray with the rendered depth images (0 at
+          pixels not covered by the object).
+        """
+        n_ims = len(obj_ids)
+        Ks = np.asarray(Ks, dtype=np.float64)
+        if Ks.ndim == 2:
+            Ks = np.tile(Ks[None], (n_ims, 1, 1))
+
+        # Project vertices of all instances and gather their triangles.
+        tri_uvz = []
+        tri_im_ids = []
+        for im_id in range(n_ims):
+            model = self.models[obj_ids[im_id]]
+            R = np.asarray(Rs[im_id], dtype=np.float64).reshape(3, 3)
+            t = np.asarray(ts[im_id], dtype=np.float64).reshape(1, 3)
+            K = Ks[im_id]
+            pts_cam = model["pts"].dot(R.T) + t
+            z = pts_cam[:, 2]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                u = K[0, 0] * pts_cam[:, 0] / z + K[0, 1] * pts_cam[:, 1] / z + K[0, 2]
+                v = K[1, 1] * pts_cam[:, 1] / z + K[1, 2]
+            uvz = np.stack([u, v, z], axis=1)[model["faces"]]  # mx3x3
+            # Triangles crossing the camera plane are not clipped but skipped.
+            uvz = uvz[np.all(uvz[:, :, 2] > 0, axis=1)]
+            tri_uvz.append(uvz)
+            tri_im_ids.append(np.full(len(uvz), im_id, dtype=np.int64))
+
+        zbuf = np.full(n_ims * self.height * self.width, np.inf, dtype=np.float64)
+        if n_ims > 0:
+            self._rasterize(np.concatenate(tri_uvz), np.concatenate(tri_im_ids), zbuf)
+
+        zbuf[np.isinf(zbuf)] = 0
+        return zbuf.reshape(n_ims, self.height, self.width).astype(np.float32)
+
+    def _rasterize(self, tri_uvz, tri_im_ids, zbuf):
+        """Rasterizes triangles into a flattened z-buffer.
+
+        Pixels are sampled at their centers, i.e. pixel [x, y] covers the
+        projection [x + 0.5, y + 0.5] (as in the OpenGL based renderers).
+
+        :param tri_uvz: mx3x3 ndarray with the (u, v, z) coordinates of the
+          triangle vertices.
+        :param tri_im_ids: m ndarray with the index of the image to which each
+          triangle is rendered.
+        :param zbuf: (N*H*W) ndarray with the z-buffer (updated in place).
+        """
+        u, v, z = tri_uvz[:, :, 0], tri_uvz[:, :, 1], tri_uvz[:, :, 2]
+
+        # Signed double area of the triangles (degenerate ones are skipped).
+        area = (u[:, 1] - u[:, 0]) * (v[:, 2] - v[:, 0]) - (u[:, 2] - u[:, 0]) * (v[:, 1] - v[:, 0])
+
+        # Pixel bounding boxes of the triangles, clipped to the image.
+        x_min = np.maximum(np.ceil(u.min(axis=1) - 0.5), 0)
+        x_max = np.minimum(np.floor(u.max(axis=1) - 0.5), self.width - 1)
+        y_min = np.maximum(np.ceil(v.min(axis=1) - 0.5), 0)
+        y_max = np.minimum(np.floor(v.max(axis=1) - 0.5), self.height - 1)
+        keep = np.logical_and.reduce([x_max >= x_min, y_max >= y_min, area != 0, np.isfinite(area)])
+        if not np.any(keep):
+            return
+
+        u, v, z, area, tri_im_ids = u[keep], v[keep], z[keep], area[keep], tri_im_ids[keep]
+        x_min, y_min = x_min[keep].astype(np.int64), y_min[keep].astype(np.int64)
+        box_w = x_max[keep].astype(np.int64) - x_min + 1
+        box_h = y_max[keep].astype(np.int64) - y_min + 1
+        n_cands = box_w * box_h
+
+        # Split the triangles into chunks with a bounded number of candidate pixels.
+        cands_end = np.cumsum(n_cands)
+        chunk_ids = (cands_end - 1) // self.max_chunk_pixels
+        splits = np.flatnonzero(np.diff(chunk_ids)) + 1
+        for tri_inds in np.split(np.arange(len(n_cands)), splits):
+            self._rasterize_chunk(
+                u[tri_inds],
+                v[tri_inds],
+                1.0 / z[tri_inds],
+                area[tri_inds],
+                tri_im_ids[tri_inds],
+                x_min[tri_inds],
+                y_min[tri_inds],
+                box_w[tri_inds],
+                n_cands[tri_inds],
+                zbuf,
+            )
+
+    def _rasterize_chunk(self, u, v, z_inv, area, tri_im_ids, x_min, y_min, box_w, n_cands, zbuf):
+        # Enumerate all candidate pixels in the bounding boxes of the triangles.
+        tri = np.repeat(np.arange(len(n_cands)), n_cands)
+        local = np.arange(tri.size) - np.repeat(np.cumsum(n_cands) - n_cands, n_cands)
+        xs = x_min[tri] + local % box_w[tri]
+        ys = y_min[tri] + local // box_w[tri]
+        px = xs + 0.5
+        py = ys + 0.5
+
+        # Barycentric coordinates of the pixel centers.
+        u_t, v_t = u[tri], v[tri]
+        w0 = ((u_t[:, 1] - px) * (v_t[:, 2] - py) - (u_t[:, 2] - px) * (v_t[:, 1] - py)) / area[tri]
+        w1 = ((u_t[:, 2] - px) * (v_t[:, 0] - py) - (u_t[:, 0] - px) * (v_t[:, 2] - py)) / area[tri]
+        w2 = 1.0 - w0 - w1
+        inside = (w0 >= 0) & (w1 >= 0) & (w2 >= 0)
+        if not np.any(inside):
+            return
+        tri, xs, ys = tri[inside], xs[inside], ys[inside]
+        w = np.stack([w0[inside], w1[inside], w2[inside]], axis=1)
+
+        # Perspective-correct interpolation of depth (1/z is linear in the image).
+        depth = 1.0 / np.sum(w * z_inv[tri], axis=1)
+        inds = (tri_im_ids[tri] * self.height + ys) * self.width + xs
+
+        # Z-test. With repeated indices the last write wins, so the fragments are
+        # written from the farthest to the closest one.
+        order = np.argsort(-depth, kind="stable")
+        inds, depth = inds[order], depth[order]
+        zbuf[inds] = np.minimum(zbuf[inds], depth)
@@ -59,6 +59,24 @@ def calc_recall(tp_count, targets_count):
         return tp_count / float(targets_count)
 
 
+def log_localization_scores(scores):
+    """Logs the scores of calc_localization_scores."""
+    obj_recalls_str = ", ".join(["{}: {:.3f}".format(i, s) for i, s in scores["obj_recalls"].items()])
+
+    scene_recalls_str = ", ".join(["{}: {:.3f}".format(i, s) for i, s in scores["scene_recalls"].items()])
+
+    misc.log("")
+    misc.log("GT count:           {:d}".format(scores["gt_count"]))
+    misc.log("Target count:       {:d}".format(scores["targets_count"]))
+    misc.log("TP count:           {:d}".format(scores["tp_count"]))
+    misc.log("Recall:             {:.4f}".format(scores["recall"]))
+    misc.log("Mean object recall: {:.4f}".format(scores["mean_obj_recall"]))
+    misc.log("Mean scene recall:  {:.4f}".format(scores["mean_scene_recall"]))
+    misc.log("Object recalls:\n{}".format(obj_recalls_str))
+    misc.log("Scene recalls:\n{}".format(scene_recalls_str))
+    misc.log("")
+
+
 def calc_localization_scores(scene_ids, obj_ids, matches, n_top, do_print=True):
     """Calculates performance scores for the 6D object localization task.
 
@@ -137,22 +155,70 @@ def calc_localization_scores(scene_ids, obj_ids, matches, n_top, do_print=True):
     }
 
     if do_print:
-        obj_recalls_str = ", ".join(["{}: {:.3f}".format(i, s) for i, s in scores["obj_recalls"].items()])
+        log_localization_scores(scores)
 
-        scene_recalls_str = ", ".join(["{}: {:.3f}".format(i, s) for i, s in scores["scene_recalls"].items()])
+    return scores
 
-        misc.log("")
-        misc.log("GT count:           {:d}".format(scores["gt_count"]))
-        misc.log("Target count:       {:d}".format(scores["targets_count"]))
-        misc.log("TP count:           {:d}".format(scores["tp_count"]))
-        misc.log("Recall:             {:.4f}".format(scores["recall"]))
-        misc.log("Mean object recall: {:.4f}".format(scores["mean_obj_recall"]))
-        misc.log("Mean scene recall:  {:.4f}".format(scores["mean_scene_recall"]))
-        misc.log("Object recalls:\n{}".format(obj_recalls_str))
-        misc.log("Scene recalls:\n{}".format(scene_recalls_str))
-        misc.log("")
 
-    return scores
+def calc_localization_scores_batch(
+    scene_ids, obj_ids, gt_scene_ids, gt_obj_ids, gt_group_ids, gt_valid, gt_matched, n_top, do_print=True
+):
+    """Calculates the scores of calc_localization_scores for the matches of
+    several thresholds of correctness at once.
+
+    :param scene_ids: ID's of considered scenes.
+    :param obj_ids: ID's of considered objects.
+    :param gt_scene_ids: (n_gts,) ndarray with the scene ID of each GT pose.
+    :param gt_obj_ids: (n_gts,) ndarray with the object ID of each GT pose.
+    :param gt_group_ids: (n_gts,) ndarray with the index of the (scene, image,
+      object) group of each GT pose.
+    :param gt_valid: (n_gts,) bool ndarray, whether the GT pose is valid.
+    :param gt_matched: (n_ths, n_gts) bool ndarray, whether a pose estimate is
+      matched to the GT pose (for each threshold).
+    :param n_top: Number of top pose estimates to consider per test target.
+    :param do_print: Whether to print the scores to the standard output.
+    :return: List with the dictionary of evaluation scores of each threshold.
+    """
+    gt_valid = np.asarray(gt_valid, dtype=bool)
+    gt_matched = np.asarray(gt_matched, dtype=bool).reshape(-1, len(gt_valid))
+    obj_ids = list(obj_ids)
+    scene_ids = list(scene_ids)
+
+    # Count the number of targets = visible object instances in each image (at most n_top).
+    _, group_inds, group_tars = np.unique(gt_group_ids[gt_valid], return_index=True, return_counts=True)
+    if n_top > 0:
+        group_tars = np.minimum(n_top, group_tars)
+    group_obj_ids = gt_obj_ids[gt_valid][group_inds]
+    group_scene_ids = gt_scene_ids[gt_valid][group_inds]
+    tars = int(group_tars.sum())
+    obj_tars = {i: int(group_tars[group_obj_ids == i].sum()) for i in obj_ids}
+    scene_tars = {i: int(group_tars[group_scene_ids == i].sum()) for i in scene_ids}
+
+    # Count the number of true positives of all thresholds.
+    tp_mask = (gt_matched & gt_valid[None]).astype(np.int64)
+    all_tps = tp_mask.sum(axis=1)
+    all_obj_tps = tp_mask.dot((gt_obj_ids[:, None] == np.asarray(obj_ids)[None]).astype(np.int64))
+    all_scene_tps = tp_mask.dot((gt_scene_ids[:, None] == np.asarray(scene_ids)[None]).astype(np.int64))
+
+    all_scores = []
+    for tps, obj_tps, scene_tps in zip(all_tps, all_obj_tps, all_scene_tps):
+        obj_recalls = {i: calc_recall(int(obj_tps[k]), obj_tars[i]) for k, i in enumerate(obj_ids)}
+        scene_recalls = {i: float(calc_recall(int(scene_tps[k]), scene_tars[i])) for k, i in enumerate(scene_ids)}
+        scores = {
+            "recall": float(calc_recall(int(tps), tars)),
+            "obj_recalls": obj_recalls,
+            "mean_obj_recall": float(np.mean(list(obj_recalls.values())).squeeze()),
+            "scene_recalls": scene_recalls,
+            "mean_scene_recall": float(np.mean(list(scene_recalls.values())).squeeze()),
+            "gt_count": len(gt_valid),
+            "targets_count": tars,
+            "tp_count": int(tps),
+        }
+        if do_print:
+            log_localization_scores(scores)
+        all_scores.append(scores)
+
+    return all_scores
 
 
 if __name__ == "__main__":
@@ -194,6 +194,35 @@ def resize(
     return F.interpolate(input, size, scale_factor, mode, align_corners)
 
 
+def class_gathered_conv2d(conv, x, out_inds):
+    """Compute only some output channels of a conv for each sample (e.g. the
+    channels of the class of each roi), using the parameters of the conv.
+
+    Args:
+        conv (nn.Conv2d): a conv with groups=1 and zero padding
+        x: [B, C, H, W]
+        out_inds (LongTensor): [B, K], the output channels of each sample
+    Returns:
+        [B, K, H', W'], the same as conv(x)[torch.arange(B)[:, None], out_inds]
+    """
+    assert conv.groups == 1 and conv.padding_mode == "zeros", conv
+    bs, c, h, w = x.shape
+    k = out_inds.shape[1]
+    weight = conv.weight[out_inds]  # [B, K, C, kh, kw]
+    bias = conv.bias[out_inds].reshape(bs * k) if conv.bias is not None else None
+    # one group per sample
+    out = F.conv2d(
+        x.reshape(1, bs * c, h, w),
+        weight.reshape(bs * k, c, *weight.shape[-2:]),
+        bias=bias,
+        stride=conv.stride,
+        padding=conv.padding,
+        dilation=conv.dilation,
+        groups=bs,
+    )
+    return out.view(bs, k, *out.shape[-2:])
+
+
 class Upsample(nn.Module):
     def __init__(self, size=None, scale_factor=None, mode="nearest", align_corners=None):
         super(Upsample, self).__init__()
@@ -0,0 +1,5 @@
+import os.path as osp
+import sys
+
+PROJ_ROOT = osp.normpath(osp.join(osp.dirname(osp.abspath(__file__)), ".."))
+sys.path.insert(0, PROJ_ROOT)
@@ -0,0 +1,95 @@
+"""batch_pnp_ransac against cv2.solvePnPRansac on synthetic correspondences."""
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+torch = pytest.importorskip("torch")
+
+from core.utils.batch_pnp import batch_pnp_ransac  # noqa: E402
+
+K = np.array([[572.4114, 0.0, 325.2611], [0.0, 573.57043, 242.04899], [0.0, 0.0, 1.0]])
+
+
+def _rot_angle(R1, R2):
+    cos = (np.trace(R1.dot(R2.T)) - 1) / 2
+    return np.rad2deg(np.arccos(np.clip(cos, -1, 1)))
+
+
+def _make_roi(rng, num_pts, outlier_ratio, noise=0.3):
+    R = cv2.Rodrigues(rng.uniform(-np.pi, np.pi, size=3))[0]
+    t = np.array([rng.uniform(-0.1, 0.1), rng.uniform(-0.1, 0.1), rng.uniform(0.6, 1.0)])
+    pts_3d = rng.uniform(-0.08, 0.08, size=(num_pts, 3))
+    proj = (pts_3d.dot(R.T) + t).dot(K.T)
+    pts_2d = proj[:, :2] / proj[:, 2:3] + rng.normal(scale=noise, size=(num_pts, 2))
+    is_outlier = rng.uniform(size=num_pts) < outlier_ratio
+    pts_2d[is_outlier] = rng.uniform([0, 0], [640, 480], size=(is_outlier.sum(), 2))
+    return R, t, pts_3d, pts_2d, ~is_outlier
+
+
+def _batch(rois, num_pad):
+    """pad the rois to the same number of points (the padding is garbage)."""
+    N = max(len(roi[2]) for roi in rois) + num_pad
+    B = len(rois)
+    pts_3d = np.random.RandomState(1).uniform(-1, 1, size=(B, N, 3))
+    pts_2d = np.random.RandomState(2).uniform(0, 640, size=(B, N, 2))
+    valid = np.zeros((B, N), dtype=bool)
+    for b, (_, _, roi_3d, roi_2d, _) in enumerate(rois):
+        n = len(roi_3d)
+        pts_3d[b, :n] = roi_3d
+        pts_2d[b, :n] = roi_2d
+        valid[b, :n] = True
+    Ks = np.tile(K[None], (B, 1, 1))
+    return [torch.as_tensor(_a) for _a in (pts_3d, pts_2d, Ks, valid)]
+
+
+def test_batch_pnp_ransac_vs_cv2():
+    torch.manual_seed(0)
+    rng = np.random.RandomState(0)
+    rois = [_make_roi(rng, num_pts, outlier_ratio) for num_pts, outlier_ratio in [(300, 0.3), (200, 0.1), (80, 0.4)]]
+    pts_3d, pts_2d, Ks, valid = _batch(rois, num_pad=20)
+    R, t, inliers = batch_pnp_ransac(pts_3d, pts_2d, Ks, valid, num_hypotheses=200, reproj_err_thr=3.0)
+    assert not inliers[~valid].any()
+
+    for b, (R_gt, t_gt, roi_3d, roi_2d, is_inlier) in enumerate(rois):
+        ok, rvec, tvec, cv_inliers = cv2.solvePnPRansac(
+            roi_3d,
+            roi_2d,
+            K,
+            None,
+            flags=cv2.SOLVEPNP_EPNP,
+            reprojectionError=3.0,
+            iterationsCount=200,
+        )
+        assert ok
+        R_cv = cv2.Rodrigues(rvec)[0]
+        t_cv = tvec.reshape(3)
+        R_b = R[b].numpy()
+        t_b = t[b].numpy()
+
+        assert _rot_angle(R_b, R_cv) < 1.0
+        assert np.linalg.norm(t_b - t_cv) < 0.005
+        assert _rot_angle(R_b, R_gt) < 1.0
+        assert np.linalg.norm(t_b - t_gt) < 0.005
+
+        cv_inlier_mask = np.zeros(len(roi_3d), dtype=bool)
+        cv_inlier_mask[cv_inliers.reshape(-1)] = True
+        n = len(roi_3d)
+        assert np.mean(inliers[b, :n].numpy() == cv_inlier_mask) > 0.95
+        assert np.mean(inliers[b, :n].numpy() == is_inlier) > 0.95
+
+
+def test_batch_pnp_ransac_exact():
+    """noise and outlier free correspondences give the exact pose, as cv2 EPnP."""
+    torch.manual_seed(0)
+    rng = np.random.RandomState(3)
+    rois = [_make_roi(rng, 50, 0.0, noise=0.0) for _ in range(2)]
+    pts_3d, pts_2d, Ks, valid = _batch(rois, num_pad=5)
+    R, t, inliers = batch_pnp_ransac(pts_3d, pts_2d, Ks, valid, num_hypotheses=10)
+    assert torch.equal(inliers, valid)
+    for b, (R_gt, t_gt, roi_3d, roi_2d, _) in enumerate(rois):
+        ok, rvec, tvec = cv2.solvePnP(roi_3d, roi_2d, K, None, flags=cv2.SOLVEPNP_EPNP)
+        assert ok
+        np.testing.assert_allclose(R[b].numpy(), cv2.Rodrigues(rvec)[0], atol=1e-5)
+        np.testing.assert_allclose(t[b].numpy(), tvec.reshape(3), atol=1e-5)
+        np.testing.assert_allclose(R[b].numpy(), R_gt, atol=1e-6)
+        np.testing.assert_allclose(t[b].numpy(), t_gt, atol=1e-6)
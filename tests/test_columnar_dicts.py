@@ -0,0 +1,97 @@
+"""ColumnarDicts against the pickled list of dataset dicts."""
+import pickle
+
+import numpy as np
+import pytest
+
+from core.utils.columnar_dicts import ColumnarDicts
+
+
+def _make_dicts(num=40, seed=0):
+    rng = np.random.RandomState(seed)
+    dicts = []
+    for i in range(num):
+        im_id = i // 3  # several instances per image
+        d = {
+            "dataset_name": "lm_13_test",
+            "file_name": "datasets/BOP_DATASETS/lm/test/000001/rgb/{:06d}.png".format(im_id),
+            "image_id": im_id,
+            "scene_im_id": "1/{}".format(im_id),
+            "cam": rng.uniform(0, 600, size=(3, 3)).astype(np.float32),
+            "depth_factor": 1000.0,
+            "img_type": "real",
+            "bbox": [float(_v) for _v in rng.uniform(0, 480, size=4)],
+            "roi_cls": int(rng.randint(13)),
+            "score": np.float32(rng.uniform()),
+            "has_mask": bool(i % 2),
+            "mixed": 1 if i % 3 else 0.5,  # int and float in one column
+            "maybe_none": None if i % 4 == 0 else [1, 2],
+            "empty_list": [],
+            "bbox_mode": (0, "xyxy"),
+            "inst_infos": {
+                "category_id": int(rng.randint(13)),
+                "pose": rng.uniform(-1, 1, size=(3, 4)),
+                "segmentation": {"size": [480, 640], "counts": "rle_{}".format(i).encode("utf-8")},
+                "model_info": {"diameter": 102.1, "extents": [0.1, 0.2, 0.3]},
+            },
+        }
+        if i % 5 == 0:  # only some of the dicts have these fields
+            d["xyz_path"] = "datasets/lm/test/xyz_crop/{:06d}_{:06d}-xyz.pkl".format(im_id, i % 3)
+            d["inst_infos"]["visib_fract"] = float(rng.uniform())
+        dicts.append(d)
+    return dicts
+
+
+def _assert_same(a, b, path="item"):
+    assert type(a) is type(b), "{}: {} != {}".format(path, type(a), type(b))
+    if isinstance(a, dict):
+        assert set(a.keys()) == set(b.keys()), path
+        for key in a:
+            _assert_same(a[key], b[key], "{}.{}".format(path, key))
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b), path
+        for i, (_a, _b) in enumerate(zip(a, b)):
+            _assert_same(_a, _b, "{}[{}]".format(path, i))
+    elif isinstance(a, (np.ndarray, np.generic)):
+        assert a.dtype == b.dtype and a.shape == b.shape, path
+        np.testing.assert_array_equal(a, b, err_msg=path)
+    else:
+        assert a == b, path
+
+
+def test_columnar_round_trip():
+    dicts = _make_dicts()
+    pickled = [pickle.dumps(d, protocol=-1) for d in dicts]
+    columnar = ColumnarDicts(dicts)
+    assert len(columnar) == len(dicts)
+    for idx in range(len(dicts)):
+        _assert_same(columnar[idx], pickle.loads(pickled[idx]))
+    _assert_same(columnar[-1], pickle.loads(pickled[-1]))
+    with pytest.raises(IndexError):
+        columnar[len(dicts)]
+
+
+def test_columnar_items_are_copies():
+    dicts = _make_dicts(num=6)
+    columnar = ColumnarDicts(dicts)
+    item = columnar[0]
+    item["cam"][:] = 0
+    item["bbox"][0] = -1.0
+    item["inst_infos"]["pose"] += 1
+    item["inst_infos"]["segmentation"]["size"].append(3)
+    _assert_same(columnar[0], pickle.loads(pickle.dumps(dicts[0], protocol=-1)))
+
+
+def test_columnar_shared_strings():
+    dicts = _make_dicts(num=30)
+    columnar = ColumnarDicts(dicts)
+    # the file names of the instances of an image, the dataset names... are stored once
+    num_strings = len(
+        {
+            _v
+            for d in dicts
+            for _v in [d["dataset_name"], d["file_name"], d["scene_im_id"], d["img_type"], d.get("xyz_path")]
+            if _v is not None
+        }
+    ) + len({d["inst_infos"]["segmentation"]["counts"] for d in dicts})
+    assert "{} strings".format(num_strings) in columnar.summary()
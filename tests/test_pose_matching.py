@@ -0,0 +1,47 @@
+"""match_poses_groups against the greedy matching of match_poses."""
+import numpy as np
+import pytest
+
+from lib.pysixd.pose_matching import match_poses, match_poses_groups
+
+
+def _match_poses_ref(errors, error_ths, gt_valid_mask, n_ests, n_gts):
+    """the matches of match_poses for each threshold and group, in the format of
+    match_poses_groups."""
+    n_groups, _, max_gts, _ = errors.shape
+    gt_est_inds = np.full((len(error_ths), n_groups, max_gts), -1, dtype=np.int64)
+    for th_ind, error_th in enumerate(error_ths):
+        for group_ind in range(n_groups):
+            errs = [
+                {
+                    "est_id": est_ind,
+                    "score": 1.0 - 0.01 * est_ind,  # sorted by decreasing score
+                    "errors": {gt_ind: list(errors[group_ind, est_ind, gt_ind]) for gt_ind in range(n_gts[group_ind])},
+                }
+                for est_ind in range(n_ests[group_ind])
+            ]
+            gt_valid = list(gt_valid_mask[group_ind, : n_gts[group_ind]])
+            for m in match_poses(errs, list(error_th), 0, gt_valid):
+                gt_est_inds[th_ind, group_ind, m["gt_id"]] = m["est_id"]
+    return gt_est_inds
+
+
+@pytest.mark.parametrize("n_elems", [1, 2])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_match_poses_groups(n_elems, seed):
+    rng = np.random.RandomState(seed)
+    n_groups, max_ests, max_gts = 50, 6, 5
+    n_ests = rng.randint(1, max_ests + 1, size=n_groups)
+    n_gts = rng.randint(1, max_gts + 1, size=n_groups)
+    errors = rng.uniform(0, 1, size=(n_groups, max_ests, max_gts, n_elems))
+    for group_ind in range(n_groups):
+        # nan padding of the missing estimates and GTs
+        errors[group_ind, n_ests[group_ind] :] = np.nan
+        errors[group_ind, :, n_gts[group_ind] :] = np.nan
+    gt_valid_mask = rng.uniform(size=(n_groups, max_gts)) < 0.8
+    error_ths = rng.uniform(0.05, 1.0, size=(7, n_elems))
+
+    gt_est_inds = match_poses_groups(errors, error_ths, gt_valid_mask)
+    gt_est_inds_ref = _match_poses_ref(errors, error_ths, gt_valid_mask, n_ests, n_gts)
+    np.testing.assert_array_equal(gt_est_inds, gt_est_inds_ref)
+    assert np.any(gt_est_inds >= 0) and np.any(gt_est_inds < 0)
@@ -0,0 +1,126 @@
+"""The numpy depth renderer against analytic depths of planar models."""
+import numpy as np
+import pytest
+
+pytest.importorskip("mmcv")
+
+from lib.pysixd import inout, renderer  # noqa: E402
+from lib.pysixd.renderer_numpy import RendererNumpy  # noqa: E402
+
+W, H = 160, 120
+K = np.array([[200.0, 0.0, 80.0], [0.0, 200.0, 60.0], [0.0, 0.0, 1.0]])
+HALF = 0.1  # half size of the squares (m)
+
+
+def _rot_x(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[1.0, 0.0, 0.0], [0.0, c, -s], [0.0, s, c]])
+
+
+def _write_ply(path, pts, faces):
+    lines = [
+        "ply",
+        "format ascii 1.0",
+        "element vertex {}".format(len(pts)),
+        "property float x",
+        "property float y",
+        "property float z",
+        "element face {}".format(len(faces)),
+        "property list uchar int vertex_indices",
+        "end_header",
+    ]
+    lines += ["{} {} {}".format(*pt) for pt in pts]
+    lines += ["3 {} {} {}".format(*face) for face in faces]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def _square(z=0.0):
+    pts = np.array([[-HALF, -HALF, z], [HALF, -HALF, z], [HALF, HALF, z], [-HALF, HALF, z]])
+    faces = np.array([[0, 1, 2], [0, 2, 3]])
+    return pts, faces
+
+
+@pytest.fixture
+def ren(tmp_path, monkeypatch):
+    monkeypatch.setattr(inout, "PLY_CACHE_DIR", None)
+    ren = RendererNumpy(W, H)
+    pts, faces = _square()
+    _write_ply(str(tmp_path / "square.ply"), pts, faces)
+    ren.add_object(1, str(tmp_path / "square.ply"))
+    # two parallel squares, the one at z=-0.2 (model) is in front of the other one
+    pts_front, faces_front = _square(z=-0.2)
+    pts_two = np.concatenate([pts, pts_front])
+    faces_two = np.concatenate([faces, faces_front + len(pts)])
+    _write_ply(str(tmp_path / "two_squares.ply"), pts_two, faces_two)
+    ren.add_object(2, str(tmp_path / "two_squares.ply"))
+    return ren
+
+
+def _plane_depth(R, t, z_model=0.0):
+    """depth of the plane z = z_model (model) at the pixel centers, and the model
+    coordinates of the points seen there."""
+    xs, ys = np.meshgrid(np.arange(W) + 0.5, np.arange(H) + 0.5)
+    rays = np.stack([(xs - K[0, 2]) / K[0, 0], (ys - K[1, 2]) / K[1, 1], np.ones_like(xs)], axis=-1)
+    normal = R[:, 2]
+    point = R.dot([0.0, 0.0, z_model]) + t
+    depth = normal.dot(point) / rays.dot(normal)
+    pts_model = (rays * depth[..., None] - t).dot(R)  # R^T (X - t)
+    return depth, pts_model
+
+
+def _check_square(depth, R, t, z_model=0.0, eps=1e-6):
+    depth_gt, pts_model = _plane_depth(R, t, z_model)
+    inside = np.all(np.abs(pts_model[..., :2]) < HALF - eps, axis=-1)
+    outside = np.any(np.abs(pts_model[..., :2]) > HALF + eps, axis=-1)
+    assert inside.sum() > 100
+    assert np.all(depth[inside] > 0)
+    np.testing.assert_allclose(depth[inside], depth_gt[inside], rtol=1e-6)
+    return inside, outside
+
+
+@pytest.mark.parametrize("angle", [0.0, np.deg2rad(30), np.deg2rad(-60)])
+def test_render_plane_depth(ren, angle):
+    R = _rot_x(angle)
+    t = np.array([0.02, -0.01, 0.8])
+    depth = ren.render_object(1, R, t, K[0, 0], K[1, 1], K[0, 2], K[1, 2])["depth"]
+    assert depth.shape == (H, W) and depth.dtype == np.float32
+    _, outside = _check_square(depth, R, t)
+    assert np.all(depth[outside] == 0)
+
+
+def test_render_occlusion(ren):
+    R = _rot_x(np.deg2rad(20))
+    t = np.array([0.0, 0.0, 1.0])
+    depth = ren.render_object(2, R, t, K[0, 0], K[1, 1], K[0, 2], K[1, 2])["depth"]
+    # only the front square is visible where both are
+    inside_front, _ = _check_square(depth, R, t, z_model=-0.2)
+    depth_back, _ = _plane_depth(R, t, z_model=0.0)
+    assert np.all(depth[inside_front] < depth_back[inside_front])
+
+
+def test_render_behind_camera(ren):
+    depth = ren.render_object(1, np.eye(3), np.array([0.0, 0.0, -1.0]), K[0, 0], K[1, 1], K[0, 2], K[1, 2])["depth"]
+    assert not np.any(depth)
+
+
+def test_render_batch(ren):
+    obj_ids = [1, 2, 1]
+    Rs = [_rot_x(np.deg2rad(_a)) for _a in [10, -20, 45]]
+    ts = [np.array([0.01, 0.0, 0.7]), np.array([0.0, 0.02, 1.0]), np.array([-0.03, 0.0, 0.9])]
+    depths = ren.render_batch(obj_ids, Rs, ts, K)
+    assert depths.shape == (3, H, W)
+    for obj_id, R, t, depth in zip(obj_ids, Rs, ts, depths):
+        depth_single = ren.render_object(obj_id, R, t, K[0, 0], K[1, 1], K[0, 2], K[1, 2])["depth"]
+        np.testing.assert_array_equal(depth, depth_single)
+
+    # small chunks give the same depths
+    ren.max_chunk_pixels = 97
+    np.testing.assert_array_equal(ren.render_batch(obj_ids, Rs, ts, K), depths)
+
+
+def test_create_renderer_modes():
+    assert isinstance(renderer.create_renderer(W, H, renderer_type="numpy"), RendererNumpy)
+    assert isinstance(renderer.create_renderer(W, H, renderer_type="numpy", mode="depth"), RendererNumpy)
+    with pytest.raises(ValueError):
+        renderer.create_renderer(W, H, renderer_type="numpy", mode="rgb")
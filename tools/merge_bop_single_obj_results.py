@@ -8,9 +8,11 @@ import numpy as np
 from tqdm import tqdm
 import mmcv
 
-# import sys
-# cur_dir = osp.dirname(osp.abspath(__file__))
-# sys.path.insert(0, osp.join(cur_dir, ".."))
+import sys
+
+cur_dir = osp.dirname(osp.abspath(__file__))
+sys.path.insert(0, osp.join(cur_dir, ".."))
+from lib.pysixd import inout
 
 
 def main():
@@ -26,26 +28,13 @@ def main():
     print("input files: ", args.paths)
     print("number of input files: ", len(args.paths))
 
-    # merge files
-    lines = []
-    for i, _path in enumerate(tqdm(args.paths)):
-        with open(_path, "r") as f:
-            for j, line in enumerate(f):
-                if j == 0:
-                    if i == 0:
-                        header = line.strip("\r\n")
-                        lines.append(header)
-                    else:
-                        continue
-                else:
-                    lines.append(line.strip("\r\n"))
-
     mmcv.mkdir_or_exist(osp.dirname(args.res_path))
 
+    # merge files, the results of each file are appended to the merged file
     print("Writing merged file...")
-    with open(args.res_path, "w") as f:
-        for line in lines:
-            f.write("{}\n".format(line))
+    with inout.BopResultsWriter(args.res_path) as writer:
+        for _path in tqdm(args.paths):
+            writer.append(inout.load_bop_results_array(_path))
     print("Done. The merged results file has been saved to {}".format(args.res_path))
 
 